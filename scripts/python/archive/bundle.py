@@ -18,20 +18,50 @@
 
 import sys
 import argparse
+import bz2
+import collections
+import contextlib
+import functools
+import gzip
+import hashlib
+import io
+import json
 import logging
+import lzma
 import tarfile
 import os
 import tempfile
+import threading
 import time
-from setuptools.archive_util import unpack_tarfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from os import getlogin
 import pwd
 import grp
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 PAIE_SRV = "/srv/"
 ENG_MODE = True
 COMPRESSION = "gz"
+COMPRESSIONS = ("gz", "zst")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BLOCK_SIZE = 4 * 1024 * 1024  # uncompressed bytes per gzip member or zstd frame
+COPY_BUFSIZE = 1024 * 1024
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+STDOUT = "-"
+MANIFEST_NAME = ".pup_bundle_manifest.json"  # last member of each bundle
+MANIFEST_SUFFIX = ".manifest.json"  # copy next to the bundle, for --since
+MANIFEST_VERSION = 1
+EXTRACT_WORKERS = 8
+SMALL_FILE = 8 * 1024 * 1024  # larger files are written by the reading thread
+FSYNC_BATCH = 256 * 1024 * 1024  # bytes extracted between fsync batches
+PART_SUFFIX = ".part"
+PREVIOUS_SUFFIX = ".previous"  # manifest kept aside during extraction
 RC_SUCCESS = 0
 RC_ERROR = 99  # generic failure
 RC_ARGS = 2  # failed to parse args given
@@ -39,6 +69,7 @@ RC_SRV = 20  # srv directory does not exist
 RC_USER_EXIT = 40  # keyboard exit
 RC_PERMISSION = 41  # Permission denied
 PAIE_EXTRACT_SRV = "/tmp/srv/"
+CHECKSUM_SUFFIX = ".sha256"
 LOG = ""
 STANDALONE = True
 LOGFILE = os.path.splitext(os.path.basename(__file__))[0] + ".log"
@@ -48,13 +79,18 @@ if (sys.version_info > (3, 0)):
         SCRIPT_DIR = 'scripts/python'
         sys.path.append(os.path.join(TOP_DIR, SCRIPT_DIR))
         import lib.logger as log
+        from lib.checksum import checksum, checksums
         LOG = log.getlogger()
         STANDALONE = False
     except:
         LOG = logging.getLogger(__name__)
+        checksum = None
+        checksums = None
         STANDALONE = True
 else:
     LOG = logging.getLogger(__name__)
+    checksum = None
+    checksums = None
 
 
 def exit(rc, *extra):
@@ -88,8 +124,143 @@ def get_top_level_dirs(thing, include=None):
             if os.path.isdir(os.path.join(thing, name)) and name in include]
 
 
+def _zstd_compress(level, block):
+    # Compressor objects are not thread safe, one is made per block
+    return zstandard.ZstdCompressor(level=level).compress(block)
+
+
+def get_compressor(compression, level=None):
+    """
+        Get a function compressing one block into a self contained gzip
+        member or zstd frame. Concatenated members and frames decompress
+        as one stream.
+    Inputs:
+        compression (str): "gz" or "zst"
+        level (int or None): compression level
+    returns:
+        function (bytes) -> bytes
+    """
+    if compression == "gz":
+        return functools.partial(gzip.compress,
+                                 compresslevel=level or GZIP_LEVEL)
+    if compression == "zst":
+        if zstandard is None:
+            exit(RC_ARGS, "zstd compression requires the zstandard module")
+        return functools.partial(_zstd_compress, level or ZSTD_LEVEL)
+    exit(RC_ARGS, "Unsupported compression {0}".format(compression))
+
+
+class BundleWriter(object):
+    """
+        File like writer compressing in a thread pool
+    The stream is cut into BLOCK_SIZE blocks, compressed concurrently as
+    independent gzip members or zstd frames and written in order, so the
+    output is a standard .gz or .zst file. zlib and zstd release the GIL,
+    so blocks compress on all cores. At most two blocks per worker are
+    held in memory. The sha256 of the output is computed as it is written.
+    Inputs:
+        fileobj (fileobj): destination, written sequentially
+        compression (str or None): "gz", "zst" or None to write as is
+        workers (int or None): compression threads, default cpu count
+    """
+
+    def __init__(self, fileobj, compression=COMPRESSION, workers=None,
+                 block_size=None, level=None):
+        self.fileobj = fileobj
+        self.block_size = block_size or BLOCK_SIZE
+        self.compress = None
+        self.executor = None
+        if compression:
+            self.compress = get_compressor(compression, level)
+            workers = workers or os.cpu_count() or 1
+            self.executor = ThreadPoolExecutor(workers)
+            self.max_pending = 2 * workers
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.digest = hashlib.sha256()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start = time.time()
+        self.end = None
+
+    def _write_out(self, data):
+        self.fileobj.write(data)
+        self.digest.update(data)
+        self.bytes_out += len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(self.compress, block))
+        while len(self.pending) > self.max_pending:
+            self._write_out(self.pending.popleft().result())
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        if self.compress is None:
+            self._write_out(data)
+            return len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        if self.end is not None:
+            return
+        try:
+            if self.compress is not None:
+                if self.buffer:
+                    self._submit(bytes(self.buffer))
+                    self.buffer = bytearray()
+                while self.pending:
+                    self._write_out(self.pending.popleft().result())
+            self.fileobj.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.end = time.time()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def summary(self):
+        elapsed = max((self.end or time.time()) - self.start, 0.001)
+        return ("{0:.1f} MB read, {1:.1f} MB written, {2:.1f} MB/s".format(
+            self.bytes_in / 1e6, self.bytes_out / 1e6,
+            self.bytes_in / 1e6 / elapsed))
+
+
+@contextlib.contextmanager
+def open_tar(src):
+    """
+        Open a tar file for reading. zstd compressed files are read as a
+        stream, others as tarfile detects them.
+    Inputs:
+        src (str): tar file path
+    returns:
+        TarFile context
+    """
+    with open(src, 'rb') as f:
+        if f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+            if zstandard is None:
+                exit(RC_ARGS, "{0} is zstd compressed, the zstandard module "
+                     "is required".format(src))
+            f.seek(0)
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                yield tar
+            return
+    with tarfile.open(src) as tar:
+        yield tar
+
+
 def get_top_level_dir_list_from_tar(extract_file):
-    with tarfile.open(extract_file) as tarlist:
+    # The manifest next to a bundle lists its tree without reading it
+    if os.path.isfile(extract_file + MANIFEST_SUFFIX):
+        files = load_manifest(extract_file + MANIFEST_SUFFIX)['files']
+        return set(path.split("/")[0] for path in files)
+    with open_tar(extract_file) as tarlist:
         tar_list_names = tarlist.getnames()
         toplevel = [t.split("/")[0] for t in tar_list_names]
         toplevel = set(toplevel)
@@ -120,17 +291,459 @@ def build_files_of_this(thing, exclude=None):
     return files
 
 
+class BundleExtractor(object):
+    """
+        Extract a bundle in a single streaming pass
+    Files up to SMALL_FILE are written by a thread pool while the
+    archive is read on, larger ones by the reading thread. Files are
+    written to '<path>.part' and hashed as they are written. About every
+    FSYNC_BATCH bytes the written files are checked in archive order
+    against the expected sha256, fsynced, renamed into place and their
+    directories fsynced. The first corrupt file stops the extraction. The
+    sha256 of the bundle file itself is computed on the same pass.
+    Inputs:
+        dest (str): destination directory
+        expected (dict or None): {path: sha256} of the bundle files,
+            known before extraction (e.g. from the manifest next to the
+            bundle). Without it the files are checked at the end against
+            the manifest in the bundle.
+        workers (int or None): writer threads
+    """
+
+    def __init__(self, dest, expected=None, workers=None):
+        self.dest = dest
+        self.real_dest = os.path.join(os.path.realpath(dest), '')
+        self.expected = expected or {}
+        workers = workers or EXTRACT_WORKERS
+        self.executor = ThreadPoolExecutor(workers)
+        # Limits the small files held in memory
+        self.slots = threading.BoundedSemaphore(2 * workers)
+        self.written = []  # (name, path, future) not yet committed
+        self.batch_bytes = 0
+        self.digests = collections.OrderedDict()
+        self.dirs = []
+        self.bundle_digest = None
+        self.files = 0
+        self.bytes = 0
+
+    def _fail(self, message):
+        for _, path, future in self.written:
+            try:
+                future.result()
+            except Exception:
+                pass
+            try:
+                os.remove(path + PART_SUFFIX)
+            except OSError:
+                pass
+        self.written = []
+        exit(RC_ERROR, message)
+
+    def _path(self, name):
+        path = _safe_join(self.dest, name)
+        # A symlink extracted earlier must not lead outside of dest
+        parent = os.path.join(os.path.realpath(os.path.dirname(path)), '')
+        if not parent.startswith(self.real_dest):
+            self._fail("Refusing to extract {0} outside of {1}".format(
+                name, self.dest))
+        return path
+
+    def _write_small(self, path, data, mode, mtime):
+        try:
+            with open(path + PART_SUFFIX, 'wb') as f:
+                f.write(data)
+            os.chmod(path + PART_SUFFIX, mode)
+            os.utime(path + PART_SUFFIX, (mtime, mtime))
+            return hashlib.sha256(data).hexdigest()
+        finally:
+            self.slots.release()
+
+    def _write_large(self, path, fileobj, mode, mtime):
+        digest = hashlib.sha256()
+        with open(path + PART_SUFFIX, 'wb') as f:
+            for block in iter(lambda: fileobj.read(COPY_BUFSIZE), b''):
+                digest.update(block)
+                f.write(block)
+        os.chmod(path + PART_SUFFIX, mode)
+        os.utime(path + PART_SUFFIX, (mtime, mtime))
+        return digest.hexdigest()
+
+    def _check(self, name, digest):
+        expected = self.expected.get(name)
+        if expected is not None and digest != expected:
+            self._fail("Corrupt file in bundle: {0}\nsha256 {1}, expected "
+                       "{2}".format(name, digest, expected))
+
+    def commit(self):
+        """ Verify, fsync and rename the files written since the last
+        commit """
+        for name, path, future in self.written:
+            try:
+                digest = future.result()
+            except OSError as e:
+                self._fail("Unable to write {0}: {1}".format(path, e))
+            self._check(name, digest)
+            self.digests[name] = digest
+        written, self.written = self.written, []
+        for _ in self.executor.map(_fsync, [path + PART_SUFFIX
+                                            for _, path, _ in written]):
+            pass
+        for _, path, _ in written:
+            os.replace(path + PART_SUFFIX, path)
+        for path in set(os.path.dirname(path) for _, path, _ in written):
+            _fsync(path)
+        self.batch_bytes = 0
+
+    def _extract_member(self, tar, member):
+        path = self._path(member.name)
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            self.dirs.append((path, member.mode & 0o7777, member.mtime))
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if member.isreg():
+            fileobj = tar.extractfile(member)
+            mode = member.mode & 0o7777
+            if member.size <= SMALL_FILE:
+                data = fileobj.read()
+                self.slots.acquire()
+                future = self.executor.submit(self._write_small, path, data,
+                                              mode, member.mtime)
+            else:
+                future = Future()
+                future.set_result(self._write_large(path, fileobj, mode,
+                                                    member.mtime))
+            self.written.append((member.name, path, future))
+            self.files += 1
+            self.bytes += member.size
+            self.batch_bytes += member.size
+            if self.batch_bytes >= FSYNC_BATCH:
+                self.commit()
+            return
+        if member.issym() or member.islnk():
+            # Link targets must be in place first
+            self.commit()
+            if os.path.lexists(path):
+                os.remove(path)
+            if member.issym():
+                os.symlink(member.linkname, path)
+            else:
+                os.link(self._path(member.linkname), path)
+                # The target of a delta may be on disk, not in the bundle
+                digest = self.digests.get(member.linkname)
+                if digest is not None:
+                    self._check(member.name, digest)
+                    self.digests[member.name] = digest
+            return
+        LOG.warning("Skipping {0}, unsupported file type".format(member.name))
+
+    def extract(self, src):
+        """
+            Extract a bundle
+        Inputs:
+            src (str): bundle path, tar optionally gz, bz2, xz or zst
+                compressed
+        returns:
+            digests (dict): sha256 of the extracted files in archive order
+        """
+        start = time.time()
+        name = None
+        with open(src, 'rb') as f:
+            raw = _HashingReader(f)
+            stream = _decompressor(f, raw, src)
+            try:
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    for member in tar:
+                        name = member.name
+                        self._extract_member(tar, member)
+                    name = None
+                    self.commit()
+            except (tarfile.TarError, EOFError, ValueError, zlib.error,
+                    lzma.LZMAError) as e:
+                self._fail("Bundle {0} is corrupt{1}: {2}".format(
+                    src, " at " + name if name else "", e))
+            except PermissionError:
+                raise
+            except OSError as e:
+                self._fail("Unable to extract {0}{1}: {2}".format(
+                    src, " at " + name if name else "", e))
+            finally:
+                self.executor.shutdown(wait=True)
+            # Include data after the end of the tar in the bundle digest
+            for _ in iter(lambda: raw.read(COPY_BUFSIZE), b''):
+                pass
+            self.bundle_digest = raw.digest.hexdigest()
+
+        for path, mode, mtime in reversed(self.dirs):
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+        if not self.expected and MANIFEST_NAME in self.digests:
+            files = load_manifest(os.path.join(self.dest, MANIFEST_NAME))[
+                'files']
+            self.expected = {path: entry[2] for path, entry in files.items()}
+            for name, digest in self.digests.items():
+                self._check(name, digest)
+        LOG.info("Extracted {0} files, {1:.1f} MB in {2:.1f} seconds".format(
+            self.files, self.bytes / 1e6, time.time() - start))
+        return self.digests
+
+
+def _decompressor(f, raw, src):
+    """ Decompressing reader of a bundle. tarfile streams read only the
+    first gzip member, the readers used here read all members or frames
+    written by BundleWriter. """
+    magic = f.read(6)
+    f.seek(0)
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            exit(RC_ARGS, "{0} is zstd compressed, the zstandard module "
+                 "is required".format(src))
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if magic.startswith(b'BZh'):
+        return bz2.BZ2File(raw)
+    if magic.startswith(b'\xfd7zXZ\x00'):
+        return lzma.LZMAFile(raw)
+    return raw
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def unarchive_this(src, dest):
+    """
+        Extract a bundle, verifying its files and its checksum file
+    Inputs:
+        src (str): bundle path
+        dest (str): destination directory
+    returns:
+        digests (dict): sha256 of the extracted files in archive order
+    """
+    expected = None
+    if os.path.isfile(src + MANIFEST_SUFFIX):
+        files = load_manifest(src + MANIFEST_SUFFIX)['files']
+        expected = {path: entry[2] for path, entry in files.items()}
+    extractor = BundleExtractor(dest, expected)
     try:
-        unpack_tarfile(src, dest)
+        digests = extractor.extract(src)
         LOG.debug("Completed unarchiving {0} to {1}".format(src, dest))
     except PermissionError as e:
         exit(RC_PERMISSION, "unable to write to {1}\n{0}".format(e, dest))
-    except Exception as e:
+    except OSError as e:
         exit(RC_ERROR, "Uncaught exception {0}".format(e))
+    verify_checksum(src, extractor.bundle_digest)
+    return digests
+
+
+class _HashingReader(object):
+    """ File reader computing the sha256 of what tarfile copies """
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
 
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
 
-def archive_this(thing, exclude=None, fileObj=None, compress=False):
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFSIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _safe_join(root, path):
+    full_path = os.path.normpath(os.path.join(root, path))
+    if os.path.isabs(path) or not full_path.startswith(
+            os.path.join(os.path.normpath(root), '')):
+        exit(RC_ERROR, "Invalid path in manifest: {0}".format(path))
+    return full_path
+
+
+def load_manifest(path):
+    """
+        Read a bundle manifest
+    Inputs:
+        path (str): manifest file
+    returns:
+        manifest (dict): 'id', 'base' (id of the manifest a delta applies
+            to or None), 'files' ({path: [size, mtime, sha256]}, hardlinks
+            with the entry of their target) and 'deleted' (paths removed
+            since the base)
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if not isinstance(manifest.get('files'), dict):
+            raise ValueError("no file list")
+    except (OSError, ValueError) as e:
+        exit(RC_ARGS, "Invalid bundle manifest {0}: {1}".format(path, e))
+    manifest.setdefault('base', None)
+    manifest.setdefault('deleted', [])
+    return manifest
+
+
+def write_manifest(filename, manifest):
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+
+
+def write_archive(thing, fileObj, exclude=None, compression=None,
+                  workers=None, since=None):
+    """
+        Write a tar stream of a directory, compressing in parallel
+    Inputs:
+        thing (str): root directory
+        fileObj (fileobj): destination, written sequentially
+        exclude (list or None): full paths of files to exclude
+        compression (str or None): "gz", "zst" or None
+        workers (int or None): compression threads
+        since (str or None): manifest of an earlier bundle. Only files
+            added or changed (by size or mtime) since are archived.
+    returns:
+       BundleWriter: closed writer with the size, digest, throughput and
+           the manifest of the tree
+    """
+    if exclude is None:
+        exclude = []
+    base = load_manifest(since) if since else None
+    base_files = base['files'] if base else {}
+    files = {}
+    archived = set()
+    changed = 0
+    writer = BundleWriter(fileObj, compression=compression, workers=workers)
+    try:
+        with tarfile.open(mode='w|', fileobj=writer) as t:
+            t.copybufsize = COPY_BUFSIZE
+            for path in build_files_of_this(thing, exclude):
+                full_path = os.path.join(thing, path)
+                if full_path in exclude or path in (
+                        MANIFEST_NAME, MANIFEST_NAME + PREVIOUS_SUFFIX):
+                    continue
+                i = t.gettarinfo(full_path, arcname=path)
+                archived.add(path)
+                try:
+                    if i.islnk():
+                        # A further path of a file archived before. It has
+                        # the manifest entry of the link target.
+                        if i.linkname not in files:
+                            LOG.error('Can not link {0} to unreadable '
+                                      '{1}'.format(path, i.linkname))
+                            continue
+                        files[path] = files[i.linkname]
+                        if base_files.get(path) == files[path]:
+                            continue
+                        t.addfile(i)
+                        changed += 1
+                    elif i.isfile():
+                        stamp = [i.size, int(i.mtime)]
+                        if base_files.get(path, [])[:2] == stamp:
+                            files[path] = base_files[path]
+                            continue
+                        try:
+                            with open(full_path, 'rb') as f:
+                                reader = _HashingReader(f)
+                                t.addfile(i, reader)
+                            files[path] = stamp + [reader.digest.hexdigest()]
+                            changed += 1
+                        except IOError:
+                            LOG.error(
+                                'Can not read file: {}'.format(full_path))
+                    else:
+                        t.addfile(i, None)
+                except Exception as e:
+                    if i is not None:
+                        LOG.error(e)
+
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'id': hashlib.sha256(json.dumps(
+                    files, sort_keys=True).encode()).hexdigest(),
+                'base': base['id'] if base else None,
+                'files': files,
+                'deleted': sorted(set(base_files) - archived)}
+            data = json.dumps(manifest, sort_keys=True).encode()
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            t.addfile(info, io.BytesIO(data))
+    finally:
+        writer.close()
+    writer.manifest = manifest
+    if base:
+        LOG.info("delta of {0}: {1} files added or changed, {2} deleted, "
+                 "{3} unchanged".format(since, changed,
+                                        len(manifest['deleted']),
+                                        len(files) - changed))
+    return writer
+
+
+def apply_manifest(dest, previous=None, digests=None):
+    """
+        Complete the extraction of a bundle: remove the files a delta
+        deletes and verify the tree against the bundle manifest
+    Inputs:
+        dest (str): extraction directory
+        previous (dict or None): manifest of the tree before extraction
+        digests (dict or None): sha256 of the files extracted from the
+            bundle. Other files of a delta are checked by size and mtime.
+            Without it all files are hashed.
+    """
+    path = os.path.join(dest, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        LOG.debug("No manifest in bundle, not verifying {0}".format(dest))
+        return
+    manifest = load_manifest(path)
+    if manifest['base'] and (previous is None or
+                             previous.get('id') != manifest['base']):
+        LOG.warning("{0} does not hold the bundle this delta was made "
+                    "from".format(dest))
+    for rel_path in manifest['deleted']:
+        full_path = _safe_join(dest, rel_path)
+        if os.path.isfile(full_path) or os.path.islink(full_path):
+            LOG.debug("Removing {0}".format(full_path))
+            os.remove(full_path)
+
+    files = manifest['files']
+    paths = {rel_path: _safe_join(dest, rel_path) for rel_path in files}
+    bad = [rel_path for rel_path, full_path in paths.items()
+           if not os.path.isfile(full_path) or
+           os.path.getsize(full_path) != files[rel_path][0]]
+    if digests is not None:
+        bad += [rel_path for rel_path, full_path in paths.items()
+                if rel_path not in bad and (
+                    digests[rel_path] != files[rel_path][2]
+                    if rel_path in digests else
+                    int(os.path.getmtime(full_path)) != files[rel_path][1])]
+    else:
+        present = [full_path for rel_path, full_path in paths.items()
+                   if rel_path not in bad]
+        if checksums is not None:
+            hashed = checksums(present, 'sha256', cache=False)
+        else:
+            hashed = {full_path: _sha256(full_path) for full_path in present}
+        bad += [rel_path for rel_path, full_path in paths.items()
+                if full_path in hashed and
+                hashed[full_path] != files[rel_path][2]]
+    if bad:
+        exit(RC_ERROR, "Verification of {0} failed, {1} files missing or "
+             "changed:\n{2}".format(dest, len(bad), "\n".join(sorted(bad)[:20])))
+    LOG.info("Verified {0} files in {1}".format(len(files), dest))
+
+
+def archive_this(thing, exclude=None, fileObj=None, compress=False,
+                 compression=COMPRESSION, workers=None):
     """
         Archive utility
     ex: fileObj = archive_this('file.txt')
@@ -138,41 +751,56 @@ def archive_this(thing, exclude=None, fileObj=None, compress=False):
         thing (str): root directory
         exclude (str or None): list of full path of files to exclude
         fileObj (fileobj): file object
+        compress (bool): compress the archive
+        compression (str): "gz" or "zst"
+        workers (int or None): compression threads
     returns:
        fileObj (fileobj): file object
     """
     if not fileObj:
         fileObj = tempfile.NamedTemporaryFile()
-    mode = 'w:'
-    if compress:
-        mode += COMPRESSION
-    with tarfile.open(mode=mode, fileobj=fileObj) as t:
-        files = build_files_of_this(thing, exclude)
-        if exclude is None:
-            exclude = []
-        for path in files:
-            full_path = os.path.join(thing, path)
-            if full_path in exclude:
-                continue
-            i = t.gettarinfo(full_path, arcname=path)
-            try:
-                if i.isfile():
-                    try:
-                        with open(full_path, 'rb') as f:
-                            t.addfile(i, f)
-                    except IOError:
-                        LOG.error(
-                            'Can not read file: {}'.format(full_path))
-                else:
-                    t.addfile(i, None)
-            except Exception as e:
-                if i is not None:
-                    LOG.error(e)
-
-    fileObj.seek(0)
+    writer = write_archive(thing, fileObj, exclude,
+                           compression if compress else None, workers)
+    LOG.debug("archived {0}: {1}".format(thing, writer.summary()))
+    if fileObj.seekable():
+        fileObj.seek(0)
     return fileObj
 
 
+def write_checksum(filename, digest=None):
+    """
+        Write sha256sum style checksum file next to a bundle
+    Inputs:
+        filename (str): bundle path
+        digest (str or None): sha256 of the bundle if known
+    """
+    if digest is None:
+        if checksum is None:
+            return
+        digest = checksum(filename, 'sha256')
+    with open(filename + CHECKSUM_SUFFIX, 'w') as f:
+        f.write("{0}  {1}\n".format(digest, os.path.basename(filename)))
+
+
+def verify_checksum(filename, digest=None):
+    """
+        Verify a bundle against its checksum file, if there is one
+    Inputs:
+        filename (str): bundle path
+        digest (str or None): sha256 of the bundle if known
+    """
+    checksum_file = filename + CHECKSUM_SUFFIX
+    if (checksum is None and digest is None) or not os.path.isfile(checksum_file):
+        return
+    with open(checksum_file) as f:
+        expected = f.read().split()[0]
+    if digest is None:
+        digest = checksum(filename, 'sha256')
+    if digest != expected.lower():
+        exit(RC_ERROR, "Checksum verification failed: {0}".format(filename))
+    LOG.debug("Verified checksum of {0}".format(filename))
+
+
 def setup_logging(debug="INFO"):
     '''
     Method to setup logging based on debug flag
@@ -189,6 +817,23 @@ def setup_logging(debug="INFO"):
     LOG.addHandler(rfh)
 
 
+def validate_since(path):
+    return do_validate_exists("since", path)
+
+
+def add_compression_args(sub_parser):
+    sub_parser.add_argument('--compression', choices=COMPRESSIONS,
+                            default=COMPRESSION,
+                            help='compression format used with --compress, '
+                                 'zst requires the zstandard module')
+    sub_parser.add_argument('--workers', type=int, default=None,
+                            help='compression threads, default cpu count')
+    sub_parser.add_argument('--since', type=validate_since, default=None,
+                            help='manifest ({0}) of an earlier bundle, only '
+                                 'files changed since are '
+                                 'bundled'.format("*" + MANIFEST_SUFFIX))
+
+
 def parse_input(args):
     parser = argparse.ArgumentParser(description="Utility for Archiving/Unarchiving\
                                      WMLA Node Deployer environment")
@@ -218,6 +863,7 @@ def parse_input(args):
                                                    dest="compress",
                                                    required=False, action="store_true",
                                                    help='compress using gzip')
+        add_compression_args(subparsers.choices['archive'])
 
         add_subparser('unarchive', "Uncompress file",
                       [('src', 'source file to unarchive', True),
@@ -231,6 +877,7 @@ def parse_input(args):
     subparsers.choices['bundle'].add_argument('--compress', dest="compress",
                                               required=False, action="store_true",
                                               help='compress using gzip')
+    add_compression_args(subparsers.choices['bundle'])
 
     add_subparser('extract_bundle', "Extract bundle WMLA software assume to {0}".format(PAIE_SRV),
                   [('from_archive', 'from which archive to extract paie software?', True)])
@@ -280,10 +927,17 @@ def validate_src(path):
 
 
 def list(args):
+    # The manifest next to a full bundle lists its files without reading
+    # the bundle. A delta's manifest lists the whole tree, not the bundle.
+    manifest_path = args.src + MANIFEST_SUFFIX
+    if os.path.isfile(manifest_path):
+        manifest = load_manifest(manifest_path)
+        if manifest['base'] is None:
+            for path in sorted(manifest['files']):
+                LOG.info(path)
+            return
     try:
-        extlist = get_top_level_dir_list_from_tar(args.src)
-        get_top_level_dirs(PAIE_SRV, extlist)
-        with tarfile.open(args.src) as tarlist:
+        with open_tar(args.src) as tarlist:
             for i in tarlist:
                 LOG.info(i.name)
     except Exception as e:
@@ -292,68 +946,68 @@ def list(args):
 
 def archive(args):
     dir_path = args.dest
-    file_name = os.path.splitext(args.dest)[0]
-    file_name_ext = os.path.splitext(args.dest)[1]
-    try:
-        try:
-            fileobj = tempfile.NamedTemporaryFile(delete=False, prefix=file_name,
-                                                  suffix=file_name_ext, dir=dir_path)
-        except OSError as e:
-            LOG.error(e)
-            try:
-                os.makedirs(dir_path)
-                fileobj = tempfile.NamedTemporaryFile(delete=False, prefix=file_name,
-                                                      suffix=file_name_ext, dir=dir_path)
-            except Exception as e:
-                exit(RC_ERROR, "Unable to create directory: {0}".format(e))
-
-        if args.compress is False or args.compress is None:
-            args.compress = False
-            LOG.debug("not compressing")
-
-        try:
-            timestr = time.strftime("%Y_%m%d-%H_%M_%S")
-            nameis = "wmla" + "." + timestr + ".tar" + (".gz" if args.compress else "")
-            filename = dir_path + nameis
-            LOG.info("archiving {0} to {1}".format(args.path, filename))
-            start = time.time()
-            archive_this(args.path, fileObj=fileobj, compress=args.compress)
-            end = time.time()
-        except Exception as e:
-            if fileobj is not None:
-                try:
-                    os.unlink(fileobj.name)
-                except:
-                    pass
-            exit(RC_ERROR, "Uncaught exception: {0}".format(e))
-        else:
-            os.rename(fileobj.name, filename)
-            LOG.info("created: {0}, size in bytes: {1}, total time: {2} seconds".format(filename,
-                                                                                        os.stat(filename).st_size,
-                                                                                        int((end - start))))
-        finally:
-            if fileobj is not None:
-                fileobj.close()
-            user_name = getlogin()
-            if user_name != 'root':
-                user_uid = pwd.getpwnam(user_name).pw_uid
-                user_gid = grp.getgrnam(user_name).gr_gid
-                os.chown(filename, user_uid, user_gid)
-                os.chmod(filename, 0o644)
+    compression = getattr(args, 'compression', None) or COMPRESSION
+    workers = getattr(args, 'workers', None)
+    since = getattr(args, 'since', None)
+    if args.compress is False or args.compress is None:
+        args.compress = False
+        LOG.debug("not compressing")
+    if not args.compress:
+        compression = None
+
+    if dir_path == STDOUT:
+        LOG.info("archiving {0} to stdout".format(args.path))
+        writer = write_archive(args.path, sys.stdout.buffer,
+                               compression=compression, workers=workers,
+                               since=since)
+        LOG.info("created: stdout, {0}".format(writer.summary()))
+        return None
 
+    try:
+        os.makedirs(dir_path, exist_ok=True)
+    except OSError as e:
+        exit(RC_ERROR, "Unable to create directory: {0}".format(e))
+    timestr = time.strftime("%Y_%m%d-%H_%M_%S")
+    nameis = "wmla" + "." + timestr + (".delta" if since else "") + ".tar" + (
+        "." + compression if compression else "")
+    filename = os.path.join(dir_path, nameis)
+    LOG.info("archiving {0} to {1}".format(args.path, filename))
+    try:
+        # Written in place, no temporary copy of the bundle is made
+        with open(filename, 'wb') as fileobj:
+            writer = write_archive(args.path, fileobj,
+                                   compression=compression, workers=workers,
+                                   since=since)
     except KeyboardInterrupt as e:
         try:
-            os.unlink(fileobj.name)
+            os.unlink(filename)
         except:
             pass
         raise e
     except Exception as e:
-        raise e
-    return fileobj
+        try:
+            os.unlink(filename)
+        except:
+            pass
+        exit(RC_ERROR, "Uncaught exception: {0}".format(e))
+
+    write_checksum(filename, writer.hexdigest())
+    write_manifest(filename + MANIFEST_SUFFIX, writer.manifest)
+    LOG.info("created: {0}, size in bytes: {1}, total time: {2} seconds, "
+             "{3}".format(filename, writer.bytes_out,
+                          int(writer.end - writer.start), writer.summary()))
+    user_name = getlogin()
+    if user_name != 'root':
+        user_uid = pwd.getpwnam(user_name).pw_uid
+        user_gid = grp.getgrnam(user_name).gr_gid
+        for path in (filename, filename + MANIFEST_SUFFIX):
+            os.chown(path, user_uid, user_gid)
+            os.chmod(path, 0o644)
+    return filename
 
 
 def unarchive(args):
-    unarchive_this(args.src, args.dest)
+    return unarchive_this(args.src, args.dest)
 
 
 def do_bundle(args):
@@ -369,12 +1023,16 @@ class Arguments(object):
         self.path = None
         self.dest = None
         self.compress = False
+        self.compression = COMPRESSION
+        self.workers = None
+        self.since = None
 
 
-def bundle_this(path, dest):
+def bundle_this(path, dest, since=None):
     args = Arguments()
     args.path = path
     args.dest = dest
+    args.since = since
     return do_bundle(args)
 
 
@@ -387,7 +1045,29 @@ def bundle(args):
 def do_extract_bundle(args):
     LOG.debug("unarchiving : {0}".format(args))
     if os.path.isdir(args.dest):
-        unarchive(args)
+        # A bundle without a manifest must not be verified against the
+        # manifest of the previous one
+        previous = None
+        manifest_path = os.path.join(args.dest, MANIFEST_NAME)
+        saved_path = manifest_path + PREVIOUS_SUFFIX
+        if os.path.isfile(saved_path) and not os.path.isfile(manifest_path):
+            # Left aside by an interrupted extraction
+            os.replace(saved_path, manifest_path)
+        if os.path.isfile(manifest_path):
+            previous = load_manifest(manifest_path)
+            os.replace(manifest_path, saved_path)
+        try:
+            digests = unarchive(args)
+            apply_manifest(args.dest, previous, digests)
+        except BaseException:
+            # Keep the record of what the site held, so the bundle can be
+            # extracted again and a delta checked against its base
+            if previous is not None:
+                LOG.info("Restoring the manifest of {0}".format(args.dest))
+                os.replace(saved_path, manifest_path)
+            raise
+        if previous is not None:
+            os.remove(saved_path)
     else:
         exit(RC_SRV, "Unable to find {0}".format(args.dest))
 
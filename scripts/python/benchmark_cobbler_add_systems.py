@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare Cobbler system registration modes against a local stub
+XML-RPC server with simulated request latency."""
+
+import argparse
+import itertools
+import threading
+import time
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+from tabulate import tabulate
+
+import lib.logger as logger
+from cobbler_add_systems import add_systems
+
+
+class _StubCobbler(object):
+    """Subset of the Cobbler XML-RPC API used by cobbler_add_systems"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handles = itertools.count()
+        self.new = {}
+        self.systems = {}
+        self.syncs = 0
+
+    def login(self, user, password):
+        return 'token'
+
+    def ping(self):
+        return True
+
+    def new_system(self, token):
+        with self.lock:
+            handle = '___NEW___system::{}'.format(next(self.handles))
+            self.new[handle] = {}
+        return handle
+
+    def modify_system(self, handle, attr, value, token):
+        self.new[handle][attr] = value
+        return True
+
+    def save_system(self, handle, token):
+        with self.lock:
+            system = self.new.pop(handle)
+            self.systems[system['name']] = system
+        return True
+
+    def sync(self, token):
+        self.syncs += 1
+        return True
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def _start_server(latency, multicall):
+    """Start stub server in a thread
+
+    Args:
+        latency (float): Seconds added to each HTTP request
+        multicall (bool): Register system.multicall
+
+    Returns:
+        tuple: Server, stub and URL
+    """
+    class Handler(SimpleXMLRPCRequestHandler):
+        def do_POST(self):
+            time.sleep(latency)
+            super(Handler, self).do_POST()
+
+        def log_message(self, *args):
+            pass
+
+    server = _Server(('127.0.0.1', 0), Handler, logRequests=False)
+    stub = _StubCobbler()
+    server.register_instance(stub)
+    if multicall:
+        server.register_multicall_functions()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    return server, stub, url
+
+
+def _systems(count):
+    systems = []
+    for index in range(count):
+        hostname = 'node-{}'.format(index)
+        attrs = [('name', hostname), ('hostname', hostname),
+                 ('power_address', '10.0.0.{}'.format(index % 250)),
+                 ('power_user', 'ADMIN'), ('power_pass', 'admin'),
+                 ('power_type', 'ipmilan'), ('profile', 'RHEL-7.6'),
+                 ('modify_interface', {
+                     'macaddress-eth0': '0c:00:00:00:00:{:02x}'.format(
+                         index % 256),
+                     'ipaddress-eth0': '10.1.0.{}'.format(index % 250),
+                     'dnsname-eth0': hostname}),
+                 ('ks_meta', 'install_disk=/dev/sda '),
+                 ('comment', '')]
+        systems.append((hostname, 'RHEL-7.6', attrs))
+    return systems
+
+
+def benchmark(count, latency, workers):
+    """Benchmark one system count
+
+    Args:
+        count (int): Number of systems
+        latency (float): Seconds added to each HTTP request
+        workers (int): Number of concurrent connections
+
+    Returns:
+        list: Table rows
+    """
+    systems = _systems(count)
+    rows = []
+    for mode_workers, multicall in ((1, False), (1, True),
+                                    (workers, False), (workers, True)):
+        server, stub, url = _start_server(latency, multicall)
+        start = time.perf_counter()
+        failed = add_systems(systems, url, mode_workers, multicall)
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        if failed or len(stub.systems) != count or stub.syncs != 1:
+            raise Exception('Stub registration incomplete')
+        rows.append([count, mode_workers, multicall,
+                     '{:.2f}'.format(elapsed),
+                     '{:.1f}'.format(count / elapsed)])
+    return rows
+
+
+def main(counts, latency, workers):
+    logger.create('nolog', 'error')
+    header = ['Systems', 'Workers', 'Multicall', 'Seconds', 'Systems/s']
+    rows = []
+    for count in counts:
+        rows += benchmark(count, latency, workers)
+    print(tabulate(rows, header))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('counts', nargs='*', type=int, default=[50, 200],
+                        help='System counts to benchmark')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Seconds added to each request')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Concurrent connections')
+    args = parser.parse_args()
+    main(args.counts, args.latency, args.workers)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare memory and lookup throughput of the AttrDict inventory node
+form, as loaded from and written to the inventory file, against the
+compact InventoryNodes table that Inventory holds in memory."""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from orderedattrdict import AttrDict
+from tabulate import tabulate
+
+from lib.inv_nodes import InventoryNodes, int_to_ipaddr, int_to_mac
+
+DATA_PORTS = 4
+LOOKUPS = 200
+SCAN_LOOKUPS = 20
+
+
+def _mock_node(index):
+    """Create a node dictionary shaped like a loaded inventory node"""
+    def mac(offset):
+        return int_to_mac(0x0c0000000000 + index * 8 + offset)
+
+    def ipaddr(offset):
+        return int_to_ipaddr(0x0a000000 + index * 2 + offset)
+
+    switch = 'mgmt{}'.format(index // 48)
+    data_switch = 'data{}'.format(index // 12)
+    node = AttrDict()
+    node.label = 'compute'
+    node.hostname = 'node-{}'.format(index)
+    node.rack_id = 'rack{}'.format(index // 48)
+    node.bmc_type = 'openbmc'
+    node.ipmi = AttrDict([
+        ('switches', [switch]), ('ports', [index % 48 + 1]),
+        ('macs', [mac(0)]), ('ipaddrs', [ipaddr(0)]),
+        ('userid', 'root'), ('password', '0penBmc')])
+    node.pxe = AttrDict([
+        ('switches', [switch]), ('ports', [index % 48 + 49]),
+        ('macs', [mac(1)]), ('ipaddrs', [ipaddr(1)]),
+        ('devices', ['eth15']), ('rename', [True])])
+    node.data = AttrDict([
+        ('switches', [data_switch] * DATA_PORTS),
+        ('ports', [(index % 12) * DATA_PORTS + x + 1
+                   for x in range(DATA_PORTS)]),
+        ('macs', [mac(2 + x) for x in range(DATA_PORTS)]),
+        ('devices', ['eth{}'.format(x) for x in range(DATA_PORTS)]),
+        ('rename', [True] * DATA_PORTS)])
+    node.os = AttrDict([('profile', 'RHEL-7.6-ppc64le'),
+                        ('install_device', '/dev/sda')])
+    node.roles = ['worker']
+    node.interfaces = []
+    return node
+
+
+def _measure(func):
+    """Return (result, seconds, bytes allocated) of calling func"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def _linear_port_lookup(nodes, switch, port):
+    """Port lookup as a scan over AttrDict nodes"""
+    for node in nodes:
+        for type_ in ('ipmi', 'pxe'):
+            if port in node[type_].ports:
+                idx = node[type_].ports.index(port)
+                if switch == node[type_].switches[idx]:
+                    return node[type_].macs[idx], node[type_].ipaddrs[idx]
+    return None, None
+
+
+def _linear_mac_lookup(nodes, mac):
+    """MAC lookup as a scan over AttrDict nodes"""
+    for index, node in enumerate(nodes):
+        for type_ in ('pxe', 'data'):
+            if mac in node[type_].macs:
+                return index, type_, node[type_].macs.index(mac)
+
+
+def benchmark(count):
+    """Benchmark one node count
+
+    Args:
+        count (int): Number of nodes
+
+    Returns:
+        list: Table rows
+    """
+    nodes, _, dict_size = _measure(
+        lambda: [_mock_node(index) for index in range(count)])
+    # Build from freshly created dicts so that only the retained compact
+    # form is counted
+    compact, _, compact_size = _measure(
+        lambda: InventoryNodes(_mock_node(index) for index in range(count)))
+
+    start = time.perf_counter()
+    compact = InventoryNodes(nodes)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    if compact.to_dicts() != nodes:
+        raise Exception('Compact node round trip is not lossless')
+    restore_time = time.perf_counter() - start
+
+    rand = random.Random(count)
+    samples = [nodes[rand.randrange(count)] for _ in range(LOOKUPS)]
+
+    start = time.perf_counter()
+    for node in samples[:SCAN_LOOKUPS]:
+        _linear_port_lookup(nodes, node.pxe.switches[0], node.pxe.ports[0])
+        _linear_mac_lookup(nodes, node.data.macs[-1])
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    port_index = compact.get_port_index()
+    mac_index = compact.get_mac_index(('pxe', 'data'))
+    index_build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for node in samples:
+        port_index.get((node.pxe.switches[0], node.pxe.ports[0]))
+        mac_index.get(compact.mac_key(node.data.macs[-1]))
+    index_time = time.perf_counter() - start
+
+    return [count,
+            dict_size // 1024, compact_size // 1024,
+            '{:.2f}'.format(build_time), '{:.2f}'.format(restore_time),
+            '{:.0f}'.format(SCAN_LOOKUPS / linear_time),
+            '{:.2f}'.format(index_build_time),
+            '{:.0f}'.format(LOOKUPS / index_time)]
+
+
+def main(counts):
+    header = ['Nodes', 'AttrDict KiB', 'Compact KiB', 'To compact s',
+              'To AttrDict s',
+              'Scan lookups/s', 'Index build s', 'Index lookups/s']
+    rows = [benchmark(count) for count in counts]
+    print(tabulate(rows, header))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('counts', nargs='*', type=int,
+                        default=[1000, 10000, 50000],
+                        help='Node counts to benchmark')
+    args = parser.parse_args()
+    main(args.counts)
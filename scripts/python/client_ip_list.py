@@ -18,8 +18,7 @@
 import argparse
 import os.path
 
-from lib.inventory import Inventory
-from lib.config import Config
+from lib.query_daemon import get_config, get_inventory
 from lib.exception import UserException
 from lib.genesis import get_python_path
 
@@ -50,8 +49,8 @@ if __name__ == '__main__':
     else:
         config_path = None
 
-    inv = Inventory(config_path)
-    cfg = Config(config_path)
+    inv = get_inventory(config_path)
+    cfg = get_config(config_path)
 
     ip_list = _get_pxe_ips(inv)
 
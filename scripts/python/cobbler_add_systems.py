@@ -18,152 +18,207 @@
 import sys
 import os.path
 import argparse
+import threading
 import xmlrpc.client
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from lib.inventory import Inventory
+from lib.exception import UserException
 import lib.genesis as gen
 import lib.logger as logger
 
+COBBLER_API_URL = "http://127.0.0.1/cobbler_api"
+WORKERS = 8
+
+
+def get_system_attrs(inv, index, hostname):
+    """Get Cobbler attributes of a node
+
+    Args:
+        inv (Inventory): Inventory
+        index (int): Node index
+        hostname (str): Node hostname
+
+    Returns:
+        tuple: Cobbler profile and list of (attribute, value) tuples in
+               the order they are passed to modify_system
+    """
+    log = logger.getlogger()
+
+    cobbler_profile = gen.check_os_profile(
+        re.sub("[.]iso", "", inv.get_nodes_os_profile(index)))
+    raid1_enabled = False
+
+    attrs = [
+        ("name", hostname),
+        ("hostname", hostname),
+        ("power_address", inv.get_nodes_ipmi_ipaddr(0, index)),
+        ("power_user", inv.get_nodes_ipmi_userid(index)),
+        ("power_pass", inv.get_nodes_ipmi_password(index)),
+        ("power_type", "ipmilan"),
+        ("profile", cobbler_profile),
+        ('modify_interface', {
+            "macaddress-eth0": inv.get_nodes_pxe_mac(0, index),
+            "ipaddress-eth0": inv.get_nodes_pxe_ipaddr(0, index),
+            "dnsname-eth0": hostname})]
+
+    ks_meta = ""
+    disks = inv.get_nodes_os_install_device(index)
+    if disks is not None:
+        if isinstance(disks, str):
+            ks_meta += 'install_disk=%s ' % disks
+        elif isinstance(disks, list) and len(disks) == 2:
+            ks_meta += (
+                'install_disk=%s install_disk_2=%s ' %
+                (disks[0], disks[1]))
+            raid1_enabled = True
+        else:
+            log.error(
+                '%s: Invalid install_device value: %s '
+                'Must be string or two item list.' %
+                (hostname, disks))
+    if raid1_enabled:
+        ks_meta += 'raid1_enabled=true '
+    domain = inv.get_nodes_os_domain(index)
+    if domain is not None:
+        ks_meta += 'domain=%s ' % domain
+    users = inv.get_nodes_os_users(index)
+    if users is not None:
+        for user in users:
+            if 'name' in user and user['name'] != 'root':
+                ks_meta += 'default_user=%s ' % user['name']
+                log.debug("%s: Using \'%s\' as default user" %
+                          (hostname, user['name']))
+                if 'password' in user:
+                    ks_meta += ('passwd=%s passwdcrypted=true ' %
+                                user['password'])
+                break
+        else:
+            log.debug("%s: No default user found" % hostname)
+    else:
+        log.debug("%s: No users defined" % hostname)
+    if ks_meta != "":
+        attrs.append(("ks_meta", ks_meta))
+    kernel_options = inv.get_nodes_os_kernel_options(index)
+    if 'ubuntu-18.04' in cobbler_profile.lower():
+        if kernel_options is None:
+            kernel_options = ''
+        if 'netcfg/do_not_use_netplan=true' not in kernel_options:
+            kernel_options += ' netcfg/do_not_use_netplan=true'
+    if kernel_options is not None:
+        attrs.append(("kernel_options", kernel_options))
+        attrs.append(("kernel_options_post", kernel_options))
+    attrs.append(("comment", ""))
+
+    return cobbler_profile, attrs
+
+
+def supports_multicall(cobbler_server):
+    """Check if the XML-RPC server implements system.multicall
+
+    Args:
+        cobbler_server (ServerProxy): Cobbler XML-RPC server
+
+    Returns:
+        bool: True if multicall is supported
+    """
+    multicall = xmlrpc.client.MultiCall(cobbler_server)
+    multicall.ping()
+    try:
+        tuple(multicall())
+    except (xmlrpc.client.Fault, xmlrpc.client.ProtocolError):
+        return False
+    return True
+
+
+def add_system(cobbler_server, token, attrs, multicall=False):
+    """Create and save one Cobbler system
+
+    Args:
+        cobbler_server (ServerProxy): Cobbler XML-RPC server
+        token (str): Login token
+        attrs (list): (attribute, value) tuples
+        multicall (bool): Send modify calls in one request
+    """
+    handle = cobbler_server.new_system(token)
+    if multicall:
+        calls = xmlrpc.client.MultiCall(cobbler_server)
+    else:
+        calls = cobbler_server
+    for attr, value in attrs:
+        calls.modify_system(handle, attr, value, token)
+    if multicall:
+        # Iterating the results raises the first Fault. Check them before
+        # saving, the server runs the remaining calls after a Fault.
+        tuple(calls())
+    cobbler_server.save_system(handle, token)
+
+
+def add_systems(systems, url=COBBLER_API_URL, workers=WORKERS,
+                multicall=None):
+    """Add Cobbler systems and run Cobbler sync once
+
+    Systems are registered concurrently over one connection per worker.
+    A failed system is logged and does not stop the others.
+
+    Args:
+        systems (list): (hostname, profile, attrs) tuples
+        url (str): Cobbler XML-RPC API URL
+        workers (int): Number of concurrent connections
+        multicall (bool): Use system.multicall. None to detect.
+
+    Returns:
+        dict: Error message by hostname of systems that failed
+    """
+    log = logger.getlogger()
+
+    cobbler_server = xmlrpc.client.ServerProxy(url)
+    token = cobbler_server.login(
+        gen.get_cobbler_user(), gen.get_cobbler_pass())
+    if multicall is None:
+        multicall = supports_multicall(cobbler_server)
+    log.debug('Cobbler multicall {}'.format(
+        'enabled' if multicall else 'not supported'))
+
+    local = threading.local()
+
+    def _add(system):
+        hostname, cobbler_profile, attrs = system
+        if not hasattr(local, 'server'):
+            local.server = xmlrpc.client.ServerProxy(url)
+        try:
+            add_system(local.server, token, attrs, multicall)
+        except (xmlrpc.client.Error, OSError) as exc:
+            log.error("Cobbler Add System failed: name=%s - %s" %
+                      (hostname, exc))
+            return hostname, str(exc)
+        log.info(
+            "Cobbler Add System: name=%s, profile=%s" %
+            (hostname, cobbler_profile))
+        return hostname, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(_add, systems))
+
+    cobbler_server.sync(token)
+    log.info("Running Cobbler sync")
 
-def cobbler_add_systems(cfg_file=None):
-    LOG = logger.getlogger()
+    return {hostname: error for hostname, error in results if error}
 
-    cobbler_user = gen.get_cobbler_user()
-    cobbler_pass = gen.get_cobbler_pass()
-    cobbler_server = xmlrpc.client.Server("http://127.0.0.1/cobbler_api")
-    token = cobbler_server.login(cobbler_user, cobbler_pass)
 
+def cobbler_add_systems(cfg_file=None, workers=WORKERS):
     inv = Inventory(cfg_file=cfg_file)
 
+    systems = []
     for index, hostname in enumerate(inv.yield_nodes_hostname()):
-        ipv4_ipmi = inv.get_nodes_ipmi_ipaddr(0, index)
-        userid_ipmi = inv.get_nodes_ipmi_userid(index)
-        password_ipmi = inv.get_nodes_ipmi_password(index)
-        ipv4_pxe = inv.get_nodes_pxe_ipaddr(0, index)
-        mac_pxe = inv.get_nodes_pxe_mac(0, index)
-        cobbler_profile = gen.check_os_profile(
-            re.sub("[.]iso", "", inv.get_nodes_os_profile(index)))
-        raid1_enabled = False
-
-        new_system_create = cobbler_server.new_system(token)
-
-        cobbler_server.modify_system(
-            new_system_create,
-            "name",
-            hostname,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "hostname",
-            hostname,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "power_address",
-            ipv4_ipmi,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "power_user",
-            userid_ipmi,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "power_pass",
-            password_ipmi,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "power_type",
-            "ipmilan",
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            "profile",
-            cobbler_profile,
-            token)
-        cobbler_server.modify_system(
-            new_system_create,
-            'modify_interface',
-            {
-                "macaddress-eth0": mac_pxe,
-                "ipaddress-eth0": ipv4_pxe,
-                "dnsname-eth0": hostname},
-            token)
-        ks_meta = ""
-        disks = inv.get_nodes_os_install_device(index)
-        if disks is not None:
-            if isinstance(disks, str):
-                ks_meta += 'install_disk=%s ' % disks
-            elif isinstance(disks, list) and len(disks) == 2:
-                ks_meta += (
-                    'install_disk=%s install_disk_2=%s ' %
-                    (disks[0], disks[1]))
-                raid1_enabled = True
-            else:
-                LOG.error(
-                    '%s: Invalid install_device value: %s '
-                    'Must be string or two item list.' %
-                    (hostname, disks))
-        if raid1_enabled:
-            ks_meta += 'raid1_enabled=true '
-        domain = inv.get_nodes_os_domain(index)
-        if domain is not None:
-            ks_meta += 'domain=%s ' % domain
-        users = inv.get_nodes_os_users(index)
-        if users is not None:
-            for user in users:
-                if 'name' in user and user['name'] != 'root':
-                    ks_meta += 'default_user=%s ' % user['name']
-                    LOG.debug("%s: Using \'%s\' as default user" %
-                              (hostname, user['name']))
-                    if 'password' in user:
-                        ks_meta += ('passwd=%s passwdcrypted=true ' %
-                                    user['password'])
-                    break
-            else:
-                LOG.debug("%s: No default user found" % hostname)
-        else:
-            LOG.debug("%s: No users defined" % hostname)
-        if ks_meta != "":
-            cobbler_server.modify_system(
-                new_system_create,
-                "ks_meta",
-                ks_meta,
-                token)
-        kernel_options = inv.get_nodes_os_kernel_options(index)
-        if 'ubuntu-18.04' in cobbler_profile.lower():
-            if kernel_options is None:
-                kernel_options = ''
-            if 'netcfg/do_not_use_netplan=true' not in kernel_options:
-                kernel_options += ' netcfg/do_not_use_netplan=true'
-        if kernel_options is not None:
-            cobbler_server.modify_system(
-                new_system_create,
-                "kernel_options",
-                kernel_options,
-                token)
-            cobbler_server.modify_system(
-                new_system_create,
-                "kernel_options_post",
-                kernel_options,
-                token)
-        comment = ""
-        cobbler_server.modify_system(
-            new_system_create,
-            "comment",
-            comment,
-            token)
-
-        cobbler_server.save_system(new_system_create, token)
-
-        LOG.info(
-            "Cobbler Add System: name=%s, profile=%s" %
-            (hostname, cobbler_profile))
+        cobbler_profile, attrs = get_system_attrs(inv, index, hostname)
+        systems.append((hostname, cobbler_profile, attrs))
 
-    cobbler_server.sync(token)
-    LOG.info("Running Cobbler sync")
+    failed = add_systems(systems, workers=workers)
+    if failed:
+        raise UserException('Failed to add Cobbler systems: {}'.format(
+            ', '.join(sorted(failed))))
 
 
 if __name__ == '__main__':
@@ -172,6 +227,9 @@ if __name__ == '__main__':
                         help='Config file path.  Absolute path or relative '
                         'to power-up/')
 
+    parser.add_argument('--workers', '-w', type=int, default=WORKERS,
+                        help='Number of concurrent Cobbler connections')
+
     parser.add_argument('--print', '-p', dest='log_lvl_print',
                         help='print log level', default='info')
 
@@ -188,4 +246,7 @@ if __name__ == '__main__':
     if not os.path.isfile(args.config_path):
         sys.exit('{} does not exist'.format(args.config_path))
 
-    cobbler_add_systems(args.config_path)
+    try:
+        cobbler_add_systems(args.config_path, args.workers)
+    except UserException as exc:
+        sys.exit(str(exc))
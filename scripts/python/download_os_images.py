@@ -18,14 +18,13 @@
 import argparse
 import sys
 import os.path
-import wget
 
 import lib.logger as logger
 from lib.config import Config
 from lib.genesis import check_os_profile, get_os_images_path, GEN_PATH, \
     get_os_image_urls
 from lib.exception import UserException
-from lib.utilities import sha1sum
+from lib.download import Downloader, Progress, print_progress
 
 
 def download_os_images(config_path=None):
@@ -36,6 +35,7 @@ def download_os_images(config_path=None):
     os_images_path = get_os_images_path() + "/"
     os_image_urls = get_os_image_urls()
 
+    downloads = []
     for os_profile in cfg.yield_ntmpl_os_profile():
         for os_image_url in os_image_urls:
             if check_os_profile(os_profile) in os_image_url['name']:
@@ -45,17 +45,20 @@ def download_os_images(config_path=None):
                         dest += image['filename']
                     else:
                         dest += image['url'].split("/")[-1]
-                    if not os.path.isfile(dest):
-                        log.info(f"Downloading OS image: {image['url']}")
-                        wget.download(image['url'], out=dest)
-                        print('')
-                        sys.stdout.flush()
-                    log.info('Verifying OS image sha1sum: %s' % dest)
-                    if image['sha1sum'] != sha1sum(dest):
-                        msg = ('OS image sha1sum verification failed: %s' %
-                               dest)
-                        log.error(msg)
-                        raise UserException(msg)
+                    downloads.append({'url': image['url'], 'dest': dest,
+                                      'checksum': image['sha1sum'],
+                                      'algorithm': 'sha1'})
+
+    # Images verified by an earlier run are neither fetched nor hashed
+    # again. Interrupted downloads are resumed.
+    log.info('Downloading and verifying OS images')
+    with Downloader(progress=Progress(print_progress)) as downloader:
+        failed = downloader.download_many(downloads)
+    if failed:
+        msg = ('OS image download or sha1sum verification failed: %s' %
+               ', '.join(failed))
+        log.error(msg)
+        raise UserException(msg)
 
 
 if __name__ == '__main__':
@@ -567,7 +567,9 @@ class Gen(object):
         log = logger.getlogger()
         print('Bundling {0} directory'.format(root_dir))
         try:
-            bundle.bundle_this(root_dir, self.args.bundle_to[0])
+            since = getattr(self.args, 'bundle_since', None)
+            bundle.bundle_this(root_dir, self.args.bundle_to[0],
+                               since[0] if since else None)
             print('Bundled {0} directory'.format(root_dir))
         except KeyboardInterrupt as e:
             log.error("User exit ... {0}".format(e))
@@ -19,6 +19,7 @@ import argparse
 import re
 import os.path
 import sys
+from collections import OrderedDict
 from subprocess import Popen, PIPE
 from time import sleep
 
@@ -27,6 +28,7 @@ from set_bootdev_clients import set_bootdev_clients
 from set_power_clients import set_power_clients
 from lib.config import Config
 from lib.inventory import Inventory
+from lib.wave_scheduler import WaveScheduler, WAVE_SIZE, MAX_IN_FLIGHT
 import lib.logger as logger
 import lib.genesis as gen
 
@@ -58,17 +60,59 @@ def _get_lists(latest_list, handled_list):
     return new_list, handled_list
 
 
-def install_client_os(config_path=None):
+def _get_cobbler_status(cmd):
+    """Get clients installing and finished from 'cobbler status'
+    returns: (list, list) ip addresses of clients which started (installing
+        or finished) and finished installation, and the command output
+    """
+    stdout, stderr = _sub_proc_exec(cmd)
+    started = []
+    finished = []
+    for line in stdout.splitlines():
+        match = re.search(r'((?:\d{1,3}\.){3}\d{1,3}).+(installing|finished)',
+                          line)
+        if match:
+            started.append(match.group(1))
+            if match.group(2) == 'finished':
+                finished.append(match.group(1))
+    return started, finished, stdout
+
+
+def install_client_os(config_path=None, wave_size=WAVE_SIZE,
+                      max_in_flight=MAX_IN_FLIGHT, rack_cap=None,
+                      switch_cap=None):
+    """Network install the client OS
+
+    Clients are powered on in waves (see lib.wave_scheduler) so that the
+    boot server is not overloaded by all clients booting at once.
+
+    Args:
+        config_path (str): Config file path
+        wave_size (int): Initial number of clients per wave
+        max_in_flight (int): Maximum clients booting or installing
+        rack_cap (int): Maximum clients booting or installing per rack
+        switch_cap (int): Maximum clients booting or installing per PXE
+                          switch
+    """
     log = logger.getlogger()
     cobbler_set_netboot_enabled(True)
     set_power_clients('off', config_path, wait=POWER_WAIT)
-    set_bootdev_clients('network', False, config_path)
-    set_power_clients('on', config_path, wait=POWER_WAIT)
     cfg = Config(config_path)
     inv = Inventory(config_path)
 
-    client_list = inv.get_nodes_ipmi_ipaddr(0)
-    client_cnt = len(client_list)
+    # Clients are tracked by PXE address as reported by 'cobbler status'
+    pxe_to_ipmi = {}
+    nodes = OrderedDict()
+    for index, hostname in enumerate(inv.yield_nodes_hostname()):
+        ipv4_pxe = inv.get_nodes_pxe_ipaddr(0, index)
+        pxe_to_ipmi[ipv4_pxe] = inv.get_nodes_ipmi_ipaddr(0, index)
+        nodes[ipv4_pxe] = {'rack': inv.get_nodes_rack_id(index),
+                           'switch': inv.get_nodes_pxe_switch(0, index)}
+    client_cnt = len(nodes)
+    scheduler = WaveScheduler(nodes, wave_size=wave_size,
+                              max_in_flight=max_in_flight,
+                              group_caps={'rack': rack_cap,
+                                          'switch': switch_cap})
 
     for vlan in cfg.yield_depl_netw_client_vlan('pxe'):
         break
@@ -80,23 +124,36 @@ def install_client_os(config_path=None):
 
     cnt = 60
     handled_list = []
+    released_cnt = 0
     log.info('Waiting for installation to begin.  Polling on 10 sec intervals')
     while cnt > 0:
-        stdout, stderr = _sub_proc_exec(cmd)
-        latest_list = re.findall(r'(?:\d{1,3}\.){3}\d{1,3}.+installing', stdout)
-        latest_list = re.findall(r'(?:\d{1,3}\.){3}\d{1,3}', ''.join(latest_list))
-        new_list, handled_list = _get_lists(latest_list, handled_list)
+        started, finished, stdout = _get_cobbler_status(cmd)
+        scheduler.update(started, finished)
+        wave = scheduler.next_wave()
+        if wave:
+            released_cnt += len(wave)
+            log.info('Booting {} clients. Released {} of {}'.format(
+                len(wave), released_cnt, client_cnt))
+            set_bootdev_clients('network', False, config_path, wave)
+            set_power_clients('on', config_path,
+                              [pxe_to_ipmi[client] for client in wave],
+                              wait=POWER_WAIT)
+            cnt = 60
+
+        new_list, handled_list = _get_lists(started, handled_list)
         installing_cnt = len(handled_list)
         print('Nodes installing: {} of {}. Remaining polls: {}{}'.
               format(installing_cnt, client_cnt, cnt, gen.Color.up_one))
         sys.stdout.flush()
         if new_list:
             set_bootdev_clients('default', True, config_path, new_list)
-        else:
+            cnt = 60
+        elif not wave:
             sleep(10)
-        if installing_cnt == client_cnt:
+        if installing_cnt >= client_cnt:
             break
-        cnt -= 1
+        if scheduler.is_done():
+            cnt -= 1
     print('\n')
     log.info(stdout)
     msg = ('\nNot all cluster nodes have started installation. POWER-Up is\n'
@@ -105,7 +162,7 @@ def install_client_os(config_path=None):
            'encountered a problem.  You may be able to interact with each\n'
            'clients installer via IPMI SOL console to resolve the problem\n'
            'manually.\n')
-    if installing_cnt != client_cnt:
+    if installing_cnt < client_cnt:
         log.info('\n{}{}{}'.format(gen.Color.red, msg, gen.Color.endc))
 
 
@@ -115,6 +172,20 @@ if __name__ == '__main__':
                         help='Config file path.  Absolute path or relative '
                         'to power-up/')
 
+    parser.add_argument('--wave-size', type=int, default=WAVE_SIZE,
+                        help='Initial number of clients booted per wave')
+
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                        help='Maximum clients booting or installing')
+
+    parser.add_argument('--rack-cap', type=int, default=None,
+                        help='Maximum clients booting or installing per '
+                        'rack')
+
+    parser.add_argument('--switch-cap', type=int, default=None,
+                        help='Maximum clients booting or installing per PXE '
+                        'switch')
+
     parser.add_argument('--print', '-p', dest='log_lvl_print',
                         help='print log level', default='info')
 
@@ -130,4 +201,5 @@ if __name__ == '__main__':
         sys.exit('{} does not exist'.format(args.config_path))
 
     logger.create(args.log_lvl_print, args.log_lvl_file)
-    install_client_os(args.config_path)
+    install_client_os(args.config_path, args.wave_size, args.max_in_flight,
+                      args.rack_cap, args.switch_cap)
@@ -27,18 +27,30 @@ def inv_set_interface_name(set_mac, set_name, config_path=None):
         macs (str): Interface MAC address
         name (str): Device name
     """
+    inv_set_interface_names({set_mac: set_name}, config_path)
+
+
+def inv_set_interface_names(mac_names, config_path=None):
+    """Set physical interface names
+
+    Args:
+        mac_names (dict of str): Interface MAC address{Device name}
+    """
     inv = Inventory(config_path)
-    inv.set_interface_name(set_mac, set_name)
+    inv.set_interface_names(mac_names)
 
 
 if __name__ == '__main__':
     """
     Arg1: Interface MAC address
     Arg2: Device name
-    Arg3: config file path
+    [Arg3: Interface MAC address
+     Arg4: Device name ...]
+    ArgN: config file path
     """
 
-    if len(sys.argv) != 4:
+    if len(sys.argv) < 4 or len(sys.argv) % 2 != 0:
         sys.exit('Invalid number of arguments.')
 
-    inv_set_interface_name(sys.argv[1], sys.argv[2], sys.argv[3])
+    args = sys.argv[1:-1]
+    inv_set_interface_names(dict(zip(args[0::2], args[1::2])), sys.argv[-1])
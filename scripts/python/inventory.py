@@ -16,15 +16,26 @@
 # limitations under the License.
 
 import argparse
+import fcntl
+import hashlib
 import json
 import os.path
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
 
-from lib.inventory import Inventory
-from lib.config import Config
+from lib.query_daemon import get_config, get_inventory
 import lib.logger as logger
 import lib.genesis as gen
 
 SSH_USER = 'root'
+CACHE_DIR = os.path.join(gen.get_python_path(), '.inventory_cache')
+CACHE_CURRENT = 'current'
+CACHE_LOCK_FILE = '.lock'
+CACHE_KEY_FILE = 'key.json'
+CACHE_INVENTORY_FILE = 'inventory.json'
+CACHE_HOSTVARS_DIR = 'hostvars'
 SSH_PRIVATE_KEY = gen.get_ssh_private_key_file()
 INVENTORY_INIT = {
     'all': {
@@ -45,16 +56,22 @@ INVENTORY_INIT = {
 }
 
 
-def generate_dynamic_inventory():
+def get_config_path():
     config_pointer_file = gen.get_python_path() + '/config_pointer_file'
     if os.path.isfile(config_pointer_file):
         with open(config_pointer_file) as f:
             config_path = f.read()
     else:
         config_path = None
+    return config_path
 
-    inv = Inventory(config_path)
-    cfg = Config(config_path)
+
+def generate_dynamic_inventory(config_path=None):
+    if config_path is None:
+        config_path = get_config_path()
+
+    inv = get_inventory(config_path)
+    cfg = get_config(config_path)
 
     # Initialize the empty inventory
     dynamic_inventory = INVENTORY_INIT
@@ -120,17 +137,191 @@ def _sanitize(str):
     return str.replace('-', '_')
 
 
+def _sha256sum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _file_key(path, digest=True):
+    """Get cache key of a source file
+
+    Args:
+        path (str): File path (symlinks are recorded as given)
+        digest (bool): Include content hash
+
+    Returns:
+        dict: File key or None if the file does not exist
+    """
+    realpath = os.path.realpath(path)
+    try:
+        stat = os.stat(realpath)
+    except OSError:
+        return None
+    key = {'path': path,
+           'realpath': realpath,
+           'mtime': stat.st_mtime_ns,
+           'size': stat.st_size}
+    if digest:
+        key['sha256'] = _sha256sum(realpath)
+    return key
+
+
+def _get_source_files(config_path):
+    """Get config and inventory files the dynamic inventory is built from
+
+    Returns:
+        list of str: File paths
+    """
+    files = [config_path or gen.CFG_FILE]
+    if not gen.is_container():
+        files.append(gen.get_symlink_path(config_path))
+    inv_file = gen.get_inventory_realpath(config_path)
+    files.append(inv_file)
+    files.append(inv_file + gen.INV_JOURNAL_SUFFIX)
+    return files
+
+
+def _is_cache_current(cache_path, config_path):
+    """Check cached inventory against its source files
+
+    File mtime and size are compared first; the content hash is only
+    computed when those differ.
+
+    Returns:
+        bool: True if cache can be used
+    """
+    try:
+        with open(os.path.join(cache_path, CACHE_KEY_FILE)) as f:
+            cache_key = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if cache_key.get('config_path') != config_path:
+        return False
+
+    for file_key in cache_key.get('files', []):
+        current = _file_key(file_key['path'], digest=False)
+        if current is None or current['realpath'] != file_key['realpath']:
+            return False
+        if (current['mtime'] == file_key['mtime'] and
+                current['size'] == file_key['size']):
+            continue
+        if (current['size'] != file_key['size'] or
+                _sha256sum(current['realpath']) != file_key['sha256']):
+            return False
+    return True
+
+
+def _write_cache(config_path):
+    """Generate dynamic inventory and atomically replace the cache
+
+    The inventory is written into a new generation directory which is then
+    swapped in by renaming the 'current' symlink over the old one. Must be
+    called with the cache lock held exclusively, see open_cache(), so that
+    no other generation is in use.
+
+    Returns:
+        str: Path of the new cache generation
+    """
+    files = _get_source_files(config_path)
+    file_keys = [_file_key(path) for path in files]
+    dynamic_inventory = generate_dynamic_inventory(config_path)
+
+    cache_path = tempfile.mkdtemp(prefix='gen-', dir=CACHE_DIR)
+    os.chmod(cache_path, 0o755)
+    hostvars_path = os.path.join(cache_path, CACHE_HOSTVARS_DIR)
+    os.mkdir(hostvars_path)
+    for host, hostvars in dynamic_inventory['_meta']['hostvars'].items():
+        with open(os.path.join(hostvars_path, host + '.json'), 'w') as f:
+            json.dump(hostvars, f, indent=4)
+    with open(os.path.join(cache_path, CACHE_INVENTORY_FILE), 'w') as f:
+        json.dump(dynamic_inventory, f, indent=4)
+    # Key files are written last and only if all sources existed so that an
+    # incomplete generation is never considered current
+    if None not in file_keys:
+        with open(os.path.join(cache_path, CACHE_KEY_FILE), 'w') as f:
+            json.dump({'config_path': config_path, 'files': file_keys}, f)
+
+    current = os.path.join(CACHE_DIR, CACHE_CURRENT)
+    link_tmp = os.path.join(CACHE_DIR, '.' + os.path.basename(cache_path))
+    os.symlink(os.path.basename(cache_path), link_tmp)
+    os.replace(link_tmp, current)
+
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith('gen-') and name != os.path.basename(cache_path):
+            shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+    return cache_path
+
+
+@contextmanager
+def open_cache():
+    """Get current dynamic inventory cache, regenerating it if stale
+
+    Readers hold a shared lock on the cache directory while they use a
+    generation. A stale cache is regenerated under an exclusive lock, so
+    concurrent regenerations are serialized and old generations are only
+    removed when no reader can be using them.
+
+    Yields:
+        str: Path of the cache generation
+    """
+    config_path = get_config_path()
+    current = os.path.join(CACHE_DIR, CACHE_CURRENT)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, CACHE_LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        cache_path = os.path.realpath(current)
+        if not _is_cache_current(cache_path, config_path):
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have regenerated while this one waited
+            cache_path = os.path.realpath(current)
+            if not _is_cache_current(cache_path, config_path):
+                cache_path = _write_cache(config_path)
+            fcntl.flock(lock, fcntl.LOCK_SH)
+        yield cache_path
+
+
+def print_cached_list():
+    with open_cache() as cache_path:
+        with open(os.path.join(cache_path, CACHE_INVENTORY_FILE)) as f:
+            shutil.copyfileobj(f, sys.stdout)
+    print()
+
+
+def print_cached_host(host):
+    with open_cache() as cache_path:
+        hostvars_file = os.path.join(cache_path, CACHE_HOSTVARS_DIR,
+                                     os.path.basename(host) + '.json')
+        if os.path.isfile(hostvars_file):
+            with open(hostvars_file) as f:
+                shutil.copyfileobj(f, sys.stdout)
+            print()
+        else:
+            print(json.dumps({}))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--list', action='store_true')
     parser.add_argument('--host', action='store')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Generate inventory without using the cache')
     args = parser.parse_args()
     logger.create()
     LOG = logger.getlogger()
 
-    if args.list:
-        dynamic_inventory = generate_dynamic_inventory()
+    if args.no_cache:
+        if args.list:
+            dynamic_inventory = generate_dynamic_inventory()
+        else:
+            dynamic_inventory = INVENTORY_INIT
+        print(json.dumps(dynamic_inventory, indent=4))
+    elif args.list:
+        print_cached_list()
+    elif args.host:
+        print_cached_host(args.host)
     else:
-        dynamic_inventory = INVENTORY_INIT
-
-    print(json.dumps(dynamic_inventory, indent=4))
+        print(json.dumps(INVENTORY_INIT, indent=4))
@@ -406,6 +406,13 @@ def get_args(parser_args=False):
         nargs=1,
         help="Bundle repos and software directory")
 
+    parser_software.add_argument(
+        '--bundle-since',
+        nargs=1,
+        metavar='MANIFEST',
+        help="With --bundle-to, bundle only files changed since the bundle "
+             "of this manifest (<bundle>.manifest.json)")
+
     parser_software.add_argument(
         '--extract-from',
         nargs=1,
@@ -500,6 +507,13 @@ def get_args(parser_args=False):
         nargs=1,
         help="Bundle repos and software directory")
 
+    parser_utils.add_argument(
+        '--bundle-since',
+        nargs=1,
+        metavar='MANIFEST',
+        help="With --bundle-to, bundle only files changed since the bundle "
+             "of this manifest (<bundle>.manifest.json)")
+
     if parser_args:
         return (parser, parser_setup, parser_config, parser_validate,
                 parser_deploy, parser_post_deploy, parser_software,
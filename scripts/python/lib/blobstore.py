@@ -0,0 +1,273 @@
+"""Content-addressed store of repository files, shared through hardlinks"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from contextlib import contextmanager
+
+import lib.logger as logger
+from lib.checksum import checksums, get_cache
+
+SRV_DIR = '/srv'
+STORE_DIR = '.blobs'
+ALGORITHM = 'sha256'
+
+
+def _link(src, dest):
+    """ Hardlink src to dest, atomically replacing dest """
+    tmp_path = f'{dest}.{os.getpid()}.link'
+    os.link(src, tmp_path)
+    try:
+        os.replace(tmp_path, dest)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+def _size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024 or unit == 'GB':
+            break
+        num /= 1024
+    return f'{num:.1f} {unit}' if unit != 'B' else f'{num} B'
+
+
+class BlobStore(object):
+    """ Files stored once by sha256 digest
+
+    Repository files are hardlinks to the blobs, so a package mirrored
+    into several repositories takes space once. Blobs are never modified
+    in place, files replaced in repositories get a new inode. Hardlinks
+    need the store and the repositories on one filesystem, files that
+    can not be linked are left as they are.
+
+    Args:
+        root (str): Store directory
+        cache (ChecksumCache or bool, optional): Digest cache used by all
+                                                 operations of the store.
+                                                 True uses the shared
+                                                 cache, see get_cache().
+    """
+
+    def __init__(self, root, cache=True):
+        self.log = logger.getlogger()
+        self.root = root
+        self.cache = get_cache() if cache is True else cache or None
+
+    @contextmanager
+    def batch(self):
+        """ Save the digest cache once when the batch ends """
+        if self.cache:
+            with self.cache.batch():
+                yield
+        else:
+            yield
+
+    def _remember(self, path, digest):
+        """ Cache the digest of a path just linked to a blob, so the new
+        inode is not hashed again """
+        if self.cache:
+            self.cache.set(path, ALGORITHM, digest.lower(), os.stat(path))
+
+    def blob_path(self, digest):
+        digest = digest.lower()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _valid_blobs(self, digests, known=None):
+        """ Check blobs against their digests. Blobs changed by writing to
+        one of their links are dropped from the store.
+
+        Args:
+            digests (iterable): sha256 hex digests
+            known (dict, optional): Digest of files just hashed. A blob
+                                    linked to one of them is not hashed
+                                    again.
+
+        Returns:
+            set: Digests of the valid blobs
+        """
+        blobs = {}
+        for digest in set(digest.lower() for digest in digests):
+            blob = self.blob_path(digest)
+            try:
+                blobs[blob] = (digest, os.stat(blob))
+            except OSError:
+                pass
+        valid = set(digest for digest, _ in blobs.values())
+        linked = set()
+        for path, digest in (known or {}).items():
+            blob = self.blob_path(digest)
+            try:
+                if blob in blobs and os.path.samestat(os.stat(path),
+                                                      blobs[blob][1]):
+                    linked.add(blob)
+            except OSError:
+                pass
+        unverified = [blob for blob in blobs if blob not in linked]
+        for blob, digest in checksums(unverified, ALGORITHM,
+                                      cache=self.cache).items():
+            if digest != blobs[blob][0]:
+                self.log.warning(f'Removing modified blob {blob}')
+                valid.discard(blobs[blob][0])
+                try:
+                    os.remove(blob)
+                except OSError as exc:
+                    self.log.debug(f'Unable to remove {blob} - {exc}')
+        return valid
+
+    def materialize(self, digest, dest):
+        """ Link a stored blob to a path
+
+        Args:
+            digest (str): sha256 hex digest
+            dest (str): Destination file path. An existing file is
+                        replaced.
+
+        Returns:
+            bool: True if the blob exists and was linked
+        """
+        blob = self.blob_path(digest)
+        try:
+            if not self._valid_blobs([digest]):
+                return False
+            if os.path.exists(dest) and os.path.samefile(blob, dest):
+                return True
+            os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+            _link(blob, dest)
+            self._remember(dest, digest)
+        except OSError as exc:
+            self.log.debug(f'Unable to link {blob} to {dest} - {exc}')
+            return False
+        self.log.debug(f'{dest} linked from the package store')
+        return True
+
+    def add(self, path, digest=None):
+        """ Store a file. A file whose content is stored already is
+        replaced by a link to the blob.
+
+        Args:
+            path (str): File path
+            digest (str, optional): sha256 hex digest of the file if known
+
+        Returns:
+            bool: True if the file is linked to a blob
+        """
+        if digest is None:
+            digest = checksums([path], ALGORITHM, cache=self.cache)[path]
+        return self._add(path, digest, digest.lower() in self._valid_blobs(
+            [digest], {path: digest}))
+
+    def _add(self, path, digest, stored):
+        blob = self.blob_path(digest)
+        try:
+            if stored:
+                if not os.path.samefile(blob, path):
+                    _link(blob, path)
+                    self._remember(path, digest)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(path, blob)
+        except OSError as exc:
+            self.log.debug(f'Unable to store {path} - {exc}')
+            return False
+        return True
+
+    def add_tree(self, top, suffixes=None):
+        """ Store the files below a directory
+
+        Args:
+            top (str): Directory
+            suffixes (tuple, optional): Filename suffixes of the files to
+                                        store. Defaults to all files.
+
+        Returns:
+            int: Number of files linked to blobs
+        """
+        root = os.path.realpath(self.root)
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames if not name.startswith(
+                '.') and os.path.realpath(os.path.join(dirpath, name)) != root]
+            paths.extend(os.path.join(dirpath, name) for name in filenames
+                         if not name.startswith('.') and
+                         (suffixes is None or name.endswith(suffixes)))
+        paths = [path for path in paths if os.path.isfile(path) and
+                 not os.path.islink(path)]
+        with self.batch():
+            digests = checksums(paths, ALGORITHM, cache=self.cache)
+            stored = self._valid_blobs(digests.values(), digests)
+            count = 0
+            for path in paths:
+                digest = digests[path].lower()
+                if self._add(path, digest, digest in stored):
+                    # Later files with this content link to the new blob
+                    stored.add(digest)
+                    count += 1
+        return count
+
+    def stats(self):
+        """ Get the size of the store and the space saved by sharing
+
+        Returns:
+            dict: 'blobs', 'size' (bytes stored once), 'saved' (bytes not
+                  stored again by repositories sharing a blob) and 'unused'
+                  (bytes of blobs no repository links to anymore)
+        """
+        stats = {'blobs': 0, 'size': 0, 'saved': 0, 'unused': 0}
+        try:
+            subdirs = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return stats
+        for subdir in subdirs:
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(subdir.path):
+                stat = entry.stat(follow_symlinks=False)
+                stats['blobs'] += 1
+                stats['size'] += stat.st_size
+                # One link is the blob, one is the first repository copy
+                stats['saved'] += stat.st_size * max(0, stat.st_nlink - 2)
+                if stat.st_nlink == 1:
+                    stats['unused'] += stat.st_size
+        return stats
+
+    def summary(self):
+        """ One line description of stats() """
+        stats = self.stats()
+        summary = (f'{stats["blobs"]} files, {_size(stats["size"])} stored, '
+                   f'{_size(stats["saved"])} saved')
+        if stats['unused']:
+            summary += f', {_size(stats["unused"])} unused'
+        return summary
+
+
+def get_store(path):
+    """ Get the blob store for files below a directory
+
+    Repositories under /srv share one store, others use a store in the
+    directory itself.
+
+    Args:
+        path (str): Repository base directory
+
+    Returns:
+        BlobStore: Store
+    """
+    real = os.path.realpath(path)
+    if real == SRV_DIR or real.startswith(SRV_DIR + '/'):
+        return BlobStore(os.path.join(SRV_DIR, STORE_DIR))
+    return BlobStore(os.path.join(path, STORE_DIR))
@@ -0,0 +1,323 @@
+"""Cached, concurrent file checksums"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import lib.logger as logger
+from lib.genesis import GEN_PATH
+
+CHECKSUM_CACHE = os.path.join(GEN_PATH, 'checksum_cache.json')
+BUF_SIZE = 1024 * 1024
+WORKERS = 4
+
+
+def file_digest(path, algorithm='sha1', buf_size=BUF_SIZE):
+    """ Calculate checksum of single file
+
+    The file is read into one reusable buffer of 'buf_size' bytes.
+    hashlib releases the GIL while hashing large blocks, so several
+    files can be hashed concurrently from threads.
+
+    Args:
+        path (str): Path to file
+        algorithm (str): hashlib algorithm name
+        buf_size (int): Read buffer size in bytes
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.new(algorithm)
+    buf = bytearray(buf_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        for size in iter(lambda: f.readinto(buf), 0):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def _stat_key(stat):
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class ChecksumCache(object):
+    """ Persistent file digests
+
+    Digests are keyed by real path and remembered with the file's size,
+    modification time and inode. A digest is only returned while all
+    three are unchanged, so modified or replaced files are hashed again.
+    The cache file is JSON. It is read once when the cache is created and
+    written by save(), which is deferred while a batch() is open.
+
+    Args:
+        path (str, optional): Cache file path
+    """
+
+    def __init__(self, path=CHECKSUM_CACHE):
+        self.log = logger.getlogger()
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.batches = 0
+        self.file_stat = None
+        self.entries = self._load()
+
+    def _stat_file(self):
+        try:
+            return _stat_key(os.stat(self.path))
+        except OSError:
+            return None
+
+    def _load(self):
+        self.file_stat = self._stat_file()
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            self.log.warning(f'Ignoring checksum cache {self.path} - {exc}')
+            return {}
+        self.log.warning(f'Ignoring checksum cache {self.path}')
+        return {}
+
+    def get(self, path, algorithm='sha1'):
+        """ Get cached digest
+
+        Args:
+            path (str): File path
+            algorithm (str): hashlib algorithm name
+
+        Returns:
+            str: Hex digest or None if not cached or file changed
+        """
+        realpath = os.path.realpath(path)
+        try:
+            stat_key = _stat_key(os.stat(realpath))
+        except OSError:
+            with self.lock:
+                if self.entries.pop(realpath, None) is not None:
+                    self.dirty = True
+            return None
+        with self.lock:
+            entry = self.entries.get(realpath)
+            if entry and entry['stat'] == stat_key:
+                return entry['digests'].get(algorithm)
+        return None
+
+    def set(self, path, algorithm, digest, stat):
+        """ Remember digest
+
+        Args:
+            path (str): File path
+            algorithm (str): hashlib algorithm name
+            digest (str): Hex digest
+            stat (os.stat_result): File stat taken before hashing
+        """
+        realpath = os.path.realpath(path)
+        stat_key = _stat_key(stat)
+        with self.lock:
+            entry = self.entries.get(realpath)
+            if not entry or entry['stat'] != stat_key:
+                entry = {'stat': stat_key, 'digests': {}}
+                self.entries[realpath] = entry
+            entry['digests'][algorithm] = digest
+            self.dirty = True
+
+    @contextmanager
+    def batch(self):
+        """ Defer save() until the outermost batch ends
+
+        Callers checking files one at a time wrap the loop in a batch, so
+        the cache file is written once instead of once per file.
+        """
+        with self.lock:
+            self.batches += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.batches -= 1
+            self.save()
+
+    def save(self):
+        """ Write the cache file if it changed and no batch is open
+
+        Entries written by other processes since loading are kept. Entries
+        of files found missing by get() are dropped.
+        """
+        with self.lock:
+            if not self.dirty or self.batches:
+                return
+            if self._stat_file() != self.file_stat:
+                entries = self._load()
+                entries.update(self.entries)
+                self.entries = entries
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.entries, f, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            except OSError as exc:
+                self.log.warning(f'Unable to write checksum cache '
+                                 f'{self.path} - {exc}')
+                return
+            self.file_stat = self._stat_file()
+            self.dirty = False
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=None):
+    """ Get the cache shared by all users of a cache file in this process
+
+    The cache file is read on first use and written again at exit if
+    entries were added since the last save().
+
+    Args:
+        path (str, optional): Cache file path. Defaults to CHECKSUM_CACHE.
+
+    Returns:
+        ChecksumCache: Shared cache
+    """
+    path = path or CHECKSUM_CACHE
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ChecksumCache(path)
+        return _caches[path]
+
+
+@atexit.register
+def _save_caches():
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.save()
+
+
+def _get_cache(cache):
+    if cache is True:
+        return get_cache()
+    return cache or None
+
+
+def checksums(paths, algorithm='sha1', workers=WORKERS, cache=True):
+    """ Calculate checksums of several files concurrently
+
+    Args:
+        paths (iterable): File paths
+        algorithm (str): hashlib algorithm name
+        workers (int): Number of files hashed concurrently
+        cache (ChecksumCache or bool): Cache to use. True uses the shared
+                                       cache of the default cache file,
+                                       False disables caching.
+
+    Returns:
+        dict: Hex digest of each path
+    """
+    log = logger.getlogger()
+    cache = _get_cache(cache)
+    paths = list(paths)
+    results = {}
+    if cache:
+        for path in paths:
+            digest = cache.get(path, algorithm)
+            if digest:
+                log.debug(f'Using cached {algorithm} of {path}')
+                results[path] = digest
+
+    def _hash(path):
+        stat = os.stat(path)
+        digest = file_digest(path, algorithm)
+        # Do not cache a digest of a file written to while hashing
+        if cache and _stat_key(os.stat(path)) == _stat_key(stat):
+            cache.set(path, algorithm, digest, stat)
+        return digest
+
+    missing = [path for path in dict.fromkeys(paths) if path not in results]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for path, digest in zip(missing, executor.map(_hash, missing)):
+                results[path] = digest
+        if cache:
+            cache.save()
+    return results
+
+
+def checksum(path, algorithm='sha1', cache=True):
+    """ Calculate checksum of single file
+
+    Args:
+        path (str): File path
+        algorithm (str): hashlib algorithm name
+        cache (ChecksumCache or bool): See checksums()
+
+    Returns:
+        str: Hex digest
+    """
+    return checksums([path], algorithm, cache=cache)[path]
+
+
+def verify_checksums(expected, algorithm='sha1', workers=WORKERS,
+                     cache=True):
+    """ Verify files against expected checksums
+
+    Args:
+        expected (dict): Expected hex digest of each path
+        algorithm (str): hashlib algorithm name
+        workers (int): Number of files hashed concurrently
+        cache (ChecksumCache or bool): See checksums()
+
+    Returns:
+        list: Paths not matching their expected digest
+    """
+    digests = checksums(expected, algorithm, workers, cache)
+    return [path for path, digest in expected.items()
+            if digests[path] != digest.lower()]
+
+
+def files_match(path1, path2, algorithm='sha1', cache=True):
+    """ Check if two files have the same content
+
+    Args:
+        path1 (str): File path
+        path2 (str): File path
+        algorithm (str): hashlib algorithm name
+        cache (ChecksumCache or bool): See checksums()
+
+    Returns:
+        bool: True if both files exist and have equal content
+    """
+    try:
+        if os.path.getsize(path1) != os.path.getsize(path2):
+            return False
+    except OSError:
+        return False
+    if os.path.samefile(path1, path2):
+        return True
+    digests = checksums([path1, path2], algorithm, cache=cache)
+    return digests[path1] == digests[path2]
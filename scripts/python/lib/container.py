@@ -129,12 +129,20 @@ class Container(object):
             if not os.path.isfile(source):
                 os.mknod(source)
 
+            # Inventory journal is shared so that incremental updates made
+            # inside the container are visible to the deployer
+            journal_source = source + gen.INV_JOURNAL_SUFFIX
+            journal_target = target + gen.INV_JOURNAL_SUFFIX
+            if not os.path.isfile(journal_source):
+                os.mknod(journal_source)
+
             switch_lock_path = gen.get_switch_lock_path()
             container_package_path = gen.get_container_package_path()
             dest_path = os.path.join(container_package_path[:1 +
                                      container_package_path[1:].find('/')],
                                      switch_lock_path[1:])
             volumes = {source: {'bind': target, 'mode': 'Z'},
+                       journal_source: {'bind': journal_target, 'mode': 'Z'},
                        switch_lock_path: {'bind': dest_path, 'mode': 'z'}}
             self.log.debug(f'Container volumes: {volumes}')
 
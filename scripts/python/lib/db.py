@@ -17,8 +17,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fcntl
+import json
 import os
+from contextlib import contextmanager
 import yaml
+from orderedattrdict import AttrDict
 from orderedattrdict.yamlutils import AttrDictYAMLLoader
 
 import lib.logger as logger
@@ -114,10 +118,50 @@ class DatabaseConfig(object):
         logic.validate_config_logic()
 
 
+def _is_mount_point(path):
+    """Check if path is a mount point (e.g. a file bind mounted into a
+    container)
+
+    Args:
+        path (str): Path
+
+    Returns:
+        bool: True if path is a mount point
+    """
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                mount_point = line.split()[4]
+                mount_point = (mount_point.replace('\\040', ' ')
+                               .replace('\\011', '\t')
+                               .replace('\\012', '\n')
+                               .replace('\\134', '\\'))
+                if mount_point == path:
+                    return True
+    except (OSError, IndexError):
+        pass
+    return False
+
+
 class DatabaseInventory(object):
-    """Database """
+    """Database
+
+    Small updates are appended to a journal of JSON 'set' records next to
+    the inventory file and replayed on load. Once the journal grows beyond
+    COMPACT_BYTES it is compacted into the inventory file.
+
+    The inventory file may be bind mounted into the POWER-Up container, so
+    it is rewritten in place rather than renamed. Readers hold a shared
+    and writers an exclusive lock on the journal. A compaction first
+    appends a full 'snapshot' record to the journal, then rewrites the
+    inventory file and finally truncates the journal, so a crash at any
+    point leaves a loadable state.
+    """
 
     FILE_MODE = 0o666
+    COMPACT_BYTES = 1024 * 1024
+    # Block size when scanning a torn journal record backwards
+    SCAN_BYTES = 64 * 1024
 
     def __init__(self, inv_file=None, cfg_file=None):
         self.log = logger.getlogger()
@@ -130,12 +174,38 @@ class DatabaseInventory(object):
                 if not os.path.exists(os.readlink(symlink_path)):
                     os.unlink(symlink_path)
             self.inv_file = gen.get_inventory_realpath(cfg_file)
+        self.journal_file = self.inv_file + gen.INV_JOURNAL_SUFFIX
 
         self.inv = None
 
         # Create inventory file if it does not exist
         if not os.path.isfile(self.inv_file):
             os.mknod(self.inv_file, self.FILE_MODE)
+        if not os.path.isfile(self.journal_file):
+            os.mknod(self.journal_file, self.FILE_MODE)
+
+        # A journal private to the container would not be seen by the
+        # deployer, so only use it if it is shared like the inventory file
+        self.journal_enabled = not (_is_mount_point(self.inv_file) and
+                                    not _is_mount_point(self.journal_file))
+
+    @contextmanager
+    def _lock(self, exclusive=False):
+        """Lock inventory
+
+        Args:
+            exclusive (bool): Exclusive (write) instead of shared lock
+
+        Yields:
+            file: Journal file object opened for reading and appending
+        """
+        with open(self.journal_file, 'a+b') as journal:
+            fcntl.flock(journal,
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield journal
+            finally:
+                fcntl.flock(journal, fcntl.LOCK_UN)
 
     def _load_yaml_file(self, yaml_file):
         """Load from YAML file
@@ -158,22 +228,96 @@ class DatabaseInventory(object):
     def _dump_yaml_file(self, yaml_file, content):
         """Dump to YAML file
 
+        The content is serialized before the file is touched and the file
+        is synced to disk before returning.
+
         Exception:
             If dump to file fails
         """
 
         try:
-            yaml.safe_dump(
+            data = yaml.safe_dump(
                 content,
-                open(yaml_file, 'w'),
                 indent=4,
-                default_flow_style=False)
+                default_flow_style=False).encode('utf-8')
+            with open(yaml_file, 'r+b') as f:
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
         except Exception as exc:
             self.log.error("Failed to dump inventory to '{}' - {}".format(
                 yaml_file, exc))
             raise UserException("Failed to dump inventory to '{}'".format(
                 yaml_file))
 
+    @staticmethod
+    def _read_journal(journal):
+        """Read journal records
+
+        A torn last record left by a crash is ignored.
+
+        Args:
+            journal (file): Journal file object
+
+        Returns:
+            list of dict: Records
+        """
+        journal.seek(0)
+        lines = journal.read().split(b'\n')
+        records = []
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line.decode('utf-8'),
+                                          object_pairs_hook=AttrDict))
+            except ValueError:
+                if index < len(lines) - 1:
+                    raise
+        return records
+
+    @classmethod
+    def _drop_torn_record(cls, journal):
+        """Truncate a torn last record left by a crash
+
+        Only the last byte is read unless the journal does not end with a
+        newline, in which case it is scanned backwards to the last one.
+        """
+        end = journal.seek(0, os.SEEK_END)
+        if not end:
+            return
+        journal.seek(end - 1)
+        if journal.read(1) == b'\n':
+            return
+        pos = end
+        while pos > 0:
+            start = max(0, pos - cls.SCAN_BYTES)
+            journal.seek(start)
+            index = journal.read(pos - start).rfind(b'\n')
+            if index >= 0:
+                journal.truncate(start + index + 1)
+                return
+            pos = start
+        journal.truncate(0)
+
+    @classmethod
+    def _append_journal(cls, journal, records):
+        """Append records to the journal and sync it to disk"""
+        data = b''.join(json.dumps(record).encode('utf-8') + b'\n'
+                        for record in records)
+        cls._drop_torn_record(journal)
+        journal.write(data)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    @staticmethod
+    def _apply_set(inv, path, value):
+        target = inv
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+
     def load_inventory(self):
         """Load inventory from database
 
@@ -181,16 +325,84 @@ class DatabaseInventory(object):
             object: Inventory
         """
 
-        self.inv = self._load_yaml_file(self.inv_file)
+        with self._lock() as journal:
+            try:
+                records = self._read_journal(journal)
+            except ValueError as exc:
+                self.log.error("Failed to parse journal '{}' - {}".format(
+                    self.journal_file, exc))
+                raise UserException("Failed to load '{}'".format(
+                    self.journal_file))
+
+            start = 0
+            for index, record in enumerate(records):
+                if record['op'] == 'snapshot':
+                    start = index
+            if records and records[start]['op'] == 'snapshot':
+                inv = records[start]['value']
+                start += 1
+            else:
+                inv = self._load_yaml_file(self.inv_file)
+
+            for record in records[start:]:
+                if inv is None:
+                    inv = AttrDict()
+                self._apply_set(inv, record['path'], record['value'])
+
+        self.inv = inv
         return self.inv
 
-    def dump_inventory(self, inv):
-        """Dump inventory to database"""
+    @staticmethod
+    def _to_persisted(inv):
+        """Get the persisted form of an inventory
+
+        A compact 'nodes' table (see lib.inv_nodes.InventoryNodes) is
+        converted back to a list of dictionaries.
+        """
+        nodes = inv.get('nodes') if inv is not None else None
+        if not hasattr(nodes, 'to_dicts'):
+            return inv
+        persisted = AttrDict(inv)
+        persisted['nodes'] = nodes.to_dicts()
+        return persisted
+
+    def dump_inventory(self, inv, changes=None):
+        """Dump inventory to database
+
+        Args:
+            inv (AttrDict): Inventory. The nodes may be held in compact
+                form, they are only converted when the full inventory is
+                written.
+            changes (list of 2-tuple, optional): (path, value) of each value
+                changed since the last dump. Path is a list of dictionary
+                keys and list indexes from the inventory root. If given the
+                changes are journaled instead of dumping the inventory.
+        """
 
         self.inv = inv
-        self._dump_yaml_file(self.inv_file, inv)
+        if changes is not None and not changes and self.journal_enabled:
+            return
+        with self._lock(exclusive=True) as journal:
+            size = os.fstat(journal.fileno()).st_size
+            if (changes is not None and self.journal_enabled and
+                    size < self.COMPACT_BYTES):
+                self._append_journal(
+                    journal, [{'op': 'set', 'path': list(path),
+                               'value': value} for path, value in changes])
+                return
+
+            inv = self._to_persisted(inv)
+            self._append_journal(journal, [{'op': 'snapshot', 'value': inv}])
+            self._dump_yaml_file(self.inv_file, inv)
+            journal.truncate(0)
+            journal.flush()
+            os.fsync(journal.fileno())
 
     def __del__(self):
         if (os.path.isfile(self.inv_file) and
-                os.stat(self.inv_file).st_size == 0):
+                os.stat(self.inv_file).st_size == 0 and
+                os.path.isfile(self.journal_file) and
+                os.stat(self.journal_file).st_size == 0):
             os.remove(self.inv_file)
+            if not _is_mount_point(self.journal_file):
+                os.remove(self.journal_file)
@@ -0,0 +1,489 @@
+"""Resumable, segmented HTTP downloads"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from email.utils import parsedate_to_datetime
+from time import sleep, time
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+import lib.logger as logger
+from lib.blobstore import ALGORITHM as STORE_ALGORITHM
+from lib.checksum import file_digest, get_cache
+from lib.exception import UserException
+
+CHUNK_SIZE = 1024 * 1024
+SEGMENTS = 4
+MIN_SEGMENT_SIZE = 32 * 1024 * 1024
+WORKERS = 8
+RETRIES = 3
+TIMEOUT = 60
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.yml'
+STATE_INTERVAL = 16 * 1024 * 1024  # bytes between state file updates
+
+
+class Progress(object):
+    """ Thread safe download progress counters
+
+    Args:
+        callback (callable, optional): Called with this object at most
+                                       once per 'interval' seconds
+        interval (float, optional): Seconds between callback calls
+    """
+
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.start_time = time()
+        self.report_time = 0
+        self.total = 0
+        self.done = 0
+        self.files_total = 0
+        self.files_done = 0
+
+    def add_file(self, size):
+        with self.lock:
+            self.files_total += 1
+            self.total += size or 0
+
+    def update(self, size=0, file_done=False):
+        with self.lock:
+            self.done += size
+            if file_done:
+                self.files_done += 1
+            now = time()
+            if not self.callback or (not file_done and
+                                     now - self.report_time < self.interval):
+                return
+            self.report_time = now
+        self.callback(self)
+
+    def rate(self):
+        """ Get average download rate
+
+        Returns:
+            float: Bytes per second
+        """
+        return self.done / max(time() - self.start_time, 1e-6)
+
+    def __str__(self):
+        mib = 1024 * 1024
+        return (f'{self.files_done}/{self.files_total} files '
+                f'{self.done / mib:.1f}/{self.total / mib:.1f} MiB '
+                f'{self.rate() / mib:.1f} MiB/s')
+
+
+def print_progress(progress):
+    """ Progress callback printing a single updating line """
+    sys.stdout.write(f'\r{progress}  ')
+    if progress.files_done == progress.files_total:
+        sys.stdout.write('\n')
+    sys.stdout.flush()
+
+
+def _http_time(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class _Download(object):
+    """ State of a single, possibly segmented and resumed, download
+
+    Segments are [start, end, done] lists. 'end' is None if the size is
+    unknown. The state is kept in a file next to the partial download so
+    that an interrupted download resumes where it stopped.
+    """
+
+    def __init__(self, url, dest, size, validator):
+        self.url = url
+        self.dest = dest
+        self.part = dest + PART_SUFFIX
+        self.state_file = dest + STATE_SUFFIX
+        self.size = size
+        self.validator = validator
+        self.segments = None
+        self.lock = threading.Lock()
+        self.saved = 0
+
+    def load(self):
+        """ Load state of an earlier attempt of the same download
+
+        Returns:
+            bool: True if the download can be resumed
+        """
+        try:
+            with open(self.state_file) as f:
+                state = yaml.safe_load(f)
+            if (state['url'] == self.url and state['size'] == self.size and
+                    state['validator'] == self.validator and
+                    self.validator and os.path.isfile(self.part)):
+                self.segments = state['segments']
+                return True
+        except FileNotFoundError:
+            pass
+        except (OSError, KeyError, TypeError, yaml.YAMLError):
+            pass
+        return False
+
+    def create(self, segment_count):
+        length = self.size // segment_count if self.size else 0
+        self.segments = [[index * length,
+                          self.size if index == segment_count - 1
+                          else (index + 1) * length, 0]
+                         for index in range(segment_count)]
+        with open(self.part, 'wb') as f:
+            if segment_count > 1:
+                f.truncate(self.size)
+        self.save(force=True)
+
+    def done(self):
+        return sum(segment[2] for segment in self.segments)
+
+    def save(self, force=False):
+        with self.lock:
+            done = self.done()
+            if not force and done - self.saved < STATE_INTERVAL:
+                return
+            self.saved = done
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                yaml.safe_dump({'url': self.url, 'size': self.size,
+                                'validator': self.validator,
+                                'segments': self.segments}, f)
+            os.replace(tmp_path, self.state_file)
+
+    def remove(self):
+        for path in (self.part, self.state_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class Downloader(object):
+    """ HTTP downloader with resume, segments and connection pooling
+
+    Files are downloaded to '<dest>.part' and renamed when complete and
+    verified. Interrupted downloads resume with HTTP range requests, also
+    across runs. Files of at least two 'min_segment_size' are fetched in
+    up to 'segments' parallel ranges if the server supports it. Several
+    files are downloaded concurrently over pooled keep-alive connections.
+
+    Args:
+        workers (int, optional): Files downloaded concurrently
+        segments (int, optional): Maximum parallel ranges per file
+        min_segment_size (int, optional): Minimum bytes per range
+        retries (int, optional): Retries of a failed range
+        timeout (float, optional): Connect and read timeout in seconds
+        progress (Progress, optional): Progress counters to update
+        cache (ChecksumCache or bool, optional): Digest cache used to skip
+                                                 and record verified files.
+                                                 Saved by download_many()
+                                                 and close().
+        store (BlobStore, optional): Content store. Files with a sha256
+                                     checksum found in the store are linked
+                                     instead of fetched, verified downloads
+                                     are added to it.
+    """
+
+    def __init__(self, workers=WORKERS, segments=SEGMENTS,
+                 min_segment_size=MIN_SEGMENT_SIZE, retries=RETRIES,
+                 timeout=TIMEOUT, progress=None, cache=True, store=None):
+        self.log = logger.getlogger()
+        self.workers = max(1, workers)
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.retries = retries
+        self.timeout = timeout
+        self.progress = progress or Progress()
+        self.cache = get_cache() if cache is True else cache or None
+        self.store = store
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers,
+                              pool_maxsize=self.workers * self.segments)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+        if self.cache:
+            self.cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _head(self, url):
+        """ Get size, range support, validator and modification time
+
+        Servers not answering HEAD are treated as supporting plain GET only.
+        """
+        try:
+            resp = self.session.head(url, allow_redirects=True,
+                                     timeout=self.timeout)
+        except requests.RequestException as exc:
+            raise UserException(f'Unable to reach {url} - {exc}')
+        if not resp.ok:
+            self.log.debug(f'HEAD {url} returned {resp.status_code}')
+            return None, False, None, None
+        size = resp.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+        ranges = resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        last_modified = resp.headers.get('Last-Modified')
+        validator = resp.headers.get('ETag') or last_modified
+        if validator and validator.startswith('W/'):
+            validator = None
+        return size, ranges, validator, _http_time(last_modified)
+
+    def _has_checksum(self, dest, checksum, algorithm, size=None):
+        if not os.path.isfile(dest):
+            return False
+        if size is not None and os.path.getsize(dest) != size:
+            return False
+        digest = self.cache.get(dest, algorithm) if self.cache else None
+        if digest is None:
+            stat = os.stat(dest)
+            digest = file_digest(dest, algorithm)
+            if self.cache:
+                self.cache.set(dest, algorithm, digest, stat)
+        return digest == checksum.lower()
+
+    def _is_newer(self, dest, size, mtime):
+        if not os.path.isfile(dest):
+            return False
+        stat = os.stat(dest)
+        return ((size is None or size == stat.st_size) and
+                mtime is not None and mtime <= stat.st_mtime)
+
+    def _fetch_segment(self, download, index, digest=None):
+        """ Fetch one segment, resuming it after connection failures """
+        segment = download.segments[index]
+        attempt = 0
+        while True:
+            start, end, done = segment
+            if end is not None and start + done >= end:
+                return digest
+            headers = {}
+            if start + done or end != download.size:
+                last = '' if end in (None, download.size) else end - 1
+                headers['Range'] = f'bytes={start + done}-{last}'
+                if done and download.validator:
+                    headers['If-Range'] = download.validator
+            try:
+                with self.session.get(download.url, headers=headers,
+                                      stream=True,
+                                      timeout=self.timeout) as resp:
+                    if 'Range' in headers and resp.status_code == 200:
+                        if len(download.segments) > 1:
+                            raise UserException(
+                                f'Range request not honored: {download.url}')
+                        # Server sent the whole file, start over
+                        self.progress.update(-done)
+                        segment[2] = done = 0
+                        if digest is not None:
+                            digest = hashlib.new(digest.name)
+                        with open(download.part, 'wb'):
+                            pass
+                    elif not resp.ok:
+                        raise UserException(
+                            f'Error downloading {download.url} - '
+                            f'HTTP {resp.status_code} {resp.reason}')
+                    with open(download.part, 'r+b') as f:
+                        f.seek(start + done)
+                        for chunk in resp.iter_content(CHUNK_SIZE):
+                            if end is not None:
+                                chunk = chunk[:end - start - done]
+                            f.write(chunk)
+                            if digest is not None:
+                                digest.update(chunk)
+                            done += len(chunk)
+                            segment[2] = done
+                            self.progress.update(len(chunk))
+                            download.save()
+                            if end is not None and start + done >= end:
+                                break
+                if end is None or start + done >= end:
+                    return digest
+                raise requests.ConnectionError('Connection closed early')
+            except requests.RequestException as exc:
+                download.save(force=True)
+                attempt += 1
+                if attempt > self.retries:
+                    raise UserException(
+                        f'Error downloading {download.url} - {exc}')
+                self.log.warning(f'Resuming {download.url} at byte '
+                                 f'{start + done} - {exc}')
+                sleep(min(2 ** attempt, 10))
+
+    def _fetch(self, download, algorithm):
+        if len(download.segments) > 1:
+            with ThreadPoolExecutor(len(download.segments)) as executor:
+                for future in [executor.submit(self._fetch_segment,
+                                               download, index)
+                               for index in range(len(download.segments))]:
+                    future.result()
+            return None
+
+        # Single stream, verify while streaming
+        digest = hashlib.new(algorithm)
+        done = download.segments[0][2]
+        if done:
+            with open(download.part, 'rb') as f:
+                while done:
+                    block = f.read(min(done, CHUNK_SIZE))
+                    if not block:
+                        break
+                    digest.update(block)
+                    done -= len(block)
+        return self._fetch_segment(download, 0, digest)
+
+    def _download(self, url, dest, checksum=None, algorithm='sha256',
+                  newer=False, size=None):
+        # A file matching its checksum is kept without contacting the server
+        if checksum and self._has_checksum(dest, checksum, algorithm, size):
+            self.log.debug(f'{dest} is up to date')
+            return False
+        if (checksum and algorithm == STORE_ALGORITHM and self.store and
+                self.store.materialize(checksum, dest)):
+            return True
+        expected_size = size
+        size, ranges, validator, mtime = self._head(url)
+        if size is None:
+            size = expected_size
+        elif expected_size is not None and size != expected_size:
+            raise UserException(f'Size mismatch downloading {url}, '
+                                f'expected {expected_size} bytes, '
+                                f'server has {size}')
+        if newer and not checksum and self._is_newer(dest, size, mtime):
+            self.log.debug(f'{dest} is up to date')
+            return False
+
+        dest_dir = os.path.dirname(dest)
+        if dest_dir and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        download = _Download(url, dest, size, validator)
+        if download.load():
+            self.log.info(f'Resuming download of {url} at byte '
+                          f'{download.done()}')
+        else:
+            segment_count = 1
+            if size and ranges and validator:
+                segment_count = max(1, min(self.segments,
+                                           size // self.min_segment_size))
+            download.create(segment_count)
+        self.progress.add_file(size)
+        self.progress.update(download.done())
+
+        try:
+            digest = self._fetch(download, algorithm)
+        except UserException:
+            # Keep partial downloads only if there is something to resume
+            if not download.done():
+                download.remove()
+            raise
+
+        if size is not None and os.path.getsize(download.part) != size:
+            download.remove()
+            raise UserException(f'Size mismatch downloading {url}')
+        if digest is not None:
+            digest = digest.hexdigest()
+        elif checksum:
+            digest = file_digest(download.part, algorithm)
+        if checksum and digest != checksum.lower():
+            download.remove()
+            raise UserException(f'{algorithm} verification failed: {url}')
+
+        os.replace(download.part, dest)
+        download.remove()
+        if mtime:
+            os.utime(dest, (mtime, mtime))
+        if digest and self.cache:
+            self.cache.set(dest, algorithm, digest, os.stat(dest))
+        if checksum and self.store:
+            self.store.add(dest, digest if algorithm == STORE_ALGORITHM
+                           else None)
+        self.progress.update(file_done=True)
+        return True
+
+    def download_many(self, downloads):
+        """ Download several files concurrently
+
+        Args:
+            downloads (iterable): dicts of download() keyword arguments
+
+        Returns:
+            dict: Error message of each failed destination path
+        """
+        downloads = list(downloads)
+        failed = {}
+        start = time()
+        with ExitStack() as stack:
+            if self.store:
+                stack.enter_context(self.store.batch())
+            executor = stack.enter_context(ThreadPoolExecutor(
+                min(self.workers, max(1, len(downloads)))))
+            futures = [(kwargs['dest'], executor.submit(self._download,
+                                                        **kwargs))
+                       for kwargs in downloads]
+            for dest, future in futures:
+                try:
+                    future.result()
+                except (UserException, OSError) as exc:
+                    self.log.error(str(exc))
+                    failed[dest] = str(exc)
+        if self.cache:
+            self.cache.save()
+        self.log.debug(f'Downloaded {len(downloads)} files in '
+                       f'{time() - start:.1f}s, {self.progress}')
+        return failed
+
+    def download(self, url, dest, checksum=None, algorithm='sha256',
+                 newer=False, size=None):
+        """ Download a single file
+
+        Args:
+            url (str): Source URL
+            dest (str): Destination file path
+            checksum (str, optional): Expected hex digest. An existing
+                                      file with this digest is kept.
+            algorithm (str, optional): hashlib algorithm of 'checksum'
+            newer (bool, optional): Keep an existing file of the remote
+                                    size not older than the remote file
+            size (int, optional): Expected size in bytes
+
+        Returns:
+            bool: True if downloaded, False if the file was current
+
+        Raises:
+            UserException: If the download or verification failed
+        """
+        return self._download(url, dest, checksum, algorithm, newer, size)
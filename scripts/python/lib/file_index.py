@@ -0,0 +1,152 @@
+"""Sidecar index of the package files of a repository directory"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+
+import lib.logger as logger
+
+PKG_INDEX = '.pkg_index.json'
+# Separate indexes written by earlier versions
+OBSOLETE_INDEXES = ('.rpm_info.yml', '.pkg_index.yml', '.repomd_cache.json')
+
+
+def file_stamp(stat):
+    """ Size and modification time of a file, see FileIndex """
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class FileIndex(object):
+    """ Facts about the package files of one directory
+
+    The RPM header reader, the package index and the yum metadata builder
+    share this one file instead of each keeping its own. Entries are keyed
+    by path relative to the directory and remember the file's size and
+    modification time. Values recorded for a file, e.g. 'info' (see
+    lib.rpm.read_rpm_info()), the package version per package kind and the
+    'primary', 'filelists' and 'other' metadata XML, are dropped together
+    as soon as the file changes.
+
+    Args:
+        directory (str): Repository directory
+    """
+
+    def __init__(self, directory):
+        self.log = logger.getlogger()
+        self.directory = directory
+        self.path = os.path.join(directory, PKG_INDEX)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+            self.log.warning(f'Ignoring package file index {self.path}')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as exc:
+            self.log.warning(f'Ignoring package file index {self.path} - '
+                             f'{exc}')
+        return {}
+
+    def get(self, relpath, key, stamp):
+        """ Get a value recorded for a file
+
+        Args:
+            relpath (str): Path relative to the directory
+            key (str): Value name
+            stamp (list): Current file_stamp() of the file
+
+        Returns:
+            Value or None if not recorded or the file changed since
+        """
+        with self.lock:
+            entry = self.entries.get(relpath)
+            if entry and entry['stamp'] == stamp:
+                return entry.get(key)
+        return None
+
+    def set(self, relpath, stamp, **values):
+        """ Record values for a file
+
+        Args:
+            relpath (str): Path relative to the directory
+            stamp (list): file_stamp() of the file the values were read
+                          from. Values recorded with a different stamp
+                          are dropped.
+            values: Values by name, JSON serializable
+        """
+        with self.lock:
+            entry = self.entries.get(relpath)
+            if not entry or entry['stamp'] != stamp:
+                entry = {'stamp': stamp}
+                self.entries[relpath] = entry
+            entry.update(values)
+            self.dirty = True
+
+    def paths(self, key=None):
+        """ Get the indexed paths
+
+        Args:
+            key (str, optional): Only paths with this value recorded
+
+        Returns:
+            list: Paths relative to the directory
+        """
+        with self.lock:
+            return [relpath for relpath, entry in self.entries.items()
+                    if key is None or key in entry]
+
+    def discard(self, relpaths):
+        """ Drop the entries of files no longer present
+
+        Args:
+            relpaths (iterable): Paths relative to the directory
+        """
+        with self.lock:
+            for relpath in relpaths:
+                if self.entries.pop(relpath, None) is not None:
+                    self.dirty = True
+
+    def save(self):
+        """ Write the index if it changed """
+        with self.lock:
+            if not self.dirty or not os.path.isdir(self.directory):
+                return
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.entries, f, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            except OSError as exc:
+                self.log.warning(f'Unable to write package file index '
+                                 f'{self.path} - {exc}')
+                return
+            self.dirty = False
+            for name in OBSOLETE_INDEXES:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                except OSError as exc:
+                    self.log.debug(f'Unable to remove {name} - {exc}')
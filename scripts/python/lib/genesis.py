@@ -54,6 +54,7 @@ CFG_FILE_NAME = 'config.yml'
 CFG_FILE = GEN_PATH + CFG_FILE_NAME
 INV_FILE_NAME = 'inventory.yml'
 INV_FILE = GEN_PATH + INV_FILE_NAME
+INV_JOURNAL_SUFFIX = '.journal'
 ANSIBLE = 'ansible'
 ANSIBLE_PLAYBOOK = 'ansible-playbook'
 ANSIBLE_VAULT = 'ansible-vault'
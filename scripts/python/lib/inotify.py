@@ -0,0 +1,107 @@
+"""Minimal Linux inotify directory watch"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+FILE_CHANGED = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO
+WATCH_LOST = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+_EVENT = struct.Struct('iIII')
+_BUF_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+    return _libc
+
+
+class DirWatch(object):
+    """Non-blocking inotify watch of the files in one directory
+
+    Args:
+        path (str): Directory path
+        mask (int): inotify event mask
+
+    Raises:
+        OSError: If inotify is not available or the watch fails
+    """
+
+    def __init__(self, path, mask=FILE_CHANGED | WATCH_LOST):
+        libc = _get_libc()
+        self.path = path
+        self.fd = None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            self.fd = None
+            raise OSError(err, os.strerror(err), path)
+
+    def read_events(self):
+        """Read pending events without blocking
+
+        Returns:
+            list of tuple: (mask, filename) of each event. filename is
+                           None for events on the directory itself.
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, _BUF_SIZE)
+            except OSError as exc:
+                if exc.errno == errno.EAGAIN:
+                    return events
+                raise
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((mask, os.fsdecode(name) if name else None))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,465 @@
+"""Compact inventory node model"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import struct
+from abc import ABCMeta, abstractmethod
+from array import array
+
+from orderedattrdict import AttrDict
+
+NONE_VALUE = -1
+RAW_VALUE = -2
+
+
+def mac_to_int(mac):
+    """Encode MAC address as integer
+
+    Args:
+        mac (str): MAC address ('xx:xx:xx:xx:xx:xx')
+
+    Returns:
+        int: Encoded MAC or None if 'mac' does not round trip
+    """
+    try:
+        value = int(mac.replace(':', ''), 16)
+    except (AttributeError, ValueError):
+        return None
+    if value < 0 or int_to_mac(value) != mac:
+        return None
+    return value
+
+
+def int_to_mac(value):
+    """Decode integer encoded MAC address
+
+    Args:
+        value (int): Encoded MAC
+
+    Returns:
+        str: MAC address ('xx:xx:xx:xx:xx:xx')
+    """
+    hex_ = '{:012x}'.format(value)
+    return ':'.join(hex_[i:i + 2] for i in range(0, len(hex_), 2))
+
+
+def ipaddr_to_int(ipaddr):
+    """Encode IPv4 address as integer
+
+    Args:
+        ipaddr (str): IPv4 address
+
+    Returns:
+        int: Encoded address or None if 'ipaddr' does not round trip
+    """
+    try:
+        value = struct.unpack('!I', socket.inet_aton(ipaddr))[0]
+    except (OSError, TypeError):
+        return None
+    if int_to_ipaddr(value) != ipaddr:
+        return None
+    return value
+
+
+def int_to_ipaddr(value):
+    """Decode integer encoded IPv4 address
+
+    Args:
+        value (int): Encoded address
+
+    Returns:
+        str: IPv4 address
+    """
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class _EncodedList(metaclass=ABCMeta):
+    """List of address strings stored as a signed 64-bit array
+
+    None is stored as NONE_VALUE. Values that do not encode losslessly are
+    kept verbatim in a side dictionary and stored as RAW_VALUE. Subclasses
+    provide the '_encode' and '_decode' codec.
+    """
+
+    __slots__ = ('_values', '_raw')
+
+    @staticmethod
+    @abstractmethod
+    def _encode(item):
+        """Encode item as non-negative integer or None if not encodable"""
+
+    @staticmethod
+    @abstractmethod
+    def _decode(value):
+        """Decode integer returned by '_encode'"""
+
+    def __init__(self, items=()):
+        self._values = array('q')
+        self._raw = None
+        for item in items:
+            self.append(item)
+
+    def _encode_item(self, index, item):
+        if self._raw is not None:
+            self._raw.pop(index, None)
+        if item is None:
+            return NONE_VALUE
+        value = self._encode(item)
+        if value is None:
+            if self._raw is None:
+                self._raw = {}
+            self._raw[index] = item
+            return RAW_VALUE
+        return value
+
+    def _decode_item(self, index):
+        value = self._values[index]
+        if value == NONE_VALUE:
+            return None
+        if value == RAW_VALUE:
+            return self._raw[index % len(self._values)]
+        return self._decode(value)
+
+    def append(self, item):
+        self._values.append(self._encode_item(len(self._values), item))
+
+    def key(self, index):
+        """Get hashable lookup key of an item
+
+        Args:
+            index (int): List index
+
+        Returns:
+            int or str: Encoded value, raw string or None
+        """
+        value = self._values[index]
+        if value == NONE_VALUE:
+            return None
+        if value == RAW_VALUE:
+            return self._raw[index % len(self._values)]
+        return value
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        return self._decode_item(index)
+
+    def __setitem__(self, index, item):
+        index %= len(self._values)
+        self._values[index] = self._encode_item(index, item)
+
+    def __iter__(self):
+        for index in range(len(self._values)):
+            yield self._decode_item(index)
+
+    def __contains__(self, item):
+        if item is None:
+            return NONE_VALUE in self._values
+        value = self._encode(item)
+        if value is None:
+            return self._raw is not None and item in self._raw.values()
+        return value in self._values
+
+    def __eq__(self, other):
+        if isinstance(other, (list, _EncodedList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def to_list(self):
+        return list(self)
+
+
+class MacList(_EncodedList):
+    """List of MAC addresses"""
+
+    __slots__ = ()
+    _encode = staticmethod(mac_to_int)
+    _decode = staticmethod(int_to_mac)
+
+
+class IpaddrList(_EncodedList):
+    """List of IPv4 addresses"""
+
+    __slots__ = ()
+    _encode = staticmethod(ipaddr_to_int)
+    _decode = staticmethod(int_to_ipaddr)
+
+
+class _CompactDict(object):
+    """Slotted replacement for an inventory AttrDict
+
+    Known keys are held in slots and 'macs' / 'ipaddrs' lists as integer
+    encoded arrays. Unknown keys are kept in an AttrDict. The key order is
+    kept in an interned tuple so that 'to_dict' reproduces the persisted
+    form exactly. Items are accessible both as keys and as attributes.
+    """
+
+    __slots__ = ('_keys', '_extra')
+    FIELDS = ()
+    ENCODED = {'macs': MacList, 'ipaddrs': IpaddrList}
+    _key_orders = {}
+
+    @classmethod
+    def _encode_field(cls, key, value):
+        if key in cls.ENCODED and isinstance(value, list):
+            return cls.ENCODED[key](value)
+        return value
+
+    @staticmethod
+    def _decode_field(value):
+        if isinstance(value, (_EncodedList, list)):
+            return list(value)
+        if isinstance(value, _CompactDict):
+            return value.to_dict()
+        return value
+
+    @classmethod
+    def _intern_keys(cls, keys):
+        return cls._key_orders.setdefault(keys, keys)
+
+    @classmethod
+    def from_dict(cls, dict_):
+        """Create from inventory dictionary
+
+        Args:
+            dict_ (dict): Inventory dictionary
+
+        Returns:
+            object: Compact representation
+        """
+        obj = cls.__new__(cls)
+        set_slot = object.__setattr__
+        for field in cls.FIELDS:
+            set_slot(obj, field, None)
+        extra = None
+        for key, value in dict_.items():
+            if key in cls.FIELDS:
+                set_slot(obj, key, cls._encode_field(key, value))
+            else:
+                if extra is None:
+                    extra = AttrDict()
+                extra[key] = value
+        set_slot(obj, '_keys', cls._intern_keys(tuple(dict_.keys())))
+        set_slot(obj, '_extra', extra)
+        return obj
+
+    def to_dict(self):
+        """Convert to inventory dictionary
+
+        Returns:
+            AttrDict: Inventory dictionary
+        """
+        dict_ = AttrDict()
+        for key in self._keys:
+            dict_[key] = self._decode_field(self[key])
+        return dict_
+
+    def keys(self):
+        return self._keys
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key in self.FIELDS:
+            return getattr(self, key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            object.__setattr__(self, key, self._encode_field(key, value))
+        else:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', AttrDict())
+            self._extra[key] = value
+        if key not in self._keys:
+            object.__setattr__(self, '_keys',
+                               self._intern_keys(self._keys + (key,)))
+
+    def __getattr__(self, key):
+        # Only called for keys not held in a slot
+        if not key.startswith('_') and self._extra and key in self._extra:
+            return self._extra[key]
+        raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __eq__(self, other):
+        if isinstance(other, _CompactDict):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class NodeInterfaces(_CompactDict):
+    """Node physical interface group ('ipmi', 'pxe' or 'data')"""
+
+    FIELDS = ('switches', 'ports', 'macs', 'ipaddrs', 'devices', 'rename',
+              'userid', 'password')
+    __slots__ = FIELDS
+
+
+class Node(_CompactDict):
+    """Inventory node"""
+
+    GROUPS = ('ipmi', 'pxe', 'data')
+    FIELDS = ('label', 'hostname', 'rack_id', 'bmc_type', 'os', 'roles',
+              'interfaces') + GROUPS
+    __slots__ = FIELDS
+
+    @classmethod
+    def _encode_field(cls, key, value):
+        if key in cls.GROUPS and isinstance(value, dict):
+            return NodeInterfaces.from_dict(value)
+        return super(Node, cls)._encode_field(key, value)
+
+
+class InventoryNodes(object):
+    """Compact table of inventory nodes
+
+    This is the in-memory form of the inventory 'nodes' list. It is built
+    when the inventory is loaded and converted back by 'to_dicts' when the
+    inventory is written.
+
+    Args:
+        nodes (list of dict): Inventory 'nodes' list
+    """
+
+    def __init__(self, nodes=()):
+        self.nodes = [node if isinstance(node, Node) else
+                      Node.from_dict(node) for node in nodes]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __getitem__(self, index):
+        return self.nodes[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, InventoryNodes)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.nodes)
+
+    def to_dicts(self):
+        """Convert to inventory 'nodes' list
+
+        Returns:
+            list of AttrDict: Inventory nodes
+        """
+        return [node.to_dict() for node in self.nodes]
+
+    @staticmethod
+    def mac_key(mac):
+        """Get MAC lookup key as used by 'get_mac_index'
+
+        Args:
+            mac (str): MAC address
+
+        Returns:
+            int or str: Encoded MAC or 'mac' if it does not encode
+        """
+        value = mac_to_int(mac)
+        return mac if value is None else value
+
+    def get_mac_index(self, types=Node.GROUPS):
+        """Get interface index keyed by MAC
+
+        The first occurrence of a MAC wins.
+
+        Args:
+            types (tuple of str): Interface groups to index
+
+        Returns:
+            dict of 3-tuple: {mac_key: (node_index, type_, if_index), ...}
+        """
+        mac_index = {}
+        for index, node in enumerate(self.nodes):
+            for type_ in types:
+                group = getattr(node, type_)
+                if group is None or group.macs is None:
+                    continue
+                macs = group.macs
+                for if_index in range(len(macs)):
+                    key = macs.key(if_index)
+                    if key is not None and key not in mac_index:
+                        mac_index[key] = (index, type_, if_index)
+        return mac_index
+
+    def get_port_index(self, types=('ipmi', 'pxe')):
+        """Get switch port index
+
+        The first occurrence of a switch port wins.
+
+        Args:
+            types (tuple of str): Interface groups to index
+
+        Returns:
+            dict of 2-tuple: {(switch, port): (mac, ipaddr), ...}
+        """
+        port_index = {}
+        for node in self.nodes:
+            for type_ in types:
+                group = getattr(node, type_)
+                if group is None or not group.ports:
+                    continue
+                for if_index, port in enumerate(group.ports):
+                    try:
+                        key = (group.switches[if_index], port)
+                    except (TypeError, IndexError):
+                        continue
+                    if key in port_index:
+                        continue
+                    try:
+                        mac = group.macs[if_index]
+                    except (TypeError, IndexError):
+                        mac = None
+                    try:
+                        ipaddr = group.ipaddrs[if_index]
+                    except (TypeError, IndexError):
+                        ipaddr = None
+                    port_index[key] = (mac, ipaddr)
+        return port_index
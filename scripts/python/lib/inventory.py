@@ -22,6 +22,7 @@ from orderedattrdict import AttrDict, DefaultAttrDict
 import lib.logger as logger
 from lib.exception import UserException
 from lib.db import DatabaseInventory
+from lib.inv_nodes import InventoryNodes
 
 
 class Singleton(type):
@@ -105,48 +106,60 @@ class Inventory(object):
         if self.InvKey.CONFIG_FILE not in self.inv:
             self.inv.config_file = cfg_file
 
-        if self.InvKey.NODES not in self.inv:
-            self.inv.nodes = []
+        self.inv.nodes = InventoryNodes(
+            self.inv.get(self.InvKey.NODES) or ())
 
         if self.InvKey.SWITCHES not in self.inv:
             self.inv.switches = []
 
+        self._nodes = None
+        self._port_index = None
+
+    @property
+    def nodes(self):
+        """Node attribute lists built by the 'add_nodes_*' methods"""
+        if self._nodes is None:
+            self._nodes = self._init_nodes()
+        return self._nodes
+
+    def _init_nodes(self):
         # Order is only kept in Python 3.6 and above
-        # self.nodes = AttrDict({
+        # nodes = AttrDict({
         #     self.InvKey.LABEL: 'a',
         #     self.InvKey.HOSTNAME: 'b',
         #     self.InvKey.PORT: 'c'})
 
-        self.nodes = AttrDict()
-        self.nodes[self.InvKey.LABEL] = []
-        self.nodes[self.InvKey.HOSTNAME] = []
-        self.nodes[self.InvKey.RACK_ID] = []
-        self.nodes[self.InvKey.BMC_TYPE] = []
-        self.nodes[self.InvKey.IPMI] = AttrDict()
-        self.nodes[self.InvKey.PXE] = AttrDict()
-        self.nodes[self.InvKey.DATA] = AttrDict()
-        self.nodes[self.InvKey.OS] = []
-        self.nodes[self.InvKey.ROLES] = []
-        self.nodes[self.InvKey.INTERFACES] = []
-
-        self.nodes[self.InvKey.IPMI][self.InvKey.SWITCHES] = []
-        self.nodes[self.InvKey.IPMI][self.InvKey.PORTS] = []
-        self.nodes[self.InvKey.IPMI][self.InvKey.MACS] = []
-        self.nodes[self.InvKey.IPMI][self.InvKey.IPADDRS] = []
-        self.nodes[self.InvKey.IPMI][self.InvKey.USERID] = []
-        self.nodes[self.InvKey.IPMI][self.InvKey.PASSWORD] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.PORTS] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.MACS] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.IPADDRS] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.DEVICES] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.SWITCHES] = []
-        self.nodes[self.InvKey.PXE][self.InvKey.RENAME] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.SWITCHES] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.PORTS] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.MACS] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.IPADDRS] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.DEVICES] = []
-        self.nodes[self.InvKey.DATA][self.InvKey.RENAME] = []
+        nodes = AttrDict()
+        nodes[self.InvKey.LABEL] = []
+        nodes[self.InvKey.HOSTNAME] = []
+        nodes[self.InvKey.RACK_ID] = []
+        nodes[self.InvKey.BMC_TYPE] = []
+        nodes[self.InvKey.IPMI] = AttrDict()
+        nodes[self.InvKey.PXE] = AttrDict()
+        nodes[self.InvKey.DATA] = AttrDict()
+        nodes[self.InvKey.OS] = []
+        nodes[self.InvKey.ROLES] = []
+        nodes[self.InvKey.INTERFACES] = []
+
+        nodes[self.InvKey.IPMI][self.InvKey.SWITCHES] = []
+        nodes[self.InvKey.IPMI][self.InvKey.PORTS] = []
+        nodes[self.InvKey.IPMI][self.InvKey.MACS] = []
+        nodes[self.InvKey.IPMI][self.InvKey.IPADDRS] = []
+        nodes[self.InvKey.IPMI][self.InvKey.USERID] = []
+        nodes[self.InvKey.IPMI][self.InvKey.PASSWORD] = []
+        nodes[self.InvKey.PXE][self.InvKey.PORTS] = []
+        nodes[self.InvKey.PXE][self.InvKey.MACS] = []
+        nodes[self.InvKey.PXE][self.InvKey.IPADDRS] = []
+        nodes[self.InvKey.PXE][self.InvKey.DEVICES] = []
+        nodes[self.InvKey.PXE][self.InvKey.SWITCHES] = []
+        nodes[self.InvKey.PXE][self.InvKey.RENAME] = []
+        nodes[self.InvKey.DATA][self.InvKey.SWITCHES] = []
+        nodes[self.InvKey.DATA][self.InvKey.PORTS] = []
+        nodes[self.InvKey.DATA][self.InvKey.MACS] = []
+        nodes[self.InvKey.DATA][self.InvKey.IPADDRS] = []
+        nodes[self.InvKey.DATA][self.InvKey.DEVICES] = []
+        nodes[self.InvKey.DATA][self.InvKey.RENAME] = []
+        return nodes
 
     def add_nodes_hostname(self, hostname):
         self.nodes.hostname.append(hostname)
@@ -231,6 +244,16 @@ class Inventory(object):
                     yield key, value
         return AttrDict(items())
 
+    def _dump_inventory(self, changes=None):
+        """Dump inventory and drop cached node lookup tables
+
+        Args:
+            changes (list of 2-tuple, optional): (path, value) of each
+                changed value. If given only the changes are journaled.
+        """
+        self._port_index = None
+        self.dbase.dump_inventory(self.inv, changes)
+
     def update_nodes(self):
         nodes = []
         flat = self._flatten(self.nodes)
@@ -245,13 +268,13 @@ class Inventory(object):
                 else:
                     nodes[index][item_key] = item_value
 
-        self.inv.nodes = nodes
-        self.dbase.dump_inventory(self.inv)
+        self.inv.nodes = InventoryNodes(nodes)
+        self._dump_inventory()
 
     def update_switches(self):
         switches = []
         self.inv.switches = switches
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory()
 
     @staticmethod
     def _get_members(obj_list, key, index):
@@ -332,33 +355,10 @@ class Inventory(object):
             str: port mac address
             str: port ipv4 address
         """
-        mac, ipaddr = None, None
-        for node in self.inv.nodes:
-            if port in node.ipmi.ports:
-                idx = node.ipmi.ports.index(port)
-                if switch == node.ipmi.switches[idx]:
-                    try:
-                        mac = node.ipmi.macs[idx]
-                    except (AttributeError, IndexError):
-                        mac = None
-                    try:
-                        ipaddr = node.ipmi.ipaddrs[idx]
-                    except (AttributeError, IndexError):
-                        ipaddr = None
-                    return mac, ipaddr
-            if port in node.pxe.ports:
-                idx = node.pxe.ports.index(port)
-                if switch == node.pxe.switches[idx]:
-                    try:
-                        mac = node.pxe.macs[idx]
-                    except (AttributeError, IndexError):
-                        mac = None
-                    try:
-                        ipaddr = node.pxe.ipaddrs[idx]
-                    except (AttributeError, IndexError):
-                        ipaddr = None
-                    return mac, ipaddr
-        return mac, ipaddr
+        if self._port_index is None:
+            self._port_index = self.inv.nodes.get_port_index(
+                (self.InvKey.IPMI, self.InvKey.PXE))
+        return self._port_index.get((switch, port), (None, None))
 
     def get_nodes_ipmi_userid(self, index=None):
         """Get nodes BMC userid
@@ -410,7 +410,8 @@ class Inventory(object):
         """
 
         self.inv.nodes[index].ipmi.ipaddrs[if_index] = ipaddr
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory([([self.InvKey.NODES, index, self.InvKey.IPMI,
+                                self.InvKey.IPADDRS, if_index], ipaddr)])
 
     def get_nodes_ipmi_mac(self, if_index, index=None):
         """Get nodes IPMI interface MAC address
@@ -461,7 +462,8 @@ class Inventory(object):
         """
 
         self.inv.nodes[index].pxe.ipaddrs[if_index] = ipaddr
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory([([self.InvKey.NODES, index, self.InvKey.PXE,
+                                self.InvKey.IPADDRS, if_index], ipaddr)])
 
     def get_nodes_pxe_mac(self, if_index, index=None):
         """Get nodes PXE interface MAC address
@@ -477,6 +479,20 @@ class Inventory(object):
             self.inv.nodes, self.InvKey.PXE,
             index)[self.InvKey.MACS][if_index]
 
+    def get_nodes_pxe_switch(self, if_index, index=None):
+        """Get nodes PXE interface switch label
+        Args:
+            if_index (int): Interface index
+            index (int, optional): List index
+
+        Returns:
+            str: nodes PXE switch label
+        """
+
+        return self._get_members(
+            self.inv.nodes, self.InvKey.PXE,
+            index)[self.InvKey.SWITCHES][if_index]
+
     def _check_all_nodes_mac_ipaddr(self, interface_type, key):
         """Check if PXE/IPMI key is populated across all nodes
         Args:
@@ -632,7 +648,8 @@ class Inventory(object):
         return self._get_members(self.inv.nodes, self.InvKey.RACK_ID, index)
 
     def _add_macs(self, macs, type_):
-        for node in self.inv.nodes:
+        changes = []
+        for node_index, node in enumerate(self.inv.nodes):
             for index, _port in enumerate(node[type_][self.InvKey.PORTS]):
                 port = str(_port)
                 switch = node[type_][self.InvKey.SWITCHES][index]
@@ -664,6 +681,10 @@ class Inventory(object):
                 if macs[switch][port][0] not in node[type_][self.InvKey.MACS]:
                     node[type_][self.InvKey.MACS][index] = \
                         macs[switch][port][0]
+                    changes.append(([self.InvKey.NODES, node_index, type_,
+                                     self.InvKey.MACS, index],
+                                    macs[switch][port][0]))
+        return changes
 
     def add_macs_ipmi(self, macs):
         """Add MAC addresses
@@ -671,8 +692,7 @@ class Inventory(object):
             macs (dict of dict of list of str): Switch{Port}{[MAC]}
         """
 
-        self._add_macs(macs, self.InvKey.IPMI)
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory(self._add_macs(macs, self.InvKey.IPMI))
 
     def add_macs_pxe(self, macs):
         """Add MAC addresses
@@ -680,8 +700,7 @@ class Inventory(object):
             macs (dict of dict of list of str): Switch{Port}{[MAC]}
         """
 
-        self._add_macs(macs, self.InvKey.PXE)
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory(self._add_macs(macs, self.InvKey.PXE))
 
     def add_macs_data(self, macs):
         """Add MAC addresses
@@ -689,8 +708,7 @@ class Inventory(object):
             macs (dict of dict of list of str): Switch{Port}{[MAC]}
         """
 
-        self._add_macs(macs, self.InvKey.DATA)
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory(self._add_macs(macs, self.InvKey.DATA))
 
     def get_data_interfaces(self):
         """Get data interface information
@@ -727,7 +745,8 @@ class Inventory(object):
         return True
 
     def _add_ipaddrs(self, ipaddrs, type_):
-        for node in self.inv.nodes:
+        changes = []
+        for node_index, node in enumerate(self.inv.nodes):
             for index, mac in enumerate(node[type_][self.InvKey.MACS]):
                 # If MAC is not found
                 if mac not in ipaddrs:
@@ -735,22 +754,24 @@ class Inventory(object):
 
                 if ipaddrs[mac] not in node[type_][self.InvKey.IPADDRS]:
                     node[type_][self.InvKey.IPADDRS][index] = ipaddrs[mac]
+                    changes.append(([self.InvKey.NODES, node_index, type_,
+                                     self.InvKey.IPADDRS, index],
+                                    ipaddrs[mac]))
+        return changes
 
     def add_ipaddrs_ipmi(self, ipaddrs):
         """Add IPMI IP addresses
         Args:
             ipaddrs (dict of str): MAC{IP}
         """
-        self._add_ipaddrs(ipaddrs, self.InvKey.IPMI)
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory(self._add_ipaddrs(ipaddrs, self.InvKey.IPMI))
 
     def add_ipaddrs_pxe(self, ipaddrs):
         """Add PXE IP addresses
         Args:
             ipaddrs (dict of str): MAC{IP}
         """
-        self._add_ipaddrs(ipaddrs, self.InvKey.PXE)
-        self.dbase.dump_inventory(self.inv)
+        self._dump_inventory(self._add_ipaddrs(ipaddrs, self.InvKey.PXE))
 
     def get_node_dict(self, index):
         """Get node dictionary
@@ -761,7 +782,7 @@ class Inventory(object):
             dict: Node dictionary
         """
 
-        return self.inv.nodes[index]
+        return self.inv.nodes[index].to_dict()
 
     def get_nodes_roles(self, index=None):
         """Get nodes hostname
@@ -781,45 +802,92 @@ class Inventory(object):
             macs (str): Interface MAC address
             name (str): Device name
         """
-        old_name = ''
-
-        for index, node in enumerate(self.inv.nodes):
-            for if_index, mac in enumerate(node.pxe.macs):
-                if set_mac == mac:
-                    old_name = node.pxe.devices[if_index]
-                    self.log.debug("Renaming node \'%s\' PXE physical "
-                                   "interface \'%s\' to \'%s\' (MAC:%s)" %
-                                   (node.hostname, old_name, set_name, mac))
-                    node.pxe.devices[if_index] = set_name
-                    break
+
+        self.set_interface_names({set_mac: set_name})
+
+    def _get_interface_mac_index(self):
+        """Get index of PXE and data physical interfaces by MAC address
+
+        Returns:
+            dict of 3-tuple: {mac_key: (node_index, type_, if_index), ...}
+        """
+
+        return self.inv.nodes.get_mac_index(
+            (self.InvKey.PXE, self.InvKey.DATA))
+
+    @staticmethod
+    def _rename_interface_value(value, renames):
+        """Rename device references in an interface definition value
+
+        Args:
+            value (str): Whitespace separated interface value
+            renames (dict of str): Old device name{New device name}
+
+        Returns:
+            str: Value with old device names replaced
+        """
+
+        value_split = []
+        for _value in value.split():
+            if _value in renames:
+                _value = renames[_value]
             else:
-                for if_index, mac in enumerate(node.data.macs):
-                    if set_mac == mac:
-                        old_name = node.data.devices[if_index]
-                        self.log.debug("Renaming node \'%s\' data physical "
-                                       "interface \'%s\' to \'%s\' (MAC:%s)" %
-                                       (node.hostname, old_name, set_name, mac))
-                        node.data.devices[if_index] = set_name
-                        break
-            if old_name != '':
-                node_index = index
-                break
-        else:
-            raise UserException("No physical interface found in inventory with "
-                                "MAC: %s" % set_mac)
-
-        for interface in self.inv.nodes[node_index][self.InvKey.INTERFACES]:
-            for key, value in iter(interface.items()):
-                if isinstance(value, str):
-                    value_split = []
-                    for _value in value.split():
-                        if old_name == _value or old_name in _value.split('.'):
-                            _value = _value.replace(old_name, set_name)
-                        value_split.append(_value)
-                    new_value = " ".join(value_split)
-                    self.log.debug("Renaming node \'%s\' interface key \'%s\' "
-                                   "from \'%s\' to \'%s\'" %
-                                   (self.inv.nodes[node_index].hostname, key,
-                                    value, new_value))
-                    interface[key] = new_value
-        self.dbase.dump_inventory(self.inv)
+                _value = '.'.join(renames.get(part, part)
+                                  for part in _value.split('.'))
+            value_split.append(_value)
+        return " ".join(value_split)
+
+    def set_interface_names(self, mac_names):
+        """Set physical interface names
+
+        All renames are resolved through a MAC index, applied in a single
+        pass over each affected node's interface definitions and the
+        inventory is persisted once.
+
+        Args:
+            mac_names (dict of str): Interface MAC address{Device name}
+        """
+
+        mac_index = self._get_interface_mac_index()
+        node_renames = {}
+        changes = []
+
+        for set_mac, set_name in mac_names.items():
+            mac_key = InventoryNodes.mac_key(set_mac)
+            if mac_key not in mac_index:
+                raise UserException("No physical interface found in "
+                                    "inventory with MAC: %s" % set_mac)
+            index, type_, if_index = mac_index[mac_key]
+            node = self.inv.nodes[index]
+            old_name = node[type_][self.InvKey.DEVICES][if_index]
+            self.log.debug("Renaming node \'%s\' %s physical "
+                           "interface \'%s\' to \'%s\' (MAC:%s)" %
+                           (node.hostname,
+                            'PXE' if type_ == self.InvKey.PXE else 'data',
+                            old_name, set_name, set_mac))
+            node[type_][self.InvKey.DEVICES][if_index] = set_name
+            changes.append(([self.InvKey.NODES, index, type_,
+                             self.InvKey.DEVICES, if_index], set_name))
+            if old_name and old_name != set_name:
+                node_renames.setdefault(index, {})[old_name] = set_name
+
+        for index, renames in node_renames.items():
+            node = self.inv.nodes[index]
+            for if_index, interface in enumerate(
+                    node[self.InvKey.INTERFACES]):
+                for key, value in iter(interface.items()):
+                    if isinstance(value, str):
+                        new_value = self._rename_interface_value(
+                            value, renames)
+                        if new_value != value:
+                            self.log.debug(
+                                "Renaming node \'%s\' interface key \'%s\' "
+                                "from \'%s\' to \'%s\'" %
+                                (node.hostname, key, value, new_value))
+                            interface[key] = new_value
+                            changes.append(
+                                ([self.InvKey.NODES, index,
+                                  self.InvKey.INTERFACES, if_index, key],
+                                 new_value))
+
+        self._dump_inventory(changes)
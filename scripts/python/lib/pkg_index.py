@@ -0,0 +1,215 @@
+"""Per-repository index of package versions"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from functools import cmp_to_key
+from itertools import zip_longest
+
+from pkg_resources import parse_version
+
+import lib.logger as logger
+from lib.file_index import FileIndex, PKG_INDEX, file_stamp
+from lib.rpm import get_rpms_info
+from lib.utilities import parse_conda_filenames, parse_pypi_filenames
+
+RPM = 'rpm'
+CONDA = 'conda'
+PYPI = 'pypi'
+_EXTENSIONS = {RPM: ('.rpm',),
+               CONDA: ('.tar.bz2',),
+               PYPI: ('.whl', '.gz', '.bz2', '.zip')}
+_SEGMENT = re.compile(r'~|[0-9]+|[a-zA-Z]+')
+
+
+def _cmp(val1, val2):
+    return (val1 > val2) - (val1 < val2)
+
+
+def compare_versions(ver1, ver2, kind=RPM):
+    """ Compare two version strings
+
+    rpm and conda versions are compared like rpmvercmp. Versions are split
+    into numeric and alphabetic segments, numeric segments compare as
+    numbers and are newer than alphabetic ones, and '~' sorts before
+    anything. pypi versions are compared per PEP 440, falling back to the
+    rpm rules for versions PEP 440 can not parse.
+
+    Args:
+        ver1 (str): Version
+        ver2 (str): Version
+        kind (str, optional): RPM, CONDA or PYPI
+
+    Returns:
+        int: -1, 0 or 1 if ver1 is older, same or newer than ver2
+    """
+    if ver1 == ver2:
+        return 0
+    if kind == PYPI:
+        try:
+            return _cmp(parse_version(ver1), parse_version(ver2))
+        except (ValueError, TypeError):
+            pass
+    for seg1, seg2 in zip_longest(_SEGMENT.findall(ver1),
+                                  _SEGMENT.findall(ver2)):
+        if seg1 == seg2:
+            continue
+        if seg1 == '~':
+            return -1
+        if seg2 == '~':
+            return 1
+        if seg1 is None:
+            return -1
+        if seg2 is None:
+            return 1
+        if seg1.isdigit() and seg2.isdigit():
+            if int(seg1) != int(seg2):
+                return _cmp(int(seg1), int(seg2))
+        elif seg1.isdigit():
+            return 1
+        elif seg2.isdigit():
+            return -1
+        else:
+            return _cmp(seg1, seg2)
+    return 0
+
+
+def compare_evr(evr1, evr2, kind=RPM):
+    """ Compare (epoch, version, release) tuples
+
+    Args:
+        evr1 (tuple): Epoch, version and release strings. An empty epoch
+                      is epoch 0.
+        evr2 (tuple): Epoch, version and release strings
+        kind (str, optional): RPM, CONDA or PYPI
+
+    Returns:
+        int: -1, 0 or 1 if evr1 is older, same or newer than evr2
+    """
+    ep1, ver1, rel1 = evr1
+    ep2, ver2, rel2 = evr2
+    return (_cmp(int(ep1 or 0), int(ep2 or 0)) or
+            compare_versions(ver1, ver2, kind) or
+            compare_versions(rel1, rel2, kind))
+
+
+class PackageIndex(object):
+    """ Versions of the packages in a repository directory
+
+    Versions are recorded in the package file index of the directory,
+    under the package kind. update() only parses files added or changed
+    since the last update and drops removed ones, lookups afterwards are
+    dictionary accesses. RPM versions come from the headers recorded by
+    lib.rpm.get_rpms_info() or the metadata builder, headers are not read
+    again.
+
+    Args:
+        repo_dir (str): Repository directory
+        kind (str): RPM, CONDA or PYPI
+    """
+
+    def __init__(self, repo_dir, kind):
+        self.log = logger.getlogger()
+        self.repo_dir = repo_dir
+        self.kind = kind
+        self.index = None
+        self.path = os.path.join(repo_dir, PKG_INDEX)
+        self.packages = {}
+
+    def _parse(self, filenames):
+        """ Get name, epoch, version and release of package files """
+        entries = {}
+        if self.kind == RPM:
+            for filename, info in get_rpms_info(self.repo_dir, filenames,
+                                                index=self.index).items():
+                entries[filename] = [info['name'], info['ep'], info['ver'],
+                                     info['rel']]
+        elif self.kind == CONDA:
+            for filename in filenames:
+                name, ver, build = parse_conda_filenames(filename)
+                entries[filename] = [name, '', ver, build]
+        else:
+            for filename in filenames:
+                for name, value in parse_pypi_filenames([filename]).items():
+                    ver, bld = value['ver_bld'][0]
+                    entries[filename] = [name, '', ver, bld]
+        return entries
+
+    def update(self):
+        """ Bring the index in line with the directory contents
+
+        Returns:
+            PackageIndex: self
+        """
+        self.index = FileIndex(self.repo_dir)
+        stamps = {}
+        try:
+            for entry in os.scandir(self.repo_dir):
+                if (entry.name.endswith(_EXTENSIONS[self.kind]) and
+                        entry.is_file()):
+                    stamps[entry.name] = file_stamp(entry.stat())
+        except FileNotFoundError:
+            pass
+
+        pkgs = {}
+        changed = []
+        for filename, stamp in stamps.items():
+            pkg = self.index.get(filename, self.kind, stamp)
+            if pkg is None:
+                changed.append(filename)
+            else:
+                pkgs[filename] = pkg
+        removed = [relpath for relpath in self.index.paths(self.kind)
+                   if '/' not in relpath and relpath not in stamps]
+        self.index.discard(removed)
+        for filename, pkg in self._parse(changed).items():
+            self.index.set(filename, stamps[filename], **{self.kind: pkg})
+            pkgs[filename] = pkg
+        if changed or removed:
+            self.log.debug(f'Package index {self.path}: {len(changed)} '
+                           f'added or changed, {len(removed)} removed')
+        self.index.save()
+
+        self.packages = {}
+        for name, ep, ver, rel in pkgs.values():
+            self.packages.setdefault(name, []).append((ep, ver, rel))
+        key = cmp_to_key(lambda evr1, evr2: compare_evr(evr1, evr2,
+                                                        self.kind))
+        for evrs in self.packages.values():
+            evrs.sort(key=key)
+        return self
+
+    def get(self, name):
+        """ Get the versions of a package
+
+        Args:
+            name (str): Package name
+
+        Returns:
+            list: (epoch, version, release) tuples, oldest first
+        """
+        return self.packages.get(name, [])
+
+    def newest(self):
+        """ Get the newest version of each package
+
+        Returns:
+            dict: {name: {'ep': epoch, 'ver': version, 'rel': release}}
+        """
+        return {name: dict(zip(('ep', 'ver', 'rel'), evrs[-1]))
+                for name, evrs in self.packages.items()}
@@ -0,0 +1,291 @@
+"""Resolve python requirements against a PEP 503 simple index"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag
+
+import requests
+import yaml
+from pkg_resources import Requirement, RequirementParseError, parse_version
+
+import lib.logger as logger
+from lib.exception import UserException
+
+PYPI_INDEX_URL = 'https://pypi.org/simple/'
+SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.zip')
+RESOLVED_FILE = '.resolved.yml'
+WORKERS = 8
+TIMEOUT = 60
+
+
+def normalize(name):
+    """ PEP 503 normalized project name """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+class _LinkParser(HTMLParser):
+    """ Collect the anchors of a simple index project page """
+
+    def __init__(self):
+        super(_LinkParser, self).__init__()
+        self.links = []
+        self._attrs = None
+        self._text = ''
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._attrs = dict(attrs)
+            self._text = ''
+
+    def handle_data(self, data):
+        if self._attrs is not None:
+            self._text += data
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._attrs is not None:
+            self.links.append((self._text.strip(), self._attrs))
+            self._attrs = None
+
+
+def parse_artifact(filename, project):
+    """ Get version and wheel tags from a distribution filename
+
+    Args:
+        filename (str): Wheel or sdist filename
+        project (str): Project name
+
+    Returns:
+        tuple: version (str) and wheel tags (tuple of python, abi and
+               platform tag sets, None for sdists), or None if the
+               filename is not a distribution of 'project'
+    """
+    if filename.endswith('.whl'):
+        parts = filename[:-4].split('-')
+        if len(parts) not in (5, 6) or normalize(parts[0]) != normalize(
+                project):
+            return None
+        return parts[1], tuple(set(tag.split('.')) for tag in parts[-3:])
+    for ext in SDIST_EXTENSIONS:
+        if filename.endswith(ext):
+            stem = filename[:-len(ext)]
+            for match in re.finditer('-', stem):
+                if normalize(stem[:match.start()]) == normalize(project):
+                    return stem[match.end():], None
+    return None
+
+
+def is_compatible(tags, py_ver, arch):
+    """ Check if a distribution installs on a python version and platform
+
+    Args:
+        tags (tuple): Wheel tags from parse_artifact(), None for sdists
+        py_ver (int or str): Python version, e.g. 27 or 36
+        arch (str): Platform architecture, e.g. 'ppc64le'
+
+    Returns:
+        bool: True if compatible
+    """
+    if tags is None:
+        return True
+    py_tags, abi_tags, plat_tags = tags
+    py_ver = str(py_ver)
+    major = py_ver[0]
+    python_ok = bool(py_tags & {'py' + major, 'py' + py_ver, 'cp' + py_ver})
+    abi_ok = bool(abi_tags & {'none', 'cp' + py_ver, f'cp{py_ver}m',
+                              f'cp{py_ver}mu'})
+    if not (python_ok and abi_ok) and 'abi3' in abi_tags:
+        # Stable ABI wheels install on later python 3 versions
+        python_ok = abi_ok = any(
+            tag.startswith('cp' + major) and int(tag[2:] or 0) <= int(py_ver)
+            for tag in py_tags if tag[2:].isdigit())
+    plat_ok = any(tag == 'any' or (tag.endswith('_' + arch) and
+                                   tag.startswith(('linux', 'manylinux')))
+                  for tag in plat_tags)
+    return python_ok and abi_ok and plat_ok
+
+
+def _is_pinned(req):
+    return (len(req.specs) == 1 and req.specs[0][0] in ('==', '===') and
+            '*' not in req.specs[0][1])
+
+
+class PypiResolver(object):
+    """ Select the distribution file of each requirement, like
+    'pip download --no-deps --python-version --platform'
+
+    The newest version satisfying the requirement wins. Of its files a
+    platform wheel is preferred over a pure python wheel over an sdist.
+    Resolutions of pinned ('==') requirements are remembered in a file in
+    'dest_dir' and reused while the file is present.
+
+    Args:
+        session (requests.Session): HTTP session
+        dest_dir (str): Download directory
+        index_url (str, optional): Simple index URL
+        py_ver (int or str, optional): Python version, e.g. 27 or 36
+        arch (str, optional): Platform architecture
+        timeout (float, optional): Request timeout in seconds
+    """
+
+    def __init__(self, session, dest_dir, index_url=PYPI_INDEX_URL, py_ver=27,
+                 arch='ppc64le', timeout=TIMEOUT):
+        self.log = logger.getlogger()
+        self.session = session
+        self.dest_dir = dest_dir
+        self.index_url = index_url.rstrip('/') + '/'
+        self.py_ver = str(py_ver)
+        self.arch = arch
+        self.timeout = timeout
+        self.resolved_file = os.path.join(dest_dir, RESOLVED_FILE)
+        try:
+            with open(self.resolved_file) as f:
+                self.resolved = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            self.resolved = {}
+        except (OSError, yaml.YAMLError) as exc:
+            self.log.warning(f'Ignoring {self.resolved_file} - {exc}')
+            self.resolved = {}
+
+    def _key(self, requirement):
+        return f'{requirement}|{self.py_ver}|{self.arch}|{self.index_url}'
+
+    def _get_links(self, project):
+        url = urljoin(self.index_url, normalize(project) + '/')
+        try:
+            resp = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as exc:
+            raise UserException(f'Unable to reach {url} - {exc}')
+        if resp.status_code == 404:
+            raise UserException(f'{project} not found in {self.index_url}')
+        if not resp.ok:
+            raise UserException(f'Error reading {url} - HTTP '
+                                f'{resp.status_code} {resp.reason}')
+        parser = _LinkParser()
+        parser.feed(resp.text)
+        return resp.url, parser.links
+
+    def resolve(self, requirement):
+        """ Select the distribution file of a requirement
+
+        Args:
+            requirement (str): Requirement, e.g. 'Keras==2.0.5'
+
+        Returns:
+            dict: 'filename', 'project', 'url', 'algorithm' and 'checksum'.
+                  'algorithm' and 'checksum' are None if the index does
+                  not publish a hash.
+
+        Raises:
+            UserException: If no compatible file was found
+        """
+        try:
+            req = Requirement.parse(requirement)
+        except (RequirementParseError, ValueError) as exc:
+            raise UserException(f'Invalid requirement {requirement} - {exc}')
+
+        key = self._key(requirement)
+        if _is_pinned(req) and key in self.resolved and os.path.isfile(
+                os.path.join(self.dest_dir, self.resolved[key]['filename'])):
+            return dict(self.resolved[key])
+
+        page_url, links = self._get_links(req.project_name)
+        allow_pre = any(parse_version(version).is_prerelease
+                        for _, version in req.specs)
+        python = parse_version(f'{self.py_ver[0]}.{self.py_ver[1:]}')
+        candidates = []
+        for filename, attrs in links:
+            if 'href' not in attrs:
+                continue
+            if 'data-yanked' in attrs and not _is_pinned(req):
+                continue
+            artifact = parse_artifact(filename, req.project_name)
+            if artifact is None:
+                continue
+            version, tags = artifact
+            parsed = parse_version(version)
+            if parsed.is_prerelease and not allow_pre:
+                continue
+            if version not in req or not is_compatible(tags, self.py_ver,
+                                                       self.arch):
+                continue
+            requires_python = attrs.get('data-requires-python')
+            if requires_python:
+                try:
+                    if python not in Requirement.parse(
+                            'python' + requires_python.replace(' ', '')):
+                        continue
+                except (RequirementParseError, ValueError):
+                    pass
+            if tags is None:
+                priority = 0
+            else:
+                priority = 1 if tags[2] == {'any'} else 2
+            candidates.append(((parsed, priority), filename, attrs['href']))
+        if not candidates:
+            raise UserException(
+                f'No distribution of {requirement} for python {self.py_ver} '
+                f'on {self.arch} found in {self.index_url}')
+
+        _, filename, href = max(candidates, key=lambda item: item[0])
+        url, fragment = urldefrag(urljoin(page_url, href))
+        algorithm, _, checksum = fragment.partition('=')
+        if not checksum or algorithm not in ('sha256', 'sha384', 'sha512',
+                                             'sha1', 'md5'):
+            algorithm = checksum = None
+        artifact = {'filename': filename,
+                    'project': normalize(req.project_name), 'url': url,
+                    'algorithm': algorithm, 'checksum': checksum}
+        if _is_pinned(req):
+            self.resolved[key] = artifact
+        return dict(artifact)
+
+    def resolve_many(self, requirements, workers=WORKERS):
+        """ Resolve requirements concurrently
+
+        Args:
+            requirements (iterable): Requirement strings
+            workers (int, optional): Concurrent index requests
+
+        Returns:
+            tuple: dict of resolve() results and dict of error messages,
+                   both keyed by requirement
+        """
+        requirements = list(dict.fromkeys(requirements))
+        resolved = {}
+        failed = {}
+        with ThreadPoolExecutor(max(1, min(workers,
+                                           len(requirements)))) as executor:
+            futures = [(requirement, executor.submit(self.resolve,
+                                                     requirement))
+                       for requirement in requirements]
+            for requirement, future in futures:
+                try:
+                    resolved[requirement] = future.result()
+                except UserException as exc:
+                    failed[requirement] = str(exc)
+        return resolved, failed
+
+    def save(self):
+        """ Write the resolutions of pinned requirements """
+        tmp_path = self.resolved_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            yaml.safe_dump(self.resolved, f, default_flow_style=False)
+        os.replace(tmp_path, self.resolved_file)
@@ -0,0 +1,507 @@
+"""Config and inventory query daemon"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import builtins
+import collections.abc
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+
+from orderedattrdict import AttrDict
+
+import lib.logger as logger
+from lib.exception import UserException
+from lib.genesis import CFG_FILE, INV_JOURNAL_SUFFIX
+
+# The socket is kept in a directory only accessible by its owner, see
+# _check_private_dir()
+SOCKET_DIR = os.path.join(tempfile.gettempdir(),
+                          'pup-query-{}'.format(os.getuid()))
+SOCKET_PATH = os.path.join(SOCKET_DIR, 'query.sock')
+CONNECT_TIMEOUT = 0.5
+READ_PREFIXES = ('get_', 'yield_', 'check_', 'is_')
+WRITE_PREFIXES = ('set_', 'add_', 'update_')
+# Inventory methods staging node attributes across calls. The staged
+# attributes would be shared by all clients, so they are not served.
+STAGING_PREFIXES = ('add_nodes_', 'update_nodes')
+INVENTORY = 'inventory'
+CONFIG = 'config'
+# Modules whose exceptions are re-raised with their type by the client
+REMOTE_EXCEPTION_MODULES = (builtins.__name__, 'lib.exception')
+
+
+def _normalize_config_path(config_path):
+    return os.path.realpath(config_path or CFG_FILE)
+
+
+def _check_private_dir(directory):
+    """Check that only the current user can create files in a directory
+
+    Raises:
+        UserException: If the directory is not owned by the current user,
+            is writable by others or is a symlink
+    """
+    try:
+        dir_stat = os.lstat(directory)
+    except OSError as exc:
+        raise UserException('Unable to check {} - {}'.format(directory, exc))
+    if not stat.S_ISDIR(dir_stat.st_mode):
+        raise UserException('{} is not a directory'.format(directory))
+    if dir_stat.st_uid != os.getuid():
+        raise UserException('{} is not owned by uid {}'.format(
+            directory, os.getuid()))
+    if dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise UserException('{} is writable by other users'.format(
+            directory))
+
+
+def _make_socket_dir(socket_path):
+    """Create the socket directory if needed and check it is private"""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    _check_private_dir(directory)
+
+
+def _check_peer(sock):
+    """Check that the daemon runs as the current user
+
+    Returns:
+        bool: True if the peer uid matches or cannot be determined
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid == os.getuid()
+
+
+def _is_served(method):
+    return (method.startswith(READ_PREFIXES + WRITE_PREFIXES) and
+            not method.startswith(STAGING_PREFIXES))
+
+
+def _json_default(obj):
+    if isinstance(obj, (collections.abc.Iterator, set, tuple)):
+        return list(obj)
+    # Compact inventory nodes, see lib.inv_nodes
+    for method in ('to_dict', 'to_dicts', 'to_list'):
+        if callable(getattr(obj, method, None)):
+            return getattr(obj, method)()
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        type(obj).__name__))
+
+
+def _encode_response(response):
+    """Encode response as JSON line
+
+    A result that is not JSON serializable is reported as a TypeError.
+    """
+    try:
+        data = json.dumps(response, default=_json_default)
+    except (TypeError, ValueError) as exc:
+        data = json.dumps({'error': str(exc), 'exception': 'TypeError',
+                           'module': 'builtins', 'args': [str(exc)]})
+    return data.encode('utf-8') + b'\n'
+
+
+def _exception_response(exc):
+    """Describe exception so that the client can raise the same type"""
+    args = list(exc.args)
+    try:
+        json.dumps(args)
+    except (TypeError, ValueError):
+        args = [str(exc)]
+    return {'error': str(exc), 'exception': type(exc).__name__,
+            'module': type(exc).__module__, 'args': args}
+
+
+def _remote_exception(response):
+    """Create exception raised in the daemon from its response
+
+    The exception type is only recreated if it is a builtin or defined in
+    lib.exception. Otherwise a UserException is returned.
+    """
+    name = response.get('exception', '')
+    module_name = response.get('module', builtins.__name__)
+    exc_type = None
+    if module_name in REMOTE_EXCEPTION_MODULES:
+        exc_type = getattr(sys.modules.get(module_name), name, None)
+    if isinstance(exc_type, type) and issubclass(exc_type, Exception):
+        try:
+            return exc_type(*response.get('args', [response['error']]))
+        except Exception:
+            pass
+    return UserException('{}: {}'.format(name, response['error']))
+
+
+class _ReadWriteLock(object):
+    """Lock allowing concurrent readers and a single exclusive writer"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _Entry(object):
+    """Loaded Config and Inventory of one config file"""
+
+    def __init__(self, config_path):
+        from lib.config import Config
+        from lib.inventory import Inventory
+
+        self.config_path = config_path
+        self.objects = {CONFIG: Config(config_path),
+                        INVENTORY: Inventory(config_path)}
+        self.inv_file = self.objects[INVENTORY].dbase.inv_file
+        self.stamp = self.get_stamp()
+
+    def get_stamp(self):
+        stamp = []
+        for path in (self.config_path, self.inv_file,
+                     self.inv_file + INV_JOURNAL_SUFFIX):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+
+class QueryServer(object):
+    """Serve Config and Inventory method calls over a Unix domain socket
+
+    Requests and responses are single JSON lines. Read methods run
+    concurrently, write methods and reloads are serialized. Files changed
+    by other processes are reloaded before the next request.
+
+    Args:
+        socket_path (str): Unix domain socket path
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.log = logger.getlogger()
+        self.socket_path = socket_path
+        self.lock = _ReadWriteLock()
+        self.entries = {}
+        self.server = None
+
+    def _get_entry(self, config_path):
+        """Get loaded entry, (re)loading it if files changed on disk"""
+        self.lock.acquire_read()
+        try:
+            entry = self.entries.get(config_path)
+            if entry is not None and entry.stamp == entry.get_stamp():
+                return entry
+        finally:
+            self.lock.release_read()
+
+        self.lock.acquire_write()
+        try:
+            entry = self.entries.get(config_path)
+            if entry is None or entry.stamp != entry.get_stamp():
+                self.log.debug('Loading {}'.format(config_path))
+                entry = _Entry(config_path)
+                self.entries[config_path] = entry
+            return entry
+        finally:
+            self.lock.release_write()
+
+    def _call(self, request):
+        obj = request.get('obj')
+        method = request.get('method', '')
+        if obj not in (CONFIG, INVENTORY):
+            raise UserException("Unknown object '{}'".format(obj))
+        if not _is_served(method):
+            raise UserException("Method '{}' not served".format(method))
+        if method.startswith(READ_PREFIXES):
+            write = False
+        else:
+            write = True
+
+        entry = self._get_entry(
+            _normalize_config_path(request.get('config_path')))
+        func = getattr(entry.objects[obj], method, None)
+        if not callable(func):
+            raise UserException("Unknown {} method '{}'".format(obj, method))
+        args = request.get('args', [])
+        kwargs = request.get('kwargs', {})
+
+        if write:
+            self.lock.acquire_write()
+            try:
+                result = func(*args, **kwargs)
+                entry.stamp = entry.get_stamp()
+            finally:
+                self.lock.release_write()
+        else:
+            self.lock.acquire_read()
+            try:
+                result = func(*args, **kwargs)
+                if isinstance(result, collections.abc.Iterator):
+                    result = list(result)
+            finally:
+                self.lock.release_read()
+        return result
+
+    def handle(self, request):
+        """Handle a decoded request
+
+        Args:
+            request (dict): Request
+
+        Returns:
+            dict: Response
+        """
+        op = request.get('op')
+        try:
+            if op == 'ping':
+                return {'result': os.getpid()}
+            if op == 'call':
+                return {'result': self._call(request)}
+            if op == 'shutdown':
+                threading.Thread(target=self.server.shutdown).start()
+                return {'result': True}
+            raise UserException("Unknown op '{}'".format(op))
+        except Exception as exc:
+            if not isinstance(exc, UserException):
+                self.log.exception('Request {} failed'.format(request))
+            return _exception_response(exc)
+
+    def serve_forever(self):
+        """Serve requests until a 'shutdown' request is received"""
+        query_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line.decode('utf-8'))
+                    except ValueError as exc:
+                        response = _exception_response(exc)
+                    else:
+                        response = query_server.handle(request)
+                    self.wfile.write(_encode_response(response))
+                    self.wfile.flush()
+
+        _make_socket_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            if QueryClient.connect(self.socket_path) is not None:
+                raise UserException('Query daemon already running on {}'
+                                    .format(self.socket_path))
+            os.unlink(self.socket_path)
+
+        old_umask = os.umask(0o077)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(
+                self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        self.server.daemon_threads = True
+        self.log.info('Query daemon listening on {}'.format(self.socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class QueryClient(object):
+    """Client connection to a running QueryServer
+
+    Args:
+        sock (socket): Connected socket
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, socket_path=SOCKET_PATH):
+        """Connect to the daemon
+
+        The socket is only trusted if it is in a private directory, is
+        owned by the current user and the daemon runs as the current user.
+
+        Returns:
+            QueryClient: Client or None if no trusted daemon is running
+        """
+        log = logger.getlogger()
+        try:
+            sock_stat = os.lstat(socket_path)
+        except OSError:
+            return None
+        try:
+            _check_private_dir(os.path.dirname(os.path.abspath(socket_path)))
+        except UserException as exc:
+            log.warning('Ignoring query daemon socket - {}'.format(exc))
+            return None
+        if (not stat.S_ISSOCK(sock_stat.st_mode) or
+                sock_stat.st_uid != os.getuid()):
+            log.warning('Ignoring query daemon socket {} - not a socket '
+                        'owned by uid {}'.format(socket_path, os.getuid()))
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+            trusted = _check_peer(sock)
+        except OSError:
+            sock.close()
+            return None
+        if not trusted:
+            log.warning('Ignoring query daemon socket {} - daemon not '
+                        'running as uid {}'.format(socket_path, os.getuid()))
+            sock.close()
+            return None
+        sock.settimeout(None)
+        return cls(sock)
+
+    def request(self, **request):
+        """Send request and wait for the response
+
+        Returns:
+            obj: Result
+
+        Raises:
+            Exception: The exception raised by the daemon, see
+                _remote_exception()
+        """
+        with self.lock:
+            self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            line = self.rfile.readline()
+        if not line:
+            raise UserException('Query daemon closed the connection')
+        response = json.loads(line.decode('utf-8'),
+                              object_pairs_hook=AttrDict)
+        if 'error' in response:
+            raise _remote_exception(response)
+        return response['result']
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class QueryProxy(object):
+    """Config or Inventory stand-in forwarding method calls to the daemon
+
+    The Inventory 'add_nodes_*' and 'update_nodes' staging methods are not
+    available, use lib.inventory.Inventory directly to create nodes.
+
+    Args:
+        client (QueryClient): Daemon connection
+        obj (str): 'config' or 'inventory'
+        config_path (str): Config file path
+    """
+
+    def __init__(self, client, obj, config_path):
+        self._client = client
+        self._obj = obj
+        self._config_path = _normalize_config_path(config_path)
+
+    def __getattr__(self, method):
+        if not _is_served(method):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            result = self._client.request(
+                op='call', obj=self._obj, method=method,
+                config_path=self._config_path, args=args, kwargs=kwargs)
+            if method.startswith('yield_'):
+                return iter(result)
+            return result
+        return call
+
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = QueryClient.connect() or False
+    return _client
+
+
+def get_inventory(config_path=None):
+    """Get Inventory from the query daemon if it is running
+
+    Args:
+        config_path (str): Config file path
+
+    Returns:
+        object: QueryProxy or Inventory
+    """
+    client = _get_client()
+    if client:
+        return QueryProxy(client, INVENTORY, config_path)
+    from lib.inventory import Inventory
+    return Inventory(config_path)
+
+
+def get_config(config_path=None):
+    """Get Config from the query daemon if it is running
+
+    Args:
+        config_path (str): Config file path
+
+    Returns:
+        object: QueryProxy or Config
+    """
+    client = _get_client()
+    if client:
+        return QueryProxy(client, CONFIG, config_path)
+    from lib.config import Config
+    return Config(config_path)
@@ -0,0 +1,192 @@
+"""Stream conda channel repodata.json files"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bz2
+import json
+import os
+
+PACKAGE_KEYS = ('packages', 'packages.conda')
+READ_SIZE = 1 << 20
+_WHITESPACE = ' \t\n\r'
+
+
+class RepodataError(Exception):
+    """Malformed repodata file"""
+
+
+class _Reader(object):
+    """ Incremental JSON tokenizer over a text file
+
+    Only as much of the file as the current value needs is held in
+    memory.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.f.read(READ_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ Next non-whitespace character, '' at the end of the file """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in \
+                    _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise RepodataError(f'Expected one of {chars!r} at offset '
+                                f'{self.pos}, found {char!r}')
+        self.pos += 1
+        return char
+
+    def value(self):
+        """ Decode the next JSON value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as exc:
+                if self._fill():
+                    continue
+                raise RepodataError(str(exc))
+            # A number at the end of the buffer may continue in the file
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """ Iterate over the (key, reader) members of the next object. The
+        caller reads each member value before advancing.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+            if self.expect(',}') == '}':
+                return
+
+
+def _open(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_packages(path):
+    """ Iterate over the package entries of a repodata file
+
+    Args:
+        path (str): repodata.json or repodata.json.bz2 path
+
+    Yields:
+        tuple: package filename and its repodata entry (dict)
+
+    Raises:
+        RepodataError: If the file is not valid repodata
+    """
+    with _open(path) as f:
+        for key, reader in _Reader(f).members():
+            if key in PACKAGE_KEYS:
+                for filename, pkg_reader in reader.members():
+                    yield filename, pkg_reader.value()
+            else:
+                reader.value()
+
+
+def filter_repodata(path, keep):
+    """ Rewrite a repodata.json file keeping only some package entries
+
+    The file is streamed, so memory use does not grow with the channel
+    size. repodata.json is written as compact JSON and repodata.json.bz2
+    is regenerated from the same output. Both replace the old files
+    atomically.
+
+    Args:
+        path (str): repodata.json path
+        keep (set): Package filenames to keep
+
+    Returns:
+        tuple: Number of entries kept and removed
+
+    Raises:
+        RepodataError: If the file is not valid repodata
+    """
+    bz2_path = path + '.bz2'
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    tmp_bz2_path = f'{bz2_path}.{os.getpid()}.tmp'
+    compressor = bz2.BZ2Compressor()
+    kept = removed = 0
+    try:
+        with _open(path) as src, open(tmp_path, 'w', encoding='utf-8') as dst, \
+                open(tmp_bz2_path, 'wb') as dst_bz2:
+
+            def write(text):
+                dst.write(text)
+                dst_bz2.write(compressor.compress(text.encode('utf-8')))
+
+            def dumps(value):
+                return json.dumps(value, separators=(',', ':'))
+
+            sep = '{'
+            for key, reader in _Reader(src).members():
+                write(f'{sep}{dumps(key)}:')
+                sep = ','
+                if key not in PACKAGE_KEYS:
+                    write(dumps(reader.value()))
+                    continue
+                pkg_sep = '{'
+                for filename, pkg_reader in reader.members():
+                    entry = pkg_reader.value()
+                    if filename in keep:
+                        write(f'{pkg_sep}{dumps(filename)}:{dumps(entry)}')
+                        pkg_sep = ','
+                        kept += 1
+                    else:
+                        removed += 1
+                write('{}' if pkg_sep == '{' else '}')
+            write('{}' if sep == '{' else '}')
+            dst_bz2.write(compressor.flush())
+        os.replace(tmp_path, path)
+        os.replace(tmp_bz2_path, bz2_path)
+    finally:
+        for _path in (tmp_path, tmp_bz2_path):
+            if os.path.exists(_path):
+                os.remove(_path)
+    return kept, removed
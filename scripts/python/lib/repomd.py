@@ -0,0 +1,467 @@
+"""Build yum repository metadata incrementally, like createrepo --update"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import hashlib
+import os
+import re
+import stat
+import struct
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from xml.sax.saxutils import escape, quoteattr
+
+import lib.logger as logger
+from lib.checksum import file_digest
+from lib.file_index import FileIndex, file_stamp
+from lib.rpm import read_rpm_header, RpmError
+
+REPODATA = 'repodata'
+PROCESS_THRESHOLD = 32
+COMPRESS_LEVEL = 6
+CHECKSUM = 'sha256'
+
+NS_REPO = 'http://linux.duke.edu/metadata/repo'
+NS_COMMON = 'http://linux.duke.edu/metadata/common'
+NS_FILELISTS = 'http://linux.duke.edu/metadata/filelists'
+NS_OTHER = 'http://linux.duke.edu/metadata/other'
+NS_RPM = 'http://linux.duke.edu/metadata/rpm'
+# Metadata generated here. Other repomd.xml entries, e.g. group or
+# updateinfo data, are carried over.
+DATA_TYPES = ('primary', 'filelists', 'other')
+_REPLACED_TYPES = DATA_TYPES + tuple(f'{kind}_db' for kind in DATA_TYPES)
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_ROOTS = {
+    'primary': (f'<metadata xmlns="{NS_COMMON}" xmlns:rpm="{NS_RPM}" '
+                'packages="{}">\n', '</metadata>\n'),
+    'filelists': (f'<filelists xmlns="{NS_FILELISTS}" packages="{{}}">\n',
+                  '</filelists>\n'),
+    'other': (f'<otherdata xmlns="{NS_OTHER}" packages="{{}}">\n',
+              '</otherdata>\n')}
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SUMMARY = 1004
+RPMTAG_DESCRIPTION = 1005
+RPMTAG_BUILDTIME = 1006
+RPMTAG_BUILDHOST = 1007
+RPMTAG_SIZE = 1009
+RPMTAG_VENDOR = 1011
+RPMTAG_LICENSE = 1014
+RPMTAG_PACKAGER = 1015
+RPMTAG_GROUP = 1016
+RPMTAG_URL = 1020
+RPMTAG_ARCH = 1022
+RPMTAG_OLDFILENAMES = 1027
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_SOURCERPM = 1044
+RPMTAG_ARCHIVESIZE = 1046
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_CONFLICTFLAGS = 1053
+RPMTAG_CONFLICTNAME = 1054
+RPMTAG_CONFLICTVERSION = 1055
+RPMTAG_CHANGELOGTIME = 1080
+RPMTAG_CHANGELOGNAME = 1081
+RPMTAG_CHANGELOGTEXT = 1082
+RPMTAG_OBSOLETENAME = 1090
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_OBSOLETEFLAGS = 1114
+RPMTAG_OBSOLETEVERSION = 1115
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMSIGTAG_PAYLOADSIZE = 1007
+
+RPMSENSE_SENSEMASK = 0x0e
+RPMSENSE_PRE = (1 << 6) | (1 << 9) | (1 << 10)
+RPMFILE_GHOST = 1 << 6
+_FLAGS = {2: 'LT', 4: 'GT', 8: 'EQ', 10: 'LE', 12: 'GE'}
+_DEPENDENCIES = (
+    ('provides', RPMTAG_PROVIDENAME, RPMTAG_PROVIDEFLAGS,
+     RPMTAG_PROVIDEVERSION),
+    ('requires', RPMTAG_REQUIRENAME, RPMTAG_REQUIREFLAGS,
+     RPMTAG_REQUIREVERSION),
+    ('conflicts', RPMTAG_CONFLICTNAME, RPMTAG_CONFLICTFLAGS,
+     RPMTAG_CONFLICTVERSION),
+    ('obsoletes', RPMTAG_OBSOLETENAME, RPMTAG_OBSOLETEFLAGS,
+     RPMTAG_OBSOLETEVERSION))
+# Files listed in primary.xml as well as filelists.xml
+_PRIMARY_FILES = re.compile(r'^/etc/|bin/|^/usr/lib/sendmail$')
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _text(value):
+    return escape(_INVALID_XML.sub('', str(value)))
+
+
+def _attr(value):
+    return quoteattr(_INVALID_XML.sub('', str(value)))
+
+
+def _first(header, tag, default=''):
+    value = header.get(tag, default)
+    if isinstance(value, list):
+        value = value[0] if value else default
+    return value
+
+
+def _evr_attrs(version):
+    """ epoch, ver and rel attributes of an '[epoch:]version[-release]'
+    dependency version """
+    epoch, sep, ver = version.partition(':')
+    if not sep:
+        epoch, ver = '0', version
+    ver, sep, rel = ver.partition('-')
+    attrs = f'epoch={_attr(epoch or "0")} ver={_attr(ver)}'
+    if sep:
+        attrs += f' rel={_attr(rel)}'
+    return attrs
+
+
+def _dependencies(header):
+    lines = []
+    for kind, name_tag, flags_tag, version_tag in _DEPENDENCIES:
+        names = header.get(name_tag, [])
+        flags = header.get(flags_tag, [0] * len(names))
+        versions = header.get(version_tag, [''] * len(names))
+        entries = []
+        for name, flag, version in zip(names, flags, versions):
+            if kind == 'requires' and name.startswith('rpmlib('):
+                continue
+            entry = f'<rpm:entry name={_attr(name)}'
+            if flag & RPMSENSE_SENSEMASK in _FLAGS and version:
+                entry += (f' flags="{_FLAGS[flag & RPMSENSE_SENSEMASK]}" '
+                          f'{_evr_attrs(version)}')
+            if kind == 'requires' and flag & RPMSENSE_PRE:
+                entry += ' pre="1"'
+            entry += '/>'
+            if entry not in entries:
+                entries.append(entry)
+        if entries:
+            lines.append(f'    <rpm:{kind}>')
+            lines.extend(f'      {entry}' for entry in entries)
+            lines.append(f'    </rpm:{kind}>')
+    return lines
+
+
+def _files(header):
+    """ (path, type) of the package files. type is 'file', 'dir' or
+    'ghost' """
+    basenames = header.get(RPMTAG_BASENAMES)
+    if basenames is None:
+        paths = header.get(RPMTAG_OLDFILENAMES, [])
+    else:
+        dirnames = header.get(RPMTAG_DIRNAMES, [])
+        paths = [dirnames[index] + basename for index, basename in
+                 zip(header.get(RPMTAG_DIRINDEXES, []), basenames)]
+    modes = header.get(RPMTAG_FILEMODES, [])
+    flags = header.get(RPMTAG_FILEFLAGS, [])
+    files = []
+    for index, path in enumerate(paths):
+        if index < len(flags) and flags[index] & RPMFILE_GHOST:
+            files.append((path, 'ghost'))
+        elif index < len(modes) and stat.S_ISDIR(modes[index]):
+            files.append((path, 'dir'))
+        else:
+            files.append((path, 'file'))
+    return files
+
+
+def _file_lines(files, indent):
+    return [f'{indent}<file>{_text(path)}</file>' if kind == 'file' else
+            f'{indent}<file type="{kind}">{_text(path)}</file>'
+            for path, kind in files]
+
+
+def _index_package(repo_dir, relpath):
+    """ Render the primary, filelists and other XML of one package
+
+    Runs in worker processes, so errors are returned rather than raised.
+
+    Returns:
+        tuple: FileIndex values (dict, with the file_stamp() as 'stamp')
+               and error message (str), one of them None
+    """
+    path = os.path.join(repo_dir, relpath)
+    try:
+        st = os.stat(path)
+        signature, header, start, end = read_rpm_header(path)
+        pkgid = file_digest(path, CHECKSUM)
+    except (OSError, RpmError, ValueError, struct.error) as exc:
+        return None, f'{relpath} - {exc}'
+
+    name = _first(header, RPMTAG_NAME)
+    arch = _first(header, RPMTAG_ARCH)
+    if RPMTAG_SOURCERPM not in header:
+        arch = 'src'
+    epoch = str(_first(header, RPMTAG_EPOCH, 0))
+    info = {'name': name, 'ep': str(_first(header, RPMTAG_EPOCH)),
+            'ver': _first(header, RPMTAG_VERSION),
+            'rel': _first(header, RPMTAG_RELEASE), 'arch': arch}
+    version = (f'<version epoch={_attr(epoch)} '
+               f'ver={_attr(_first(header, RPMTAG_VERSION))} '
+               f'rel={_attr(_first(header, RPMTAG_RELEASE))}/>')
+    archive_size = _first(header, RPMTAG_ARCHIVESIZE,
+                          _first(signature, RPMSIGTAG_PAYLOADSIZE, 0))
+    files = _files(header)
+
+    primary = [
+        '<package type="rpm">',
+        f'  <name>{_text(name)}</name>',
+        f'  <arch>{_text(arch)}</arch>',
+        f'  {version}',
+        f'  <checksum type="{CHECKSUM}" pkgid="YES">{pkgid}</checksum>',
+        f'  <summary>{_text(_first(header, RPMTAG_SUMMARY))}</summary>',
+        '  <description>'
+        f'{_text(_first(header, RPMTAG_DESCRIPTION))}</description>',
+        f'  <packager>{_text(_first(header, RPMTAG_PACKAGER))}</packager>',
+        f'  <url>{_text(_first(header, RPMTAG_URL))}</url>',
+        f'  <time file="{int(st.st_mtime)}" '
+        f'build="{_first(header, RPMTAG_BUILDTIME, 0)}"/>',
+        f'  <size package="{st.st_size}" '
+        f'installed="{_first(header, RPMTAG_SIZE, 0)}" '
+        f'archive="{archive_size}"/>',
+        f'  <location href={_attr(relpath)}/>',
+        '  <format>',
+        f'    <rpm:license>{_text(_first(header, RPMTAG_LICENSE))}'
+        '</rpm:license>',
+        f'    <rpm:vendor>{_text(_first(header, RPMTAG_VENDOR))}</rpm:vendor>',
+        f'    <rpm:group>{_text(_first(header, RPMTAG_GROUP))}</rpm:group>',
+        f'    <rpm:buildhost>{_text(_first(header, RPMTAG_BUILDHOST))}'
+        '</rpm:buildhost>',
+        f'    <rpm:sourcerpm>{_text(_first(header, RPMTAG_SOURCERPM))}'
+        '</rpm:sourcerpm>',
+        f'    <rpm:header-range start="{start}" end="{end}"/>']
+    primary.extend(_dependencies(header))
+    primary.extend(_file_lines([(path, kind) for path, kind in files
+                                if _PRIMARY_FILES.search(path)], '    '))
+    primary.extend(['  </format>', '</package>'])
+
+    pkg = f'<package pkgid="{pkgid}" name={_attr(name)} arch={_attr(arch)}>'
+    filelists = [pkg, f'  {version}'] + _file_lines(files, '  ')
+    filelists.append('</package>')
+
+    other = [pkg, f'  {version}']
+    for author, date, text in zip(header.get(RPMTAG_CHANGELOGNAME, []),
+                                  header.get(RPMTAG_CHANGELOGTIME, []),
+                                  header.get(RPMTAG_CHANGELOGTEXT, [])):
+        other.append(f'  <changelog author={_attr(author)} date="{date}">'
+                     f'{_text(text)}</changelog>')
+    other.append('</package>')
+
+    return {'stamp': file_stamp(st), 'info': info,
+            'primary': '\n'.join(primary) + '\n',
+            'filelists': '\n'.join(filelists) + '\n',
+            'other': '\n'.join(other) + '\n'}, None
+
+
+def _scan(repo_dir):
+    """ Stamps of the RPM files below repo_dir, keyed by relative path """
+    stamps = {}
+    dirs = ['']
+    while dirs:
+        rel_dir = dirs.pop()
+        with os.scandir(os.path.join(repo_dir, rel_dir)) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                relpath = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if relpath != REPODATA:
+                        dirs.append(relpath)
+                elif entry.name.endswith('.rpm') and entry.is_file():
+                    stamps[relpath] = file_stamp(entry.stat())
+    return stamps
+
+
+def _write_atomic(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_data(repodata_dir, kind, fragments, count, timestamp):
+    """ Write one compressed metadata file
+
+    Returns:
+        dict: repomd.xml data values of the file
+    """
+    opening, closing = _ROOTS[kind]
+    open_digest = hashlib.new(CHECKSUM)
+    open_size = 0
+    tmp_path = os.path.join(repodata_dir, f'{kind}.xml.gz.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f, gzip.GzipFile(
+                filename='', mode='wb', fileobj=f,
+                compresslevel=COMPRESS_LEVEL, mtime=0) as gz:
+            for text in [_XML_HEADER, opening.format(count)] + fragments + [
+                    closing]:
+                data = text.encode('utf-8')
+                gz.write(data)
+                open_digest.update(data)
+                open_size += len(data)
+        digest = file_digest(tmp_path, CHECKSUM)
+        filename = f'{digest}-{kind}.xml.gz'
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, os.path.join(repodata_dir, filename))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {'checksum': digest, 'open-checksum': open_digest.hexdigest(),
+            'location': f'{REPODATA}/{filename}', 'timestamp': timestamp,
+            'size': size, 'open-size': open_size}
+
+
+def _read_repomd(repodata_dir):
+    """ The data elements of an existing repomd.xml, keyed by type """
+    try:
+        root = ET.parse(os.path.join(repodata_dir, 'repomd.xml')).getroot()
+    except (OSError, ET.ParseError):
+        return {}
+    return {data.get('type'): data for data in root.findall(f'{{{NS_REPO}}}data')}
+
+
+def _element_xml(element):
+    """ Serialize a repomd.xml element in the default namespace """
+    tag = element.tag.rpartition('}')[2]
+    attrs = ''.join(f' {key.rpartition("}")[2]}={_attr(value)}'
+                    for key, value in element.attrib.items())
+    content = _text((element.text or '').strip()) + ''.join(
+        _element_xml(child) for child in element)
+    if not content:
+        return f'<{tag}{attrs}/>'
+    return f'<{tag}{attrs}>{content}</{tag}>'
+
+
+def _write_repomd(repodata_dir, data, extra, timestamp):
+    lines = [_XML_HEADER.rstrip('\n'),
+             f'<repomd xmlns="{NS_REPO}" xmlns:rpm="{NS_RPM}">',
+             f'  <revision>{timestamp}</revision>']
+    for kind in DATA_TYPES:
+        values = data[kind]
+        lines.extend([
+            f'  <data type="{kind}">',
+            f'    <checksum type="{CHECKSUM}">{values["checksum"]}</checksum>',
+            f'    <open-checksum type="{CHECKSUM}">{values["open-checksum"]}'
+            '</open-checksum>',
+            f'    <location href="{values["location"]}"/>',
+            f'    <timestamp>{values["timestamp"]}</timestamp>',
+            f'    <size>{values["size"]}</size>',
+            f'    <open-size>{values["open-size"]}</open-size>',
+            '  </data>'])
+    lines.extend('  ' + _element_xml(element) for element in extra)
+    lines.append('</repomd>\n')
+    _write_atomic(os.path.join(repodata_dir, 'repomd.xml'),
+                  lambda f: f.write('\n'.join(lines).encode('utf-8')))
+
+
+def _remove_stale(repodata_dir, data, old_data):
+    """ Remove metadata files replaced by this run """
+    keep = {os.path.basename(values['location']) for values in data.values()}
+    for kind, element in old_data.items():
+        if kind not in _REPLACED_TYPES:
+            continue
+        location = element.find(f'{{{NS_REPO}}}location')
+        if location is None:
+            continue
+        filename = os.path.basename(location.get('href', ''))
+        path = os.path.join(repodata_dir, filename)
+        if filename and filename not in keep and os.path.isfile(path):
+            os.remove(path)
+
+
+def create_metadata(repo_dir, workers=None, force=False):
+    """ Create or update the yum metadata (repodata/) of a directory of RPMs
+
+    The primary, filelists and other XML of each package are recorded in
+    the package file index of the directory, keyed by path, size and
+    modification time, along with the package identity used by
+    lib.rpm.get_rpms_info().
+    Only added or changed packages are read. Large sets of new packages
+    are read by multiple worker processes. The metadata is not rewritten
+    if no package was added, changed or removed.
+
+    Args:
+        repo_dir (str): Repository directory. RPMs in subdirectories are
+                        included.
+        workers (int, optional): Worker processes. Defaults to the number
+                                 of CPUs.
+        force (bool, optional): Rewrite the metadata even if no package
+                                changed
+
+    Returns:
+        tuple: Number of packages in the metadata, added or changed and
+               removed
+    """
+    log = logger.getlogger()
+    workers = workers or os.cpu_count() or 1
+    repodata_dir = os.path.join(repo_dir, REPODATA)
+    index = FileIndex(repo_dir)
+    stamps = _scan(repo_dir)
+
+    removed = [relpath for relpath in index.paths('primary')
+               if relpath not in stamps]
+    index.discard(removed)
+    changed = sorted(relpath for relpath, stamp in stamps.items()
+                     if index.get(relpath, 'primary', stamp) is None)
+    if len(changed) >= PROCESS_THRESHOLD and workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_index_package, repeat(repo_dir),
+                                        changed, chunksize=8))
+    else:
+        results = [_index_package(repo_dir, relpath) for relpath in changed]
+    added = 0
+    for relpath, (values, error) in zip(changed, results):
+        if error:
+            log.error(f'Error reading package {error}')
+            index.discard([relpath])
+        else:
+            index.set(relpath, values.pop('stamp'), **values)
+            added += 1
+    relpaths = sorted(index.paths('primary'))
+
+    old_data = _read_repomd(repodata_dir)
+    current = all(kind in old_data for kind in DATA_TYPES)
+    if changed or removed or force or not current:
+        os.makedirs(repodata_dir, exist_ok=True)
+        timestamp = int(time.time())
+        entries = [index.entries[relpath] for relpath in relpaths]
+        data = {kind: _write_data(repodata_dir, kind,
+                                  [entry[kind] for entry in entries],
+                                  len(relpaths), timestamp)
+                for kind in DATA_TYPES}
+        _write_repomd(repodata_dir, data,
+                      [element for kind, element in old_data.items()
+                       if kind not in _REPLACED_TYPES], timestamp)
+        _remove_stale(repodata_dir, data, old_data)
+    index.save()
+    return len(relpaths), added, len(removed)
@@ -0,0 +1,236 @@
+"""Read package identity from RPM headers without the rpm command"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.logger as logger
+from lib.file_index import FileIndex, file_stamp
+
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+LEAD_SIZE = 96
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_ARCH = 1022
+RPMTAG_SOURCERPM = 1044
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+WORKERS = 8
+
+_PREAMBLE = struct.Struct('>4s4xII')
+_ENTRY = struct.Struct('>iiii')
+_INT_FORMATS = {RPM_INT8_TYPE: 'B', RPM_INT16_TYPE: 'H', RPM_INT32_TYPE: 'I',
+                RPM_INT64_TYPE: 'Q'}
+_TAGS = {RPMTAG_NAME: 'name', RPMTAG_VERSION: 'ver',
+         RPMTAG_RELEASE: 'rel', RPMTAG_EPOCH: 'ep', RPMTAG_ARCH: 'arch',
+         RPMTAG_SOURCERPM: 'sourcerpm'}
+
+
+class RpmError(Exception):
+    """Invalid or truncated RPM file"""
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise RpmError('Truncated RPM header')
+    return data
+
+
+def _read_index(f):
+    """ Read the preamble and index of a header structure
+
+    Returns:
+        tuple: List of (tag, type, offset, count) entries and data store
+               size
+    """
+    magic, count, size = _PREAMBLE.unpack(_read(f, _PREAMBLE.size))
+    if magic != HEADER_MAGIC:
+        raise RpmError('Bad RPM header magic')
+    index = _read(f, count * _ENTRY.size)
+    entries = [_ENTRY.unpack_from(index, offset)
+               for offset in range(0, len(index), _ENTRY.size)]
+    return entries, size
+
+
+def _read_header(f):
+    """ Read a header structure and decode all of its tags
+
+    Returns:
+        dict: Tag values. Strings are str, string arrays and i18n strings
+              lists of str, integers lists of int and binary data bytes.
+    """
+    entries, size = _read_index(f)
+    store = _read(f, size)
+    tags = {}
+    for tag, tag_type, offset, count in entries:
+        if tag_type == RPM_STRING_TYPE:
+            end = store.index(b'\0', offset)
+            tags[tag] = store[offset:end].decode('utf-8', 'replace')
+        elif tag_type in (RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+            values = []
+            for _ in range(count):
+                end = store.index(b'\0', offset)
+                values.append(store[offset:end].decode('utf-8', 'replace'))
+                offset = end + 1
+            tags[tag] = values
+        elif tag_type in _INT_FORMATS:
+            tags[tag] = list(struct.unpack_from(
+                f'>{count}{_INT_FORMATS[tag_type]}', store, offset))
+        elif tag_type in (RPM_CHAR_TYPE, RPM_BIN_TYPE):
+            tags[tag] = store[offset:offset + count]
+    return tags
+
+
+def read_rpm_header(path):
+    """ Read the signature and the header of an RPM package
+
+    Args:
+        path (str): RPM file path
+
+    Returns:
+        tuple: Signature tags (dict), header tags (dict, see
+               _read_header()) and the start and end file offsets of the
+               header
+
+    Raises:
+        RpmError: If the file is not a valid RPM
+    """
+    with open(path, 'rb') as f:
+        lead = _read(f, LEAD_SIZE)
+        if lead[:4] != LEAD_MAGIC:
+            raise RpmError('Bad RPM lead magic')
+        signature = _read_header(f)
+        f.seek((8 - f.tell() % 8) % 8, os.SEEK_CUR)
+        start = f.tell()
+        header = _read_header(f)
+        end = f.tell()
+    return signature, header, start, end
+
+
+def read_rpm_info(path):
+    """ Read name, epoch, version, release and arch of an RPM package
+
+    Only the lead, the header index and the start of the header data
+    store up to the wanted values are read. The signature and payload
+    are skipped.
+
+    Args:
+        path (str): RPM file path
+
+    Returns:
+        dict: 'name', 'ep', 'ver', 'rel' and 'arch' strings. 'ep' is ''
+              if the package has no epoch. 'arch' is 'src' for source
+              packages.
+
+    Raises:
+        RpmError: If the file is not a valid RPM
+    """
+    with open(path, 'rb') as f:
+        lead = _read(f, LEAD_SIZE)
+        if lead[:4] != LEAD_MAGIC:
+            raise RpmError('Bad RPM lead magic')
+        # Skip the signature, its data store is padded to 8 bytes
+        _, size = _read_index(f)
+        f.seek(size + (8 - (f.tell() + size) % 8) % 8, os.SEEK_CUR)
+        entries, size = _read_index(f)
+        entries = [entry for entry in entries if entry[0] in _TAGS]
+        end = max([offset for _, _, offset, _ in entries] or [0])
+        store = _read(f, min(size, end + 256))
+        while b'\0' not in store[end:] and len(store) < size:
+            store += _read(f, min(size - len(store), 4096))
+
+    info = {'name': '', 'ep': '', 'ver': '', 'rel': '', 'arch': '',
+            'sourcerpm': ''}
+    for tag, tag_type, offset, count in entries:
+        if tag_type in (RPM_STRING_TYPE, RPM_I18NSTRING_TYPE):
+            end = store.index(b'\0', offset)
+            info[_TAGS[tag]] = store[offset:end].decode('utf-8', 'replace')
+        elif tag_type == RPM_INT32_TYPE and count:
+            info[_TAGS[tag]] = str(struct.unpack_from('>i', store,
+                                                      offset)[0])
+    if not info['name']:
+        raise RpmError('RPM header has no name')
+    # Source packages carry the build arch in the header
+    if not info.pop('sourcerpm'):
+        info['arch'] = 'src'
+    return info
+
+
+def get_rpms_info(rpm_dir, filenames=None, workers=WORKERS, index=None):
+    """ Get header information of the RPM files of a directory
+
+    Headers are read in parallel and recorded in the package file index
+    of the directory, so unchanged files are not read again.
+
+    Args:
+        rpm_dir (str): Directory of RPM files
+        filenames (list, optional): RPM filenames. Defaults to all *.rpm
+                                    files in the directory.
+        workers (int, optional): Files read concurrently
+        index (FileIndex, optional): Index of the directory. The caller
+                                     saves it. Defaults to reading and
+                                     saving the index of rpm_dir.
+
+    Returns:
+        dict: read_rpm_info() dict of each filename. Unreadable files are
+              logged and left out.
+    """
+    log = logger.getlogger()
+    all_files = filenames is None
+    if all_files:
+        filenames = [name for name in os.listdir(rpm_dir)
+                     if name.endswith('.rpm')]
+    own_index = index is None
+    if own_index:
+        index = FileIndex(rpm_dir)
+
+    def _get_info(filename):
+        path = os.path.join(rpm_dir, filename)
+        try:
+            stamp = file_stamp(os.stat(path))
+            info = index.get(filename, 'info', stamp)
+            if info is None:
+                info = read_rpm_info(path)
+                index.set(filename, stamp, info=info)
+            return info
+        except (OSError, RpmError, ValueError, struct.error) as exc:
+            log.error(f'Error reading package {rpm_dir}/{filename} - {exc}')
+            return None
+
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        infos = dict(zip(filenames, executor.map(_get_info, filenames)))
+    if all_files:
+        present = set(filenames)
+        index.discard(relpath for relpath in index.paths('info')
+                      if '/' not in relpath and relpath not in present)
+    if own_index:
+        index.save()
+    return {filename: info for filename, info in infos.items() if info}
@@ -22,17 +22,19 @@ import datetime
 import subprocess
 import fileinput
 import readline
-from shutil import copy2, copyfile
+from shutil import copy2, copyfile, rmtree
 from subprocess import Popen, PIPE
 from netaddr import IPNetwork, IPAddress, IPSet
 from tabulate import tabulate
 from textwrap import dedent
-import hashlib
+import json
 from distro import linux_distribution
 
+from lib.checksum import file_digest
 from lib.config import Config
 import lib.logger as logger
 from lib.exception import UserException
+from lib.rpm import get_rpms_info
 
 PATTERN_DHCP = r"^\|_*\s+(.+):(.+)"
 PATTERN_MAC = r'([\da-fA-F]{2}:){5}[\da-fA-F]{2}'
@@ -1482,72 +1484,54 @@ def firewall_add_services(services):
     return fw_err
 
 
-def extract_iso_image(iso_path, dest_dir):
-    """Extract ISO image into directory
+ISO_CACHE_DIR = '.iso_cache'
+
 
-    If a (non-empty) directory matching the iso file already exists in
-    the destination directory extraction is not attempted.
+def _find_kernel_initrd(name, tree_dir):
+    """Find kernel and initrd in extracted ISO image
 
     Args:
-        iso_path (str): Path to ISO file
-        dest_dir (str): Path to an existing directory that the ISO will
-                        be extracted into. A subdirectory matching the
-                        image filename will be created.
+        name (str): ISO image name (filename without '.iso')
+        tree_dir (str): Path to extracted image
 
     Returns:
-        tuple: ('str: Relative path to kernel',
-                'str: Relative path to initrd')
+        tuple: ('str: Path to kernel relative to tree_dir',
+                'str: Path to initrd relative to tree_dir')
 
     Raises:
-        UserException: iso_path is not a valid file path
-                       iso_path does not end in '.iso'
-                       can't find kernel or initrd in extracted image
+        UserException: can't find kernel or initrd in extracted image
     """
-
-    if not os.path.isfile(iso_path):
-        raise UserException(f"Invalid iso_path: '{iso_path}")
-    elif not iso_path.lower().endswith('.iso'):
-        raise UserException(f"File does not end with '.iso': '{iso_path}'")
-
-    name = os.path.basename(iso_path)[:-4]
-    iso_dir = os.path.join(dest_dir, name)
-
-    if not os.path.isdir(iso_dir):
-        os.makedirs(iso_dir)
-
-    if len(os.listdir(iso_dir)) == 0:
-        bash_cmd(f'xorriso -osirrox on -indev {iso_path} -extract / {iso_dir}')
-        bash_cmd(f'chmod 755 {iso_dir}')
-
     filename_parsed = {item.lower() for item in name.split('-')}
     kernel = None
     initrd = None
     if {'ubuntu', 'amd64'}.issubset(filename_parsed):
         sub_path = 'install/netboot/ubuntu-installer/amd64'
-        kernel = os.path.join(name, sub_path, 'linux')
-        initrd = os.path.join(name, sub_path, 'initrd.gz')
-        if not os.path.isfile(kernel):
+        kernel = os.path.join(sub_path, 'linux')
+        initrd = os.path.join(sub_path, 'initrd.gz')
+        if not os.path.isfile(os.path.join(tree_dir, kernel)):
             sub_path = 'casper'
-            kernel = os.path.join(name, sub_path, 'vmlinux')
-            initrd = os.path.join(name, sub_path, 'initrd')
+            kernel = os.path.join(sub_path, 'vmlinux')
+            initrd = os.path.join(sub_path, 'initrd')
     elif {'ubuntu', 'ppc64el'}.issubset(filename_parsed):
         sub_path = 'install/netboot/ubuntu-installer/ppc64el'
-        kernel = os.path.join(name, sub_path, 'vmlinux')
-        initrd = os.path.join(name, sub_path, 'initrd.gz')
+        kernel = os.path.join(sub_path, 'vmlinux')
+        initrd = os.path.join(sub_path, 'initrd.gz')
     elif ({'rhel', 'x86_64'}.issubset(filename_parsed) or
             {'centos', 'x86_64'}.issubset(filename_parsed)):
         sub_path = 'images/pxeboot'
-        kernel = os.path.join(name, sub_path, 'vmlinuz')
-        initrd = os.path.join(name, sub_path, 'initrd.img')
+        kernel = os.path.join(sub_path, 'vmlinuz')
+        initrd = os.path.join(sub_path, 'initrd.img')
     elif ({'rhel', 'ppc64le'}.issubset(filename_parsed) or
             {'centos', 'ppc64le'}.issubset(filename_parsed)):
         sub_path = 'ppc/ppc64'
-        kernel = os.path.join(name, sub_path, 'vmlinuz')
-        initrd = os.path.join(name, sub_path, 'initrd.img')
+        kernel = os.path.join(sub_path, 'vmlinuz')
+        initrd = os.path.join(sub_path, 'initrd.img')
 
-    if not os.path.isfile(os.path.join(dest_dir, kernel)):
+    if kernel is not None and not os.path.isfile(
+            os.path.join(tree_dir, kernel)):
         kernel = None
-    if not os.path.isfile(os.path.join(dest_dir, initrd)):
+    if initrd is not None and not os.path.isfile(
+            os.path.join(tree_dir, initrd)):
         initrd = None
 
     # If kernel or initrd isn't in the above matrix search for them
@@ -1555,14 +1539,14 @@ def extract_iso_image(iso_path, dest_dir):
         kernel_names = {'linux', 'vmlinux', 'vmlinuz'}
         initrd_names = {'initrd.gz', 'initrd.img', 'initrd'}
 
-        for dirpath, dirnames, filenames in os.walk(iso_dir):
+        for dirpath, dirnames, filenames in os.walk(tree_dir):
             if kernel is None and not kernel_names.isdisjoint(set(filenames)):
-                rel_dir = os.path.relpath(dirpath, dest_dir)
-                kernel = (os.path.join(
+                rel_dir = os.path.relpath(dirpath, tree_dir)
+                kernel = os.path.normpath(os.path.join(
                     rel_dir, kernel_names.intersection(set(filenames)).pop()))
             if initrd is None and not initrd_names.isdisjoint(set(filenames)):
-                rel_dir = os.path.relpath(dirpath, dest_dir)
-                initrd = (os.path.join(
+                rel_dir = os.path.relpath(dirpath, tree_dir)
+                initrd = os.path.normpath(os.path.join(
                     rel_dir, initrd_names.intersection(set(filenames)).pop()))
             if kernel is not None and initrd is not None:
                 break
@@ -1574,6 +1558,118 @@ def extract_iso_image(iso_path, dest_dir):
     return kernel, initrd
 
 
+def _remove_tree(path):
+    """Remove directory tree including read-only directories"""
+    for dirpath, dirnames, filenames in os.walk(path):
+        os.chmod(dirpath, 0o755)
+    rmtree(path)
+
+
+def _load_iso_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        LOG.warning(f"Ignoring ISO manifest '{manifest_path}' - {exc}")
+        return None
+
+
+def extract_iso_image(iso_path, dest_dir):
+    """Extract ISO image into directory
+
+    Images are extracted once per content into a directory named after
+    the image sha1 checksum below '<dest_dir>/.iso_cache'. The checksum
+    directory is renamed into place only once extraction completed and a
+    sidecar '<checksum>.json' manifest records the kernel and initrd
+    paths. '<dest_dir>/<image name>' is a symlink to the checksum
+    directory. The manifest also records the stat of each ISO file
+    pointing at it, so unchanged ISO files are not hashed again.
+
+    Args:
+        iso_path (str): Path to ISO file
+        dest_dir (str): Path to an existing directory that the ISO will
+                        be extracted into. A subdirectory matching the
+                        image filename will be created.
+
+    Returns:
+        tuple: ('str: Relative path to kernel',
+                'str: Relative path to initrd')
+
+    Raises:
+        UserException: iso_path is not a valid file path
+                       iso_path does not end in '.iso'
+                       can't find kernel or initrd in extracted image
+    """
+
+    if not os.path.isfile(iso_path):
+        raise UserException(f"Invalid iso_path: '{iso_path}")
+    elif not iso_path.lower().endswith('.iso'):
+        raise UserException(f"File does not end with '.iso': '{iso_path}'")
+
+    name = os.path.basename(iso_path)[:-4]
+    iso_dir = os.path.join(dest_dir, name)
+    cache_dir = os.path.join(dest_dir, ISO_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    iso_realpath = os.path.realpath(iso_path)
+    stat = os.stat(iso_realpath)
+    iso_stat = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    manifest = None
+    if os.path.islink(iso_dir):
+        digest = os.path.basename(os.readlink(iso_dir))
+        manifest = _load_iso_manifest(
+            os.path.join(cache_dir, digest + '.json'))
+        if (manifest is None or not os.path.isdir(iso_dir) or
+                manifest['isos'].get(iso_realpath) != iso_stat):
+            manifest = None
+
+    if manifest is None:
+        LOG.info(f"Verifying ISO image '{iso_path}'")
+        digest = sha1sum(iso_path)
+        tree_dir = os.path.join(cache_dir, digest)
+        manifest_path = os.path.join(cache_dir, digest + '.json')
+        manifest = _load_iso_manifest(manifest_path)
+        if manifest is None or not os.path.isdir(tree_dir):
+            LOG.info(f"Extracting ISO image '{iso_path}'")
+            tmp_dir = f'{tree_dir}.tmp{os.getpid()}'
+            if os.path.isdir(tmp_dir):
+                _remove_tree(tmp_dir)
+            os.makedirs(tmp_dir)
+            try:
+                bash_cmd(f'xorriso -osirrox on -indev {iso_path} '
+                         f'-extract / {tmp_dir}')
+                os.chmod(tmp_dir, 0o755)
+                kernel, initrd = _find_kernel_initrd(name, tmp_dir)
+                if os.path.isdir(tree_dir):
+                    # Left by an interrupted run, no manifest was written
+                    _remove_tree(tree_dir)
+                os.rename(tmp_dir, tree_dir)
+            except BaseException:
+                _remove_tree(tmp_dir)
+                raise
+            manifest = {'kernel': kernel, 'initrd': initrd, 'isos': {}}
+
+        manifest['isos'][iso_realpath] = iso_stat
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        if os.path.isdir(iso_dir) and not os.path.islink(iso_dir):
+            # Extracted in place by an earlier version
+            _remove_tree(iso_dir)
+        tmp_link = iso_dir + '.tmp-link'
+        if os.path.lexists(tmp_link):
+            os.unlink(tmp_link)
+        os.symlink(os.path.join(ISO_CACHE_DIR, digest), tmp_link)
+        os.replace(tmp_link, iso_dir)
+
+    return (os.path.join(name, manifest['kernel']),
+            os.path.join(name, manifest['initrd']))
+
+
 def timestamp():
     return datetime.datetime.now().strftime("%d-%h-%Y-%H-%M-%S")
 
@@ -1587,11 +1683,7 @@ def sha1sum(file_path):
     Returns:
         str: sha1 checksum
     """
-    sha1sum = hashlib.sha1()
-    with open(file_path, 'rb') as file_object:
-        for block in iter(lambda: file_object.read(sha1sum.block_size), b''):
-            sha1sum.update(block)
-    return sha1sum.hexdigest()
+    return file_digest(file_path, 'sha1')
 
 
 def md5sum(file_path):
@@ -1603,11 +1695,7 @@ def md5sum(file_path):
     Returns:
         str: md5 checksum
     """
-    md5sum = hashlib.md5()
-    with open(file_path, 'rb') as file_object:
-        for block in iter(lambda: file_object.read(md5sum.block_size), b''):
-            md5sum.update(block)
-    return md5sum.hexdigest()
+    return file_digest(file_path, 'md5')
 
 
 def clear_curses():
@@ -1726,34 +1814,20 @@ def parse_conda_filenames(filenames):
 
 
 def get_rpm_info(filelist, _dir):
-    def get_parts(info):
-        name = ep = ver = rel = ''
-        if 'Name' in info:
-            name = info.split('Name', 1)[-1].lstrip(' :')
-            name = name[:name.index('\n')]
-        else:
-            LOG.error(f'Name not found in rpm package info {info}')
-        if 'Epoch' in info:
-            ep = info.split('Epoch', 1)[-1].lstrip(' :')
-            ep = ep[:ep.index('\n')]
-        if 'Version' in info:
-            ver = info.split('Version', 1)[-1].lstrip(' :')
-            ver = ver[:ver.index('\n')]
-        if 'Release' in info:
-            rel = info.split('Release', 1)[-1].lstrip(' :')
-            rel = rel[:rel.index('\n')]
-
-        return name, ep, ver, rel
-
+    """Returns the name, epoch, version and release of the newest package of
+    each name in a list of rpm files. Package headers are read natively and
+    cached in the directory, see lib.rpm.get_rpms_info.
+    Args:
+        filelist (list): rpm filenames
+        _dir (str): directory of the rpm files
+    Returns:
+        dictionary of form: {name: {'ep': epoch, 'ver': version, 'rel': release}}
+    """
     if isinstance(filelist, list):
         _dict = {}
-        for _file in filelist:
-            path = os.path.join(_dir, _file)
-            cmd = f'rpm -qip {path}'
-            resp, err, rc = sub_proc_exec(cmd)
-            if rc != 0:
-                LOG.error(f'Error querying package {path}')
-            name, ep, ver, rel = get_parts(resp)
+        for _file, info in get_rpms_info(_dir, filelist).items():
+            name, ep, ver, rel = (info['name'], info['ep'], info['ver'],
+                                  info['rel'])
             if name in _dict:
                 if ep > _dict[name]['ep']:
                     _dict[name]['ver'] = ver
@@ -1868,6 +1942,34 @@ def parse_rpm_filenames(filename, form='list'):
     return basename, epoch, version, release
 
 
+def packages_in_message(message, packages):
+    """ Get the packages a yum or yumdownloader message is about
+
+    Packages are matched by exact name, not as substrings, so a message
+    about 'python-devel' is not taken to be about 'python'. A package given
+    by basename also matches the full rpm filename in a message, e.g. in
+    the URL of a failed download.
+    Args:
+        message (str): Output line
+        packages (list): Package names, basenames or full names with or
+            without a trailing '.rpm'
+    Returns:
+        list: The packages the message refers to
+    """
+    names = set()
+    for token in re.split(r'[\s/]+', message):
+        token = token.strip('\'",:;')
+        if token.endswith('.rpm'):
+            token = token[:-4]
+        if not token:
+            continue
+        names.add(token)
+        if '-' in token and '.' in token:
+            names.add(parse_rpm_filenames(token)[0])
+    return [pkg for pkg in packages
+            if (pkg[:-4] if pkg.endswith('.rpm') else pkg) in names]
+
+
 def lscpu():
     """ Get 'lscpu' output as dictionary
 
@@ -0,0 +1,159 @@
+"""Wave based OS installation scheduler"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import Counter
+from time import time
+
+import lib.logger as logger
+
+WAVE_SIZE = 8
+MAX_WAVE_SIZE = 64
+MAX_IN_FLIGHT = 128
+START_TIMEOUT = 5 * 60
+INSTALL_TIMEOUT = 60 * 60
+
+
+class WaveScheduler(object):
+    """Release nodes for OS installation in adaptive waves
+
+    A wave of nodes is released (PXE booted) once every node of the
+    previous wave started installing, or once the previous wave stalled
+    for 'start_timeout' seconds. The wave size grows by 'wave_size' after
+    each wave that started in time and is halved after a stalled wave.
+
+    Released nodes that have not finished installing are in flight. The
+    number of nodes in flight is limited by 'max_in_flight' and by a cap
+    per group, e.g. per rack or per switch. Nodes that did not start
+    within 'start_timeout' or finish within 'install_timeout' are not
+    counted, they do not load the boot server.
+
+    Args:
+        nodes (dict): Groups of each node, in release order. Values are
+                      dicts of group type to group name, e.g.
+                      {'192.168.3.21': {'rack': 'rack1', 'switch': 'mgmt1'}}
+        wave_size (int, optional): Initial wave size and growth step
+        max_wave_size (int, optional): Maximum wave size
+        max_in_flight (int, optional): Maximum nodes in flight
+        group_caps (dict, optional): Maximum nodes in flight per group of
+                                     each group type, e.g. {'rack': 16}
+        start_timeout (float, optional): Seconds for a released node to
+                                         start installing
+        install_timeout (float, optional): Seconds for a released node to
+                                           finish installing
+    """
+
+    def __init__(self, nodes, wave_size=WAVE_SIZE, max_wave_size=MAX_WAVE_SIZE,
+                 max_in_flight=MAX_IN_FLIGHT, group_caps=None,
+                 start_timeout=START_TIMEOUT,
+                 install_timeout=INSTALL_TIMEOUT):
+        self.log = logger.getlogger()
+        self.nodes = dict(nodes)
+        self.pending = list(nodes)
+        self.step = max(1, wave_size)
+        self.wave_size = self.step
+        self.max_wave_size = max(self.step, max_wave_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.group_caps = {group_type: cap for group_type, cap in
+                           (group_caps or {}).items() if cap}
+        self.start_timeout = start_timeout
+        self.install_timeout = install_timeout
+        self.released = {}
+        self.started = set()
+        self.finished = set()
+        self.wave = []
+        self.wave_time = None
+
+    def update(self, started=(), finished=()):
+        """Record installation progress
+
+        Args:
+            started (iterable): Nodes that started installing
+            finished (iterable): Nodes that finished installing
+        """
+        finished = set(finished) & set(self.nodes)
+        self.started |= (set(started) & set(self.nodes)) | finished
+        self.finished |= finished
+
+    def _in_flight(self, now):
+        return [node for node, release_time in self.released.items()
+                if node not in self.finished and
+                now - release_time <= (self.install_timeout
+                                       if node in self.started
+                                       else self.start_timeout)]
+
+    def next_wave(self, now=None):
+        """Get the next wave of nodes to release
+
+        Args:
+            now (float, optional): Current time
+
+        Returns:
+            list: Nodes to release now, possibly empty
+        """
+        if now is None:
+            now = time()
+
+        if self.wave:
+            if all(node in self.started for node in self.wave):
+                self.wave_size = min(self.max_wave_size,
+                                     self.wave_size + self.step)
+            elif now - self.wave_time > self.start_timeout:
+                self.wave_size = max(1, self.wave_size // 2)
+                self.log.info('Wave stalled, {} of {} nodes started. '
+                              'Wave size reduced to {}'.format(
+                                  len(set(self.wave) & self.started),
+                                  len(self.wave), self.wave_size))
+            else:
+                return []
+            self.wave = []
+
+        in_flight = self._in_flight(now)
+        group_counts = Counter(
+            (group_type, self.nodes[node].get(group_type))
+            for node in in_flight for group_type in self.group_caps)
+        room = min(self.wave_size, self.max_in_flight - len(in_flight))
+        wave = []
+        for node in self.pending:
+            if len(wave) >= room:
+                break
+            groups = [(group_type, self.nodes[node].get(group_type))
+                      for group_type in self.group_caps]
+            if any(group_counts[group] >= self.group_caps[group[0]]
+                   for group in groups):
+                continue
+            group_counts.update(groups)
+            wave.append(node)
+
+        if wave:
+            for node in wave:
+                self.pending.remove(node)
+                self.released[node] = now
+            self.wave = wave
+            self.wave_time = now
+            self.log.debug('Releasing wave of {} nodes, {} in flight, '
+                           '{} pending'.format(len(wave), len(in_flight),
+                                               len(self.pending)))
+        return wave
+
+    def is_done(self):
+        """Check if all nodes were released
+
+        Returns:
+            bool: True if no node is pending release
+        """
+        return not self.pending
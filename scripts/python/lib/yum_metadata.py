@@ -0,0 +1,182 @@
+"""Refresh yum repository metadata only when it changed"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import configparser
+import glob
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import lib.logger as logger
+from lib.utilities import sub_proc_exec
+
+YUM_REPOS_DIR = '/etc/yum.repos.d'
+YUM_CACHE_DIR = '/var/cache/yum'
+WORKERS = 8
+TIMEOUT = 30
+_REVISION = re.compile(rb'<revision>\s*([^<\s]+)\s*</revision>')
+
+
+def repomd_revision(content):
+    """ Get the revision of a repomd.xml file
+
+    Args:
+        content (bytes): repomd.xml content
+
+    Returns:
+        str: The revision element, or the sha256 of the content if it has
+             none
+    """
+    match = _REVISION.search(content)
+    if match:
+        return match.group(1).decode('utf-8', 'replace')
+    return hashlib.sha256(content).hexdigest()
+
+
+class YumMetadataSession(object):
+    """ Keeps the yum metadata cache current during one prep run
+
+    refresh() compares the revision in each repository's remote
+    repomd.xml with the one in the yum cache. Only repositories whose
+    metadata changed are expired and fetched again, each at most once
+    per session unless its revision changes again. Repositories whose
+    revision can not be determined, e.g. mirrorlist repositories, are
+    refreshed once per session.
+
+    Args:
+        arch (str, optional): Value of $basearch in repository URLs
+        repos_dir (str, optional): Directory of the .repo files
+        cache_dir (str, optional): yum cache directory
+    """
+
+    def __init__(self, arch='ppc64le', repos_dir=YUM_REPOS_DIR,
+                 cache_dir=YUM_CACHE_DIR):
+        self.log = logger.getlogger()
+        self.arch = arch
+        self.repos_dir = repos_dir
+        self.cache_dir = cache_dir
+        self.refreshed = {}
+        self.session = requests.Session()
+
+    def get_repos(self):
+        """ Get the enabled repositories
+
+        Returns:
+            dict: Base URL of each repository id. None for repositories
+                  without a usable base URL.
+        """
+        repos = {}
+        for path in sorted(glob.glob(os.path.join(self.repos_dir, '*.repo'))):
+            config = configparser.ConfigParser(interpolation=None,
+                                               strict=False)
+            try:
+                config.read(path)
+            except configparser.Error as exc:
+                self.log.debug(f'Unable to read {path} - {exc}')
+                continue
+            for repo_id in config.sections():
+                section = config[repo_id]
+                if section.get('enabled', '1').strip() in ('0', 'false',
+                                                           'no'):
+                    continue
+                baseurl = (section.get('baseurl') or '').split()
+                baseurl = baseurl[0] if baseurl else None
+                if baseurl:
+                    baseurl = baseurl.replace('$basearch', self.arch).replace(
+                        '$arch', self.arch)
+                    if '$' in baseurl:
+                        baseurl = None
+                repos[repo_id] = baseurl
+        return repos
+
+    def _remote_revision(self, baseurl):
+        if not baseurl:
+            return None
+        url = baseurl.rstrip('/') + '/repodata/repomd.xml'
+        try:
+            if url.startswith('file://'):
+                with open(url[7:], 'rb') as f:
+                    return repomd_revision(f.read())
+            resp = self.session.get(url, timeout=TIMEOUT)
+            if resp.ok:
+                return repomd_revision(resp.content)
+            self.log.debug(f'GET {url} returned {resp.status_code}')
+        except (OSError, requests.RequestException) as exc:
+            self.log.debug(f'Unable to read {url} - {exc}')
+        return None
+
+    def _cached_revision(self, repo_id):
+        for path in glob.glob(os.path.join(self.cache_dir, '*', '*', repo_id,
+                                           'repomd.xml')):
+            try:
+                with open(path, 'rb') as f:
+                    return repomd_revision(f.read())
+            except OSError:
+                pass
+        return None
+
+    def refresh(self, repo_ids=None):
+        """ Refresh the metadata of repositories that changed
+
+        Args:
+            repo_ids (list, optional): Repository ids. Defaults to all
+                                       enabled repositories.
+
+        Returns:
+            bool: False if a yum command failed
+        """
+        repos = self.get_repos()
+        if repo_ids is not None:
+            repos = {repo_id: baseurl for repo_id, baseurl in repos.items()
+                     if repo_id in repo_ids}
+        if not repos:
+            return True
+        with ThreadPoolExecutor(min(WORKERS, len(repos))) as executor:
+            revisions = dict(zip(repos, executor.map(self._remote_revision,
+                                                     repos.values())))
+
+        stale = {}
+        for repo_id, revision in revisions.items():
+            if repo_id in self.refreshed:
+                if revision is None or revision == self.refreshed[repo_id]:
+                    continue
+            elif (revision is not None and
+                  revision == self._cached_revision(repo_id)):
+                self.log.debug(f'yum metadata of {repo_id} is current')
+                self.refreshed[repo_id] = revision
+                continue
+            stale[repo_id] = revision
+        if not stale:
+            return True
+
+        enable = ','.join(sorted(stale))
+        self.log.debug(f'Refreshing yum metadata of {enable}')
+        rc = True
+        for cmd in ('yum clean expire-cache metadata', 'yum makecache fast'):
+            cmd = f'{cmd} --noplugins --disablerepo=* --enablerepo={enable}'
+            resp, err, _rc = sub_proc_exec(cmd)
+            if _rc != 0:
+                rc = False
+                self.log.error('An error occurred while refreshing the yum '
+                               f'cache\nrc: {_rc} err: {err}')
+        if rc:
+            self.refreshed.update(stale)
+        return rc
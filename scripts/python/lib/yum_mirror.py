@@ -0,0 +1,363 @@
+"""Delta mirroring of yum repositories, an incremental reposync"""
+
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bz2
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.logger as logger
+from lib.checksum import file_digest
+from lib.download import Downloader, WORKERS
+from lib.exception import UserException
+from lib.repomd import NS_COMMON, NS_REPO, REPODATA
+
+MANIFEST = '.mirror_manifest.json'
+TIMEOUT = 60
+_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def _url_path(url):
+    return url[7:] if url.startswith('file://') else None
+
+
+def _safe_path(top, href):
+    """ Path of a repository relative href, None if it leaves top """
+    path = os.path.normpath(os.path.join(top, href))
+    if os.path.isabs(href) or not path.startswith(os.path.join(top, '')):
+        return None
+    return path
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _algorithm(checksum):
+    """ hashlib name of a checksum element type. 'sha' is sha1. """
+    algorithm = checksum.get('type', 'sha256')
+    return 'sha1' if algorithm == 'sha' else algorithm
+
+
+def parse_repomd(content):
+    """ Get the data files listed in a repomd.xml
+
+    Args:
+        content (bytes): repomd.xml content
+
+    Returns:
+        dict: 'href', 'checksum', 'algorithm' and 'size' of each data
+              file, keyed by type
+    """
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError as exc:
+        raise UserException(f'Invalid repomd.xml - {exc}')
+    data = {}
+    for element in root.findall(f'{{{NS_REPO}}}data'):
+        location = element.find(f'{{{NS_REPO}}}location')
+        checksum = element.find(f'{{{NS_REPO}}}checksum')
+        size = element.findtext(f'{{{NS_REPO}}}size')
+        if location is None or checksum is None:
+            continue
+        data[element.get('type')] = {
+            'href': location.get('href'), 'checksum': checksum.text.strip(),
+            'algorithm': _algorithm(checksum),
+            'size': int(size) if size else None}
+    return data
+
+
+def iter_primary(path):
+    """ Stream the packages of a primary.xml file
+
+    The file is parsed incrementally and each package element is freed
+    after use, so memory does not grow with the repository size.
+
+    Args:
+        path (str): primary.xml file, optionally gz, bz2 or xz compressed
+
+    Yields:
+        dict: 'href', 'checksum', 'algorithm' and 'size' of each package
+    """
+    opener = _OPENERS.get(os.path.splitext(path)[1], open)
+    package = f'{{{NS_COMMON}}}package'
+    with opener(path, 'rb') as f:
+        root = None
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event != 'end' or element.tag != package:
+                continue
+            location = element.find(f'{{{NS_COMMON}}}location')
+            checksum = element.find(f'{{{NS_COMMON}}}checksum')
+            size = element.find(f'{{{NS_COMMON}}}size')
+            if location is not None and checksum is not None:
+                yield {'href': location.get('href'),
+                       'checksum': checksum.text.strip(),
+                       'algorithm': _algorithm(checksum),
+                       'size': int(size.get('package')) if size is not None
+                       else None}
+            root.clear()
+
+
+class YumMirror(object):
+    """ Mirror a yum repository into a directory, fetching only changes
+
+    The remote repomd.xml is compared with the one of the last run. If
+    it changed, primary.xml is streamed and each package compared with
+    a manifest of the packages mirrored before. Only new or changed
+    packages are downloaded, concurrently and verified against their
+    checksums. The repository metadata is staged in a separate directory
+    and swapped in when complete, like createrepo does.
+
+    Args:
+        baseurl (str): Repository URL. http(s) or file.
+        repo_dir (str): Local mirror directory
+        downloader (Downloader, optional): Downloader for http(s) URLs
+        workers (int, optional): Concurrent copies for file URLs
+    """
+
+    def __init__(self, baseurl, repo_dir, downloader=None, workers=WORKERS):
+        self.log = logger.getlogger()
+        self.baseurl = baseurl.rstrip('/') + '/'
+        self.repo_dir = repo_dir
+        self.downloader = downloader
+        self.workers = workers
+        self.manifest_path = os.path.join(repo_dir, MANIFEST)
+
+    def _get_downloader(self):
+        if self.downloader is None:
+            self.downloader = Downloader(workers=self.workers)
+        return self.downloader
+
+    def _read(self, href):
+        url = self.baseurl + href
+        path = _url_path(url)
+        try:
+            if path is not None:
+                with open(path, 'rb') as f:
+                    return f.read()
+            resp = self._get_downloader().session.get(url, timeout=TIMEOUT)
+        except OSError as exc:
+            raise UserException(f'Unable to read {url} - {exc}')
+        if not resp.ok:
+            raise UserException(f'Unable to read {url} - HTTP '
+                                f'{resp.status_code}')
+        return resp.content
+
+    def _copy(self, src, dest, checksum, algorithm, size):
+        """ Copy a local file, verified, unless dest matches already """
+        if (os.path.isfile(dest) and
+                (size is None or os.path.getsize(dest) == size) and
+                file_digest(dest, algorithm) == checksum.lower()):
+            return
+        tmp_path = f'{dest}.{os.getpid()}.tmp'
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            shutil.copyfile(src, tmp_path)
+            if file_digest(tmp_path, algorithm) != checksum.lower():
+                raise UserException(f'{algorithm} verification failed: {src}')
+            shutil.copystat(src, tmp_path)
+            os.replace(tmp_path, dest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _fetch_many(self, files, dest_dir):
+        """ Fetch repository files verified against their checksums
+
+        Args:
+            files (list): dicts with 'href', 'checksum', 'algorithm' and
+                          'size'
+            dest_dir (str): Destination of the hrefs
+
+        Returns:
+            dict: Error message of each failed href
+        """
+        downloads = {}
+        for entry in files:
+            dest = _safe_path(dest_dir, entry['href'])
+            if dest is None:
+                raise UserException(f'Invalid location {entry["href"]}')
+            downloads[dest] = (entry['href'], {
+                'url': self.baseurl + entry['href'], 'dest': dest,
+                'checksum': entry['checksum'],
+                'algorithm': entry['algorithm'], 'size': entry['size']})
+        if not downloads:
+            return {}
+        if _url_path(self.baseurl) is None:
+            failed = self._get_downloader().download_many(
+                kwargs for _, kwargs in downloads.values())
+            return {downloads[dest][0]: error for dest, error in failed.items()}
+
+        def copy(kwargs):
+            try:
+                self._copy(_url_path(kwargs['url']), kwargs['dest'],
+                           kwargs['checksum'], kwargs['algorithm'],
+                           kwargs['size'])
+            except (UserException, OSError) as exc:
+                self.log.error(str(exc))
+                return str(exc)
+
+        with ThreadPoolExecutor(min(self.workers, len(downloads))) as executor:
+            errors = executor.map(copy, [kwargs for _, kwargs in
+                                         downloads.values()])
+            return {href: error for (href, _), error in
+                    zip(downloads.values(), errors) if error}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'repomd': None, 'packages': {}}
+        except (OSError, ValueError) as exc:
+            self.log.warning(f'Ignoring mirror manifest {self.manifest_path} '
+                             f'- {exc}')
+            return {'repomd': None, 'packages': {}}
+        manifest.setdefault('packages', {})
+        return manifest
+
+    def _is_current(self, href, entry, manifest):
+        if manifest['packages'].get(href) != [entry['algorithm'],
+                                              entry['checksum'],
+                                              entry['size']]:
+            return False
+        try:
+            size = os.path.getsize(os.path.join(self.repo_dir, href))
+        except OSError:
+            return False
+        return entry['size'] is None or size == entry['size']
+
+    def _stage_repodata(self, repomd, data):
+        """ Fetch the metadata files into a staging directory. Files of
+        the current metadata are reused. """
+        stage_dir = os.path.join(self.repo_dir, f'.{REPODATA}.tmp')
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.makedirs(os.path.join(stage_dir, REPODATA))
+        for entry in data.values():
+            current = _safe_path(self.repo_dir, entry['href'])
+            staged = _safe_path(stage_dir, entry['href'])
+            if current and staged and os.path.isfile(current):
+                os.makedirs(os.path.dirname(staged), exist_ok=True)
+                os.link(current, staged)
+        failed = self._fetch_many(list(data.values()), stage_dir)
+        if failed:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            raise UserException('Unable to fetch the repository metadata '
+                                f'from {self.baseurl}')
+        _write_atomic(os.path.join(stage_dir, REPODATA, 'repomd.xml'), repomd)
+        return stage_dir
+
+    def _swap_repodata(self, stage_dir):
+        repodata_dir = os.path.join(self.repo_dir, REPODATA)
+        old_dir = os.path.join(self.repo_dir, f'.{REPODATA}.old')
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(repodata_dir):
+            os.rename(repodata_dir, old_dir)
+        os.rename(os.path.join(stage_dir, REPODATA), repodata_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def _remove_obsolete(self, hrefs):
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.repo_dir):
+            dirnames[:] = [name for name in dirnames if not
+                           name.startswith('.') and not (
+                               dirpath == self.repo_dir and name == REPODATA)]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if (name.endswith('.rpm') and
+                        os.path.relpath(path, self.repo_dir) not in hrefs):
+                    self.log.debug(f'Removing obsolete package {path}')
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def sync(self, delete=False):
+        """ Bring the mirror up to date
+
+        Args:
+            delete (bool, optional): Remove local packages no longer in the
+                                     repository
+
+        Returns:
+            tuple: Number of packages in the repository, downloaded and
+                   removed
+
+        Raises:
+            UserException: If the metadata can not be read or packages
+                           failed to download
+        """
+        os.makedirs(self.repo_dir, exist_ok=True)
+        repomd = self._read(f'{REPODATA}/repomd.xml')
+        repomd_digest = hashlib.sha256(repomd).hexdigest()
+        manifest = self._load_manifest()
+        if (manifest['repomd'] == repomd_digest and
+                all(self._is_current(href, {'algorithm': entry[0],
+                                            'checksum': entry[1],
+                                            'size': entry[2]}, manifest)
+                    for href, entry in manifest['packages'].items())):
+            self.log.debug(f'{self.baseurl} is unchanged')
+            removed = (self._remove_obsolete(set(manifest['packages']))
+                       if delete else 0)
+            return len(manifest['packages']), 0, removed
+
+        data = parse_repomd(repomd)
+        if 'primary' not in data:
+            raise UserException(f'No primary metadata in {self.baseurl}')
+        stage_dir = self._stage_repodata(repomd, data)
+        try:
+            packages = {entry['href']: entry for entry in iter_primary(
+                _safe_path(stage_dir, data['primary']['href']))}
+        except (OSError, EOFError, lzma.LZMAError, ET.ParseError) as exc:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            raise UserException(f'Unable to read the primary metadata of '
+                                f'{self.baseurl} - {exc}')
+
+        changed = [entry for href, entry in sorted(packages.items())
+                   if not self._is_current(href, entry, manifest)]
+        self.log.info(f'{len(changed)} of {len(packages)} packages to fetch '
+                      f'from {self.baseurl}')
+        failed = self._fetch_many(changed, self.repo_dir)
+
+        manifest = {'repomd': None if failed else repomd_digest,
+                    'packages': {href: [entry['algorithm'], entry['checksum'],
+                                        entry['size']]
+                                 for href, entry in packages.items()
+                                 if href not in failed}}
+        _write_atomic(self.manifest_path, json.dumps(manifest).encode('utf-8'))
+        if failed:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            raise UserException(f'Failed to fetch {len(failed)} packages from '
+                                f'{self.baseurl}:\n' + '\n'.join(sorted(failed)))
+        self._swap_repodata(stage_dir)
+        removed = self._remove_obsolete(set(packages)) if delete else 0
+        return len(packages), len(changed), removed
@@ -17,8 +17,11 @@
 
 import argparse
 import curses
+import hashlib
 import npyscreen
 import os.path
+import queue
+import threading
 import yaml
 import copy
 from orderedattrdict.yamlutils import AttrDictYAMLLoader
@@ -34,6 +37,7 @@ from tabulate import tabulate
 
 import lib.logger as logger
 import lib.interfaces as interfaces
+import lib.inotify as inotify
 from lib.genesis import get_package_path, get_sample_configs_path, \
     get_os_images_path, get_nginx_root_dir
 import lib.utilities as u
@@ -43,6 +47,7 @@ from lib.bmc import Bmc
 from set_bootdev_clients import set_bootdev_clients
 from set_power_clients import set_power_clients
 from lib.genesis import get_power_wait
+from lib.wave_scheduler import WaveScheduler
 
 GEN_PATH = get_package_path()
 GEN_SAMPLE_CONFIGS_PATH = get_sample_configs_path()
@@ -51,6 +56,10 @@ IPR = IPRoute()
 
 PROFILE = os.path.join(GEN_PATH, 'profile.yml')
 NODE_STATUS = os.path.join(GEN_PATH, 'osinstall_node_status.yml')
+SN_PN_CACHE = os.path.join(GEN_PATH, 'osinstall_sn_pn_cache.yml')
+SN_PN_CACHE_TTL = 24 * 3600  # seconds
+DHCP_LEASES_FILES = ('/var/lib/dnsmasq/dnsmasq.leases',
+                     '/var/lib/misc/dnsmasq.leases')
 
 HTTP_ROOT_DIR = get_nginx_root_dir()
 OSINSTALL_HTTP_DIR = 'osinstall'
@@ -246,37 +255,88 @@ def get_selected_clients(profile_object, node_dict_file, bmc_ip='all'):
 
 
 def initiate_pxeboot(profile_object, node_dict_file):
+    """ Power off the selected clients and PXE boot the first wave
+
+    Returns:
+        WaveScheduler: Scheduler releasing the remaining clients
+    """
     clients = get_selected_clients(profile_object, node_dict_file)
     set_power_clients('off', clients=clients, wait=POWER_WAIT)
-    set_bootdev_clients('network', persist=False, clients=clients)
-    set_power_clients('on', clients=clients, wait=POWER_WAIT)
+    scheduler = WaveScheduler({bmc_ip: {} for bmc_ip in clients})
+    pxeboot_clients(profile_object, node_dict_file, scheduler.next_wave())
+    return scheduler
 
 
-def update_install_status(node_dict_file, start_time, write_results=True):
-    """ Update client node installation status
+def pxeboot_clients(profile_object, node_dict_file, bmc_ips):
+    """ PXE boot powered off clients
 
     Args:
-        node_dict_file (str): Selected nodes dictionary file path
+        bmc_ips (list): BMC ip addresses of the clients to boot
+    """
+    clients = get_selected_clients(profile_object, node_dict_file)
+    clients = {bmc_ip: clients[bmc_ip] for bmc_ip in bmc_ips}
+    set_bootdev_clients('network', persist=False, clients=clients)
+    set_power_clients('on', clients=clients, wait=POWER_WAIT)
 
-        start_time (int): UNIX Epoch time - only status reported _after_
-                          this time will be inspected
 
-        write_results (bool, optional): Write updated node dictionary to
-                                        file (using 'node_dict_file' path)
+class InstallStatusTracker(object):
+    """Incremental client node installation status
 
-    Returns:
-        dict: Selected node dictionary with updated 'start_time',
-              'finish_time', and 'report_data' values
+    Watches the client status directory with inotify and only processes
+    report files that were added or changed since the last refresh.
+    PXE IP and serial number to BMC MAC indexes are kept in memory. If
+    inotify is not available all file stats are compared instead, which
+    still skips parsing unchanged reports.
 
+    Args:
+        node_dict_file (str): Selected nodes dictionary file path
+        status_dir (str, optional): Client status report directory
     """
-    log = logger.getlogger()
-    status_dir = CLIENT_STATUS_DIR
-    nodes = yaml.full_load(open(node_dict_file))
 
-    def _associate_pxe_to_bmc(nodes, pxe_ip, report_data=None):
-        for bmc_mac, value in nodes['selected'].items():
-            if 'pxe_ip' in value and value['pxe_ip'] == pxe_ip:
-                return bmc_mac
+    def __init__(self, node_dict_file, status_dir=CLIENT_STATUS_DIR):
+        self.log = logger.getlogger()
+        self.node_dict_file = node_dict_file
+        self.status_dir = status_dir
+        self.watch = None
+        self.start_time = None
+        self.nodes = None
+        self.node_dict_stamp = None
+        self.seen = {}
+        self.pxe_index = {}
+        self.serial_index = {}
+
+    @staticmethod
+    def _get_stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_nodes(self):
+        self.nodes = yaml.full_load(open(self.node_dict_file))
+        self.node_dict_stamp = self._get_stamp(self.node_dict_file)
+        self.seen = {}
+        self.pxe_index = {}
+        self.serial_index = {}
+        for bmc_mac, value in self.nodes['selected'].items():
+            if 'pxe_ip' in value:
+                self.pxe_index.setdefault(value['pxe_ip'], bmc_mac)
+            if 'serial' in value:
+                self.serial_index.setdefault(value['serial'], bmc_mac)
+
+    def _set_pxe_ip(self, bmc_mac, pxe_ip):
+        node = self.nodes['selected'][bmc_mac]
+        old_pxe_ip = node.get('pxe_ip')
+        if old_pxe_ip != pxe_ip:
+            if self.pxe_index.get(old_pxe_ip) == bmc_mac:
+                del self.pxe_index[old_pxe_ip]
+            self.pxe_index.setdefault(pxe_ip, bmc_mac)
+        node['pxe_ip'] = pxe_ip
+
+    def _associate_pxe_to_bmc(self, pxe_ip, report_data=None):
+        if pxe_ip in self.pxe_index:
+            return self.pxe_index[pxe_ip]
 
         if report_data is not None:
             try:
@@ -284,73 +344,171 @@ def update_install_status(node_dict_file, start_time, write_results=True):
                     bmc_mac = (
                         report_data[f'ipmitool_lan_print_{channel}']
                                    ['MAC Address'].upper())
-                    if bmc_mac in nodes['selected']:
+                    if bmc_mac in self.nodes['selected']:
                         return bmc_mac
             except KeyError:
-                log.debug('No ipmitool_lan_print MAC Address in report data')
+                self.log.debug('No ipmitool_lan_print MAC Address in '
+                               'report data')
             try:
                 for fru in report_data['ipmitool_fru_print']:
-                    if 'Chassis Serial' in fru:
-                        for bmc_mac, value in nodes['selected'].items():
-                            if fru['Chassis Serial'] == value['serial']:
-                                return bmc_mac
+                    if ('Chassis Serial' in fru and
+                            fru['Chassis Serial'] in self.serial_index):
+                        return self.serial_index[fru['Chassis Serial']]
             except KeyError:
-                log.debug('No ipmitool_fru_print in report data')
+                self.log.debug('No ipmitool_fru_print in report data')
 
-        log.debug(f'Unable to associate PXE IP \'{pxe_ip}\' with client node')
+        self.log.debug(f'Unable to associate PXE IP \'{pxe_ip}\' with '
+                       'client node')
         return None
 
-    for filename in os.listdir(status_dir):
-        filepath = os.path.join(status_dir, filename)
-        if start_time is not None and start_time < os.path.getmtime(filepath):
-            pxe_ip = filename.split('_')[0]
-            status = filename.split('_')[1]
+    def _process_file(self, filename):
+        """Process one status report file
+
+        Returns:
+            bool: True if the node dictionary changed
+        """
+        filepath = os.path.join(self.status_dir, filename)
+        stamp = self._get_stamp(filepath)
+        if stamp is None or self.seen.get(filename) == stamp:
+            return False
+        self.seen[filename] = stamp
+        mtime = stamp[0] / 1e9
+        if self.start_time is None or self.start_time >= mtime:
+            return False
+        pxe_ip = filename.split('_')[0]
+        status = filename.split('_')[1]
+
+        try:
+            with open(filepath) as json_file:
+                report_data = json.load(json_file)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            report_data = None
+
+        bmc_mac = self._associate_pxe_to_bmc(pxe_ip, report_data)
+
+        if bmc_mac in self.nodes['selected']:
+            node = self.nodes['selected'][bmc_mac]
+            self._set_pxe_ip(bmc_mac, pxe_ip)
+        else:
+            if 'other' not in self.nodes:
+                self.nodes['other'] = {}
+            if pxe_ip not in self.nodes['other']:
+                self.nodes['other'][pxe_ip] = {}
+            node = self.nodes['other'][pxe_ip]
+            self.log.debug('Unable to associate client installation report '
+                           f'with a selected node: {filename}')
+        node[status + '_time'] = mtime
+        try:
+            if node['start_time'] >= node['finish_time']:
+                node['finish_time'] = None
+        except (KeyError, TypeError):
+            pass
+        if (bmc_mac not in self.nodes['selected'] and status == 'start' and
+                'finish_time' in node):
+            node['finish_time'] = None
+        if report_data is not None:
+            node['report_data'] = report_data
+        return True
+
+    def _get_changed_files(self):
+        """Get names of files changed since the last call
 
+        Returns:
+            iterable: File names, or None if the directory is missing
+        """
+        if self.watch is not None:
             try:
-                with open(filepath) as json_file:
-                    report_data = json.load(json_file)
-            except (json.decoder.JSONDecodeError, UnicodeDecodeError):
-                report_data = None
+                events = self.watch.read_events()
+            except OSError as exc:
+                self.log.debug(f'Status directory watch failed - {exc}')
+                events = [(inotify.IN_Q_OVERFLOW, None)]
+            if not any(mask & (inotify.IN_Q_OVERFLOW | inotify.WATCH_LOST)
+                       for mask, _ in events):
+                return {name for mask, name in events
+                        if name is not None and
+                        mask & inotify.FILE_CHANGED}
+            self.watch.close()
+            self.watch = None
+
+        if not os.path.isdir(self.status_dir):
+            return None
+        try:
+            # Watch before listing so that no change is missed
+            self.watch = inotify.DirWatch(self.status_dir)
+        except (OSError, AttributeError) as exc:
+            self.log.debug(f'inotify not available, polling - {exc}')
+        return os.listdir(self.status_dir)
 
-            bmc_mac = _associate_pxe_to_bmc(nodes, pxe_ip, report_data)
+    def update(self, start_time, write_results=True):
+        """Update client node installation status
 
-            if bmc_mac in nodes['selected']:
-                nodes['selected'][bmc_mac]['pxe_ip'] = pxe_ip
-                nodes['selected'][bmc_mac][status + '_time'] = (
-                    os.path.getmtime(filepath))
-                try:
-                    if (nodes['selected'][bmc_mac]['start_time'] >=
-                            nodes['selected'][bmc_mac]['finish_time']):
-                        nodes['selected'][bmc_mac]['finish_time'] = None
-                except (KeyError, TypeError):
-                    pass
-                if report_data is not None:
-                    nodes['selected'][bmc_mac]['report_data'] = report_data
-            else:
-                if 'other' not in nodes:
-                    nodes['other'] = {}
-                if pxe_ip not in nodes['other']:
-                    nodes['other'][pxe_ip] = {}
-                nodes['other'][pxe_ip][status + '_time'] = (
-                    os.path.getmtime(filepath))
-                try:
-                    if (nodes['other'][pxe_ip]['start_time'] >=
-                            nodes['other'][pxe_ip]['finish_time']):
-                        nodes['other'][pxe_ip]['finish_time'] = None
-                except (KeyError, TypeError):
-                    pass
-                if (status == 'start' and
-                        'finish_time' in nodes['other'][pxe_ip]):
-                    nodes['other'][pxe_ip]['finish_time'] = None
-                if report_data is not None:
-                    nodes['other'][pxe_ip]['report_data'] = report_data
-                log.debug('Unable to associate client installation report '
-                          f'with a selected node: {filename}')
-    if write_results:
-        with open(NODE_STATUS, 'w') as f:
-            yaml.dump(nodes, f, indent=4, default_flow_style=False)
+        Args:
+            start_time (int): UNIX Epoch time - only status reported
+                              _after_ this time will be inspected
+
+            write_results (bool, optional): Write updated node dictionary
+                                            to file if it changed
+
+        Returns:
+            dict: Selected node dictionary
+        """
+        if (self.nodes is None or
+                self._get_stamp(self.node_dict_file) !=
+                self.node_dict_stamp):
+            self._load_nodes()
+            self.start_time = start_time
+            self.close()
+        elif start_time != self.start_time:
+            self.start_time = start_time
+            self.seen = {}
+            self.close()
+
+        changed = False
+        for filename in self._get_changed_files() or ():
+            changed |= self._process_file(filename)
+
+        if changed and write_results:
+            with open(self.node_dict_file, 'w') as f:
+                yaml.dump(self.nodes, f, indent=4, default_flow_style=False)
+            self.node_dict_stamp = self._get_stamp(self.node_dict_file)
+
+        return self.nodes
+
+    def close(self):
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
+
+
+_install_status_trackers = {}
+
+
+def update_install_status(node_dict_file, start_time, write_results=True):
+    """ Update client node installation status
+
+    Only status report files added or changed since the previous call
+    with the same 'node_dict_file' are processed (see
+    InstallStatusTracker).
+
+    Args:
+        node_dict_file (str): Selected nodes dictionary file path
+
+        start_time (int): UNIX Epoch time - only status reported _after_
+                          this time will be inspected
 
-    return nodes
+        write_results (bool, optional): Write updated node dictionary to
+                                        file (using 'node_dict_file' path)
+
+    Returns:
+        dict: Selected node dictionary with updated 'start_time',
+              'finish_time', and 'report_data' values
+
+    """
+    if node_dict_file not in _install_status_trackers:
+        _install_status_trackers[node_dict_file] = (
+            InstallStatusTracker(node_dict_file))
+    return _install_status_trackers[node_dict_file].update(start_time,
+                                                           write_results)
 
 
 def get_install_status(node_dict_file, colorized=False):
@@ -451,6 +609,305 @@ def reset_bootdev(profile_object, node_dict_file, bmc_ip='all'):
     set_bootdev_clients('disk', persist=False, clients=clients)
 
 
+def get_bmcs_sn_pn(node_list, uid, pw, bmc_type, callback=None):
+    """ Scan the node list for BMCs. Return the sn and pn of nodes which
+    responded
+
+    Args:
+        node_list(tup or list): Node ipv4 addresses
+        bmc_type(str): BMC type, can be 'open' or '2200' for openBMC or
+                   '623' or 'ipmi' for ipmi based BMCs
+        callback(func, optional): Called with the ip address and the sn,
+                   pn, bmc_type tuple of each node as soon as it responded
+    returns:
+        Dictionary. Keys are ip address. Values are tuple containing
+            sn, pn, bmc_type
+    """
+    # create dict to hold Bmc class instances
+    bmc_inst = {}
+    # list for responding BMCs
+    sn_pn_list = {}
+    if bmc_type in ('2200', 'openbmc'):
+        for ip in node_list:
+            this_bmc = Bmc(ip, uid, pw, 'openbmc')
+            if this_bmc.is_connected():
+                bmc_inst[ip] = this_bmc
+        for ip in bmc_inst:
+            sn_pn = bmc_inst[ip].get_system_sn_pn() + ('openbmc',)
+            sn_pn_list[ip] = sn_pn
+            if callback is not None:
+                callback(ip, sn_pn)
+
+    elif bmc_type in ('623', 'ipmi'):
+        for ip in node_list:
+            this_bmc = Bmc(ip, uid, pw, 'ipmi')
+            if this_bmc.is_connected():
+                bmc_inst[ip] = this_bmc
+
+        # Create dict to hold inventory gathering sub process instances
+        sub_proc_instance = {}
+        # Start a sub process instance to gather inventory for each node.
+        for node in bmc_inst:
+            sub_proc_instance[node] = bmc_inst[node].\
+                get_system_inventory_in_background()
+        # poll for inventory gathering completion
+        st_time = time()
+        timeout = 15  # seconds
+
+        while time() < st_time + timeout and len(sn_pn_list) < len(bmc_inst):
+            for node in sub_proc_instance:
+                if sub_proc_instance[node].poll() is not None:
+                    if (sub_proc_instance[node].poll() == 0 and
+                            node not in sn_pn_list):
+                        inv, stderr = sub_proc_instance[node].communicate()
+                        inv = inv.decode('utf-8')
+                        sn_pn_list[node] = bmc_inst[node].\
+                            extract_system_sn_pn(inv) + ('ipmi',)
+                        if callback is not None:
+                            callback(node, sn_pn_list[node])
+            # Yield the CPU to the UI thread while waiting
+            sleep(0.1)
+
+    for node in bmc_inst:
+        bmc_inst[node].logout()
+
+    return sn_pn_list
+
+
+class SnPnCache(object):
+    """ Persistent BMC serial and part number cache
+
+    Entries map a BMC MAC and IP address pair to the serial number, part
+    number and BMC type read from the BMC. Entries also record a salted
+    hash of the BMC credentials they were read with and only hit for the
+    same credentials, so a cache hit still implies working credentials.
+    Entries expire after 'ttl' seconds and are dropped when the DHCP leases
+    show that the MAC or the IP address was paired differently.
+
+    Args:
+        path (str, optional): Cache file path
+        ttl (int, optional): Entry lifetime in seconds
+        leases_files (iterable, optional): dnsmasq leases file paths. The
+                                           first existing one is used.
+    """
+
+    def __init__(self, path=SN_PN_CACHE, ttl=SN_PN_CACHE_TTL,
+                 leases_files=DHCP_LEASES_FILES):
+        self.log = logger.getlogger()
+        self.path = path
+        self.ttl = ttl
+        self.leases_files = leases_files
+        self.leases_stamp = None
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            pass
+        except (OSError, yaml.YAMLError) as exc:
+            self.log.warning(f'Ignoring SN/PN cache {self.path} - {exc}')
+
+    @staticmethod
+    def _credentials_hash(salt, uid, pw):
+        return hashlib.sha256(
+            f'{salt}\0{uid}\0{pw}'.encode('utf-8')).hexdigest()
+
+    def get(self, bmc_mac, bmc_ip, uid, pw):
+        """ Get cached serial number, part number and BMC type
+
+        Args:
+            bmc_mac (str): BMC MAC address
+            bmc_ip (str): BMC IP address
+            uid (str): BMC userid
+            pw (str): BMC password
+
+        Returns:
+            tuple: sn, pn, bmc_type or None if not cached
+        """
+        with self.lock:
+            entry = self.entries.get(bmc_mac.upper())
+            if (entry is None or entry['bmc_ip'] != bmc_ip or
+                    time() - entry['time'] > self.ttl or
+                    'cred_salt' not in entry or
+                    entry.get('cred') != self._credentials_hash(
+                        entry['cred_salt'], uid, pw)):
+                return None
+            return entry['sn'], entry['pn'], entry['bmc_type']
+
+    def set(self, bmc_mac, bmc_ip, sn_pn, uid, pw):
+        """ Cache serial number, part number and BMC type
+
+        Args:
+            bmc_mac (str): BMC MAC address
+            bmc_ip (str): BMC IP address
+            sn_pn (tuple): sn, pn, bmc_type
+            uid (str): BMC userid sn_pn was read with
+            pw (str): BMC password sn_pn was read with
+        """
+        salt = os.urandom(16).hex()
+        with self.lock:
+            self.entries[bmc_mac.upper()] = {
+                'bmc_ip': bmc_ip, 'sn': sn_pn[0], 'pn': sn_pn[1],
+                'bmc_type': sn_pn[2], 'time': time(), 'cred_salt': salt,
+                'cred': self._credentials_hash(salt, uid, pw)}
+            self.dirty = True
+
+    def check_leases(self):
+        """ Drop entries whose MAC to IP pairing changed in the DHCP leases
+
+        The leases file is only read if it changed since the last call.
+        """
+        for leases_file in self.leases_files:
+            if os.path.isfile(leases_file):
+                break
+        else:
+            return
+        stat = os.stat(leases_file)
+        stamp = (leases_file, stat.st_mtime_ns, stat.st_size)
+        if stamp == self.leases_stamp:
+            return
+        self.leases_stamp = stamp
+
+        mac_ip = {}
+        with open(leases_file) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    mac_ip[fields[1].upper()] = fields[2]
+        ip_mac = {ip: mac for mac, ip in mac_ip.items()}
+
+        with self.lock:
+            for bmc_mac, entry in list(self.entries.items()):
+                if (mac_ip.get(bmc_mac, entry['bmc_ip']) != entry['bmc_ip'] or
+                        ip_mac.get(entry['bmc_ip'], bmc_mac) != bmc_mac):
+                    self.log.debug(f'SN/PN cache: {bmc_mac} re-leased')
+                    del self.entries[bmc_mac]
+                    self.dirty = True
+
+    def save(self):
+        """ Write the cache file if it changed """
+        with self.lock:
+            if not self.dirty:
+                return
+            now = time()
+            self.entries = {mac: entry for mac, entry in self.entries.items()
+                            if now - entry['time'] <= self.ttl}
+            tmp_path = self.path + '.tmp'
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT |
+                              os.O_TRUNC, 0o600), 'w') as f:
+                yaml.safe_dump(self.entries, f, indent=4,
+                               default_flow_style=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+class NodeScanner(threading.Thread):
+    """ Background BMC discovery
+
+    Repeatedly scans the BMC subnet and puts newly discovered BMCs with
+    their serial and part numbers in a queue for the UI to drain. BMCs
+    already identified are remembered by MAC address and not queried
+    again. Serial and part numbers are also looked up in 'cache' so that
+    BMCs identified by an earlier run with the same credentials are not
+    queried either.
+
+    Queue items are tuples:
+        ('devices', count): Devices responding on the subnet
+        ('bmcs', count): Devices with a BMC port open
+        ('node', bmc_mac, bmc_ip, sn, pn, bmc_type): Identified BMC
+        ('pass', None): Scan pass completed
+
+    Args:
+        cidr (str): BMC subnet in cidr format
+        uid (str): BMC userid
+        pw (str): BMC password
+        known (dict, optional): Identified BMCs, (bmc_ip, sn, pn, bmc_type)
+                                by BMC MAC address. Updated by the scanner.
+        cache (SnPnCache, optional): Persistent serial and part number
+                                     cache
+        interval (int, optional): Seconds between scan passes
+    """
+
+    def __init__(self, cidr, uid, pw, known=None, cache=None, interval=10):
+        super(NodeScanner, self).__init__()
+        self.daemon = True
+        self.log = logger.getlogger()
+        self.cidr = cidr
+        self.uid = uid
+        self.pw = pw
+        self.known = known if known is not None else {}
+        self.cache = cache
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.bmcs = set(self.known)
+        for bmc_mac, (bmc_ip, sn, pn, bmc_type) in self.known.items():
+            self.queue.put(('node', bmc_mac, bmc_ip, sn, pn, bmc_type))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.scan()
+                if self.cache is not None:
+                    self.cache.save()
+            except Exception as exc:
+                self.log.error(f'Node scan failed - {exc}')
+            self.queue.put(('pass', None))
+            self.stop_event.wait(self.interval)
+
+    def _add_node(self, bmc_mac, bmc_ip, sn_pn, cached=False):
+        if self.cache is not None and not cached:
+            self.cache.set(bmc_mac, bmc_ip, sn_pn, self.uid, self.pw)
+        # Replace any spaces in serial and part number with dashes so that
+        # the individual data fields can be later retrieved with a split()
+        sn = sn_pn[0].replace(' ', '-')
+        pn = sn_pn[1].replace(' ', '-')
+        self.known[bmc_mac] = (bmc_ip, sn, pn, sn_pn[2])
+        self.queue.put(('node', bmc_mac, bmc_ip, sn, pn, sn_pn[2]))
+
+    def scan(self):
+        """ Run one scan pass """
+        if self.cache is not None:
+            self.cache.check_leases()
+        # basic icmp 'ping' scan. returns (ip, mac)
+        devices = u.scan_subnet(self.cidr)
+        self.queue.put(('devices', len(devices)))
+        ips = [ip for ip, mac in devices
+               if self.known.get(mac.upper(), (None,))[0] != ip]
+
+        # Access BMCs for serial number and part number
+        for port in ('2200', '623'):
+            if not ips or self.stop_event.is_set():
+                break
+            # get list of tuples of (ip, mac)
+            found = u.scan_subnet_for_port_open(ips, port)
+            if not found:
+                continue
+            macs = {ip: mac.upper() for ip, mac in found}
+            self.bmcs.update(macs.values())
+            self.queue.put(('bmcs', len(self.bmcs)))
+            query_ips = []
+            for ip, mac in macs.items():
+                sn_pn = None
+                if self.cache is not None:
+                    sn_pn = self.cache.get(mac, ip, self.uid, self.pw)
+                if sn_pn is not None:
+                    self._add_node(mac, ip, sn_pn, cached=True)
+                else:
+                    query_ips.append(ip)
+            if query_ips:
+                get_bmcs_sn_pn(
+                    query_ips, self.uid, self.pw, port,
+                    callback=lambda ip, sn_pn: self._add_node(macs[ip], ip,
+                                                              sn_pn))
+            ips = [ip for ip in ips if ip not in macs]
+
+
 class Profile():
     def __init__(self, prof_path='profile-template.yml'):
         profile_template_path = os.path.join(GEN_SAMPLE_CONFIGS_PATH,
@@ -939,6 +1396,8 @@ class MyButtonPress(npyscreen.MiniButtonPress):
 class Pup_form(npyscreen.ActionFormV2):
     install_start_time = None
     pxeboot_enabled = False
+    install_scheduler = None
+    pxeboot_thread = None
 
     def beforeEditing(self):
         pass
@@ -958,6 +1417,9 @@ class Pup_form(npyscreen.ActionFormV2):
         self.fields = {}  # dictionary for holding field instances
         self.next_form = self.parentApp.NEXT_ACTIVE_FORM
         self.talking_nodes = {}  # Nodes we can talk to using ipmi or openBMC
+        self.scanner = None
+        self.scan_cache = {}  # Identified BMCs by MAC, see NodeScanner
+        self.sn_pn_cache = SnPnCache()
         node_status_path = os.path.join(GEN_PATH, 'osinstall_node_status.yml')
         if os.path.isfile(node_status_path):
             os.remove(node_status_path)
@@ -1309,78 +1771,76 @@ class Pup_form(npyscreen.ActionFormV2):
             scan_pw = self.fields['bmc_password'].value
             if scan_uid != self.scan_uid or scan_pw != self.scan_pw:
                 self.talking_nodes = {}
+                self.scan_cache = {}
                 self.fields['node_list'].values = [None]
                 self.fields['node_list'].value = []
                 self.fields['devices_found'].value = None
                 self.fields['bmcs_found'].value = None
                 self.scan_uid = scan_uid
                 self.scan_pw = scan_pw
-
-            self.keypress_timeout = 100  # set scan loop back to 10 sec
-            p = self.parentApp.prof.get_network_profile_tuple()
-
-            msg = ['Attempting to communicate with BMCs']
-            npyscreen.notify(msg)
-            # basic icmp 'ping' scan. returns (ip, mac)
-            nodes = u.scan_subnet(p.bmc_subnet_cidr)
-            device_dict = {node[0]: node[1] for node in nodes}
-
-            self.fields['devices_found'].value = str(len(nodes))
-
-            ips = [node[0] for node in nodes]
-
-            nodes = []
-            node_dict = {}
-            # Access BMCs for serial number and part number
-            for port in ('2200', '623'):
-                # get list of tuples of (ip, mac)
-                _nodes = u.scan_subnet_for_port_open(ips, port)
-                if _nodes:
-                    nodes += _nodes
-                    _ips = [item[0] for item in _nodes]
-                    node_dict.update(self._get_bmcs_sn_pn(_ips, scan_uid, scan_pw, port))
-                if len(_nodes) == len(ips):
-                    break
-
-            if nodes:
-                self.fields['bmcs_found'].value = str(len(nodes))
-            # Replace any spaces in serial and part number with dashes
-            # so that the individual data fields can be later retrieved with a split()
-            for _node in node_dict:
-                node = list(node_dict[_node])
-                node[0] = node[0].replace(' ', '-')
-                node[1] = node[1].replace(' ', '-')
-                node_dict[_node] = node
-
-            self.display()
-            if node_dict:
-                for node in node_dict:
-                    if node not in self.talking_nodes:
-                        self.talking_nodes[node] = (f'{node_dict[node][0]:>16}' +
-                                                    f'{node_dict[node][1]:^18}' +
-                                                    f'{device_dict[node]:^19} {node:^17}' +
-                                                    f'{node_dict[node][2]:^9}')
-            field_list = [self.talking_nodes[node] for node in self.talking_nodes]
-            field_list = [None] if field_list == [] else field_list
-            bmcs_found_cnt = self.fields['bmcs_found'].value
-
-            try:
-                bmcs_found_cnt = int(self.fields['bmcs_found'].value)
-            except (TypeError, ValueError):
-                bmcs_found_cnt = 0
-            if len(self.talking_nodes) == bmcs_found_cnt:
-                self.scan = False
-                self.fields['scan_for_nodes'].name = 'Scan for nodes'
-            else:
-                self.fields['scan_for_nodes'].name = 'Stop node scan'
-            self.display()
-            self.fields['node_list'].values = field_list
-            self.display()
+                self.stop_scanner()
+
+            if self.scanner is None:
+                p = self.parentApp.prof.get_network_profile_tuple()
+                msg = ['Attempting to communicate with BMCs']
+                npyscreen.notify(msg)
+                self.scanner = NodeScanner(p.bmc_subnet_cidr, scan_uid,
+                                           scan_pw, known=self.scan_cache,
+                                           cache=self.sn_pn_cache)
+                self.scanner.start()
+
+            self.keypress_timeout = 10  # drain scan results every 1 sec
+            self.update_scan_values()
+        elif self.scanner is not None:
+            self.stop_scanner()
         elif self.check_install_status:
             self.keypress_timeout = 10  # set scan loop to 1 sec
             self.update_status_values()
             self.display()
 
+    def stop_scanner(self):
+        if self.scanner is not None:
+            self.scanner.stop()
+            self.scanner = None
+
+    def update_scan_values(self):
+        """ Drain the node scanner queue into the form fields """
+        pass_done = False
+        nodes_changed = False
+        while True:
+            try:
+                item = self.scanner.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == 'devices':
+                self.fields['devices_found'].value = str(item[1])
+            elif item[0] == 'bmcs':
+                self.fields['bmcs_found'].value = str(item[1])
+            elif item[0] == 'node':
+                bmc_mac, bmc_ip, sn, pn, bmc_type = item[1:]
+                self.talking_nodes[bmc_mac] = (f'{sn:>16}' + f'{pn:^18}' +
+                                               f'{bmc_mac:^19} {bmc_ip:^17}' +
+                                               f'{bmc_type:^9}')
+                nodes_changed = True
+            elif item[0] == 'pass':
+                pass_done = True
+
+        if nodes_changed:
+            self.fields['node_list'].values = list(
+                self.talking_nodes.values())
+
+        try:
+            bmcs_found_cnt = int(self.fields['bmcs_found'].value)
+        except (TypeError, ValueError):
+            bmcs_found_cnt = 0
+        if pass_done and len(self.talking_nodes) >= bmcs_found_cnt:
+            self.scan = False
+            self.stop_scanner()
+            self.fields['scan_for_nodes'].name = 'Scan for nodes'
+        else:
+            self.fields['scan_for_nodes'].name = 'Stop node scan'
+        self.display()
+
     def while_editing(self, instance):
         # instance is the instance of the widget you're moving into
         field = ''
@@ -1539,65 +1999,34 @@ class Pup_form(npyscreen.ActionFormV2):
 
         msg += "done\nPXE boot nodes... "
         npyscreen.notify(msg, title=notify_title)
-        initiate_pxeboot(self.parentApp.prof, NODE_STATUS)
+        Pup_form.install_scheduler = initiate_pxeboot(self.parentApp.prof,
+                                                      NODE_STATUS)
 
         msg += "done\n"
 
-    def _get_bmcs_sn_pn(self, node_list, uid, pw, bmc_type):
-        """ Scan the node list for BMCs. Return the sn and pn of nodes which
-        responded
-
-        Args:
-            node_list(tup or list): Node ipv4 addresses
-            bmc_type(str): BMC type, can be 'open' or '2200' for openBMC or
-                       '623' or 'ipmi' for ipmi based BMCs
-        returns:
-            Dictionary. Keys are ip address. Values are tuple containing
-                sn, pn, bmc_type
-        """
-        # create dict to hold Bmc class instances
-        bmc_inst = {}
-        # list for responding BMCs
-        sn_pn_list = {}
-        if bmc_type in ('2200', 'openbmc'):
-            for ip in node_list:
-                this_bmc = Bmc(ip, uid, pw, 'openbmc')
-                if this_bmc.is_connected():
-                    bmc_inst[ip] = this_bmc
-            for ip in bmc_inst:
-                sn_pn = bmc_inst[ip].get_system_sn_pn() + ('openbmc',)
-                sn_pn_list[ip] = sn_pn
-
-        elif bmc_type in ('623', 'ipmi'):
-            for ip in node_list:
-                this_bmc = Bmc(ip, uid, pw, 'ipmi')
-                if this_bmc.is_connected():
-                    bmc_inst[ip] = this_bmc
-
-            # Create dict to hold inventory gathering sub process instances
-            sub_proc_instance = {}
-            # Start a sub process instance to gather inventory for each node.
-            for node in bmc_inst:
-                sub_proc_instance[node] = bmc_inst[node].\
-                    get_system_inventory_in_background()
-            # poll for inventory gathering completion
-            st_time = time()
-            timeout = 15  # seconds
-
-            while time() < st_time + timeout and len(sn_pn_list) < len(bmc_inst):
-                for node in sub_proc_instance:
-                    if sub_proc_instance[node].poll() is not None:
-                        if (sub_proc_instance[node].poll() == 0 and
-                                node not in sn_pn_list):
-                            inv, stderr = sub_proc_instance[node].communicate()
-                            inv = inv.decode('utf-8')
-                            sn_pn_list[node] = bmc_inst[node].\
-                                extract_system_sn_pn(inv) + ('ipmi',)
-
-        for node in bmc_inst:
-            bmc_inst[node].logout()
-
-        return sn_pn_list
+    def release_pxeboot_wave(self, node_status):
+        """ PXE boot the next wave of clients in the background """
+        scheduler = Pup_form.install_scheduler
+        if scheduler is None or not Pup_form.pxeboot_enabled:
+            return
+        started = []
+        finished = []
+        for node in node_status['selected'].values():
+            if node.get('start_time') is not None:
+                started.append(node['bmc_ip'])
+                if node.get('finish_time') is not None:
+                    finished.append(node['bmc_ip'])
+        scheduler.update(started, finished)
+        if (Pup_form.pxeboot_thread is not None and
+                Pup_form.pxeboot_thread.is_alive()):
+            return
+        wave = scheduler.next_wave()
+        if wave:
+            Pup_form.pxeboot_thread = threading.Thread(
+                target=pxeboot_clients,
+                args=(self.parentApp.prof, NODE_STATUS, wave))
+            Pup_form.pxeboot_thread.daemon = True
+            Pup_form.pxeboot_thread.start()
 
     def update_status_values(self):
         self.fields['installation_image'].value = (
@@ -1638,6 +2067,7 @@ class Pup_form(npyscreen.ActionFormV2):
                             other_nodes_finished += 1
                     except (KeyError, TypeError):
                         pass
+            self.release_pxeboot_wave(node_status)
             self.fields['nodes_finished'].value = (f'{total_nodes_finished} / '
                                                    f'{total_nodes}')
             if total_nodes_finished >= total_nodes:
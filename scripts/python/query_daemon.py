@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+import lib.logger as logger
+from lib.query_daemon import QueryServer, QueryClient, SOCKET_PATH
+
+
+def main(args):
+    log = logger.getlogger()
+
+    if args.action == 'start':
+        QueryServer(args.socket).serve_forever()
+        return
+
+    client = QueryClient.connect(args.socket)
+    if client is None:
+        log.info('Query daemon not running')
+        if args.action == 'status':
+            sys.exit(1)
+        return
+
+    if args.action == 'status':
+        log.info('Query daemon running (pid {}) on {}'.format(
+            client.request(op='ping'), args.socket))
+    elif args.action == 'stop':
+        client.request(op='shutdown')
+        log.info('Query daemon stopped')
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve config and inventory queries from memory')
+    parser.add_argument('action', choices=['start', 'stop', 'status'],
+                        help='start runs the daemon in the foreground')
+    parser.add_argument('--socket', default=SOCKET_PATH,
+                        help='Unix domain socket path')
+
+    parser.add_argument('--print', '-p', dest='log_lvl_print',
+                        help='print log level', default='info')
+
+    parser.add_argument('--file', '-f', dest='log_lvl_file',
+                        help='file log level', default='info')
+
+    args = parser.parse_args()
+
+    logger.create(args.log_lvl_print, args.log_lvl_file)
+    main(args)
@@ -19,7 +19,7 @@ import argparse
 import sys
 import os.path
 
-from lib.inventory import Inventory
+from lib.query_daemon import get_inventory
 import lib.logger as logger
 import lib.genesis as gen
 import lib.utilities as util
@@ -27,7 +27,7 @@ import lib.utilities as util
 
 def remove_client_host_keys(config_path=None):
     log = logger.getlogger()
-    inv = Inventory(config_path)
+    inv = get_inventory(config_path)
 
     for ipaddr in inv.yield_nodes_pxe_ipaddr():
         log.info("Remove any stale ssh host keys for {}".format(ipaddr))
@@ -19,20 +19,80 @@ from __future__ import nested_scopes, generators, division, absolute_import, \
     with_statement, print_function, unicode_literals
 
 import argparse
-import json
 import glob
 import os
 import re
 from shutil import copy, copytree, rmtree, Error
-from sys import executable
 
 import lib.logger as logger
 from lib.utilities import sub_proc_display, sub_proc_exec, get_url, \
     get_dir, get_yesno, get_selection, get_file_path, get_src_path, bold, \
-    parse_conda_filenames, parse_rpm_filenames, parse_pypi_filenames, get_rpm_info
+    parse_conda_filenames, parse_rpm_filenames
 from lib.exception import UserException
-
-PYTHON = executable
+from lib.blobstore import get_store, ALGORITHM as STORE_ALGORITHM
+from lib.checksum import checksum, files_match
+from lib.download import Downloader, Progress, print_progress, WORKERS
+from lib.pypi import PypiResolver, PYPI_INDEX_URL
+from lib.repomd import create_metadata
+from lib.yum_metadata import YumMetadataSession
+from lib.yum_mirror import YumMirror
+from lib.repodata import filter_repodata, iter_packages, RepodataError
+from lib.pkg_index import PackageIndex, compare_versions, compare_evr, \
+    RPM, CONDA, PYPI
+
+
+def copy_if_changed(src_path, dst_dir, store=None):
+    """Copy a file to a directory unless an identical file is already there.
+    Checksums are cached, so repeated runs do not re-read unchanged files.
+    Inputs:
+        src_path (str): Source file path
+        dst_dir (str): Destination directory
+        store (BlobStore): Content store. If it has the file, the file is
+            linked from it instead of copied. Copies are added to it.
+    Returns:
+        dst_path (str): Destination file path
+    """
+    dst_path = os.path.join(dst_dir, os.path.basename(src_path))
+    if files_match(src_path, dst_path):
+        logger.getlogger().debug(f'{dst_path} is up to date')
+        return dst_path
+    digest = None
+    if store is not None:
+        digest = checksum(src_path, STORE_ALGORITHM, cache=store.cache)
+        if store.materialize(digest, dst_path):
+            return dst_path
+    # Copy beside and rename. The old file may be linked from other repos.
+    tmp_path = f'{dst_path}.{os.getpid()}.tmp'
+    copy(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+    if store is not None:
+        store.add(dst_path, digest)
+    return dst_path
+
+
+def download_file(url, dest_dir, newer=False, downloader=None):
+    """Download a file into a directory. Interrupted downloads are resumed.
+    Inputs:
+        url (str): File url
+        dest_dir (str): Destination directory
+        newer (bool): Only download if the remote file is newer or differs
+            in size, like 'wget -N'.
+        downloader (Downloader): Downloader to use. A new one is used if None.
+    Returns:
+        rc (int): 0 if the file was downloaded or is current, else 1.
+    """
+    dest_path = os.path.join(dest_dir, os.path.basename(url))
+    _downloader = downloader or Downloader(progress=Progress(print_progress))
+    try:
+        if not _downloader.download(url, dest_path, newer=newer):
+            print(f'{os.path.basename(url)} is current -- not retrieving')
+    except UserException as exc:
+        logger.getlogger().debug(str(exc))
+        return 1
+    finally:
+        if downloader is None:
+            _downloader.close()
+    return 0
 
 
 def setup_source_file(name, src_glob, dest_dir, base_dir, url='', alt_url='http://',
@@ -92,8 +152,7 @@ def setup_source_file(name, src_glob, dest_dir, base_dir, url='', alt_url='http:
                     abs_dest_dir = f'{base_dir}{dest_dir}'
                     if not os.path.exists(abs_dest_dir):
                         os.makedirs(abs_dest_dir)
-                    cmd = f'wget -P {abs_dest_dir} {_url}'
-                    rc = sub_proc_display(cmd)
+                    rc = download_file(_url, abs_dest_dir)
                     if rc != 0:
                         log.error(f'Failed downloading {name} source to'
                                   f' {abs_dest_dir}/ directory. \n{rc}')
@@ -104,8 +163,7 @@ def setup_source_file(name, src_glob, dest_dir, base_dir, url='', alt_url='http:
                         copied = True
                     if src2:
                         _url2 = os.path.join(os.path.dirname(_url), src2)
-                        cmd = f'wget -P {abs_dest_dir} {_url2}'
-                        rc = sub_proc_display(cmd)
+                        rc = download_file(_url2, abs_dest_dir)
                         if rc != 0:
                             log.error(f'Failed downloading {name} source file {src2} to'
                                       f' {abs_dest_dir}/ directory. \n{rc}')
@@ -120,7 +178,7 @@ def setup_source_file(name, src_glob, dest_dir, base_dir, url='', alt_url='http:
                 if not os.path.exists(abs_dest_dir):
                     os.makedirs(abs_dest_dir)
                 try:
-                    copy(src_path, abs_dest_dir)
+                    copy_if_changed(src_path, abs_dest_dir)
                 except Error as err:
                     log.debug(f'Failed copying {name} source file to {abs_dest_dir}/ '
                               f'directory. \n{err}')
@@ -133,7 +191,7 @@ def setup_source_file(name, src_glob, dest_dir, base_dir, url='', alt_url='http:
                 if src2:
                     try:
                         src2_path = os.path.join(os.path.dirname(src_path), src2)
-                        copy(src2_path, abs_dest_dir)
+                        copy_if_changed(src2_path, abs_dest_dir)
                     except Error as err:
                         log.debug(f'Failed copying {name} source file to {abs_dest_dir}/ '
                                   f'directory. \n{err}')
@@ -168,7 +226,7 @@ def powerup_file_from_disk(name, file_glob, base_dir):
         if not os.path.exists(f'{base_dir}{name_src}'):
             os.mkdir(f'{base_dir}{name_src}')
         try:
-            copy(src_path, f'{base_dir}{name_src}/')
+            copy_if_changed(src_path, f'{base_dir}{name_src}/')
         except Error as err:
             log.debug(f'Failed copying {name} source file to {base_dir}{name_src}/ '
                       f'directory. \n{err}')
@@ -200,6 +258,7 @@ class PowerupRepo(object):
         self.repo_type = 'yum'
         self.rhel_ver = str(rhel_ver)
         self.repo_base_dir = repo_base_dir  # '/srv'
+        self.store = get_store(repo_base_dir)
         if self.repo_id in ('dependencies', 'rhel-common', 'rhel-optional',
                             'rhel-supplemental', 'rhel-extras',
                             'pup_install_yum'):
@@ -226,36 +285,14 @@ class PowerupRepo(object):
         return self.repo_base_dir
 
     def get_ver_state(self, ver_in_repo, ver_in_pkg_lst):
-        """Compares two version of the form n.m.o.p.... Versions are first
-        padded to the same length, then compared on a field bases.
+        """Compares two versions of the form n.m.o.p.... Numeric fields are
+        compared as numbers, so multi-digit fields order correctly.
            Returns -1, 0, 1 if ver_in_repo is older, same , newer than
            ver_in_pkg_lst.
         """
         if ver_in_pkg_lst == '':
             return 0
-
-        ver_in_repo_s = ver_in_repo.split('.')
-        ver_in_pkg_lst_s = ver_in_pkg_lst.split('.')
-
-        if len(ver_in_repo_s) > len(ver_in_pkg_lst_s):
-            # pad to equal length (equal number of fields)
-            ver_in_pkg_lst_s = ((['0'] * (len(ver_in_repo_s) -
-                                len(ver_in_pkg_lst_s))) + ver_in_pkg_lst_s)
-        elif len(ver_in_pkg_lst_s) > len(ver_in_repo_s):
-            ver_in_repo_s = ((['0'] * (len(ver_in_pkg_lst_s) -
-                             len(ver_in_repo_s))) + ver_in_repo_s)
-        state = 0
-        # pad each field to at least 5 characters
-        for r in range(len(ver_in_repo_s)):
-            if (('     ' + ver_in_repo_s[r])[-5:] >
-                    ('     ' + ver_in_pkg_lst_s[r])[-5:]):
-                state = 1
-                break
-            elif (('     ' + ver_in_pkg_lst_s[r])[-5:] >
-                  ('     ' + ver_in_repo_s[r])[-5:]):
-                state = -1
-                break
-        return state
+        return compare_versions(ver_in_repo, ver_in_pkg_lst)
 
     def get_pkg_state(self, pkg_in_repo, pkg):
         """Determines whether a package in a yum repo is
@@ -272,27 +309,19 @@ class PowerupRepo(object):
         state = self.get_ver_state(pkg_in_repo['ver'], pkg['ver'])
         if state == 0:
             if pkg['ep'] == pkg_in_repo['ep'] or pkg['ep'] == '':
-                if pkg['rel'] == pkg_in_repo['rel'] or pkg['rel'] == '':
+                if pkg['rel'] == '':
                     state = 0
-                elif pkg['rel'] > pkg_in_repo['rel']:
-                    state = -1
                 else:
-                    state = 1
-            elif pkg['ep'] > pkg_in_repo['ep']:
-                state = -1
+                    state = compare_versions(pkg_in_repo['rel'], pkg['rel'])
             else:
-                state = 1
+                state = compare_evr((pkg_in_repo['ep'], '', ''),
+                                    (pkg['ep'], '', ''))
         return state
 
     def verify_pkgs(self, pkglist):
         pkgs_vers = parse_rpm_filenames(pkglist, form='dict')
         pkg_lst_cnt = len(pkgs_vers)
-        try:
-            filelist = os.listdir(self.yumrepo_dir)
-        except FileNotFoundError:
-            filelist = []
-        filelist = [fi for fi in filelist if fi[-4:] == '.rpm']
-        files_vers = get_rpm_info(filelist, self.yumrepo_dir)
+        files_vers = PackageIndex(self.yumrepo_dir, RPM).update().newest()
         pkg_cnt = 0
         nwr_cnt = 0
         old_cnt = 0
@@ -374,7 +403,7 @@ class PowerupRepo(object):
         dst_dir = f'{self.repo_base_dir}/{dst}'
         if not os.path.exists(dst_dir):
             os.mkdir(dst_dir)
-        copy(src_path, dst_dir)
+        copy_if_changed(src_path, dst_dir, self.store)
 
     def copytree_to_srv(self, src_dir, dst):
         """Copy a directory recursively to the POWER-Up server base directory.
@@ -385,6 +414,7 @@ class PowerupRepo(object):
         if os.path.exists(dst_dir):
             os.removedirs(dst_dir)
         copytree(src_dir, dst_dir)
+        self.store.add_tree(dst_dir)
 
     def get_yum_dotrepo_content(self, url=None, repo_dir=None, gpgkey=None, gpgcheck=1,
                                 metalink=False, local=False, client=False):
@@ -467,20 +497,27 @@ class PowerupRepo(object):
         with open(repo_link_path, 'w') as f:
             f.write(content)
 
-    def create_meta(self, update=False):
+    def create_meta(self, update=False, force=False):
+        """Creates or updates the repository metadata. Only packages added or
+        changed since the last run are read. The metadata is left as it is
+        if no package was added, changed or removed and it is complete.
+        Inputs:
+            update (bool): Only changes the wording of the log messages.
+            force (bool): If True, the metadata is rewritten even if no
+                package changed.
+        """
         action = ('update', 'Updating') if update else ('create', 'Creating')
-        self.log.info(f'{action[1]} repository metadata and databases')
-        print('This may take a few minutes.')
-        if not update:
-            cmd = f'createrepo -v {self.yumrepo_dir}'
-        else:
-            cmd = f'createrepo -v --update {self.yumrepo_dir}'
-        resp, err, rc = sub_proc_exec(cmd)
-        if rc != 0:
-            self.log.error(f'Repo creation error: rc: {rc} stderr: {err}')
+        self.log.info(f'{action[1]} repository metadata')
+        try:
+            self.store.add_tree(self.yumrepo_dir, suffixes=('.rpm',))
+            total, added, removed = create_metadata(self.yumrepo_dir,
+                                                    force=force)
+        except OSError as exc:
+            self.log.error(f'Repo creation error: {exc}')
         else:
             self.log.info(f'Repo {action[0]} metadata for {self.repo_id} finished'
-                          ' successfully')
+                          f' successfully. {total} packages, {added} added or '
+                          f'changed, {removed} removed')
 
 
 class PowerupRepoFromRpm(PowerupRepo):
@@ -524,7 +561,7 @@ class PowerupRepoFromRpm(PowerupRepo):
         dst_dir = f'{self.yumrepo_dir}{self.repo_id}'
         if not os.path.exists(dst_dir):
             os.mkdir(dst_dir)
-        copy(self.rpm_path, dst_dir)
+        copy_if_changed(self.rpm_path, dst_dir, self.store)
         dest_path = os.path.join(dst_dir, os.path.basename(src_path))
         dest_path = os.path.join(dst_dir, os.path.basename(src_path))
         print(dest_path)
@@ -568,17 +605,40 @@ class PowerupYumRepoFromRepo(PowerupRepo):
         super(PowerupYumRepoFromRepo, self).__init__(repo_id, repo_name, repo_base_dir,
                                                      arch, proc_family, rhel_ver)
 
-    def sync(self):
+    def sync(self, delete=False):
+        """Mirror the repository configured in /etc/yum.repos.d. Only packages
+        added or changed since the last sync are downloaded. Repositories
+        without a plain baseurl (e.g. mirrorlist) are synced with reposync.
+        Inputs:
+            delete (bool): Remove local packages no longer in the repository
+        """
         self.log.info(f'Syncing {self.repo_name}')
-        self.log.info('This can take many minutes or hours for large repositories\n')
-        cmd = (f'reposync -a {self.arch} -r {self.repo_id} -p '
-               f'{os.path.dirname(self.yumrepo_dir)} -l -m')
-        rc = sub_proc_display(cmd)
-        if rc != 0:
-            self.log.error(bold(f'\nFailed {self.repo_name} repo sync. {rc}'))
-            raise UserException
-        else:
+        baseurl = YumMetadataSession(self.arch).get_repos().get(self.repo_id)
+        if baseurl is None:
+            self.log.info('This can take many minutes or hours for large '
+                          'repositories\n')
+            cmd = (f'reposync -a {self.arch} -r {self.repo_id} -p '
+                   f'{os.path.dirname(self.yumrepo_dir)} -l -m')
+            if delete:
+                cmd += ' --delete'
+            rc = sub_proc_display(cmd)
+            if rc != 0:
+                self.log.error(bold(f'\nFailed {self.repo_name} repo sync. {rc}'))
+                raise UserException
             self.log.info(f'{self.repo_name} sync finished successfully')
+            return
+
+        with Downloader(progress=Progress(print_progress),
+                        store=self.store) as downloader:
+            mirror = YumMirror(baseurl, self.yumrepo_dir, downloader)
+            try:
+                total, downloaded, removed = mirror.sync(delete=delete)
+            except UserException as exc:
+                self.log.error(bold(f'\nFailed {self.repo_name} repo sync. {exc}'))
+                raise UserException
+        self.log.info(f'{self.repo_name} sync finished successfully. '
+                      f'{downloaded} of {total} packages downloaded, '
+                      f'{removed} removed')
 
 
 class PowerupAnaRepoFromRepo(PowerupRepo):
@@ -626,15 +686,13 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
                     pkg_in_repo_py_ver = re.search(r'py\d+', bld)
                     if pkg_py_ver and pkg_in_repo_py_ver:
                         if pkg_py_ver.group(0) == pkg_in_repo_py_ver.group(0):
-                            if pkg[1] > bld:
+                            if compare_versions(pkg[1], bld) > 0:
                                 state = -1
                             else:
                                 state = 1
                             break
-            elif pkg[0] > ver:
-                state = -1
-            elif pkg[0] < ver:
-                state = 1
+            else:
+                state = compare_versions(ver, pkg[0])
 
         return state
 
@@ -656,9 +714,10 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
         if not os.path.isdir(repo_dir):
             return 0, 0, 0, 0
 
-        filelist = os.listdir(repo_dir)
-        filelist = [fi for fi in filelist if fi[-8:] == '.tar.bz2']
-        files_vers = parse_conda_filenames(filelist)
+        index = PackageIndex(repo_dir, CONDA).update()
+        files_vers = {name: {'ver_bld': [(ver, bld) for _, ver, bld in
+                                         index.get(name)]}
+                      for name in pkgs_vers if index.get(name)}
         pkg_cnt = 0
         new_cnt = 0
         old_cnt = 0
@@ -689,64 +748,58 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
         return (pkg_lst_cnt, pkg_cnt, new_cnt, old_cnt)
 
     def get_pkg_list(self, path):
-        """ Looks for the repodata.json file. If present, it is loaded and the
+        """ Looks for the repodata.json file. If present, it is read and the
         package list is extracted and returned
         Args:
-            path (str): url to the repodata
+            path (str): path to the repodata.json or repodata.json.bz2 file
         Returns:
             list of packages. Full names, no path.
         """
-        if os.path.isfile(path):
-            with open(path, 'r') as f:
-                repodata = f.read()
-        else:
+        if not os.path.isfile(path):
             return
+        return [pkg for pkg, _ in iter_packages(path)]
 
-        repodata = json.loads(repodata)
-        pkgs = repodata['packages'].keys()
-        return pkgs
+    def _get_repodata_pkgs(self, path, fields=('size', 'sha256', 'md5')):
+        """ Read the package entries of a repodata.json file. Only the given
+        fields of each entry are kept.
+        Args:
+            path (str): path to the repodata.json file
+            fields (tuple): entry fields to keep
+        Returns:
+            dict of package entries keyed by file name or None if the
+            file does not exist.
+        """
+        if not os.path.isfile(path):
+            return
+        return {pkg: {field: entry[field] for field in fields if field in entry}
+                for pkg, entry in iter_packages(path)}
 
     def _update_repodata(self, path):
         """ Update the repodata.json file to reflect the actual contents of the
-        repodata directory.
+        repodata directory. The file is filtered while streaming and
+        repodata.json.bz2 is regenerated along with it.
             Args:
         path: (str) full path to the repodata directory.
         """
-        status = True
-        path = os.path.join(path, 'repodata.json')
-        exists = glob.glob(path, recursive=True)
-        if exists:
-            repodata_path = exists[0]
-            dir_name = os.path.dirname(repodata_path)
-            file_list = glob.glob(os.path.join(dir_name, '*'))
-            file_list = [f.rsplit('/', 1)[1] for f in file_list]
-        else:
+        repodata_path = os.path.join(path, 'repodata.json')
+        if not os.path.isfile(repodata_path):
             self.log.error(f'Unable to find repodata for {self.repo_name}')
+            return False
 
-        with open(path, 'r') as f:
-            repodata = f.read()
-
-        repodata = json.loads(repodata)
-        pkgs = {pkg: repodata['packages'][pkg] for pkg in
-                repodata['packages'] if pkg in file_list}
-
-        # Build the new dict from the original. Replace the value of the 'packages'
-        # key in the new dict
-        new_repodata = {}
-        for item in repodata.keys():
-            if item == 'packages':
-                new_repodata[item] = pkgs
-            else:
-                new_repodata[item] = repodata[item]
-
-        # write (replace) the repodata file
-        with open(path, 'w') as f:
-            json.dump(new_repodata, f, indent=2)
-
-        return status
-
-    def sync_ana(self, url, rejlist=None, acclist=None, noarch=False):
-        """Syncs an Anaconda repository using wget or rsync.
+        with os.scandir(path) as entries:
+            file_list = {entry.name for entry in entries}
+        try:
+            kept, removed = filter_repodata(repodata_path, file_list)
+        except (OSError, RepodataError) as exc:
+            self.log.error(f'Unable to update {repodata_path} - {exc}')
+            return False
+        self.log.debug(f'{repodata_path}: {kept} packages present, {removed} '
+                       'entries removed')
+        return True
+
+    def sync_ana(self, url, rejlist=None, acclist=None, noarch=False,
+                 workers=WORKERS):
+        """Syncs an Anaconda repository using concurrent downloads or rsync.
         To download the entire repository, leave the accept list (acclist) and rejlist
         empty. Alternately, set the acclist to all or the rejlist to all to accept or
         reject the entire repo. Note that the accept list and reject list are mutually
@@ -756,6 +809,7 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
                 only the listed files will be downloaded.
             rejlist (str): Reject list. List of files to reject. If specified,
                 the entire repository except the files in the rejlist will be downloaded.
+            workers (int): Number of concurrent downloads.
         """
         def _get_table_row(file_handle):
             """read lines from file handle until end of table row </tr> found
@@ -782,20 +836,18 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
             self.log.info('This can take several minutes\n')
             # Get the repodata.json files and html index files
             # -S = preserve time stamp.  -N = only if Newer or missing -P = download path
-            for file in ('repodata.json', 'repodata2.json', 'repodata.json.bz2'):
-                cmd = (f'wget -N -S -P {dest_dir} {url}{file}')
-                res, err, rc = sub_proc_exec(cmd, shell=True)
+            # repodata.json.bz2 is regenerated by _update_repodata
+            downloader = Downloader(workers=workers, store=self.store)
+            for file in ('repodata.json', 'repodata2.json'):
+                rc = download_file(f'{url}{file}', dest_dir, newer=True,
+                                   downloader=downloader)
                 if rc != 0 and file == 'repodata.json':
                     self.log.error(f'Error downloading {file}.  rc: {rc} url:{url} '
-                                   f'dest_dir:{dest_dir}\ncmd:{cmd}')
-                err = err.splitlines()
-                for line in err:
-                    if '-- not retrieving' in line:
-                        print(line, '\n')
+                                   f'dest_dir:{dest_dir}')
 
             # Get the list of packages in the repo. Note that if both acclist
             # and rejlist are not provided the full set of packages is downloaded
-            pkgs = self.get_pkg_list(os.path.join(dest_dir, 'repodata.json'))
+            pkgs = self._get_repodata_pkgs(os.path.join(dest_dir, 'repodata.json'))
             if pkgs is None:
                 self.log.error('repodata.json file not found')
                 return None
@@ -814,18 +866,26 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
                 else:
                     download_set = download_set - set(rejlist)
 
-            # Get em
+            # Get em. Files already present with the size and checksum of
+            # their repodata entry are skipped, the rest is verified while
+            # streaming.
+            downloads = []
             for file in sorted(download_set):
-                print(file)
-                cmd = (f'wget -N -S -P {dest_dir} {url}{file}')
-                res, err, rc = sub_proc_exec(cmd, shell=True)
-                if rc != 0:
-                    self.log.error(f'Error downloading {url}.  rc: {rc}')
-                err = err.splitlines()
-                for line in err:
-                    if '-- not retrieving' in line:
-                        print(line, '\n')
-            self._update_repodata(dest_dir)
+                entry = pkgs[file]
+                algorithm = 'sha256' if 'sha256' in entry else 'md5'
+                downloads.append({'url': f'{url}{file}',
+                                  'dest': os.path.join(dest_dir, file),
+                                  'checksum': entry.get(algorithm),
+                                  'algorithm': algorithm,
+                                  'size': entry.get('size')})
+            downloader.progress.callback = print_progress
+            failed = downloader.download_many(downloads)
+            downloader.close()
+            self.log.info(f'{downloader.progress.files_done} of {len(downloads)} '
+                          f'{self.repo_name} packages downloaded')
+            if failed:
+                self.log.error(f'Error downloading {len(failed)} packages from '
+                               f'{url}:\n' + '\n'.join(sorted(failed)))
 
         elif 'file:///' in url:
             src_dir = url[7:]
@@ -842,6 +902,7 @@ class PowerupAnaRepoFromRepo(PowerupRepo):
                 self.log.error('Sync of {self.repo_id} failed. rc: {rc}')
             else:
                 self.log.info(f'{self.repo_name} sync finished successfully')
+            self.store.add_tree(dest_dir, suffixes=('.tar.bz2',))
 
         self._update_repodata(dest_dir)
 
@@ -913,7 +974,8 @@ class PowerupPypiRepoFromRepo(PowerupRepo):
         state = -2  # same version and build
         ver_pkg_lst, _ = pkg
         for ver_repo, bld in pkg_in_repo:
-            this_state = self.get_ver_state(ver_repo, ver_pkg_lst)
+            this_state = (0 if ver_pkg_lst == '' else
+                          compare_versions(ver_repo, ver_pkg_lst, PYPI))
             if this_state == 0:
                 state = this_state
                 break
@@ -922,11 +984,9 @@ class PowerupPypiRepoFromRepo(PowerupRepo):
         return state
 
     def verify_pkgs(self, pkglist):
-        try:
-            filenames = os.listdir(self.pypirepo_dir)
-        except FileNotFoundError:
-            filenames = []
-        files_vers = parse_pypi_filenames(filenames)
+        index = PackageIndex(self.pypirepo_dir, PYPI).update()
+        files_vers = {name: {'ver_bld': [(ver, bld) for _, ver, bld in evrs]}
+                      for name, evrs in index.packages.items()}
         pkgs_vers = self.parse_pypi_pkg_list(pkglist)
 
         pkg_lst_cnt = len(pkgs_vers)
@@ -970,62 +1030,83 @@ class PowerupPypiRepoFromRepo(PowerupRepo):
 
         return (pkg_lst_cnt, pkg_cnt, new_cnt, old_cnt)
 
-    def sync(self, pkg_list, alt_url=None, py_ver=27):
-        """
+    def sync(self, pkg_list, alt_url=None, py_ver=27, workers=WORKERS):
+        """Resolves each requirement against the simple index and downloads
+        the selected files (no dependencies) concurrently. Files already
+        present with matching hashes are not downloaded again.
         inputs:
             pkg_list (str): list of packages separated by space(s). Packages can
                 include versions. ie Keras==2.0.5
+            alt_url (str): Alternate simple index url.
+            py_ver (int): Python version of the packages. ie 27 or 36
+            workers (int): Number of concurrent index requests and downloads.
         """
         if not os.path.isdir(self.pypirepo_dir):
             os.mkdir(self.pypirepo_dir)
         pkg_cnt = len(pkg_list.split())
         print(f'Downloading {pkg_cnt} python{py_ver} packages plus dependencies:\n')
 
-        pkg_list2 = pkg_list.split()
-        if alt_url:
-            host = re.search(r'http://([^/]+)', alt_url).group(1)
-            cmd = host  # Dummy assign to silence tox
-            # wait on 'f' string formatting since 'pkg' is not available yet
-            cmd = ("f'{PYTHON} -m pip download --python-version {py_ver} "
-                   "--platform {self.arch} --no-deps --index-url={alt_url} "
-                   "-d {self.pypirepo_dir} {pkg} --trusted-host {host}'")
-        else:
-            cmd = ("f'{PYTHON} -m pip download --python-version {py_ver} "
-                   "--platform {self.arch} --no-deps -d {self.pypirepo_dir} {pkg}'")
-        for pkg in pkg_list2:
-            print(pkg)
-            resp, err, rc = sub_proc_exec(eval(cmd), shell=True)
-            if rc != 0:
-                err_str = 'setup.py egg_info" failed with error code 1 in'
-                if ('functools32' in resp or 'weave' in resp or
-                        'gensim' in resp and err_str in err):
-                    pass
-                else:
-                    self.log.error('Error occured while downloading python packages: '
-                                   f'\nResp: {resp} \nRet code: {rc} \nerr: {err}')
-
-        if not os.path.isdir(self.pypirepo_dir + '/simple'):
-            os.mkdir(self.pypirepo_dir + '/simple')
-        dir_list = os.listdir(self.pypirepo_dir)
+        downloader = Downloader(workers=workers,
+                                progress=Progress(print_progress),
+                                store=self.store)
+        resolver = PypiResolver(downloader.session, self.pypirepo_dir,
+                                alt_url or PYPI_INDEX_URL, py_ver, self.arch)
+        resolved, failed = resolver.resolve_many(pkg_list.split(), workers)
+        resolver.save()
+
+        downloads = []
+        for artifact in resolved.values():
+            dest = os.path.join(self.pypirepo_dir, artifact['filename'])
+            if artifact['checksum']:
+                downloads.append({'url': artifact['url'], 'dest': dest,
+                                  'checksum': artifact['checksum'],
+                                  'algorithm': artifact['algorithm']})
+            elif not os.path.isfile(dest):
+                downloads.append({'url': artifact['url'], 'dest': dest})
+        failed.update(downloader.download_many(downloads))
+        downloader.close()
+        for pkg, err in sorted(failed.items()):
+            self.log.error(f'Error occured while downloading python package {pkg}: '
+                           f'{err}')
+
+        self.create_simple_index({artifact['filename']: artifact['project']
+                                  for artifact in resolved.values()})
+
+    def create_simple_index(self, filenames=None):
+        """Links package files into the PEP 503 simple/ index directory,
+        simple/<normalized name>/<file>. Only the given files are linked,
+        unless the index does not exist yet.
+        inputs:
+            filenames (dict): Normalized project name of each file name. If None,
+                all files in the repo directory are linked and project names
+                are derived from the file names.
+        """
+        simple_dir = os.path.join(self.pypirepo_dir, 'simple')
+        if not os.path.isdir(simple_dir):
+            os.mkdir(simple_dir)
+            filenames = None
+        if filenames is None:
+            filenames = dict.fromkeys(os.listdir(self.pypirepo_dir))
         cnt = 0
 
-        for item in dir_list:
+        for item, name in filenames.items():
             if item[0] != '.' and os.path.isfile(self.pypirepo_dir + '/' + item):
-                res = re.search(r'([-_+\w\.]+)(?=-(\d+\.\d+){1,3}).+', item)
-                if res:
-                    cnt += 1
+                if name is None:
+                    res = re.search(r'([-_+\w\.]+)(?=-(\d+\.\d+){1,3}).+', item)
+                    if not res:
+                        self.log.error(f'mismatch: {item}. There was a problem entering '
+                                       f'{item}\ninto the python package index')
+                        continue
                     name = res.group(1)
                     name = name.replace('.', '-')
                     name = name.replace('_', '-')
                     name = name.lower()
-                    if not os.path.isdir(self.pypirepo_dir + f'/simple/{name}'):
-                        os.mkdir(self.pypirepo_dir + f'/simple/{name}')
-                    if not os.path.islink(self.pypirepo_dir + f'/simple/{name}/{item}'):
-                        os.symlink(self.pypirepo_dir + f'/{item}',
-                                   self.pypirepo_dir + f'/simple/{name}/{item}')
-                else:
-                    self.log.error(f'mismatch: {item}. There was a problem entering '
-                                   f'{item}\ninto the python package index')
+                cnt += 1
+                if not os.path.isdir(self.pypirepo_dir + f'/simple/{name}'):
+                    os.mkdir(self.pypirepo_dir + f'/simple/{name}')
+                if not os.path.islink(self.pypirepo_dir + f'/simple/{name}/{item}'):
+                    os.symlink(self.pypirepo_dir + f'/{item}',
+                               self.pypirepo_dir + f'/simple/{name}/{item}')
         self.log.info(f'A total of {cnt} packages exist or were added to the python '
                       'package repository')
 # dir2pi changes underscores to dashes in the links it creates which caused some
@@ -35,6 +35,8 @@ import grp
 import click
 
 import lib.logger as logger
+from lib.blobstore import get_store
+from lib.yum_metadata import YumMetadataSession
 from repos import PowerupRepo, PowerupRepoFromDir, PowerupYumRepoFromRepo, \
     PowerupAnaRepoFromRepo, PowerupRepoFromRpm, setup_source_file, \
     PowerupPypiRepoFromRepo, get_name_dir
@@ -177,6 +179,7 @@ class software(object):
         self.sw_vars['rhel_ver'] = self.rhel_ver
         self.arch = 'ppc64le'
         self.sw_vars['arch'] = self.arch
+        self.yum_session = YumMetadataSession(self.arch)
         self.root_dir = '/srv/'
         self.repo_dir = self.root_dir + 'repos/{repo_id}/rhel' + self.rhel_ver + \
             '/{repo_id}'
@@ -379,6 +382,8 @@ class software(object):
                 it = (item + '                              ')[:38]
                 print(f'  {it:<39} : ' + status)
                 exists = exists and self.state[item] != '-'
+            print(f'  {"Package store":<39} : '
+                  f'{get_store(self.root_dir).summary()}')
 
             gtg = 'Preparation complete. '
             if ver_mis:
@@ -789,8 +794,7 @@ class software(object):
         if ch == 'E':
             repo = PowerupRepo(repo_id, repo_name)
             repo_dir = repo.get_repo_dir()
-            self._add_dependent_packages(repo_dir, dep_list)
-            self._add_dependent_packages(repo_dir, more)
+            self._add_dependent_packages(repo_dir, f'{dep_list} {more}')
             repo.create_meta()
             content = repo.get_yum_dotrepo_content(gpgcheck=0, local=True)
             repo.write_yum_dot_repo_file(content)
@@ -1145,6 +1149,7 @@ class software(object):
                 yaml.dump(self.sw_vars, f, default_flow_style=False)
 
     def _add_dependent_packages(self, repo_dir, dep_list):
+        self.yum_session.refresh()
         cmd = (f'yumdownloader --archlist={self.arch} --destdir '
                f'{repo_dir} {dep_list}')
         resp, err, rc = sub_proc_exec(cmd)
@@ -1156,18 +1161,6 @@ class software(object):
             if 'No Match' in item:
                 self.log.error(f'Dependent packages download error. {item}')
 
-        cmd = 'yum clean packages expire-cache'
-        resp, err, rc = sub_proc_exec(cmd)
-        if rc != 0:
-            self.log.error('An error occurred while cleaning the yum cache\n'
-                           f'rc: {rc} err: {err}')
-
-        cmd = 'yum makecache fast'
-        resp, err, rc = sub_proc_exec(cmd)
-        if rc != 0:
-            self.log.error('An error occurred while making the yum cache\n'
-                           f'rc: {rc} err: {err}')
-
     def init_clients(self):
         log = logger.getlogger()
 
@@ -37,6 +37,8 @@ import grp
 import click
 
 import lib.logger as logger
+from lib.blobstore import get_store
+from lib.yum_metadata import YumMetadataSession
 from repos import PowerupRepo, PowerupRepoFromDir, PowerupYumRepoFromRepo, \
     PowerupAnaRepoFromRepo, PowerupRepoFromRpm, setup_source_file, \
     PowerupPypiRepoFromRepo, get_name_dir
@@ -44,7 +46,7 @@ from software_hosts import get_ansible_inventory, \
     validate_software_inventory, get_host_list_no_reboot
 from lib.utilities import sub_proc_display, sub_proc_exec, heading1, Color, \
     get_selection, get_yesno, rlinput, bold, ansible_pprint, replace_regex, \
-    lscpu, parse_rpm_filenames, md5sum
+    lscpu, parse_rpm_filenames, md5sum, packages_in_message
 from lib.genesis import GEN_SOFTWARE_PATH, get_ansible_playbook_path, \
     get_playbooks_path, get_nginx_root_dir, get_venv_path, get_python_path, get_scripts_path, PYTHON_EXE
 from nginx_setup import nginx_setup
@@ -83,6 +85,7 @@ class software(object):
         self.my_name = sys.modules[__name__].__name__
         self.rhel_ver = '7'
         self.arch = arch
+        self.yum_session = YumMetadataSession(self.arch)
         self.yum_powerup_repo_files = []
         self.eval_ver = eval_ver
         self.non_int = non_int
@@ -293,6 +296,8 @@ class software(object):
                 status = self.state[item]
                 it = (item + '                              ')[:39]
                 print(f'  {it:<40} : ' + status)
+            print(f'  {"Package store":<40} : '
+                  f'{get_store(self.root_dir).summary()}')
 
             gtg = 'Preparation complete. '
             for item in self.state:
@@ -1026,9 +1031,8 @@ class software(object):
                 repo_dir = repo.get_repo_dir()
                 os.makedirs(repo_dir, exist_ok=True)
                 good = self._add_dependent_packages(repo_id, repo_dir, dep_list,
-                                                    also_get_newest=True)
-                self._add_dependent_packages(repo_id, repo_dir, more,
-                                             also_get_newest=True)
+                                                    also_get_newest=True,
+                                                    optional=more)
                 repo.create_meta()
                 if not good:
                     self.log.error(f'An error occurred downloading {_repo.desc}')
@@ -1075,9 +1079,8 @@ class software(object):
                                        proc_family=self.proc_family)
                     repo_dir = repo.get_repo_dir()
                     good = self._add_dependent_packages(repo_id, repo_dir, dep_list,
-                                                        also_get_newest=True)
-                    self._add_dependent_packages(repo_id, repo_dir, more,
-                                                 also_get_newest=True)
+                                                        also_get_newest=True,
+                                                        optional=more)
                     repo.create_meta()
                     if not good:
                         self.log.error(f'An error occurred downloading {_repo.desc}')
@@ -1335,9 +1338,8 @@ class software(object):
                 repo = PowerupRepo(repo_id, repo_name, self.root_dir)
                 repo_dir = repo.get_repo_dir()
                 good = self._add_dependent_packages(repo_id, repo_dir, epel_list,
-                                                    also_get_newest=True)
-                self._add_dependent_packages(repo_id, repo_dir, more,
-                                             also_get_newest=True)
+                                                    also_get_newest=True,
+                                                    optional=more)
                 repo.create_meta()
                 if not good:
                     self.log.error(f'An error occurred downloading {_repo.desc}')
@@ -1623,87 +1625,67 @@ class software(object):
             sys.exit('Exit due to critical error')
 
     def _add_dependent_packages(self, repo_id, repo_dir, dep_list,
-                                also_get_newest=True):
+                                also_get_newest=True, optional=''):
         """
         Returns True if all packages downloaded succesfully and no yum errors
-            occurred.
+            occurred. Packages in optional are downloaded by the same
+            yumdownloader runs, failing to download them is not an error.
         """
-        def refresh_yum_cache():
-            rc = True
-
-            cmd = 'yum clean packages expire-cache'
-            resp, err, _rc = sub_proc_exec(cmd)
-            if _rc != 0:
-                rc = False
-                self.log.error('An error occurred while cleaning the yum cache'
-                               f'\nrc: {_rc} err: {err}')
-
-            cmd = 'yum makecache fast'
-            resp, err, _rc = sub_proc_exec(cmd)
-            if _rc != 0:
-                rc = False
-                self.log.error('An error occurred while making the yum cache\n'
-                               f'rc: {_rc} err: {err}')
-
-            return rc
-
-        def yum_download(repo_dir, dep_list):
+        def yum_download(repo_dir, dep_list, optional=''):
             rc = True
-            rc = refresh_yum_cache() and rc
             cmd = (f'yumdownloader --noplugins --archlist={self.arch} --destdir '
-                   f'{repo_dir} {dep_list}')
+                   f'{repo_dir} {dep_list} {optional}')
             resp, err, _rc = sub_proc_exec(cmd)
+            errors = 0
+            resp = resp.splitlines()
+            for item in resp:
+                if 'Not Found' in item or 'HTTP Error 404' in item or 'No Match' in item:
+                    errors += 1
+                    failed = packages_in_message(
+                        item, (dep_list + ' ' + optional).split())
+                    if not failed or not set(failed) <= set(optional.split()):
+                        rc = False
+                    self.log.warning(f'A problem occurred while downloading. {item}')
+                    for _file in failed:
+                        fpath = os.path.join(repo_dir, _file + '.rpm')
+                        try:
+                            if 0 == os.stat(fpath).st_size:
+                                os.remove(fpath)
+                        except FileNotFoundError:
+                            pass
             if _rc != 0:
-                rc = False
+                # A failure caused only by optional packages is not an error
+                if not errors:
+                    rc = False
                 self.log.warning('A problem occurred while downloading dependent '
                                  f'packages to:\n {repo_dir}\n'
                                  f'rc: {_rc} err: {err}')
                 self.log.debug(f'Failure, download command: {cmd}')
-            resp = resp.splitlines()
-            for item in resp:
-                if 'Not Found' in item or 'HTTP Error 404' in item or 'No Match' in item:
-                    rc = False
-                    self.log.warning(f'A problem occurred while downloading. {item}')
-                    for _file in dep_list.split():
-                        if _file in item:
-                            fpath = os.path.join(repo_dir, _file + '.rpm')
-                            try:
-                                if 0 == os.stat(fpath).st_size:
-                                    os.remove(fpath)
-                                    break
-                            except FileNotFoundError:
-                                pass
             return rc
 
-        rc = True
-        if also_get_newest:
-            # Clean yum data. Insures new packages are attempted when
-            # downloading without specifying version
-            if os.path.isfile(f'/etc/yum.repos.d/{repo_id}.repo'):
-                cmd = f'yum clean all --noplugins --disablerepo=* --enablerepo={repo_id}'
-            else:
-                cmd = 'yum clean all --noplugins'
-            resp, err, rc = sub_proc_exec(cmd)
-            if rc != 0:
-                self.log.error('An error occurred while cleaning the yum '
-                               f'repositories. Command: {cmd}')
+        def missing(pkg_list):
+            # Packages of pkg_list not already in repo_dir
+            in_repo_list = os.listdir(repo_dir)
+            return ' '.join(_file for _file in pkg_list.split()
+                            if _file + '.rpm' not in in_repo_list)
 
-            dep_list_list = dep_list.split()
-            basename_dep_list, ep, ver, rel = parse_rpm_filenames(dep_list_list)
-            basename_dep_list = ' '.join(basename_dep_list)
-            rc = yum_download(repo_dir, basename_dep_list)
+        # Refresh the metadata of repositories changed since the last
+        # refresh. Insures new packages are attempted when downloading
+        # without specifying version
+        rc = self.yum_session.refresh()
 
-            # Form new dep_list consisting of packages not already in repo_dir
-            in_repo_list = os.listdir(repo_dir)
-            dep_list = ''
-            for _file in dep_list_list:
-                if _file + '.rpm' not in in_repo_list:
-                    dep_list = dep_list + _file + ' '
+        if also_get_newest:
+            basename_dep_list = parse_rpm_filenames(dep_list.split())[0]
+            basename_optional = parse_rpm_filenames(optional.split())[0]
+            rc = yum_download(repo_dir, ' '.join(basename_dep_list),
+                              ' '.join(basename_optional)) and rc
 
-        if dep_list:
-            rc = yum_download(repo_dir, dep_list) and rc
+            # Form new lists consisting of packages not already in repo_dir
+            dep_list = missing(dep_list)
+            optional = missing(optional)
 
-        rc = refresh_yum_cache() and rc
+        if dep_list or optional:
+            rc = yum_download(repo_dir, dep_list, optional) and rc
 
         return rc
 
@@ -21,8 +21,16 @@ from mock import patch as patch
 from tests.unit import (TOP_DIR, SCRIPT_DIR)
 import lib.logger as logger
 import tarfile as t
+import gzip
+import hashlib
+import io
 import os
-from archive.bundle import bundle_extract, archive_this, unarchive_this
+import shutil
+import subprocess
+import archive.bundle as bundle
+from lib.checksum import checksum
+from archive.bundle import bundle_extract, archive_this, unarchive_this, \
+    BundleWriter, Arguments
 import tempfile
 
 COMPRESS_FORMAT = "gz"
@@ -95,3 +103,227 @@ class TestScript(unittest.TestCase):
                 os.unlink(fileobj.name)
 
         #  Bad path
+
+    def test_bundle_writer(self):
+        logger.create('nolog', 'info')
+        data = os.urandom(100000) + bytes(300000)
+        out = io.BytesIO()
+        writer = BundleWriter(out, compression='gz', workers=4,
+                              block_size=64 * 1024)
+        for i in range(0, len(data), 10000):
+            writer.write(data[i:i + 10000])
+        writer.close()
+        content = out.getvalue()
+        # Independent members, read back as one gzip stream
+        self.assertGreater(content.count(b'\x1f\x8b\x08'), 6)
+        self.assertEqual(gzip.decompress(content), data)
+        self.assertEqual(writer.bytes_in, len(data))
+        self.assertEqual(writer.bytes_out, len(content))
+        self.assertEqual(writer.hexdigest(),
+                         hashlib.sha256(content).hexdigest())
+
+    def test_archive_compressed(self):
+        logger.create('nolog', 'info')
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            args = Arguments()
+            args.path = os.path.join(TOP_DIR, SCRIPT_DIR, 'lib')
+            args.dest = os.path.join(tmpdirname, 'bundle')
+            args.compress = True
+            args.workers = 3
+            with patch.object(bundle, 'BLOCK_SIZE', 32 * 1024), \
+                    patch('archive.bundle.getlogin', return_value='root'):
+                filename = bundle.archive(args)
+            self.assertTrue(filename.endswith('.tar.gz'))
+            with open(filename, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            with open(filename + bundle.CHECKSUM_SUFFIX) as f:
+                self.assertEqual(f.read().split()[0], digest)
+            with t.open(filename, 'r:gz') as tar:
+                self.assertIn('logger.py', tar.getnames())
+            if shutil.which('tar'):
+                names = subprocess.check_output(
+                    ['tar', '-tzf', filename]).decode().split()
+                self.assertIn('logger.py', names)
+            dest = os.path.join(tmpdirname, 'extract')
+            os.mkdir(dest)
+            with patch('archive.bundle.checksum',
+                       side_effect=lambda path, algorithm: checksum(
+                           path, algorithm, cache=False)):
+                bundle_extract(filename, dest)
+            self.assertTrue(os.path.isfile(os.path.join(dest, 'logger.py')))
+
+    @unittest.skipIf(bundle.zstandard is None, 'zstandard is not installed')
+    def test_archive_zstd(self):
+        logger.create('nolog', 'info')
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            fileobj = open(os.path.join(tmpdirname, 'lib.tar.zst'), 'wb')
+            archive_this(os.path.join(TOP_DIR, SCRIPT_DIR, 'lib'),
+                         fileObj=fileobj, compress=True, compression='zst')
+            fileobj.close()
+            unarchive_this(fileobj.name, tmpdirname)
+            self.assertTrue(os.path.isfile(os.path.join(tmpdirname,
+                                                        'logger.py')))
+
+    def test_delta_bundle(self):
+        logger.create('nolog', 'info')
+
+        def write(path, content, mtime=1500000000):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+
+        def make_bundle(since=None, name=None):
+            args = Arguments()
+            args.path = src
+            args.dest = os.path.join(tmpdirname, 'bundles')
+            args.compress = True
+            args.since = since
+            with patch('archive.bundle.getlogin', return_value='root'), \
+                    patch('archive.bundle.time.strftime',
+                          return_value=name or ('delta' if since else
+                                                'full')):
+                return bundle.archive(args)
+
+        def extract(filename):
+            with patch('archive.bundle.checksum',
+                       side_effect=lambda path, algorithm: checksum(
+                           path, algorithm, cache=False)):
+                bundle_extract(filename, dest)
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            src = os.path.join(tmpdirname, 'srv')
+            dest = os.path.join(tmpdirname, 'site')
+            os.mkdir(dest)
+            write(os.path.join(src, 'repos', 'a.rpm'), 'a')
+            write(os.path.join(src, 'repos', 'b.rpm'), 'b')
+            write(os.path.join(src, 'c.txt'), 'c')
+            full = make_bundle()
+            manifest = bundle.load_manifest(full + bundle.MANIFEST_SUFFIX)
+            self.assertEqual(sorted(manifest['files']),
+                             ['c.txt', 'repos/a.rpm', 'repos/b.rpm'])
+            self.assertEqual(manifest['files']['c.txt'][:2], [1, 1500000000])
+            extract(full)
+
+            # A full bundle is listed from its manifest
+            args = Arguments()
+            args.src = full
+            with patch('archive.bundle.open_tar') as mock_open_tar, \
+                    patch('archive.bundle.LOG') as mock_log:
+                bundle.list(args)
+            mock_open_tar.assert_not_called()
+            self.assertEqual([call[0][0] for call in
+                              mock_log.info.call_args_list],
+                             ['c.txt', 'repos/a.rpm', 'repos/b.rpm'])
+
+            write(os.path.join(src, 'repos', 'b.rpm'), 'b2', 1600000000)
+            write(os.path.join(src, 'repos', 'd.rpm'), 'd')
+            os.remove(os.path.join(src, 'c.txt'))
+            delta = make_bundle(full + bundle.MANIFEST_SUFFIX)
+            with t.open(delta, 'r:gz') as tar:
+                self.assertEqual(sorted(name for name in tar.getnames()
+                                        if name.endswith(('.rpm', '.txt'))),
+                                 ['repos/b.rpm', 'repos/d.rpm'])
+            delta_manifest = bundle.load_manifest(
+                delta + bundle.MANIFEST_SUFFIX)
+            self.assertEqual(delta_manifest['base'], manifest['id'])
+            self.assertEqual(delta_manifest['deleted'], ['c.txt'])
+
+            extract(delta)
+            self.assertFalse(os.path.exists(os.path.join(dest, 'c.txt')))
+            with open(os.path.join(dest, 'repos', 'b.rpm')) as f:
+                self.assertEqual(f.read(), 'b2')
+            self.assertEqual(sorted(os.listdir(os.path.join(dest, 'repos'))),
+                             ['a.rpm', 'b.rpm', 'd.rpm'])
+
+            # Paths turned into hardlinks, as the package store does, are
+            # neither deleted nor unverified
+            blob = os.path.join(src, '.blobs', 'ab', 'abcd')
+            os.makedirs(os.path.dirname(blob))
+            os.link(os.path.join(src, 'repos', 'a.rpm'), blob)
+            write(os.path.join(src, 'repos', 'e.rpm'), 'e')
+            os.link(os.path.join(src, 'repos', 'e.rpm'),
+                    os.path.join(src, 'e.rpm'))
+            delta2 = make_bundle(delta + bundle.MANIFEST_SUFFIX, 'delta2')
+            delta2_manifest = bundle.load_manifest(
+                delta2 + bundle.MANIFEST_SUFFIX)
+            self.assertEqual(delta2_manifest['deleted'], [])
+            files = delta2_manifest['files']
+            self.assertEqual(files['.blobs/ab/abcd'], files['repos/a.rpm'])
+            self.assertEqual(files['e.rpm'], files['repos/e.rpm'])
+            extract(delta2)
+            self.assertTrue(os.path.samefile(os.path.join(dest, 'e.rpm'),
+                                             os.path.join(dest, 'repos',
+                                                          'e.rpm')))
+            with open(os.path.join(dest, 'repos', 'a.rpm')) as f:
+                self.assertEqual(f.read(), 'a')
+            with open(os.path.join(dest, '.blobs', 'ab', 'abcd')) as f:
+                self.assertEqual(f.read(), 'a')
+
+            # A failed extraction keeps the manifest of the site
+            with open(delta2, 'rb') as f:
+                data = f.read()
+            broken = os.path.join(tmpdirname, 'broken.tar.gz')
+            with open(broken, 'wb') as f:
+                f.write(data[:len(data) // 2])
+            with self.assertRaises(Exception):
+                extract(broken)
+            self.assertEqual(bundle.load_manifest(os.path.join(
+                dest, bundle.MANIFEST_NAME))['id'], delta2_manifest['id'])
+            self.assertFalse(os.path.exists(os.path.join(
+                dest, bundle.MANIFEST_NAME + bundle.PREVIOUS_SUFFIX)))
+
+            # The tree is verified against the manifest
+            write(os.path.join(dest, 'repos', 'a.rpm'), 'x')
+            with self.assertRaises(Exception):
+                bundle.apply_manifest(dest)
+
+    def test_extract_verify(self):
+        logger.create('nolog', 'info')
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            src = os.path.join(TOP_DIR, SCRIPT_DIR, 'lib')
+            args = Arguments()
+            args.path = src
+            args.dest = os.path.join(tmpdirname, 'bundles')
+            args.compress = True
+            with patch.object(bundle, 'BLOCK_SIZE', 16 * 1024), \
+                    patch('archive.bundle.getlogin', return_value='root'):
+                filename = bundle.archive(args)
+
+            # Large files written by the reading thread, several batches
+            dest = os.path.join(tmpdirname, 'extract')
+            os.mkdir(dest)
+            with patch.object(bundle, 'SMALL_FILE', 4096), \
+                    patch.object(bundle, 'FSYNC_BATCH', 64 * 1024):
+                digests = unarchive_this(filename, dest)
+            with open(os.path.join(src, 'logger.py'), 'rb') as f:
+                self.assertEqual(digests['logger.py'],
+                                 hashlib.sha256(f.read()).hexdigest())
+            self.assertEqual(os.stat(os.path.join(dest, 'logger.py')).st_mtime,
+                             int(os.stat(os.path.join(src,
+                                                      'logger.py')).st_mtime))
+            self.assertFalse([name for name in os.listdir(dest)
+                              if name.endswith(bundle.PART_SUFFIX)])
+
+            # The first corrupt file is reported by path
+            manifest_path = filename + bundle.MANIFEST_SUFFIX
+            manifest = bundle.load_manifest(manifest_path)
+            manifest['files']['logger.py'][2] = '0' * 64
+            bundle.write_manifest(manifest_path, manifest)
+            dest = os.path.join(tmpdirname, 'corrupt')
+            os.mkdir(dest)
+            with self.assertRaisesRegex(Exception, 'Corrupt file in bundle: '
+                                        'logger.py'):
+                unarchive_this(filename, dest)
+            self.assertFalse(os.path.exists(os.path.join(dest, 'logger.py')))
+            self.assertFalse(os.path.exists(os.path.join(
+                dest, 'logger.py' + bundle.PART_SUFFIX)))
+
+            # A truncated bundle fails with the member being read
+            os.remove(manifest_path)
+            with open(filename, 'rb') as f:
+                data = f.read()
+            with open(filename, 'wb') as f:
+                f.write(data[:len(data) // 2])
+            with self.assertRaisesRegex(Exception, 'is corrupt at'):
+                unarchive_this(filename, os.path.join(tmpdirname, 'corrupt'))
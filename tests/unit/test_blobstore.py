@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.blobstore import BlobStore, get_store
+from lib.checksum import ChecksumCache, file_digest
+from repos import copy_if_changed
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        super(TestBlobStore, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = BlobStore(os.path.join(self.tmp_dir, '.blobs'),
+                               ChecksumCache(os.path.join(self.tmp_dir,
+                                                          'cache.json')))
+        self.content = os.urandom(5000)
+        self.digest = hashlib.sha256(self.content).hexdigest()
+        for repo in ('wmla120', 'wmla121', 'paie112'):
+            os.makedirs(os.path.join(self.tmp_dir, repo, 'repo'))
+            with open(os.path.join(self.tmp_dir, repo, 'repo', 'pkg.rpm'),
+                      'wb') as f:
+                f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _path(self, repo):
+        return os.path.join(self.tmp_dir, repo, 'repo', 'pkg.rpm')
+
+    def test_add_tree(self):
+        self.assertEqual(self.store.add_tree(self.tmp_dir,
+                                             suffixes=('.rpm',)), 3)
+        blob = self.store.blob_path(self.digest)
+        self.assertEqual(os.stat(blob).st_nlink, 4)
+        for repo in ('wmla120', 'wmla121', 'paie112'):
+            self.assertTrue(os.path.samefile(self._path(repo), blob))
+        self.assertEqual(self.store.stats(),
+                         {'blobs': 1, 'size': 5000, 'saved': 10000,
+                          'unused': 0})
+        self.assertEqual(self.store.summary(),
+                         '1 files, 4.9 KB stored, 9.8 KB saved')
+
+        self.assertTrue(self.store.materialize(
+            self.digest, os.path.join(self.tmp_dir, 'new', 'pkg.rpm')))
+        self.assertFalse(self.store.materialize(
+            '0' * 64, os.path.join(self.tmp_dir, 'new', 'other.rpm')))
+        self.assertEqual(self.store.stats()['saved'], 15000)
+
+    @patch('lib.checksum.file_digest', wraps=file_digest)
+    def test_add_tree_batch(self, mock_digest):
+        for index in range(50):
+            with open(os.path.join(self.tmp_dir, 'wmla121', 'repo',
+                                   f'{index}.rpm'), 'wb') as f:
+                f.write(os.urandom(100))
+        with patch('lib.checksum.json.dump', wraps=json.dump) as mock_dump:
+            self.assertEqual(self.store.add_tree(self.tmp_dir, ('.rpm',)), 53)
+            self.assertEqual(mock_digest.call_count, 53)
+            self.assertEqual(mock_dump.call_count, 1)
+
+            # Stored files are neither hashed nor is the cache written again
+            self.assertEqual(self.store.add_tree(self.tmp_dir, ('.rpm',)), 53)
+            self.assertEqual(mock_digest.call_count, 53)
+            self.assertEqual(mock_dump.call_count, 1)
+
+        # A blob modified through one of its links is dropped, an intact
+        # copy of the content is stored instead
+        with open(self._path('wmla120'), 'r+b') as f:
+            f.write(b'x')
+        copy = os.path.join(self.tmp_dir, 'paie111', 'pkg.rpm')
+        os.makedirs(os.path.dirname(copy))
+        with open(copy, 'wb') as f:
+            f.write(self.content)
+        self.store.add_tree(os.path.dirname(copy))
+        with open(self.store.blob_path(self.digest), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertTrue(os.path.samefile(self.store.blob_path(self.digest),
+                                         copy))
+
+    def test_copy_if_changed(self):
+        src = self._path('wmla120')
+        self.store.add(self._path('wmla121'))
+        dst_dir = os.path.join(self.tmp_dir, 'srv')
+        os.mkdir(dst_dir)
+        dst = copy_if_changed(src, dst_dir, self.store)
+        self.assertTrue(os.path.samefile(dst, self._path('wmla121')))
+
+        # A changed source replaces the link, the shared blob is untouched
+        with open(src, 'wb') as f:
+            f.write(b'new content')
+        copy_if_changed(src, dst_dir, self.store)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'new content')
+        with open(self._path('wmla121'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(self.store.stats()['blobs'], 2)
+
+    def test_get_store(self):
+        self.assertEqual(get_store('/srv/wmla121-ppc64le/').root,
+                         '/srv/.blobs')
+        self.assertEqual(get_store(self.tmp_dir).root,
+                         os.path.join(self.tmp_dir, '.blobs'))
+
+
+if __name__ == '__main__':
+    unittest.main()
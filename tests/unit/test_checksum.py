@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.checksum as checksum
+
+
+class TestChecksum(unittest.TestCase):
+
+    def setUp(self):
+        super(TestChecksum, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache.json')
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.tmp_dir, 'image{}.iso'.format(index))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(3 * 1024 * 1024 + index))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _sha1(self, path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @patch('lib.checksum.file_digest', wraps=checksum.file_digest)
+    def test_checksums(self, mock_digest):
+        expected = {path: self._sha1(path) for path in self.paths}
+        cache = checksum.ChecksumCache(self.cache_file)
+        self.assertEqual(checksum.checksums(self.paths, cache=cache),
+                         expected)
+        self.assertEqual(mock_digest.call_count, 3)
+
+        # Unchanged files are not hashed again, also by a new process
+        cache = checksum.ChecksumCache(self.cache_file)
+        self.assertEqual(checksum.verify_checksums(expected, cache=cache), [])
+        self.assertEqual(mock_digest.call_count, 3)
+
+        # Changed file is hashed again
+        with open(self.paths[1], 'ab') as f:
+            f.write(b'x')
+        failed = checksum.verify_checksums(expected, cache=cache)
+        self.assertEqual(failed, [self.paths[1]])
+        self.assertEqual(mock_digest.call_count, 4)
+
+        # Digests per algorithm
+        self.assertEqual(
+            checksum.checksum(self.paths[0], 'md5', cache=cache),
+            hashlib.md5(open(self.paths[0], 'rb').read()).hexdigest())
+        self.assertEqual(mock_digest.call_count, 5)
+
+    @patch('lib.checksum.file_digest', wraps=checksum.file_digest)
+    def test_cache(self, mock_digest):
+        with patch('lib.checksum.CHECKSUM_CACHE', self.cache_file), \
+                patch.dict('lib.checksum._caches', clear=True):
+            cache = checksum.get_cache()
+            self.assertIs(checksum.get_cache(self.cache_file), cache)
+
+            # The cache file is written once, when the batch ends
+            with patch.object(cache, '_load', wraps=cache._load) as mock_load:
+                with cache.batch():
+                    for path in self.paths:
+                        checksum.checksum(path)
+                    self.assertFalse(os.path.exists(self.cache_file))
+                mock_load.assert_not_called()
+            self.assertTrue(os.path.exists(self.cache_file))
+
+        # Entries saved by another process are merged, not overwritten
+        other = checksum.ChecksumCache(self.cache_file)
+        copy = os.path.join(self.tmp_dir, 'copy.iso')
+        shutil.copy(self.paths[0], copy)
+        checksum.checksum(copy, cache=other)
+        checksum.checksum(self.paths[0], 'md5', cache=cache)
+        cache = checksum.ChecksumCache(self.cache_file)
+        self.assertEqual(len(cache.entries), 4)
+        self.assertEqual(mock_digest.call_count, 5)
+
+        # Entries of removed files are dropped
+        os.remove(copy)
+        self.assertIsNone(cache.get(copy))
+        cache.save()
+        self.assertEqual(len(checksum.ChecksumCache(self.cache_file).entries),
+                         3)
+
+    def test_files_match(self):
+        cache = checksum.ChecksumCache(self.cache_file)
+        copy = os.path.join(self.tmp_dir, 'copy.iso')
+        self.assertFalse(checksum.files_match(self.paths[0], copy, cache=cache))
+        shutil.copy(self.paths[0], copy)
+        self.assertTrue(checksum.files_match(self.paths[0], copy, cache=cache))
+        with open(copy, 'r+b') as f:
+            f.write(b'x')
+        self.assertFalse(checksum.files_match(self.paths[0], copy, cache=cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
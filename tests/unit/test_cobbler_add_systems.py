@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+import xmlrpc.client
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+from mock import MagicMock, patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import cobbler_add_systems
+
+
+class _XMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class _QuietHandler(SimpleXMLRPCRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _Cobbler(object):
+    """Cobbler XML-RPC API stand-in"""
+
+    TOKEN = 'token'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.created = 0
+        self.systems = {}
+        self.syncs = 0
+
+    def _check_token(self, token):
+        if token != self.TOKEN:
+            raise Exception('invalid token')
+
+    def login(self, user, password):
+        return self.TOKEN
+
+    def ping(self):
+        return True
+
+    def new_system(self, token):
+        self._check_token(token)
+        with self.lock:
+            handle = 'system::{}'.format(self.created)
+            self.created += 1
+            self.handles[handle] = []
+        return handle
+
+    def modify_system(self, handle, attr, value, token):
+        self._check_token(token)
+        if attr == 'profile' and value == 'missing':
+            raise Exception('invalid profile name: missing')
+        self.handles[handle].append((attr, value))
+        return True
+
+    def save_system(self, handle, token):
+        self._check_token(token)
+        attrs = self.handles.pop(handle)
+        with self.lock:
+            self.systems[dict(attrs)['name']] = attrs
+        return True
+
+    def sync(self, token):
+        self._check_token(token)
+        self.syncs += 1
+        return True
+
+
+def _attrs(hostname, profile='rhel-7.6'):
+    return [('name', hostname), ('hostname', hostname),
+            ('profile', profile),
+            ('modify_interface', {'macaddress-eth0': 'aa:00'})]
+
+
+class TestAddSystems(unittest.TestCase):
+
+    def setUp(self):
+        super(TestAddSystems, self).setUp()
+        logger.create('nolog', 'info')
+        self.cobbler = _Cobbler()
+
+    def _serve(self, multicall=True):
+        server = _XMLRPCServer(('127.0.0.1', 0), _QuietHandler,
+                               logRequests=False)
+        server.register_instance(self.cobbler)
+        if multicall:
+            server.register_multicall_functions()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+    def _systems(self, count):
+        return [('node{}'.format(index), 'rhel-7.6',
+                 _attrs('node{}'.format(index))) for index in range(count)]
+
+    def test_supports_multicall(self):
+        self.assertTrue(cobbler_add_systems.supports_multicall(
+            xmlrpc.client.ServerProxy(self._serve(multicall=True))))
+        self.assertFalse(cobbler_add_systems.supports_multicall(
+            xmlrpc.client.ServerProxy(self._serve(multicall=False))))
+
+    def test_add_systems(self):
+        for multicall in (True, False):
+            self.cobbler.systems.clear()
+            url = self._serve(multicall=multicall)
+            failed = cobbler_add_systems.add_systems(
+                self._systems(10), url=url, workers=4)
+            self.assertEqual(failed, {})
+            self.assertEqual(sorted(self.cobbler.systems),
+                             sorted('node{}'.format(i) for i in range(10)))
+            self.assertEqual(self.cobbler.systems['node3'], _attrs('node3'))
+            self.assertEqual(self.cobbler.handles, {})
+        self.assertEqual(self.cobbler.syncs, 2)
+
+    def test_add_systems_failure(self):
+        systems = self._systems(4)
+        systems[1] = ('node1', 'missing', _attrs('node1', 'missing'))
+        for multicall in (True, False):
+            self.cobbler.systems.clear()
+            failed = cobbler_add_systems.add_systems(
+                systems, url=self._serve(multicall=multicall), workers=2,
+                multicall=multicall)
+            self.assertEqual(list(failed), ['node1'])
+            self.assertIn('invalid profile name', failed['node1'])
+            # The failed system is not saved, the others are
+            self.assertEqual(sorted(self.cobbler.systems),
+                             ['node0', 'node2', 'node3'])
+        self.assertEqual(self.cobbler.syncs, 2)
+
+    def test_add_systems_connection_error(self):
+        add_system = cobbler_add_systems.add_system
+
+        def _add_system(server, token, attrs, multicall=False):
+            if dict(attrs)['name'] == 'node2':
+                raise ConnectionRefusedError('connection refused')
+            return add_system(server, token, attrs, multicall)
+
+        with patch('cobbler_add_systems.add_system',
+                   side_effect=_add_system):
+            failed = cobbler_add_systems.add_systems(
+                self._systems(3), url=self._serve())
+        self.assertEqual(failed, {'node2': 'connection refused'})
+        self.assertEqual(sorted(self.cobbler.systems), ['node0', 'node1'])
+        self.assertEqual(self.cobbler.syncs, 1)
+
+
+class TestGetSystemAttrs(unittest.TestCase):
+
+    def setUp(self):
+        super(TestGetSystemAttrs, self).setUp()
+        logger.create('nolog', 'info')
+        self.inv = MagicMock()
+        self.inv.get_nodes_os_profile.return_value = 'RHEL-7.6.iso'
+        self.inv.get_nodes_ipmi_ipaddr.return_value = '192.168.3.10'
+        self.inv.get_nodes_ipmi_userid.return_value = 'ADMIN'
+        self.inv.get_nodes_ipmi_password.return_value = 'pass'
+        self.inv.get_nodes_pxe_mac.return_value = 'aa:00'
+        self.inv.get_nodes_pxe_ipaddr.return_value = '192.168.4.10'
+        self.inv.get_nodes_os_install_device.return_value = None
+        self.inv.get_nodes_os_domain.return_value = None
+        self.inv.get_nodes_os_users.return_value = None
+        self.inv.get_nodes_os_kernel_options.return_value = None
+
+    def _get(self):
+        profile, attrs = cobbler_add_systems.get_system_attrs(
+            self.inv, 0, 'node1')
+        return profile, dict(attrs), [attr for attr, _ in attrs]
+
+    def test_minimal(self):
+        profile, attrs, order = self._get()
+        self.assertEqual(profile, 'RHEL-7.6')
+        self.assertEqual(order, [
+            'name', 'hostname', 'power_address', 'power_user', 'power_pass',
+            'power_type', 'profile', 'modify_interface', 'comment'])
+        self.assertEqual(attrs['power_address'], '192.168.3.10')
+        self.assertEqual(attrs['modify_interface'], {
+            'macaddress-eth0': 'aa:00', 'ipaddress-eth0': '192.168.4.10',
+            'dnsname-eth0': 'node1'})
+        self.inv.get_nodes_pxe_mac.assert_called_with(0, 0)
+
+    def test_ks_meta(self):
+        self.inv.get_nodes_os_install_device.return_value = [
+            '/dev/sda', '/dev/sdb']
+        self.inv.get_nodes_os_domain.return_value = 'example.com'
+        self.inv.get_nodes_os_users.return_value = [
+            {'name': 'root', 'password': 'x'},
+            {'name': 'user', 'password': 'crypted'}]
+        self.inv.get_nodes_os_kernel_options.return_value = 'quiet'
+        _, attrs, order = self._get()
+        self.assertEqual(
+            attrs['ks_meta'],
+            'install_disk=/dev/sda install_disk_2=/dev/sdb '
+            'raid1_enabled=true domain=example.com default_user=user '
+            'passwd=crypted passwdcrypted=true ')
+        self.assertEqual(attrs['kernel_options'], 'quiet')
+        self.assertEqual(attrs['kernel_options_post'], 'quiet')
+        self.assertEqual(order[-4:], ['ks_meta', 'kernel_options',
+                                      'kernel_options_post', 'comment'])
+
+        self.inv.get_nodes_os_install_device.return_value = '/dev/sda'
+        self.assertEqual(self._get()[1]['ks_meta'].split()[0],
+                         'install_disk=/dev/sda')
+
+    def test_ubuntu_kernel_options(self):
+        self.inv.get_nodes_os_profile.return_value = (
+            'ubuntu-18.04.1-server-ppc64el.iso')
+        _, attrs, _ = self._get()
+        self.assertEqual(attrs['kernel_options'],
+                         ' netcfg/do_not_use_netplan=true')
+        self.assertNotIn('ks_meta', attrs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from orderedattrdict import AttrDict
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.db import DatabaseInventory
+from lib.inv_nodes import InventoryNodes
+
+PATH = ['nodes', 0, 'pxe', 'ipaddrs', 0]
+
+
+class TestDatabaseInventory(unittest.TestCase):
+
+    def setUp(self):
+        super(TestDatabaseInventory, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.inv_file = os.path.join(self.tmp_dir, 'inventory.yml')
+        self.dbase = DatabaseInventory(inv_file=self.inv_file)
+        self.inv = AttrDict([('nodes', [AttrDict([(
+            'pxe', AttrDict([('ipaddrs', [None])]))])])])
+        self.dbase.dump_inventory(self.inv)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _load(self):
+        return DatabaseInventory(inv_file=self.inv_file).load_inventory()
+
+    def test_journal_replay(self):
+        self.inv.nodes[0].pxe.ipaddrs[0] = '192.168.3.21'
+        self.dbase.dump_inventory(self.inv, [(PATH, '192.168.3.21')])
+        self.assertNotIn('192.168.3.21', open(self.inv_file).read())
+        self.assertEqual(self._load(), self.inv)
+
+        # A torn record from a crashed writer is dropped
+        with open(self.dbase.journal_file, 'ab') as journal:
+            journal.write(b'{"op": "set", "pa')
+        self.assertEqual(self._load(), self.inv)
+        self.inv.nodes[0].pxe.ipaddrs[0] = '192.168.3.22'
+        self.dbase.dump_inventory(self.inv, [(PATH, '192.168.3.22')])
+        self.assertEqual(self._load(), self.inv)
+
+    def test_drop_torn_record(self):
+        class Journal(io.BytesIO):
+            read_bytes = 0
+
+            def read(self, size=-1):
+                data = super(Journal, self).read(size)
+                Journal.read_bytes += len(data)
+                return data
+
+        records = b'{"op": "set"}\n' * 1000
+        journal = Journal(records)
+        self.dbase._drop_torn_record(journal)
+        self.assertEqual(journal.getvalue(), records)
+        self.assertEqual(Journal.read_bytes, 1)
+
+        self.dbase.SCAN_BYTES = 4
+        journal = Journal(records + b'{"op": "se')
+        self.dbase._drop_torn_record(journal)
+        self.assertEqual(journal.getvalue(), records)
+
+        journal = Journal(b'{"op": "se')
+        self.dbase._drop_torn_record(journal)
+        self.assertEqual(journal.getvalue(), b'')
+
+    def test_compaction(self):
+        self.dbase.COMPACT_BYTES = 1
+        for ipaddr in ('192.168.3.21', '192.168.3.22'):
+            self.inv.nodes[0].pxe.ipaddrs[0] = ipaddr
+            self.dbase.dump_inventory(self.inv, [(PATH, ipaddr)])
+        self.assertEqual(os.path.getsize(self.dbase.journal_file), 0)
+        self.assertEqual(self._load(), self.inv)
+
+    def test_compact_nodes(self):
+        self.dbase.COMPACT_BYTES = 1
+        inv = AttrDict(self.inv)
+        inv.nodes = InventoryNodes(self.inv.nodes)
+        inv.nodes[0].pxe.ipaddrs[0] = '192.168.3.21'
+        self.dbase.dump_inventory(inv, [(PATH, '192.168.3.21')])
+        self.dbase.dump_inventory(inv, [(PATH, '192.168.3.21')])
+        self.assertIsInstance(inv.nodes, InventoryNodes)
+        loaded = self._load()
+        self.assertIsInstance(loaded.nodes, list)
+        self.assertEqual(loaded.nodes[0].pxe.ipaddrs, ['192.168.3.21'])
+
+    def test_interrupted_compaction(self):
+        self.inv.nodes[0].pxe.ipaddrs[0] = '192.168.3.21'
+        with self.dbase._lock(exclusive=True) as journal:
+            self.dbase._append_journal(
+                journal, [{'op': 'snapshot', 'value': self.inv}])
+        with open(self.inv_file, 'w') as inv_file:
+            inv_file.write('nodes: [')
+        self.assertEqual(self._load(), self.inv)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.blobstore import BlobStore
+from lib.checksum import ChecksumCache
+from lib.download import Downloader, PART_SUFFIX, STATE_SUFFIX
+from lib.exception import UserException
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Static files with range requests. Connections of GET requests are
+    dropped after 'drop_after' bytes while 'drops' is positive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send_headers(self):
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None, None
+        start, end = 0, len(content)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', '"v1"') == '"v1"':
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Last-Modified', 'Mon, 01 Jul 2019 00:00:00 GMT')
+        self.end_headers()
+        return content, (start, end)
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        self.server.requests.append((self.path,
+                                     self.headers.get('Range')))
+        content, byte_range = self._send_headers()
+        if content is None:
+            return
+        start, end = byte_range
+        with self.server.lock:
+            drop = self.server.drops > 0
+            self.server.drops -= drop
+        if drop:
+            end = min(end, start + self.server.drop_after)
+            self.close_connection = True
+        self.wfile.write(content[start:end])
+        self.server.sent += end - start
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        super(TestDownloader, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ChecksumCache(os.path.join(self.tmp_dir, 'cache.json'))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.files = {}
+        self.server.requests = []
+        self.server.drops = 0
+        self.server.drop_after = 0
+        self.server.sent = 0
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.sleep_p = patch('lib.download.sleep')
+        self.sleep_p.start()
+
+    def tearDown(self):
+        self.sleep_p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _add_file(self, name, size):
+        content = os.urandom(size)
+        self.server.files['/' + name] = content
+        return hashlib.sha256(content).hexdigest()
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_segmented_download(self):
+        checksum = self._add_file('image.iso', 4 * 1024 * 1024 + 3)
+        dest = os.path.join(self.tmp_dir, 'image.iso')
+        with Downloader(segments=4, min_segment_size=1024 * 1024,
+                        cache=self.cache) as downloader:
+            self.assertTrue(downloader.download(
+                self.url + '/image.iso', dest, checksum))
+            self.assertEqual(self._read(dest),
+                             self.server.files['/image.iso'])
+            self.assertEqual(len(self.server.requests), 4)
+            self.assertFalse(os.path.exists(dest + PART_SUFFIX))
+            self.assertFalse(os.path.exists(dest + STATE_SUFFIX))
+
+            # Verified file is kept without hashing or fetching it again
+            with patch('lib.download.file_digest') as mock_digest:
+                self.assertFalse(downloader.download(
+                    self.url + '/image.iso', dest, checksum))
+                mock_digest.assert_not_called()
+            self.assertEqual(len(self.server.requests), 4)
+
+    def test_resume(self):
+        size = 3 * 1024 * 1024
+        checksum = self._add_file('image.iso', size)
+        dest = os.path.join(self.tmp_dir, 'image.iso')
+        self.server.drops = 1
+        self.server.drop_after = 1024 * 1024
+
+        # Interrupted download keeps its partial file
+        with Downloader(retries=0, cache=self.cache) as downloader:
+            self.assertRaises(UserException, downloader.download,
+                              self.url + '/image.iso', dest, checksum)
+        self.assertTrue(os.path.isfile(dest + PART_SUFFIX))
+
+        # Next run resumes it
+        with Downloader(cache=self.cache) as downloader:
+            downloader.download(self.url + '/image.iso', dest, checksum)
+        self.assertEqual(self._read(dest), self.server.files['/image.iso'])
+        self.assertEqual(self.server.requests[-1],
+                         ('/image.iso', 'bytes={}-'.format(1024 * 1024)))
+        self.assertEqual(self.server.sent, size)
+
+        # Dropped connection is resumed within the same run
+        os.remove(dest)
+        self.server.drops = 2
+        with Downloader(cache=self.cache) as downloader:
+            downloader.download(self.url + '/image.iso', dest, checksum)
+        self.assertEqual(self._read(dest), self.server.files['/image.iso'])
+
+    def test_download_store(self):
+        checksum = self._add_file('pkg.tar.bz2', 3000)
+        store = BlobStore(os.path.join(self.tmp_dir, '.blobs'), self.cache)
+        dests = [os.path.join(self.tmp_dir, repo, 'pkg.tar.bz2')
+                 for repo in ('repo1', 'repo2')]
+        with Downloader(cache=self.cache, store=store) as downloader:
+            for dest in dests:
+                self.assertTrue(downloader.download(
+                    self.url + '/pkg.tar.bz2', dest, checksum))
+        # The second copy is linked from the store, not fetched
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(os.path.samefile(dests[0], dests[1]))
+        self.assertEqual(store.stats()['saved'], 3000)
+
+    def test_download_many(self):
+        downloads = []
+        for index in range(10):
+            name = 'pkg{}.tar.bz2'.format(index)
+            checksum = self._add_file(name, 1000 + index)
+            downloads.append({'url': '{}/{}'.format(self.url, name),
+                              'dest': os.path.join(self.tmp_dir, name),
+                              'checksum': checksum})
+        downloads[3]['checksum'] = 'bad'
+        downloads.append({'url': self.url + '/missing',
+                          'dest': os.path.join(self.tmp_dir, 'missing')})
+        with Downloader(workers=4, cache=self.cache) as downloader:
+            failed = downloader.download_many(downloads)
+        self.assertEqual(sorted(failed), sorted([downloads[3]['dest'],
+                                                 downloads[-1]['dest']]))
+        for dest in failed:
+            self.assertFalse(os.path.exists(dest))
+            self.assertFalse(os.path.exists(dest + PART_SUFFIX))
+        self.assertEqual(self._read(downloads[9]['dest']),
+                         self.server.files['/pkg9.tar.bz2'])
+        self.assertEqual(downloader.progress.files_done, 9)
+
+        # Unchanged files are not fetched again when only newer are wanted
+        count = len(self.server.requests)
+        with Downloader(cache=self.cache) as downloader:
+            self.assertFalse(downloader.download(
+                downloads[0]['url'], downloads[0]['dest'], newer=True))
+        self.assertEqual(len(self.server.requests), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import inventory
+
+
+class TestDynamicInventoryCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestDynamicInventoryCache, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.cfg_file = os.path.join(self.tmp_dir, 'config.yml')
+        self.inv_file = os.path.join(self.tmp_dir, 'inventory.yml')
+        self._write(self.cfg_file, 'version: v2.0\n')
+        self._write(self.inv_file, 'node1')
+
+        patches = [
+            patch('inventory.CACHE_DIR', self.cache_dir),
+            patch('inventory.get_config_path', return_value=self.cfg_file),
+            patch('inventory._get_source_files',
+                  return_value=[self.cfg_file, self.inv_file]),
+            patch('inventory.generate_dynamic_inventory',
+                  side_effect=self._generate)]
+        for patch_ in patches:
+            patch_.start()
+            self.addCleanup(patch_.stop)
+        self.generated = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _write(path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _generate(self, config_path):
+        self.assertEqual(config_path, self.cfg_file)
+        self.generated += 1
+        with open(self.inv_file) as f:
+            hostname = f.read()
+        return {'all': {'hosts': [hostname]},
+                '_meta': {'hostvars': {hostname: {'index': self.generated}}}}
+
+    def _list(self):
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            inventory.print_cached_list()
+        return json.loads(stdout.getvalue())
+
+    def _host(self, host):
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            inventory.print_cached_host(host)
+        return json.loads(stdout.getvalue())
+
+    def _generations(self):
+        return sorted(name for name in os.listdir(self.cache_dir)
+                      if name.startswith('gen-'))
+
+    def test_cache_key(self):
+        self.assertEqual(self._list()['all']['hosts'], ['node1'])
+        self.assertEqual(self._list()['all']['hosts'], ['node1'])
+        self.assertEqual(self.generated, 1)
+
+        # Same content with a new mtime is still current
+        stat = os.stat(self.inv_file)
+        os.utime(self.inv_file, ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10 ** 9))
+        self._list()
+        self.assertEqual(self.generated, 1)
+
+        # A different config file is not
+        other_cfg = os.path.join(self.tmp_dir, 'other.yml')
+        self._write(other_cfg, 'version: v2.0\n')
+        with patch('inventory.get_config_path', return_value=other_cfg), \
+                patch('inventory.generate_dynamic_inventory',
+                      return_value={'_meta': {'hostvars': {}}}):
+            self._list()
+        self.assertFalse(inventory._is_cache_current(
+            os.path.realpath(os.path.join(self.cache_dir, 'current')),
+            self.cfg_file))
+
+    def test_invalidation(self):
+        self._list()
+        self._write(self.inv_file, 'node2')
+        self.assertEqual(self._list()['all']['hosts'], ['node2'])
+        self.assertEqual(self.generated, 2)
+
+        # A missing source file is never cached
+        os.remove(self.cfg_file)
+        self._list()
+        self._list()
+        self.assertEqual(self.generated, 4)
+
+    def test_swap(self):
+        self._list()
+        first = self._generations()
+        self._write(self.inv_file, 'node2')
+        self._list()
+        second = self._generations()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first, second)
+        self.assertEqual(
+            os.readlink(os.path.join(self.cache_dir, 'current')), second[0])
+
+    def test_host(self):
+        self.assertEqual(self._host('node1'), {'index': 1})
+        self.assertEqual(self._host('node9'), {})
+        self.assertEqual(self._host('../current/node1'), {'index': 1})
+        self.assertEqual(self.generated, 1)
+
+    def test_concurrent_regeneration(self):
+        generate = self._generate
+
+        def slow_generate(config_path):
+            time.sleep(0.1)
+            return generate(config_path)
+
+        def read_hostvars():
+            with inventory.open_cache() as cache_path:
+                with open(os.path.join(cache_path, 'hostvars',
+                                       'node1.json')) as f:
+                    results.append(json.load(f))
+
+        results = []
+        with patch('inventory.generate_dynamic_inventory',
+                   side_effect=slow_generate):
+            threads = [threading.Thread(target=read_hostvars)
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, [{'index': 1}] * 4)
+        self.assertEqual(self.generated, 1)
+        self.assertEqual(len(self._generations()), 1)
+
+    def test_regeneration_waits_for_readers(self):
+        self._list()
+        self._write(self.inv_file, 'node2')
+        reader = open(os.path.join(self.cache_dir, inventory.CACHE_LOCK_FILE))
+        self.addCleanup(reader.close)
+        fcntl.flock(reader, fcntl.LOCK_SH)
+        thread = threading.Thread(target=self._list)
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(self.generated, 1)
+        fcntl.flock(reader, fcntl.LOCK_UN)
+        thread.join()
+        self.assertEqual(self.generated, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
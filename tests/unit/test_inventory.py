@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from mock import patch as patch
+from orderedattrdict import AttrDict
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.exception import UserException
+from lib.inventory import Inventory
+from lib.inv_nodes import InventoryNodes
+
+
+def _node(hostname, pxe_mac, data_macs):
+    return AttrDict([
+        ('hostname', hostname),
+        ('pxe', AttrDict([('macs', [pxe_mac]), ('devices', ['eth0'])])),
+        ('data', AttrDict([('macs', data_macs),
+                           ('devices', ['eth1', 'eth2'])])),
+        ('interfaces', [
+            AttrDict([('iface', 'eth1.10'), ('DEVICE', 'eth1'),
+                      ('slaves', 'eth1 eth2')]),
+            AttrDict([('iface', 'br0'), ('bridge_ports', 'eth0')])])])
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        super(TestInventory, self).setUp()
+        logger.create('nolog', 'info')
+        self.dbase_p = patch('lib.inventory.DatabaseInventory')
+        self.dbase = self.dbase_p.start()
+        self.dbase.return_value.load_inventory.return_value = None
+        self.inv = Inventory()
+        self.inv.inv.nodes = InventoryNodes([
+            _node('node1', 'aa:00', ['aa:01', 'aa:02']),
+            _node('node2', 'bb:00', ['bb:01', 'bb:02'])])
+
+    def tearDown(self):
+        self.dbase_p.stop()
+
+    def test_set_interface_names(self):
+        dump = self.dbase.return_value.dump_inventory
+        self.inv.set_interface_names(
+            {'aa:01': 'eth2', 'aa:02': 'eth3', 'bb:00': 'enP1'})
+
+        node1, node2 = self.inv.inv.nodes
+        self.assertEqual(node1.data.devices, ['eth2', 'eth3'])
+        self.assertEqual(node1.interfaces[0].iface, 'eth2.10')
+        self.assertEqual(node1.interfaces[0].DEVICE, 'eth2')
+        self.assertEqual(node1.interfaces[0].slaves, 'eth2 eth3')
+        self.assertEqual(node1.interfaces[1].bridge_ports, 'eth0')
+        self.assertEqual(node2.pxe.devices, ['enP1'])
+        self.assertEqual(node2.interfaces[1].bridge_ports, 'enP1')
+        self.assertEqual(node2.interfaces[0].slaves, 'eth1 eth2')
+        self.assertEqual(dump.call_count, 1)
+
+    def test_set_interface_name_unknown_mac(self):
+        self.assertRaises(UserException, self.inv.set_interface_name,
+                          'cc:00', 'eth9')
+
+    def test_compact_nodes_round_trip(self):
+        nodes = [_node('node1', 'aa:00', ['aa:01', 'aa:02']),
+                 _node('node2', 'bb:00', [None, 'BB-02'])]
+        nodes[0].pxe.ipaddrs = ['192.168.3.21']
+        nodes[1].custom = {'key': 'value'}
+        compact = InventoryNodes(nodes)
+        self.assertEqual(compact.to_dicts(), nodes)
+        self.assertEqual(list(compact.to_dicts()[1].keys()),
+                         list(nodes[1].keys()))
+
+        mac_index = compact.get_mac_index()
+        self.assertEqual(mac_index[compact.mac_key('BB-02')],
+                         (1, 'data', 1))
+
+    def test_compact_node_access(self):
+        node = InventoryNodes([_node('node1', 'aa:00', ['aa:01', None])])[0]
+        self.assertEqual(node.hostname, 'node1')
+        self.assertEqual(node['data']['macs'], ['aa:01', None])
+        self.assertIn('aa:01', node.data.macs)
+        self.assertNotIn('bb:01', node.data.macs)
+        self.assertIn(None, node.data.macs)
+        self.assertNotIn('os', node)
+        self.assertIsNone(node.get('os'))
+
+        node.data.macs[1] = 'AA-02'
+        node.pxe['ipaddrs'] = ['192.168.3.21']
+        node.custom = 'value'
+        self.assertEqual(node.custom, 'value')
+        self.assertEqual(node.to_dict().data.macs, ['aa:01', 'AA-02'])
+        self.assertEqual(list(node.pxe.keys()), ['macs', 'devices', 'ipaddrs'])
+        self.assertEqual(list(node.keys())[-1], 'custom')
+        self.assertRaises(AttributeError, getattr, node, 'missing')
+
+    def test_load_and_dump(self):
+        inv = AttrDict([('nodes', [
+            _node('node1', 'aa:00', ['aa:01', 'aa:02'])])])
+        inv.nodes[0].pxe.ipaddrs = [None]
+        self.dbase.return_value.load_inventory.return_value = inv
+        dump = self.dbase.return_value.dump_inventory
+        inventory = Inventory()
+        self.assertIsInstance(inventory.inv.nodes, InventoryNodes)
+
+        inventory.add_ipaddrs_pxe({'aa:00': '192.168.3.21'})
+        self.assertEqual(inventory.get_nodes_pxe_ipaddr(0, 0),
+                         '192.168.3.21')
+        self.assertEqual(dump.call_args[0][1], [
+            (['nodes', 0, 'pxe', 'ipaddrs', 0], '192.168.3.21')])
+        self.assertEqual(inventory.get_node_dict(0).pxe.ipaddrs,
+                         ['192.168.3.21'])
+
+    def test_get_port_mac_ip(self):
+        node = self.inv.inv.nodes[0]
+        node.pxe.switches = ['mgmt1']
+        node.pxe.ports = [10]
+        node.pxe.ipaddrs = ['192.168.3.21']
+        self.assertEqual(self.inv.get_port_mac_ip('mgmt1', 10),
+                         ('aa:00', '192.168.3.21'))
+        self.assertEqual(self.inv.get_port_mac_ip('mgmt1', 11),
+                         (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.pkg_index as pkg_index
+from lib.pkg_index import PackageIndex, compare_versions
+from repos import PowerupAnaRepoFromRepo
+from tests.unit.test_rpm import _write_rpm
+
+
+class TestPkgIndex(unittest.TestCase):
+
+    def setUp(self):
+        super(TestPkgIndex, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compare_versions(self):
+        self.assertEqual(compare_versions('1.10.0', '1.9.2'), 1)
+        self.assertEqual(compare_versions('1.2', '1.2.0'), -1)
+        self.assertEqual(compare_versions('1.02', '1.2'), 0)
+        self.assertEqual(compare_versions('1.0~rc1', '1.0'), -1)
+        self.assertEqual(compare_versions('1.0a', '1.0.1'), -1)
+        self.assertEqual(compare_versions('31.el7', '100.el7'), -1)
+        self.assertEqual(compare_versions('1.16.0rc1', '1.16.0',
+                                          pkg_index.PYPI), -1)
+        self.assertEqual(compare_versions('1.10', '1.9', pkg_index.PYPI), 1)
+
+    @patch('lib.pkg_index.get_rpms_info', wraps=pkg_index.get_rpms_info)
+    def test_rpm_index(self, mock_info):
+        _write_rpm(os.path.join(self.tmp_dir, 'bash-1.rpm'), 'bash', '4.2.9',
+                   '31.el7')
+        _write_rpm(os.path.join(self.tmp_dir, 'bash-2.rpm'), 'bash', '4.2.10',
+                   '3.el7')
+        index = PackageIndex(self.tmp_dir, pkg_index.RPM).update()
+        self.assertEqual(index.get('bash'), [('', '4.2.9', '31.el7'),
+                                             ('', '4.2.10', '3.el7')])
+        self.assertEqual(index.newest(),
+                         {'bash': {'ep': '', 'ver': '4.2.10', 'rel': '3.el7'}})
+
+        # Only new files are parsed, removed files drop out
+        os.remove(os.path.join(self.tmp_dir, 'bash-2.rpm'))
+        _write_rpm(os.path.join(self.tmp_dir, 'zsh.rpm'), 'zsh', '5.0.2',
+                   '28.el7', epoch=1)
+        index = PackageIndex(self.tmp_dir, pkg_index.RPM).update()
+        self.assertEqual(mock_info.call_args[0][1], ['zsh.rpm'])
+        self.assertEqual(index.newest(),
+                         {'bash': {'ep': '', 'ver': '4.2.9', 'rel': '31.el7'},
+                          'zsh': {'ep': '1', 'ver': '5.0.2', 'rel': '28.el7'}})
+
+    def test_verify_conda_pkgs(self):
+        repo = PowerupAnaRepoFromRepo('free', 'free', self.tmp_dir + '/')
+        repo_dir = os.path.join(repo.get_repo_dir(), f'linux-{repo.arch}')
+        os.makedirs(repo_dir)
+        for filename in ('numpy-1.10.4-py36_0.tar.bz2',
+                         'scipy-1.2.1-py36_0.tar.bz2'):
+            open(os.path.join(repo_dir, filename), 'w').close()
+        pkglist = ['numpy-1.9.3-py36_0.tar.bz2', 'scipy-1.2.1-py36_0.tar.bz2',
+                   'pandas-0.24.2-py36_0.tar.bz2']
+        self.assertEqual(repo.verify_pkgs(pkglist), (3, 2, 1, 0))
+        self.assertTrue(os.path.isfile(os.path.join(repo_dir,
+                                                    pkg_index.PKG_INDEX)))
+
+
+if __name__ == '__main__':
+    unittest.main()
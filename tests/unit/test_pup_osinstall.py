@@ -16,9 +16,16 @@
 # limitations under the License.
 
 
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import yaml
 from mock import patch as patch
 from lib import utilities as util
+import lib.logger as logger
 GOOD_NMAP_OUTPUT = """[sudo] password for jja:
 Starting Nmap 6.40 ( http://nmap.org ) at 2019-01-23 13:33 EST
 Pre-scan script results:
@@ -74,3 +81,185 @@ class TestScript(unittest.TestCase):
         # erroneous device ... not found
         util.has_dhcp_servers(device)
         assert mock_get.called_once_with(device)
+
+
+class TestInstallStatusTracker(unittest.TestCase):
+
+    def setUp(self):
+        super(TestInstallStatusTracker, self).setUp()
+        logger.create('nolog', 'info')
+        import osinstall
+        self.tmp_dir = tempfile.mkdtemp()
+        self.status_dir = os.path.join(self.tmp_dir, 'status')
+        os.mkdir(self.status_dir)
+        self.node_dict_file = os.path.join(self.tmp_dir, 'nodes.yml')
+        with open(self.node_dict_file, 'w') as f:
+            yaml.dump({'selected': {
+                'AA:00': {'bmc_ip': '10.0.0.1', 'serial': 'S1'},
+                'BB:00': {'bmc_ip': '10.0.0.2', 'serial': 'S2'}}}, f)
+        self.tracker = osinstall.InstallStatusTracker(
+            self.node_dict_file, self.status_dir)
+        self.start_time = time.time() - 10
+
+    def tearDown(self):
+        self.tracker.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _report(self, filename, report_data):
+        with open(os.path.join(self.status_dir, filename), 'w') as f:
+            json.dump(report_data, f)
+
+    def test_update(self):
+        nodes = self.tracker.update(self.start_time)
+        self.assertNotIn('other', nodes)
+        stamp = os.stat(self.node_dict_file).st_mtime_ns
+
+        self._report('192.168.3.21_start',
+                     {'ipmitool_fru_print': [{'Chassis Serial': 'S2'}]})
+        nodes = self.tracker.update(self.start_time)
+        self.assertEqual(nodes['selected']['BB:00']['pxe_ip'],
+                         '192.168.3.21')
+        self.assertIn('start_time', nodes['selected']['BB:00'])
+        self.assertNotEqual(os.stat(self.node_dict_file).st_mtime_ns, stamp)
+
+        # Unchanged reports are not processed and the file is not written
+        stamp = os.stat(self.node_dict_file).st_mtime_ns
+        with patch('osinstall.json.load') as load:
+            self.tracker.update(self.start_time)
+            self.assertFalse(load.called)
+        self.assertEqual(os.stat(self.node_dict_file).st_mtime_ns, stamp)
+
+        # Later reports are associated through the PXE IP index
+        self._report('192.168.3.21_finish', None)
+        self._report('192.168.3.99_start', None)
+        nodes = self.tracker.update(self.start_time)
+        self.assertIn('finish_time', nodes['selected']['BB:00'])
+        self.assertEqual(list(nodes['other']), ['192.168.3.99'])
+        with open(self.node_dict_file) as f:
+            self.assertEqual(yaml.full_load(f), nodes)
+
+
+class TestNodeScanner(unittest.TestCase):
+
+    def setUp(self):
+        super(TestNodeScanner, self).setUp()
+        logger.create('nolog', 'info')
+
+    @patch('osinstall.get_bmcs_sn_pn')
+    @patch('lib.utilities.scan_subnet_for_port_open')
+    @patch('lib.utilities.scan_subnet')
+    def test_scan(self, mock_subnet, mock_port, mock_sn_pn):
+        import osinstall
+
+        def sn_pn(ips, uid, pw, port, callback):
+            for ip in ips:
+                callback(ip, (f'SN {ip}', 'PN', 'ipmi'))
+
+        mock_subnet.return_value = [('10.0.0.1', 'aa:00'),
+                                    ('10.0.0.2', 'bb:00')]
+        mock_port.side_effect = lambda ips, port: (
+            [(ip, mac) for ip, mac in mock_subnet.return_value
+             if ip in ips] if port == '623' else [])
+        mock_sn_pn.side_effect = sn_pn
+
+        scanner = osinstall.NodeScanner('10.0.0.0/24', 'uid', 'pw')
+        scanner.scan()
+        items = []
+        while not scanner.queue.empty():
+            items.append(scanner.queue.get())
+        self.assertEqual(items[:2], [('devices', 2), ('bmcs', 2)])
+        self.assertIn(('node', 'AA:00', '10.0.0.1', 'SN-10.0.0.1', 'PN',
+                       'ipmi'), items)
+        self.assertEqual(scanner.known['BB:00'][0], '10.0.0.2')
+
+        # Known BMCs are not queried again unless their IP changes
+        mock_sn_pn.reset_mock()
+        scanner.scan()
+        self.assertFalse(mock_sn_pn.called)
+        mock_subnet.return_value = [('10.0.0.1', 'aa:00'),
+                                    ('10.0.0.3', 'bb:00')]
+        scanner.scan()
+        self.assertEqual(mock_sn_pn.call_args[0][0], ['10.0.0.3'])
+
+
+class TestSnPnCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestSnPnCache, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.yml')
+        self.leases_file = os.path.join(self.tmp_dir, 'dnsmasq.leases')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _cache(self, ttl=3600):
+        import osinstall
+        return osinstall.SnPnCache(self.path, ttl, [self.leases_file])
+
+    def _leases(self, *mac_ips):
+        with open(self.leases_file, 'w') as f:
+            for mac, ip in mac_ips:
+                f.write(f'1548711134 {mac} {ip} * 01:{mac}\n')
+
+    def test_cache(self):
+        cache = self._cache()
+        cache.set('aa:00', '10.0.0.1', ('SN1', 'PN1', 'ipmi'), 'uid', 'pw')
+        cache.set('bb:00', '10.0.0.2', ('SN2', 'PN2', 'openbmc'), 'uid',
+                  'pw')
+        cache.save()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        with open(self.path) as f:
+            self.assertNotIn('pw', yaml.safe_load(f)['AA:00'].values())
+
+        cache = self._cache()
+        self.assertEqual(cache.get('AA:00', '10.0.0.1', 'uid', 'pw'),
+                         ('SN1', 'PN1', 'ipmi'))
+        self.assertIsNone(cache.get('AA:00', '10.0.0.9', 'uid', 'pw'))
+
+        # bb:00 is now leased a different address
+        self._leases(('aa:00', '10.0.0.1'), ('bb:00', '10.0.0.3'))
+        cache.check_leases()
+        self.assertIsNotNone(cache.get('AA:00', '10.0.0.1', 'uid', 'pw'))
+        self.assertIsNone(cache.get('BB:00', '10.0.0.2', 'uid', 'pw'))
+
+        self.assertIsNone(self._cache(ttl=-1).get('AA:00', '10.0.0.1',
+                                                  'uid', 'pw'))
+
+    def test_cache_credentials(self):
+        cache = self._cache()
+        cache.set('aa:00', '10.0.0.1', ('SN1', 'PN1', 'ipmi'), 'uid', 'pw')
+        self.assertIsNone(cache.get('AA:00', '10.0.0.1', 'uid', 'wrong'))
+        self.assertIsNone(cache.get('AA:00', '10.0.0.1', 'admin', 'pw'))
+        self.assertIsNotNone(cache.get('AA:00', '10.0.0.1', 'uid', 'pw'))
+
+        # Entries written without credentials never hit
+        del cache.entries['AA:00']['cred_salt']
+        self.assertIsNone(cache.get('AA:00', '10.0.0.1', 'uid', 'pw'))
+
+    @patch('osinstall.get_bmcs_sn_pn')
+    @patch('lib.utilities.scan_subnet_for_port_open')
+    @patch('lib.utilities.scan_subnet')
+    def test_scanner_credentials(self, mock_subnet, mock_port, mock_sn_pn):
+        import osinstall
+        mock_subnet.return_value = [('10.0.0.1', 'aa:00')]
+        mock_port.return_value = [('10.0.0.1', 'aa:00')]
+        cache = self._cache()
+        cache.set('aa:00', '10.0.0.1', ('SN1', 'PN1', 'ipmi'), 'uid', 'pw')
+
+        # A changed password queries the BMC instead of using the cache
+        scanner = osinstall.NodeScanner('10.0.0.0/24', 'uid', 'wrong',
+                                        cache=cache)
+        scanner.scan()
+        self.assertEqual(mock_sn_pn.call_args[0][:3],
+                         (['10.0.0.1'], 'uid', 'wrong'))
+        self.assertEqual(scanner.known, {})
+
+        mock_sn_pn.reset_mock()
+        scanner = osinstall.NodeScanner('10.0.0.0/24', 'uid', 'pw',
+                                        cache=cache)
+        scanner.scan()
+        self.assertFalse(mock_sn_pn.called)
+        self.assertEqual(scanner.known['AA:00'],
+                         ('10.0.0.1', 'SN1', 'PN1', 'ipmi'))
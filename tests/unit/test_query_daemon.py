@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch as patch
+from orderedattrdict import AttrDict
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.query_daemon as query_daemon
+from lib.exception import UserException
+from lib.inv_nodes import InventoryNodes
+from lib.query_daemon import (QueryClient, QueryProxy, QueryServer,
+                              _ReadWriteLock)
+
+
+class _Inventory(object):
+    """Inventory stand-in reading hostnames from the inventory file"""
+
+    loads = 0
+
+    def __init__(self, config_path):
+        _Inventory.loads += 1
+        self.dbase = AttrDict(inv_file=config_path + '.inv')
+        with open(self.dbase.inv_file) as f:
+            self.hostnames = f.read().split()
+        self.staged = []
+
+    def get_nodes_hostname(self, index=None):
+        return self.hostnames if index is None else self.hostnames[index]
+
+    def yield_nodes_hostname(self):
+        return iter(self.hostnames)
+
+    def get_nodes_compact(self):
+        return InventoryNodes([AttrDict([('macs', ['aa:00'])])])[0]
+
+    def get_object(self):
+        return object()
+
+    def get_missing(self, key):
+        return {}[key]
+
+    def get_user_error(self):
+        raise UserException('user error')
+
+    def set_nodes_hostname(self, index, hostname):
+        self.hostnames[index] = hostname
+        with open(self.dbase.inv_file, 'w') as f:
+            f.write(' '.join(self.hostnames))
+
+    def add_nodes_hostname(self, hostname):
+        self.staged.append(hostname)
+
+    def update_nodes(self):
+        pass
+
+
+class _Config(object):
+
+    def __init__(self, config_path):
+        pass
+
+    def get_depl_netw_cont_ip(self):
+        return '192.168.5.2'
+
+
+class TestQueryDaemon(unittest.TestCase):
+
+    def setUp(self):
+        super(TestQueryDaemon, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'query.sock')
+        self.cfg_file = os.path.join(self.tmp_dir, 'config.yml')
+        with open(self.cfg_file, 'w') as f:
+            f.write('version: v2.0\n')
+        self._write_inventory('node1 node2')
+        _Inventory.loads = 0
+
+        for patch_ in (patch('lib.inventory.Inventory', _Inventory),
+                       patch('lib.config.Config', _Config)):
+            patch_.start()
+            self.addCleanup(patch_.stop)
+
+        self.server = QueryServer(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        for _ in range(100):
+            self.client = QueryClient.connect(self.socket_path)
+            if self.client is not None:
+                break
+            time.sleep(0.01)
+        self.inv = QueryProxy(self.client, query_daemon.INVENTORY,
+                              self.cfg_file)
+
+    def tearDown(self):
+        self.client.request(op='shutdown')
+        self.client.close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_inventory(self, content):
+        with open(self.cfg_file + '.inv', 'w') as f:
+            f.write(content)
+
+    def test_proxy(self):
+        self.assertEqual(self.client.request(op='ping'), os.getpid())
+        self.assertEqual(self.inv.get_nodes_hostname(), ['node1', 'node2'])
+        self.assertEqual(self.inv.get_nodes_hostname(1), 'node2')
+        self.assertEqual(list(self.inv.yield_nodes_hostname()),
+                         ['node1', 'node2'])
+        self.assertEqual(self.inv.get_nodes_compact(), {'macs': ['aa:00']})
+        cfg = QueryProxy(self.client, query_daemon.CONFIG, self.cfg_file)
+        self.assertEqual(cfg.get_depl_netw_cont_ip(), '192.168.5.2')
+        self.assertEqual(_Inventory.loads, 1)
+
+        self.inv.set_nodes_hostname(0, 'node3')
+        self.assertEqual(self.inv.get_nodes_hostname(0), 'node3')
+        self.assertEqual(_Inventory.loads, 1)
+
+    def test_reload_on_change(self):
+        self.assertEqual(self.inv.get_nodes_hostname(0), 'node1')
+        self._write_inventory('node10 node2')
+        self.assertEqual(self.inv.get_nodes_hostname(0), 'node10')
+        self.assertEqual(_Inventory.loads, 2)
+
+    def test_exceptions(self):
+        self.assertRaises(KeyError, self.inv.get_missing, 'key')
+        self.assertRaises(UserException, self.inv.get_user_error)
+        self.assertRaises(IndexError, self.inv.get_nodes_hostname, 5)
+        self.assertRaises(TypeError, self.inv.get_object)
+        self.assertRaises(UserException, self.client.request,
+                          op='call', obj='switch', method='get_x')
+        self.assertRaises(AttributeError, getattr, self.inv, 'dbase')
+        # The connection is still usable
+        self.assertEqual(self.inv.get_nodes_hostname(0), 'node1')
+
+    def test_untrusted_socket(self):
+        self.assertIsNotNone(QueryClient.connect(self.socket_path))
+        # Socket or daemon of another user
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(QueryClient.connect(self.socket_path))
+        with patch('lib.query_daemon._check_peer', return_value=False):
+            self.assertIsNone(QueryClient.connect(self.socket_path))
+        # Directory other users can write to
+        os.chmod(self.tmp_dir, 0o777)
+        try:
+            self.assertIsNone(QueryClient.connect(self.socket_path))
+            self.assertRaises(UserException, query_daemon._make_socket_dir,
+                              self.socket_path)
+        finally:
+            os.chmod(self.tmp_dir, 0o700)
+        # Not a socket
+        self.assertIsNone(QueryClient.connect(self.cfg_file))
+
+    def test_socket_dir(self):
+        socket_dir = os.path.join(self.tmp_dir, 'run')
+        query_daemon._make_socket_dir(os.path.join(socket_dir, 'query.sock'))
+        self.assertEqual(os.stat(socket_dir).st_mode & 0o777, 0o700)
+        os.symlink(socket_dir, socket_dir + '.link')
+        self.assertRaises(UserException, query_daemon._make_socket_dir,
+                          os.path.join(socket_dir + '.link', 'query.sock'))
+
+    def test_remote_exception_types(self):
+        exc = query_daemon._remote_exception(
+            {'error': 'x', 'exception': 'UserCriticalException',
+             'module': 'lib.exception', 'args': ['x']})
+        self.assertEqual(type(exc).__name__, 'UserCriticalException')
+        exc = query_daemon._remote_exception(
+            {'error': 'x', 'exception': 'TestQueryDaemon',
+             'module': __name__, 'args': ['x']})
+        self.assertIsInstance(exc, UserException)
+        exc = query_daemon._remote_exception(
+            {'error': 'x', 'exception': 'SystemExit',
+             'module': 'builtins', 'args': [1]})
+        self.assertIsInstance(exc, UserException)
+
+    def test_staging_not_served(self):
+        self.assertRaises(AttributeError, getattr, self.inv,
+                          'add_nodes_hostname')
+        self.assertRaises(AttributeError, getattr, self.inv, 'update_nodes')
+        self.assertRaises(UserException, self.client.request,
+                          op='call', obj=query_daemon.INVENTORY,
+                          method='add_nodes_hostname', args=['node3'],
+                          config_path=self.cfg_file)
+
+    def test_fallback(self):
+        with patch('lib.query_daemon._client', None), \
+                patch('lib.query_daemon.QueryClient.connect',
+                      return_value=None):
+            inv = query_daemon.get_inventory(self.cfg_file)
+            self.assertIsInstance(inv, _Inventory)
+            self.assertIsInstance(query_daemon.get_config(self.cfg_file),
+                                  _Config)
+        with patch('lib.query_daemon._client', self.client):
+            self.assertIsInstance(
+                query_daemon.get_inventory(self.cfg_file), QueryProxy)
+
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def _start(self, target):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join(0.1)
+        return thread
+
+    def test_lock(self):
+        lock = _ReadWriteLock()
+        events = []
+
+        def read():
+            lock.acquire_read()
+            events.append('read')
+            lock.release_read()
+
+        def write():
+            lock.acquire_write()
+            events.append('write')
+            lock.release_write()
+
+        # Readers share the lock
+        lock.acquire_read()
+        self.assertFalse(self._start(read).is_alive())
+        # A writer waits for the readers
+        writer = self._start(write)
+        self.assertTrue(writer.is_alive())
+        lock.release_read()
+        writer.join()
+        self.assertEqual(events, ['read', 'write'])
+
+        # Readers wait for the writer
+        lock.acquire_write()
+        reader = self._start(read)
+        self.assertTrue(reader.is_alive())
+        lock.release_write()
+        reader.join()
+        self.assertEqual(events, ['read', 'write', 'read'])
+
+
+if __name__ == '__main__':
+    unittest.main()
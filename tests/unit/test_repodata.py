@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bz2
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.repodata as repodata
+
+REPODATA = {
+    'info': {'subdir': 'linux-ppc64le', 'default_python_version': 3.6},
+    'packages': {
+        f'pkg{index}-1.{index}-py36_0.tar.bz2': {
+            'name': f'pkg{index}', 'version': f'1.{index}', 'size': 1000 +
+            index, 'depends': ['python >=3.6,<3.7', 'libgcc-ng >=7.3.0'],
+            'license': 'BSD é'}
+        for index in range(50)},
+    'packages.conda': {},
+    'removed': [],
+    'repodata_version': 1234567}
+
+
+class TestRepodata(unittest.TestCase):
+
+    def setUp(self):
+        super(TestRepodata, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'repodata.json')
+        with open(self.path, 'w') as f:
+            json.dump(REPODATA, f, indent=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('lib.repodata.READ_SIZE', 7)
+    def test_iter_packages(self):
+        self.assertEqual(dict(repodata.iter_packages(self.path)),
+                         REPODATA['packages'])
+        with open(self.path, 'w') as f:
+            f.write('{"packages": {"a.tar.bz2": {}')
+        with self.assertRaises(repodata.RepodataError):
+            list(repodata.iter_packages(self.path))
+
+    @patch('lib.repodata.READ_SIZE', 64)
+    def test_filter_repodata(self):
+        keep = {'pkg3-1.3-py36_0.tar.bz2', 'pkg10-1.10-py36_0.tar.bz2',
+                'other.tar.bz2'}
+        self.assertEqual(repodata.filter_repodata(self.path, keep), (2, 48))
+        expected = dict(REPODATA)
+        expected['packages'] = {pkg: entry for pkg, entry in
+                                REPODATA['packages'].items() if pkg in keep}
+        with open(self.path) as f:
+            text = f.read()
+        self.assertEqual(json.loads(text), expected)
+        self.assertNotIn('\n', text)
+        with bz2.open(self.path + '.bz2', 'rt') as f:
+            self.assertEqual(f.read(), text)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['repodata.json', 'repodata.json.bz2'])
+        self.assertEqual(dict(repodata.iter_packages(self.path + '.bz2')),
+                         expected['packages'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.repomd as repomd
+import lib.rpm as rpm
+from lib.pkg_index import PackageIndex, PKG_INDEX, RPM
+from tests.unit.test_rpm import _write_rpm
+
+NS = {'repo': repomd.NS_REPO, 'common': repomd.NS_COMMON,
+      'rpm': repomd.NS_RPM, 'filelists': repomd.NS_FILELISTS,
+      'other': repomd.NS_OTHER}
+EXTRA = [(repomd.RPMTAG_PROVIDENAME, rpm.RPM_STRING_ARRAY_TYPE,
+          ['bash', '/bin/sh']),
+         (repomd.RPMTAG_PROVIDEFLAGS, rpm.RPM_INT32_TYPE, [8, 0]),
+         (repomd.RPMTAG_PROVIDEVERSION, rpm.RPM_STRING_ARRAY_TYPE,
+          ['4.2.46-31.el7', '']),
+         (repomd.RPMTAG_REQUIRENAME, rpm.RPM_STRING_ARRAY_TYPE,
+          ['rpmlib(PayloadIsXz)', 'glibc', 'ncurses']),
+         (repomd.RPMTAG_REQUIREFLAGS, rpm.RPM_INT32_TYPE, [16777226, 12, 64]),
+         (repomd.RPMTAG_REQUIREVERSION, rpm.RPM_STRING_ARRAY_TYPE,
+          ['5.2-1', '1:2.17', '']),
+         (repomd.RPMTAG_DIRNAMES, rpm.RPM_STRING_ARRAY_TYPE,
+          ['/usr/bin/', '/usr/share/doc/', '/usr/share/doc/bash/']),
+         (repomd.RPMTAG_BASENAMES, rpm.RPM_STRING_ARRAY_TYPE,
+          ['bash', 'bash', 'README']),
+         (repomd.RPMTAG_DIRINDEXES, rpm.RPM_INT32_TYPE, [0, 1, 2]),
+         (repomd.RPMTAG_FILEMODES, rpm.RPM_INT16_TYPE,
+          [0o100755, 0o40755, 0o100644]),
+         (repomd.RPMTAG_CHANGELOGTIME, rpm.RPM_INT32_TYPE, [1500000000]),
+         (repomd.RPMTAG_CHANGELOGNAME, rpm.RPM_STRING_ARRAY_TYPE,
+          ['Jane <jane@example.com> - 4.2.46-31']),
+         (repomd.RPMTAG_CHANGELOGTEXT, rpm.RPM_STRING_ARRAY_TYPE,
+          ['- Fix <thing> & other'])]
+
+
+class TestRepomd(unittest.TestCase):
+
+    def setUp(self):
+        super(TestRepomd, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp_dir, 'Packages'))
+        _write_rpm(os.path.join(self.tmp_dir, 'Packages', 'bash.rpm'), 'bash',
+                   '4.2.46', '31.el7', extra=EXTRA)
+        _write_rpm(os.path.join(self.tmp_dir, 'zsh.rpm'), 'zsh', '5.0.2',
+                   '28.el7', epoch=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, kind):
+        repodata_dir = os.path.join(self.tmp_dir, 'repodata')
+        root = ET.parse(os.path.join(repodata_dir, 'repomd.xml')).getroot()
+        data = root.find(f"repo:data[@type='{kind}']", NS)
+        href = data.find('repo:location', NS).get('href')
+        with open(os.path.join(self.tmp_dir, href), 'rb') as f:
+            content = f.read()
+        self.assertEqual(data.find('repo:checksum', NS).text,
+                         hashlib.sha256(content).hexdigest())
+        return ET.fromstring(gzip.decompress(content))
+
+    def test_create_metadata(self):
+        self.assertEqual(repomd.create_metadata(self.tmp_dir), (2, 2, 0))
+        primary = self._read('primary')
+        self.assertEqual(primary.get('packages'), '2')
+        pkgs = primary.findall('common:package', NS)
+        self.assertEqual([pkg.find('common:location', NS).get('href')
+                          for pkg in pkgs], ['Packages/bash.rpm', 'zsh.rpm'])
+        bash = pkgs[0]
+        with open(os.path.join(self.tmp_dir, 'Packages', 'bash.rpm'),
+                  'rb') as f:
+            self.assertEqual(bash.find('common:checksum', NS).text,
+                             hashlib.sha256(f.read()).hexdigest())
+        self.assertEqual(pkgs[1].find('common:version', NS).attrib,
+                         {'epoch': '1', 'ver': '5.0.2', 'rel': '28.el7'})
+        fmt = bash.find('common:format', NS)
+        self.assertEqual(
+            [entry.attrib for entry in fmt.find('rpm:provides', NS)],
+            [{'name': 'bash', 'flags': 'EQ', 'epoch': '0', 'ver': '4.2.46',
+              'rel': '31.el7'}, {'name': '/bin/sh'}])
+        self.assertEqual(
+            [entry.attrib for entry in fmt.find('rpm:requires', NS)],
+            [{'name': 'glibc', 'flags': 'GE', 'epoch': '1', 'ver': '2.17'},
+             {'name': 'ncurses', 'pre': '1'}])
+        self.assertEqual([f.text for f in fmt.findall('common:file', NS)],
+                         ['/usr/bin/bash'])
+
+        filelists = self._read('filelists')
+        files = filelists.find('filelists:package', NS).findall(
+            'filelists:file', NS)
+        self.assertEqual([(f.text, f.get('type')) for f in files],
+                         [('/usr/bin/bash', None), ('/usr/share/doc/bash', 'dir'),
+                          ('/usr/share/doc/bash/README', None)])
+        other = self._read('other')
+        self.assertEqual(
+            other.find('other:package/other:changelog', NS).text,
+            '- Fix <thing> & other')
+
+    @patch('lib.repomd.read_rpm_header', wraps=rpm.read_rpm_header)
+    def test_update_metadata(self, mock_read):
+        repomd.create_metadata(self.tmp_dir)
+        repodata_dir = os.path.join(self.tmp_dir, 'repodata')
+        repomd_path = os.path.join(repodata_dir, 'repomd.xml')
+        with open(repomd_path) as f:
+            text = f.read()
+        with open(repomd_path, 'w') as f:
+            f.write(text.replace('</repomd>', '<data type="group"><location '
+                                 'href="repodata/comps.xml"/></data></repomd>'))
+        mtime = os.stat(repomd_path).st_mtime_ns
+
+        # Nothing changed, nothing is read or written
+        self.assertEqual(repomd.create_metadata(self.tmp_dir), (2, 0, 0))
+        self.assertEqual(mock_read.call_count, 2)
+        self.assertEqual(os.stat(repomd_path).st_mtime_ns, mtime)
+
+        _write_rpm(os.path.join(self.tmp_dir, 'tcsh.rpm'), 'tcsh', '6.18.01',
+                   '15.el7')
+        os.remove(os.path.join(self.tmp_dir, 'zsh.rpm'))
+        self.assertEqual(repomd.create_metadata(self.tmp_dir), (2, 1, 1))
+        self.assertEqual(mock_read.call_count, 3)
+        self.assertEqual(
+            [pkg.find('common:name', NS).text for pkg in
+             self._read('primary').findall('common:package', NS)],
+            ['bash', 'tcsh'])
+        root = ET.parse(repomd_path).getroot()
+        self.assertEqual([data.get('type') for data in
+                          root.findall('repo:data', NS)],
+                         ['primary', 'filelists', 'other', 'group'])
+        self.assertEqual(len([name for name in os.listdir(repodata_dir)
+                              if name.endswith('.xml.gz')]), 3)
+
+    @patch('lib.rpm.read_rpm_info', wraps=rpm.read_rpm_info)
+    def test_shared_index(self, mock_info):
+        for name in ('.rpm_info.yml', '.repomd_cache.json'):
+            open(os.path.join(self.tmp_dir, name), 'w').close()
+        repomd.create_metadata(self.tmp_dir)
+
+        # Headers read for the metadata are not read again for versions
+        index = PackageIndex(self.tmp_dir, RPM).update()
+        self.assertEqual(index.newest(),
+                         {'zsh': {'ep': '1', 'ver': '5.0.2', 'rel': '28.el7'}})
+        mock_info.assert_not_called()
+        self.assertEqual(sorted(name for name in os.listdir(self.tmp_dir)
+                                if name.startswith('.')), [PKG_INDEX])
+
+        # Metadata updates keep the recorded versions of unchanged files
+        _write_rpm(os.path.join(self.tmp_dir, 'tcsh.rpm'), 'tcsh', '6.18.01',
+                   '15.el7')
+        self.assertEqual(repomd.create_metadata(self.tmp_dir), (3, 1, 0))
+        with patch('lib.pkg_index.get_rpms_info',
+                   wraps=rpm.get_rpms_info) as mock_get:
+            index = PackageIndex(self.tmp_dir, RPM).update()
+        self.assertEqual(mock_get.call_args[0][1], ['tcsh.rpm'])
+        self.assertEqual(sorted(index.newest()), ['tcsh', 'zsh'])
+        mock_info.assert_not_called()
+
+    @patch('lib.repomd.PROCESS_THRESHOLD', 1)
+    def test_create_metadata_processes(self):
+        self.assertEqual(repomd.create_metadata(self.tmp_dir, workers=2),
+                         (2, 2, 0))
+        self.assertEqual(self._read('other').get('packages'), '2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from repos import PowerupAnaRepoFromRepo, PowerupPypiRepoFromRepo
+
+PKGS = ('numpy-1.16.4-py36h99e49ec_0.tar.bz2',
+        'pandas-0.24.2-py36he6710b0_0.tar.bz2',
+        'scipy-1.2.1-py36he2b7bc3_0.tar.bz2')
+
+
+class _Handler(SimpleHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super(_Handler, self).do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPowerupAnaRepoFromRepo(unittest.TestCase):
+
+    def setUp(self):
+        super(TestPowerupAnaRepoFromRepo, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.channel_dir = os.path.join(self.tmp_dir, 'channel')
+        os.mkdir(self.channel_dir)
+        packages = {}
+        for index, pkg in enumerate(PKGS):
+            content = os.urandom(2000 + index)
+            with open(os.path.join(self.channel_dir, pkg), 'wb') as f:
+                f.write(content)
+            packages[pkg] = {'size': len(content),
+                             'sha256': hashlib.sha256(content).hexdigest(),
+                             'md5': hashlib.md5(content).hexdigest()}
+        with open(os.path.join(self.channel_dir, 'repodata.json'), 'w') as f:
+            json.dump({'info': {'subdir': 'linux-ppc64le'},
+                       'packages': packages}, f)
+
+        handler = functools.partial(_Handler, directory=self.channel_dir)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(
+            self.server.server_address[1])
+        self.cache_p = patch('lib.checksum.CHECKSUM_CACHE',
+                             os.path.join(self.tmp_dir, 'cache.json'))
+        self.cache_p.start()
+        self.store_cache_p = patch.dict('lib.checksum._caches', clear=True)
+        self.store_cache_p.start()
+
+    def tearDown(self):
+        self.cache_p.stop()
+        self.store_cache_p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _pkg_requests(self):
+        return sorted(path for path in self.server.requests
+                      if path.endswith('.tar.bz2'))
+
+    def test_sync_ana(self):
+        repo = PowerupAnaRepoFromRepo('free', 'free', self.tmp_dir + '/')
+        dest_dir = repo.sync_ana(self.url, acclist=list(PKGS[:2]))
+        self.assertEqual(self._pkg_requests(), ['/' + pkg for pkg in PKGS[:2]])
+        with open(os.path.join(dest_dir, 'repodata.json')) as f:
+            self.assertEqual(sorted(json.load(f)['packages']),
+                             list(PKGS[:2]))
+
+        # Only missing and damaged packages are fetched again
+        with open(os.path.join(dest_dir, PKGS[0]), 'r+b') as f:
+            f.write(b'x')
+        self.server.requests = []
+        repo.sync_ana(self.url)
+        self.assertEqual(self._pkg_requests(), ['/' + PKGS[0], '/' + PKGS[2]])
+        for pkg in PKGS:
+            with open(os.path.join(dest_dir, pkg), 'rb') as f1, \
+                    open(os.path.join(self.channel_dir, pkg), 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+
+WHEELS = ('Keras-2.0.5-py2.py3-none-any.whl',
+          'numpy-1.16.4-cp27-cp27mu-manylinux1_ppc64le.whl',
+          'numpy-1.16.4-cp27-cp27mu-manylinux1_x86_64.whl',
+          'numpy-1.16.5rc1-cp27-cp27mu-manylinux1_ppc64le.whl',
+          'six-1.11.0-py2.py3-none-any.whl',
+          'six-1.12.0.tar.gz',
+          'six-1.12.0-py2.py3-none-any.whl')
+
+
+class TestPowerupPypiRepoFromRepo(unittest.TestCase):
+
+    def setUp(self):
+        super(TestPowerupPypiRepoFromRepo, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.tmp_dir, 'index')
+        links = {}
+        for filename in WHEELS:
+            content = os.urandom(1000)
+            project = filename.split('-')[0].lower()
+            os.makedirs(os.path.join(self.index_dir, 'packages'),
+                        exist_ok=True)
+            with open(os.path.join(self.index_dir, 'packages', filename),
+                      'wb') as f:
+                f.write(content)
+            links.setdefault(project, []).append(
+                '<a href="../../packages/{0}#sha256={1}">{0}</a><br/>'.format(
+                    filename, hashlib.sha256(content).hexdigest()))
+        for project, anchors in links.items():
+            os.makedirs(os.path.join(self.index_dir, 'simple', project))
+            with open(os.path.join(self.index_dir, 'simple', project,
+                                   'index.html'), 'w') as f:
+                f.write('<html><body>{}</body></html>'.format(
+                    ''.join(anchors)))
+
+        handler = functools.partial(_Handler, directory=self.index_dir)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/simple'.format(
+            self.server.server_address[1])
+        self.cache_p = patch('lib.checksum.CHECKSUM_CACHE',
+                             os.path.join(self.tmp_dir, 'cache.json'))
+        self.cache_p.start()
+        self.store_cache_p = patch.dict('lib.checksum._caches', clear=True)
+        self.store_cache_p.start()
+
+    def tearDown(self):
+        self.cache_p.stop()
+        self.store_cache_p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sync(self):
+        os.mkdir(os.path.join(self.tmp_dir, 'repos'))
+        repo = PowerupPypiRepoFromRepo('pypi', 'pypi', self.tmp_dir)
+        repo.sync('Keras==2.0.5 numpy>=1.16 six<=1.12.0 missing==1.0',
+                  self.url)
+        expected = ['Keras-2.0.5-py2.py3-none-any.whl',
+                    'numpy-1.16.4-cp27-cp27mu-manylinux1_ppc64le.whl',
+                    'six-1.12.0-py2.py3-none-any.whl']
+        self.assertEqual(sorted(path for path in self.server.requests
+                                if path.startswith('/packages/')),
+                         ['/packages/' + filename for filename in expected])
+        for filename in expected:
+            link = os.path.join(repo.pypirepo_dir, 'simple',
+                                filename.split('-')[0].lower(), filename)
+            self.assertTrue(os.path.isfile(link))
+
+        # Pinned and present requirements need no requests
+        self.server.requests = []
+        repo.sync('Keras==2.0.5', self.url)
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
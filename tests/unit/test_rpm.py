@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.rpm as rpm
+from lib.utilities import get_rpm_info
+
+
+def _header(entries, pad=False):
+    """Header structure of (tag, type, value) entries"""
+    index = b''
+    store = b''
+    for tag, tag_type, value in entries:
+        count = 1
+        if tag_type == rpm.RPM_INT32_TYPE:
+            store += b'\0' * (-len(store) % 4)
+            values = value if isinstance(value, list) else [value]
+            count = len(values)
+            data = struct.pack(f'>{count}i', *values)
+        elif tag_type == rpm.RPM_INT16_TYPE:
+            store += b'\0' * (-len(store) % 2)
+            count = len(value)
+            data = struct.pack(f'>{count}H', *value)
+        elif tag_type == rpm.RPM_STRING_ARRAY_TYPE:
+            count = len(value)
+            data = b''.join(item.encode() + b'\0' for item in value)
+        else:
+            data = value.encode() + b'\0'
+        index += struct.pack('>iiii', tag, tag_type, len(store), count)
+        store += data
+    header = (rpm.HEADER_MAGIC + b'\0' * 4 +
+              struct.pack('>II', len(entries), len(store)) + index + store)
+    if pad:
+        header += b'\0' * (-len(header) % 8)
+    return header
+
+
+def _write_rpm(path, name, version, release, arch='ppc64le', epoch=None,
+               source=False, extra=()):
+    entries = [(rpm.RPMTAG_NAME, rpm.RPM_STRING_TYPE, name),
+               (rpm.RPMTAG_VERSION, rpm.RPM_STRING_TYPE, version),
+               (rpm.RPMTAG_RELEASE, rpm.RPM_STRING_TYPE, release),
+               (1004, rpm.RPM_I18NSTRING_TYPE, 'Summary ' * 100)]
+    if epoch is not None:
+        entries.append((rpm.RPMTAG_EPOCH, rpm.RPM_INT32_TYPE, epoch))
+    entries.append((rpm.RPMTAG_ARCH, rpm.RPM_STRING_TYPE, arch))
+    if not source:
+        entries.append((rpm.RPMTAG_SOURCERPM, rpm.RPM_STRING_TYPE,
+                        f'{name}-{version}-{release}.src.rpm'))
+    entries.extend(extra)
+    lead = rpm.LEAD_MAGIC + b'\0' * (rpm.LEAD_SIZE - 4)
+    signature = _header([(1000, rpm.RPM_INT32_TYPE, 12345),
+                         (1004, rpm.RPM_STRING_TYPE, 'x' * 13)], pad=True)
+    with open(path, 'wb') as f:
+        f.write(lead + signature + _header(entries) + b'payload')
+
+
+class TestRpm(unittest.TestCase):
+
+    def setUp(self):
+        super(TestRpm, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_rpm_info(self):
+        path = os.path.join(self.tmp_dir, 'pkg.rpm')
+        _write_rpm(path, 'bash', '4.2.46', '31.el7', epoch=1)
+        self.assertEqual(rpm.read_rpm_info(path),
+                         {'name': 'bash', 'ep': '1', 'ver': '4.2.46',
+                          'rel': '31.el7', 'arch': 'ppc64le'})
+        _write_rpm(path, 'bash', '4.2.46', '31.el7', source=True)
+        self.assertEqual(rpm.read_rpm_info(path),
+                         {'name': 'bash', 'ep': '', 'ver': '4.2.46',
+                          'rel': '31.el7', 'arch': 'src'})
+        with open(path, 'wb') as f:
+            f.write(b'not an rpm')
+        self.assertRaises(rpm.RpmError, rpm.read_rpm_info, path)
+
+    @patch('lib.rpm.read_rpm_info', wraps=rpm.read_rpm_info)
+    def test_get_rpm_info(self, mock_read):
+        _write_rpm(os.path.join(self.tmp_dir, 'bash-1.rpm'), 'bash', '4.2.46',
+                   '31.el7')
+        _write_rpm(os.path.join(self.tmp_dir, 'bash-2.rpm'), 'bash', '4.2.46',
+                   '34.el7')
+        _write_rpm(os.path.join(self.tmp_dir, 'zsh.rpm'), 'zsh', '5.0.2',
+                   '28.el7', epoch=0)
+        with open(os.path.join(self.tmp_dir, 'bad.rpm'), 'wb') as f:
+            f.write(b'bad')
+        filelist = sorted(os.listdir(self.tmp_dir))
+        expected = {'bash': {'ep': '', 'ver': '4.2.46', 'rel': '34.el7'},
+                    'zsh': {'ep': '0', 'ver': '5.0.2', 'rel': '28.el7'}}
+        self.assertEqual(get_rpm_info(filelist, self.tmp_dir), expected)
+        self.assertEqual(mock_read.call_count, 4)
+
+        # Unchanged files are served from the index
+        self.assertEqual(get_rpm_info(filelist, self.tmp_dir), expected)
+        self.assertEqual(mock_read.call_count, 5)
+        _write_rpm(os.path.join(self.tmp_dir, 'zsh.rpm'), 'zsh', '5.0.2',
+                   '29.el7abc')
+        self.assertEqual(
+            rpm.get_rpms_info(self.tmp_dir)['zsh.rpm']['rel'], '29.el7abc')
+        self.assertEqual(mock_read.call_count, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
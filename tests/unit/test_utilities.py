@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+import lib.utilities as util
+
+ISO_NAME = 'RHEL-7.6-Server-ppc64le-dvd1'
+
+
+def _xorriso(cmd):
+    """Stand-in for 'xorriso -extract / <dir>' of a RHEL image"""
+    tree_dir = cmd.split()[-1]
+    os.makedirs(os.path.join(tree_dir, 'ppc/ppc64'))
+    for filename in ('vmlinuz', 'initrd.img'):
+        with open(os.path.join(tree_dir, 'ppc/ppc64', filename), 'w') as f:
+            f.write(filename)
+    os.chmod(os.path.join(tree_dir, 'ppc'), 0o555)
+    return ''
+
+
+class TestExtractIsoImage(unittest.TestCase):
+
+    def setUp(self):
+        super(TestExtractIsoImage, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dest_dir = os.path.join(self.tmp_dir, 'html')
+        os.mkdir(self.dest_dir)
+        self.iso_path = os.path.join(self.tmp_dir, ISO_NAME + '.iso')
+        with open(self.iso_path, 'w') as f:
+            f.write('iso content')
+
+    def tearDown(self):
+        util._remove_tree(self.tmp_dir)
+
+    @patch('lib.utilities.sha1sum', wraps=util.sha1sum)
+    @patch('lib.utilities.bash_cmd', side_effect=_xorriso)
+    def test_extract_iso_image(self, mock_cmd, mock_sha1sum):
+        expected = (os.path.join(ISO_NAME, 'ppc/ppc64/vmlinuz'),
+                    os.path.join(ISO_NAME, 'ppc/ppc64/initrd.img'))
+        self.assertEqual(
+            util.extract_iso_image(self.iso_path, self.dest_dir), expected)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.dest_dir, expected[0])))
+
+        # Unchanged image is neither hashed nor extracted again
+        self.assertEqual(
+            util.extract_iso_image(self.iso_path, self.dest_dir), expected)
+        self.assertEqual(mock_sha1sum.call_count, 1)
+        self.assertEqual(mock_cmd.call_count, 1)
+
+        # Renamed image is hashed but not extracted again
+        renamed = os.path.join(self.tmp_dir, 'RHEL-7.6-ppc64le.iso')
+        shutil.copy(self.iso_path, renamed)
+        kernel, initrd = util.extract_iso_image(renamed, self.dest_dir)
+        self.assertEqual(kernel, 'RHEL-7.6-ppc64le/ppc/ppc64/vmlinuz')
+        self.assertTrue(os.path.isfile(os.path.join(self.dest_dir, initrd)))
+        self.assertEqual(mock_sha1sum.call_count, 2)
+        self.assertEqual(mock_cmd.call_count, 1)
+
+    @patch('lib.utilities.bash_cmd')
+    def test_extract_iso_image_failed(self, mock_cmd):
+        mock_cmd.side_effect = lambda cmd: _xorriso(cmd) + 1
+        self.assertRaises(TypeError, util.extract_iso_image, self.iso_path,
+                          self.dest_dir)
+        self.assertEqual(
+            os.listdir(os.path.join(self.dest_dir, util.ISO_CACHE_DIR)), [])
+        self.assertFalse(os.path.exists(os.path.join(self.dest_dir,
+                                                     ISO_NAME)))
+
+
+class TestPackagesInMessage(unittest.TestCase):
+
+    def test_packages_in_message(self):
+        pkgs = ['python', 'python-devel', 'tcsh-6.18.01-15.el7.ppc64le']
+        self.assertEqual(util.packages_in_message(
+            'No Match for argument: python-devel', pkgs), ['python-devel'])
+        self.assertEqual(util.packages_in_message(
+            'No package python available.', pkgs), ['python'])
+        self.assertEqual(util.packages_in_message(
+            'http://repo/Packages/python-devel-2.7.5-88.el7.ppc64le.rpm: '
+            '[Errno 14] HTTP Error 404 - Not Found', pkgs), ['python-devel'])
+        self.assertEqual(util.packages_in_message(
+            'http://repo/tcsh-6.18.01-15.el7.ppc64le.rpm: [Errno 14] HTTP '
+            'Error 404 - Not Found', pkgs), ['tcsh-6.18.01-15.el7.ppc64le'])
+        self.assertEqual(util.packages_in_message(
+            'No Match for argument: python3', pkgs), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from collections import OrderedDict
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.wave_scheduler import WaveScheduler
+
+
+def _nodes(count, racks=2):
+    return OrderedDict(
+        ('node{}'.format(index), {'rack': 'rack{}'.format(index % racks)})
+        for index in range(count))
+
+
+class TestWaveScheduler(unittest.TestCase):
+
+    def setUp(self):
+        super(TestWaveScheduler, self).setUp()
+        logger.create('nolog', 'info')
+
+    def test_adaptive_wave_size(self):
+        scheduler = WaveScheduler(_nodes(20), wave_size=2,
+                                  start_timeout=60)
+        wave = scheduler.next_wave(now=0)
+        self.assertEqual(wave, ['node0', 'node1'])
+        # Wave still booting
+        self.assertEqual(scheduler.next_wave(now=10), [])
+
+        # Wave started in time, next wave grows
+        scheduler.update(started=wave)
+        wave = scheduler.next_wave(now=20)
+        self.assertEqual(len(wave), 4)
+
+        # Wave stalled, next wave shrinks
+        scheduler.update(started=wave[:1])
+        self.assertEqual(scheduler.next_wave(now=50), [])
+        self.assertEqual(len(scheduler.next_wave(now=81)), 2)
+
+    def test_caps(self):
+        scheduler = WaveScheduler(_nodes(10), wave_size=8, max_in_flight=5,
+                                  group_caps={'rack': 2, 'switch': None},
+                                  start_timeout=60)
+        wave = scheduler.next_wave(now=0)
+        self.assertEqual(wave, ['node0', 'node1', 'node2', 'node3'])
+
+        scheduler.update(started=wave, finished=['node0'])
+        self.assertEqual(scheduler.next_wave(now=10), ['node4'])
+
+        scheduler.update(finished=['node1', 'node2', 'node3', 'node4'])
+        wave = scheduler.next_wave(now=20)
+        self.assertEqual(wave, ['node5', 'node6', 'node7', 'node8'])
+        self.assertFalse(scheduler.is_done())
+
+        # Nodes not starting in time no longer count as in flight
+        self.assertEqual(scheduler.next_wave(now=81), ['node9'])
+        self.assertTrue(scheduler.is_done())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.yum_metadata import YumMetadataSession, repomd_revision
+
+REPOMD = ('<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns='
+          '"http://linux.duke.edu/metadata/repo">\n  <revision>{}</revision>\n'
+          '</repomd>\n')
+
+
+class TestYumMetadata(unittest.TestCase):
+
+    def setUp(self):
+        super(TestYumMetadata, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repos_dir = os.path.join(self.tmp_dir, 'yum.repos.d')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(self.repos_dir)
+        with open(os.path.join(self.repos_dir, 'powerup.repo'), 'w') as f:
+            for repo_id in ('base', 'epel', 'cuda'):
+                f.write(f'[{repo_id}]\nname={repo_id}\nbaseurl=file://'
+                        f'{self.tmp_dir}/{repo_id}/$basearch/\nenabled=1\n\n')
+            f.write('[off]\nbaseurl=http://example.com/off\nenabled=0\n\n'
+                    '[mirror]\nmirrorlist=http://example.com/?arch=$basearch\n')
+        for repo_id, revision in (('base', '1'), ('epel', '2'), ('cuda', '3')):
+            self._write_remote(repo_id, revision)
+        for repo_id, revision in (('base', '1'), ('epel', '1')):
+            path = os.path.join(self.cache_dir, 'ppc64le', '7', repo_id)
+            os.makedirs(path)
+            with open(os.path.join(path, 'repomd.xml'), 'w') as f:
+                f.write(REPOMD.format(revision))
+        self.session = YumMetadataSession('ppc64le', self.repos_dir,
+                                          self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_remote(self, repo_id, revision):
+        path = os.path.join(self.tmp_dir, repo_id, 'ppc64le', 'repodata')
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'repomd.xml'), 'w') as f:
+            f.write(REPOMD.format(revision))
+
+    def test_repomd_revision(self):
+        self.assertEqual(repomd_revision(REPOMD.format(1573000000).encode()),
+                         '1573000000')
+        self.assertEqual(len(repomd_revision(b'<repomd/>')), 64)
+
+    def test_get_repos(self):
+        self.assertEqual(self.session.get_repos(),
+                         {'base': f'file://{self.tmp_dir}/base/ppc64le/',
+                          'epel': f'file://{self.tmp_dir}/epel/ppc64le/',
+                          'cuda': f'file://{self.tmp_dir}/cuda/ppc64le/',
+                          'mirror': None})
+
+    @patch('lib.yum_metadata.sub_proc_exec')
+    def test_refresh(self, mock_sub_proc_exec):
+        mock_sub_proc_exec.return_value = ('', '', 0)
+        flags = '--noplugins --disablerepo=* --enablerepo='
+
+        # Only repositories not current in the cache are refreshed
+        self.assertTrue(self.session.refresh())
+        self.assertEqual(
+            [call[0][0] for call in mock_sub_proc_exec.call_args_list],
+            [f'yum clean expire-cache metadata {flags}cuda,epel,mirror',
+             f'yum makecache fast {flags}cuda,epel,mirror'])
+
+        # Each repository is refreshed once per session
+        mock_sub_proc_exec.reset_mock()
+        self.assertTrue(self.session.refresh())
+        self.assertTrue(self.session.refresh(['base']))
+        mock_sub_proc_exec.assert_not_called()
+
+        # unless its revision changes
+        self._write_remote('epel', '4')
+        self.assertTrue(self.session.refresh())
+        self.assertEqual(mock_sub_proc_exec.call_args[0][0],
+                         f'yum makecache fast {flags}epel')
+
+        # A failed refresh is attempted again
+        mock_sub_proc_exec.reset_mock()
+        mock_sub_proc_exec.return_value = ('', 'error', 1)
+        self._write_remote('base', '5')
+        self.assertFalse(self.session.refresh(['base']))
+        self.assertFalse(self.session.refresh(['base']))
+        self.assertEqual(mock_sub_proc_exec.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2019 IBM Corp.
+#
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch as patch
+from tests.unit import (TOP_DIR, SCRIPT_DIR)  # noqa: F401
+import lib.logger as logger
+from lib.exception import UserException
+from lib.repomd import create_metadata
+from lib.yum_mirror import YumMirror, iter_primary
+from tests.unit.test_rpm import _write_rpm
+
+
+class TestYumMirror(unittest.TestCase):
+
+    def setUp(self):
+        super(TestYumMirror, self).setUp()
+        logger.create('nolog', 'info')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.remote_dir = os.path.join(self.tmp_dir, 'remote')
+        self.local_dir = os.path.join(self.tmp_dir, 'local')
+        os.makedirs(os.path.join(self.remote_dir, 'Packages'))
+        _write_rpm(os.path.join(self.remote_dir, 'Packages', 'bash.rpm'),
+                   'bash', '4.2.46', '31.el7')
+        _write_rpm(os.path.join(self.remote_dir, 'zsh.rpm'), 'zsh', '5.0.2',
+                   '28.el7')
+        create_metadata(self.remote_dir)
+        self.mirror = YumMirror(f'file://{self.remote_dir}', self.local_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _local_files(self):
+        return sorted(os.path.relpath(os.path.join(dirpath, name),
+                                      self.local_dir)
+                      for dirpath, _, names in os.walk(self.local_dir)
+                      for name in names if name.endswith('.rpm'))
+
+    def test_iter_primary(self):
+        repodata_dir = os.path.join(self.remote_dir, 'repodata')
+        primary = [os.path.join(repodata_dir, name) for name in
+                   os.listdir(repodata_dir) if name.endswith('primary.xml.gz')]
+        pkgs = list(iter_primary(primary[0]))
+        self.assertEqual([pkg['href'] for pkg in pkgs],
+                         ['Packages/bash.rpm', 'zsh.rpm'])
+        self.assertEqual(pkgs[1]['algorithm'], 'sha256')
+        self.assertEqual(pkgs[1]['size'], os.path.getsize(
+            os.path.join(self.remote_dir, 'zsh.rpm')))
+
+    def test_sync(self):
+        self.assertEqual(self.mirror.sync(), (2, 2, 0))
+        self.assertEqual(self._local_files(), ['Packages/bash.rpm', 'zsh.rpm'])
+        with open(os.path.join(self.remote_dir, 'repodata', 'repomd.xml'),
+                  'rb') as f:
+            remote_repomd = f.read()
+        with open(os.path.join(self.local_dir, 'repodata', 'repomd.xml'),
+                  'rb') as f:
+            self.assertEqual(f.read(), remote_repomd)
+
+        # Unchanged repository, nothing is read but repomd.xml
+        with patch.object(YumMirror, '_fetch_many') as mock_fetch:
+            self.assertEqual(self.mirror.sync(), (2, 0, 0))
+            mock_fetch.assert_not_called()
+
+        # Only the changes are fetched, obsolete packages removed if asked
+        _write_rpm(os.path.join(self.remote_dir, 'tcsh.rpm'), 'tcsh',
+                   '6.18.01', '15.el7')
+        os.remove(os.path.join(self.remote_dir, 'zsh.rpm'))
+        create_metadata(self.remote_dir)
+        self.assertEqual(self.mirror.sync(), (2, 1, 0))
+        self.assertEqual(self._local_files(),
+                         ['Packages/bash.rpm', 'tcsh.rpm', 'zsh.rpm'])
+        self.assertEqual(self.mirror.sync(delete=True), (2, 0, 1))
+        self.assertEqual(self._local_files(), ['Packages/bash.rpm', 'tcsh.rpm'])
+        self.assertEqual(sorted(os.listdir(self.local_dir)),
+                         ['.mirror_manifest.json', 'Packages', 'repodata',
+                          'tcsh.rpm'])
+
+    def test_sync_verify(self):
+        self.mirror.sync()
+        repomd_path = os.path.join(self.local_dir, 'repodata', 'repomd.xml')
+        with open(repomd_path, 'rb') as f:
+            repomd = f.read()
+
+        # A package not matching its checksum fails the sync and the
+        # metadata is left as it was
+        _write_rpm(os.path.join(self.remote_dir, 'tcsh.rpm'), 'tcsh',
+                   '6.18.01', '15.el7')
+        create_metadata(self.remote_dir)
+        with open(os.path.join(self.remote_dir, 'tcsh.rpm'), 'ab') as f:
+            f.write(b'corrupt')
+        with self.assertRaises(UserException):
+            self.mirror.sync()
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir,
+                                                     'tcsh.rpm')))
+        with open(repomd_path, 'rb') as f:
+            self.assertEqual(f.read(), repomd)
+
+
+if __name__ == '__main__':
+    unittest.main()